@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 from .types import (
     GenerateResult,
@@ -26,6 +26,34 @@ class BaseAIProvider(ABC):
     ) -> GenerateResult:
         raise NotImplementedError
 
+    def generate_stream(
+        self,
+        *,
+        model: str,
+        parts: List[InputPart],
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_output_tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        """
+        Genera texto en fragmentos conforme llegan del proveedor.
+
+        Cerrar el generador (`close()`, o que el cliente HTTP se desconecte)
+        debe cortar la petición al proveedor. Por defecto entrega todo el texto
+        de `generate` en un solo fragmento.
+        """
+        result = self.generate(
+            model=model,
+            parts=parts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            extra=extra,
+        )
+        if result.text:
+            yield result.text
+
     @abstractmethod
     def generate_image(
         self,
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import os
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, Iterator, List, Optional, Sequence
 
 from .base import BaseAIProvider
 from .config import get_active_provider, get_model_for_task, get_provider_api_key
@@ -98,6 +98,39 @@ class AIClient:
             extra=extra,
         )
 
+    def generate_stream(
+        self,
+        *,
+        model: Optional[str] = None,
+        prompt: Optional[str] = None,
+        parts: Optional[List[InputPart]] = None,
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_output_tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        """
+        Igual que `generate` pero entrega el texto en fragmentos. Las
+        validaciones se hacen antes de devolver el generador, así los errores
+        de configuración salen al llamar y no a la mitad del stream.
+        """
+        model_name = model or get_model_for_task("text", provider=self.provider_name)
+        if not model_name:
+            raise AIProviderError("No model configured for text task")
+        content_parts = list(parts or [])
+        if prompt:
+            content_parts.insert(0, InputPart.from_text(prompt))
+        if not content_parts:
+            raise AIProviderError("At least one prompt or part is required")
+        return self.provider.generate_stream(
+            model=model_name,
+            parts=content_parts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            extra=extra,
+        )
+
     def generate_image(
         self,
         *,
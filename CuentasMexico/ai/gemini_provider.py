@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
 
@@ -14,7 +14,7 @@ from .types import (
     SpeechResult,
     TranscriptionResult,
 )
-from .utils import b64_decode, b64_encode, is_url
+from .utils import b64_decode, b64_encode, is_url, iter_sse_events
 
 
 class GeminiProvider(BaseAIProvider):
@@ -67,16 +67,21 @@ class GeminiProvider(BaseAIProvider):
 
         raise AIProviderError(f"Unsupported part kind: {part.kind}")
 
-    def generate(
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "x-goog-api-key": self.api_key,
+        }
+
+    def _generate_payload(
         self,
         *,
-        model: str,
         parts: List[InputPart],
-        system_prompt: Optional[str] = None,
-        temperature: Optional[float] = None,
-        max_output_tokens: Optional[int] = None,
-        extra: Optional[Dict[str, Any]] = None,
-    ) -> GenerateResult:
+        system_prompt: Optional[str],
+        temperature: Optional[float],
+        max_output_tokens: Optional[int],
+        extra: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
         payload: Dict[str, Any] = {
             "contents": [{"role": "user", "parts": [self._to_gemini_part(p) for p in parts]}]
         }
@@ -90,13 +95,28 @@ class GeminiProvider(BaseAIProvider):
                 payload["generationConfig"]["maxOutputTokens"] = max_output_tokens
         if extra:
             payload.update(extra)
+        return payload
 
+    def generate(
+        self,
+        *,
+        model: str,
+        parts: List[InputPart],
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_output_tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> GenerateResult:
+        payload = self._generate_payload(
+            parts=parts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            extra=extra,
+        )
         response = requests.post(
             self._endpoint(model),
-            headers={
-                "Content-Type": "application/json",
-                "x-goog-api-key": self.api_key,
-            },
+            headers=self._headers(),
             data=json.dumps(payload),
             timeout=self.timeout,
         )
@@ -128,6 +148,49 @@ class GeminiProvider(BaseAIProvider):
             raw=data,
         )
 
+    def generate_stream(
+        self,
+        *,
+        model: str,
+        parts: List[InputPart],
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_output_tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        payload = self._generate_payload(
+            parts=parts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            extra=extra,
+        )
+        # streamGenerateContent con alt=sse: cada evento es un
+        # GenerateContentResponse parcial. El `with` corta la conexión si el
+        # consumidor cierra el generador antes de terminar.
+        with requests.post(
+            self._endpoint(model, "streamGenerateContent"),
+            params={"alt": "sse"},
+            headers=self._headers(),
+            data=json.dumps(payload),
+            timeout=self.timeout,
+            stream=True,
+        ) as response:
+            self._raise_for_error(response)
+            for _event, data in iter_sse_events(response):
+                try:
+                    body = json.loads(data)
+                except ValueError:
+                    continue
+                if body.get("error"):
+                    raise AIProviderError("Gemini stream failed", details=body["error"])
+                candidates = body.get("candidates", []) or []
+                if not candidates:
+                    continue
+                for part in (candidates[0].get("content", {}) or {}).get("parts", []) or []:
+                    if part.get("text"):
+                        yield part["text"]
+
     def generate_image(
         self,
         *,
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
 
@@ -14,7 +14,7 @@ from .types import (
     SpeechResult,
     TranscriptionResult,
 )
-from .utils import b64_encode, safe_get
+from .utils import b64_encode, iter_sse_events, safe_get
 
 
 class OpenAIProvider(BaseAIProvider):
@@ -78,17 +78,16 @@ class OpenAIProvider(BaseAIProvider):
 
         raise AIProviderError(f"Unsupported part kind: {part.kind}")
 
-    def generate(
+    def _generate_payload(
         self,
         *,
         model: str,
         parts: List[InputPart],
-        system_prompt: Optional[str] = None,
-        temperature: Optional[float] = None,
-        max_output_tokens: Optional[int] = None,
-        extra: Optional[Dict[str, Any]] = None,
-    ) -> GenerateResult:
-        url = f"{self.base_url}/v1/responses"
+        system_prompt: Optional[str],
+        temperature: Optional[float],
+        max_output_tokens: Optional[int],
+        extra: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
         payload: Dict[str, Any] = {
             "model": model,
             "input": [
@@ -106,12 +105,16 @@ class OpenAIProvider(BaseAIProvider):
             payload["max_output_tokens"] = max_output_tokens
         if extra:
             payload.update(extra)
+        return payload
 
+    def _post_responses(self, payload: Dict[str, Any], *, stream: bool = False) -> requests.Response:
+        url = f"{self.base_url}/v1/responses"
         response = requests.post(
             url,
             headers=self._headers(),
             data=json.dumps(payload),
             timeout=self.timeout,
+            stream=stream,
         )
 
         # Algunos modelos (p.ej. ciertos GPT-5) no aceptan `temperature`.
@@ -123,14 +126,36 @@ class OpenAIProvider(BaseAIProvider):
             except Exception:
                 err_message = ""
             if "unsupported parameter" in err_message and "temperature" in err_message:
+                response.close()
                 payload.pop("temperature", None)
                 response = requests.post(
                     url,
                     headers=self._headers(),
                     data=json.dumps(payload),
                     timeout=self.timeout,
+                    stream=stream,
                 )
+        return response
 
+    def generate(
+        self,
+        *,
+        model: str,
+        parts: List[InputPart],
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_output_tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> GenerateResult:
+        payload = self._generate_payload(
+            model=model,
+            parts=parts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            extra=extra,
+        )
+        response = self._post_responses(payload)
         self._raise_for_error(response)
         data = response.json()
 
@@ -162,6 +187,49 @@ class OpenAIProvider(BaseAIProvider):
             raw=data,
         )
 
+    def generate_stream(
+        self,
+        *,
+        model: str,
+        parts: List[InputPart],
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_output_tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        payload = self._generate_payload(
+            model=model,
+            parts=parts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            extra=extra,
+        )
+        payload["stream"] = True
+        # El `with` cierra la conexión también cuando el consumidor cierra el
+        # generador a medias (GeneratorExit), así se cancela la generación.
+        with self._post_responses(payload, stream=True) as response:
+            self._raise_for_error(response)
+            for event, data in iter_sse_events(response):
+                if data == "[DONE]":
+                    break
+                try:
+                    body = json.loads(data)
+                except ValueError:
+                    continue
+                event_type = body.get("type") or event
+                if event_type == "response.output_text.delta":
+                    delta = body.get("delta") or ""
+                    if delta:
+                        yield delta
+                elif event_type in {"error", "response.failed"}:
+                    raise AIProviderError(
+                        "OpenAI stream failed",
+                        details=safe_get(body, "response", "error") or body.get("error") or body,
+                    )
+                elif event_type == "response.completed":
+                    break
+
     def generate_image(
         self,
         *,
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import base64
-from typing import Any
+from typing import Any, Iterator, List, Tuple
 
 
 def b64_encode(value: bytes | str) -> str:
@@ -27,3 +27,31 @@ def safe_get(dct: Any, *keys: str, default=None):
             return default
         current = current[key]
     return current
+
+
+def iter_sse_events(response) -> Iterator[Tuple[str, str]]:
+    """
+    Recorre una respuesta `text/event-stream` de requests (abierta con
+    stream=True) y devuelve (evento, data) por cada mensaje SSE completo.
+    """
+    event = ""
+    data_lines: List[str] = []
+    for raw_line in response.iter_lines(decode_unicode=False):
+        line = raw_line.decode("utf-8") if isinstance(raw_line, bytes) else raw_line
+        if not line:
+            if data_lines:
+                yield event or "message", "\n".join(data_lines)
+            event = ""
+            data_lines = []
+            continue
+        if line.startswith(":"):
+            continue
+        name, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if name == "event":
+            event = value
+        elif name == "data":
+            data_lines.append(value)
+    if data_lines:
+        yield event or "message", "\n".join(data_lines)
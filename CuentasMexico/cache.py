@@ -0,0 +1,172 @@
+"""
+Caché compartida entre procesos.
+
+`SQLiteCache` es un backend de caché de Django respaldado por un archivo
+SQLite: todos los workers de gunicorn (y los comandos de manage.py) de una
+misma máquina ven el mismo estado. En producción con varias máquinas se usa
+Redis (ver CACHES en settings). `incr_counter` da contadores atómicos con
+cualquiera de los dos backends.
+"""
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """Backend de caché en un archivo SQLite (modo WAL, seguro entre procesos)."""
+
+    _local = threading.local()
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._cull_probability = float(params.get('OPTIONS', {}).get('CULL_PROBABILITY', 0.01))
+        directory = os.path.dirname(os.path.abspath(location))
+        os.makedirs(directory, exist_ok=True)
+
+    # ------------------------------------------------------------------ helpers
+
+    def _connection(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (os.getpid(), self._path)
+        conn = connections.get(key)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, expires REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            connections[key] = conn
+        return conn
+
+    @staticmethod
+    def _encode(value):
+        # Los enteros se guardan nativos para que incr() sea un UPDATE atómico
+        if type(value) is int:
+            return value
+        return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _cull(self, conn, now):
+        if random.random() >= self._cull_probability:
+            return
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (now,))
+        total = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if total > self._max_entries:
+            to_delete = max(1, total // self._cull_frequency) if self._cull_frequency else total
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?)',
+                (to_delete,),
+            )
+
+    # ---------------------------------------------------------------- cache API
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        conn = self._connection()
+        cursor = conn.execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, self._encode(value), self.get_backend_timeout(timeout), now),
+        )
+        self._cull(conn, now)
+        return cursor.rowcount > 0
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            return default
+        return self._decode(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, self._encode(value), self.get_backend_timeout(timeout)),
+        )
+        self._cull(conn, time.time())
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'UPDATE cache SET value = value + ? '
+            "WHERE key = ? AND typeof(value) = 'integer' AND (expires IS NULL OR expires > ?) "
+            'RETURNING value',
+            (delta, key, time.time()),
+        ).fetchone()
+        if row is None:
+            raise ValueError("Key '%s' not found" % key)
+        return row[0]
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Conexiones persistentes por hilo; SQLite no necesita cerrarlas por request
+        pass
+
+
+def incr_counter(key, timeout, delta=1, backend=None):
+    """
+    Incrementa un contador de forma atómica y devuelve el nuevo valor.
+    La ventana (timeout) empieza con el primer incremento y no se reinicia
+    con los siguientes.
+    """
+    backend = backend or cache
+    for _ in range(3):
+        if backend.add(key, delta, timeout=timeout):
+            return delta
+        try:
+            return backend.incr(key, delta)
+        except ValueError:
+            # Expiró entre add() e incr(); reintentar
+            continue
+    backend.set(key, delta, timeout=timeout)
+    return delta
@@ -0,0 +1,78 @@
+"""
+Utilidades de base de datos que deben comportarse igual en SQLite (pruebas)
+y MySQL (producción).
+
+`bulk_upsert` inserta o actualiza en bloque por una llave única. Django 4.2
+solo acepta `bulk_create(update_conflicts=True, unique_fields=...)` en
+backends con `supports_update_conflicts_with_target` (SQLite, PostgreSQL); en
+MySQL lanza NotSupportedError. Ahí se actualizan los renglones existentes y
+se insertan los nuevos dentro de una transacción.
+"""
+from django.db import connections, router, transaction
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bulk_upsert(model, objs, *, unique_fields, update_fields, batch_size=1000):
+    """
+    Guarda `objs` por `unique_fields`: los que ya existen solo cambian
+    `update_fields` (el resto de columnas se respeta), los demás se insertan.
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    db = router.db_for_write(model)
+    manager = model._default_manager.using(db)
+    if connections[db].features.supports_update_conflicts_with_target:
+        manager.bulk_create(
+            objs,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
+        )
+        return
+
+    opts = model._meta
+    key_fields = [opts.get_field(name) for name in unique_fields]
+    attnames = [field.attname for field in key_fields]
+    auto_now_fields = [
+        field for field in (opts.get_field(name) for name in update_fields)
+        if getattr(field, 'auto_now', False)
+    ]
+
+    def key(obj):
+        return tuple(getattr(obj, attname) for attname in attnames)
+
+    with transaction.atomic(using=db):
+        for batch in _chunks(objs, batch_size):
+            # Filtro por columna (superconjunto) y cruce exacto en Python
+            lookup = {
+                f'{attname}__in': {getattr(obj, attname) for obj in batch}
+                for attname in attnames
+            }
+            existing = {
+                tuple(row[1:]): row[0]
+                for row in manager.select_for_update()
+                .filter(**lookup)
+                .values_list(opts.pk.attname, *attnames)
+            }
+            to_update, to_insert = [], []
+            for obj in batch:
+                pk = existing.get(key(obj))
+                if pk is None:
+                    to_insert.append(obj)
+                    continue
+                setattr(obj, opts.pk.attname, pk)
+                for field in auto_now_fields:
+                    field.pre_save(obj, add=False)
+                to_update.append(obj)
+            if to_update:
+                manager.bulk_update(to_update, update_fields, batch_size=batch_size)
+            if to_insert:
+                # Si otro proceso insertó la misma llave entre la lectura y
+                # aquí, se conserva su renglón (calculado al mismo tiempo).
+                manager.bulk_create(to_insert, batch_size=batch_size, ignore_conflicts=True)
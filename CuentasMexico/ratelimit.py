@@ -0,0 +1,216 @@
+"""
+Limitador de solicitudes con ventana deslizante sobre la caché compartida.
+
+Se usan dos contadores de ventana fija (actual y anterior) incrementados con
+`incr_counter`, que es atómico en Redis/SQLite/locmem; el conteo estimado es
+`anterior * (1 - transcurrido / ventana) + actual`. Así no hay carreras de
+get()/set() entre workers y la ventana no se reinicia con cada solicitud.
+
+Uso:
+    @rate_limit('otp_phone', limit='OTP_RATE_LIMIT_PER_PHONE',
+                window='OTP_RATE_WINDOW_SEC', key='phone')
+    def send_whatsapp_verification(request): ...
+"""
+import hashlib
+import json
+import math
+import re
+import time
+from dataclasses import dataclass
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+from CuentasMexico.cache import incr_counter
+
+
+DEFAULT_MESSAGE = 'Demasiadas solicitudes. Intenta de nuevo más tarde.'
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    count: float
+    limit: int
+    retry_after: int
+
+
+class SlidingWindowLimiter:
+    def __init__(self, scope, limit, window_sec, backend=None):
+        self.scope = scope
+        self.limit = int(limit)
+        self.window = max(1, int(window_sec))
+        self.backend = backend or cache
+
+    def _key(self, identity, bucket):
+        digest = hashlib.sha1(str(identity).encode('utf-8')).hexdigest()[:20]
+        return f'rl:{self.scope}:{digest}:{bucket}'
+
+    def hit(self, identity, now=None):
+        """Registra una solicitud y devuelve si está permitida."""
+        now = time.time() if now is None else now
+        bucket = int(now // self.window)
+        elapsed = now - bucket * self.window
+        current_key = self._key(identity, bucket)
+
+        current = incr_counter(current_key, timeout=self.window * 2, backend=self.backend)
+        previous = self.backend.get(self._key(identity, bucket - 1), 0) or 0
+        weight = 1 - (elapsed / self.window)
+        estimated = previous * weight + current
+
+        if estimated <= self.limit:
+            return RateLimitResult(True, estimated, self.limit, 0)
+
+        # Las solicitudes rechazadas no consumen cupo
+        self.refund(identity, now)
+        current -= 1
+
+        if current >= self.limit or not previous:
+            retry_after = self.window - elapsed
+        else:
+            # Momento en que el peso de la ventana anterior deja espacio para una solicitud más
+            needed_weight = (self.limit - current - 1) / previous
+            retry_after = (1 - needed_weight) * self.window - elapsed
+        return RateLimitResult(False, estimated, self.limit, max(1, math.ceil(retry_after)))
+
+    def refund(self, identity, now):
+        """Devuelve una solicitud registrada con `hit` en el mismo instante `now`."""
+        try:
+            self.backend.decr(self._key(identity, int(now // self.window)))
+        except ValueError:
+            pass
+
+
+def client_ip(request):
+    """
+    IP del cliente según el proxy de confianza. nginx agrega la IP que ve al
+    final de X-Forwarded-For (después de lo que haya mandado el cliente), así
+    que se toma la entrada RATE_LIMIT_TRUSTED_PROXIES posiciones desde el
+    final; la primera la controla el cliente y no sirve para limitar.
+    """
+    trusted = int(getattr(settings, 'RATE_LIMIT_TRUSTED_PROXIES', 1))
+    hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    if trusted > 0 and len(hops) >= trusted:
+        return hops[-trusted]
+    return request.META.get('REMOTE_ADDR', 'unknown')
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _phone_identity(request):
+    data = _json_body(request)
+    digits = re.sub(r'\D', '', str(data.get('phone_number') or ''))
+    if not digits:
+        return None
+    # Los últimos 8 dígitos identifican el número sin importar lada/prefijos
+    return f"{str(data.get('country') or '').strip().lower()}:{digits[-8:]}"
+
+
+def _session_identity(request):
+    session = getattr(request, 'session', None)
+    return getattr(session, 'session_key', None) or 'anon'
+
+
+def _user_identity(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return None
+
+
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'session': _session_identity,
+    'user': _user_identity,
+    'phone': _phone_identity,
+}
+
+
+def _identity(request, key):
+    parts = []
+    for name in (key if isinstance(key, (list, tuple)) else (key,)):
+        value = KEY_FUNCTIONS[name](request) if isinstance(name, str) else name(request)
+        if value is None:
+            # Sin identidad (ej. teléfono ausente): se limita por IP
+            value = f'ip:{client_ip(request)}'
+        parts.append(str(value))
+    return '|'.join(parts)
+
+
+def _resolve(value):
+    if isinstance(value, str):
+        return int(getattr(settings, value))
+    return int(value)
+
+
+def too_many_requests(result, message=DEFAULT_MESSAGE, error_key='message'):
+    response = JsonResponse(
+        {'success': False, error_key: message, 'retry_after': result.retry_after},
+        status=429,
+    )
+    response['Retry-After'] = str(result.retry_after)
+    return response
+
+
+@dataclass(frozen=True)
+class _Rule:
+    scope: str
+    limit: object
+    window: object
+    key: object
+    message: str
+    error_key: str
+
+
+def _check_rules(request, rules):
+    """
+    Aplica todas las reglas como una sola: si alguna rechaza, se devuelve el
+    cupo que ya tomaron las anteriores. Devuelve la respuesta 429 o None.
+    """
+    now = time.time()
+    taken = []
+    for rule in rules:
+        limiter = SlidingWindowLimiter(rule.scope, _resolve(rule.limit), _resolve(rule.window))
+        identity = _identity(request, rule.key)
+        result = limiter.hit(identity, now=now)
+        if not result.allowed:
+            for previous, previous_identity in taken:
+                previous.refund(previous_identity, now)
+            return too_many_requests(result, message=rule.message, error_key=rule.error_key)
+        taken.append((limiter, identity))
+    return None
+
+
+def rate_limit(scope, limit, window, key='ip', message=DEFAULT_MESSAGE, error_key='message'):
+    """
+    Decorador de vistas. `limit` y `window` aceptan un entero o el nombre de
+    un setting (se lee en cada solicitud). `key` es 'ip', 'session', 'user',
+    'phone', un callable(request) o una tupla de ellos.
+
+    Varios @rate_limit apilados se revisan juntos: una solicitud que rechaza
+    cualquiera de ellos no consume el cupo de los demás.
+    """
+    rule = _Rule(scope, limit, window, key, message, error_key)
+
+    def decorator(view_func):
+        rules = (rule,) + getattr(view_func, 'rate_limit_rules', ())
+        view = getattr(view_func, 'rate_limited_view', view_func)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            rejected = _check_rules(request, rules)
+            if rejected is not None:
+                return rejected
+            return view(request, *args, **kwargs)
+        wrapper.rate_limit_rules = rules
+        wrapper.rate_limited_view = view
+        return wrapper
+    return decorator
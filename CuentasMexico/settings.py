@@ -77,6 +77,7 @@ SITE_ID = 1
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    'adm.middleware.RequestCacheMiddleware',  # Caché por request (negocio, créditos, afiliado)
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -246,6 +247,74 @@ EVO_WHATSAPP_API_URL = os.getenv('EVO_WHATSAPP_API_URL', '')
 EVO_INSTANCE = os.getenv('EVO_INSTANCE', '')
 EVO_API_KEY = os.getenv('EVO_API_KEY', '')
 
+# Ritmo de envío por instancia (EVO_INSTANCE admite pool: "inst1,inst2:10/300/3000")
+WHATSAPP_BUDGET_PER_MINUTE = int(os.getenv('WHATSAPP_BUDGET_PER_MINUTE', '6'))
+WHATSAPP_BUDGET_PER_HOUR = int(os.getenv('WHATSAPP_BUDGET_PER_HOUR', '240'))
+WHATSAPP_BUDGET_PER_DAY = int(os.getenv('WHATSAPP_BUDGET_PER_DAY', '2500'))
+WHATSAPP_RECEIVABLE_BUDGET_SHARE = float(os.getenv('WHATSAPP_RECEIVABLE_BUDGET_SHARE', '0.9'))
+WHATSAPP_MARKETING_BUDGET_SHARE = float(os.getenv('WHATSAPP_MARKETING_BUDGET_SHARE', '0.6'))
+WHATSAPP_BACKOFF_BASE_SEC = int(os.getenv('WHATSAPP_BACKOFF_BASE_SEC', '30'))
+WHATSAPP_BACKOFF_MAX_SEC = int(os.getenv('WHATSAPP_BACKOFF_MAX_SEC', '900'))
+WHATSAPP_ACQUIRE_TIMEOUT_SEC = int(os.getenv('WHATSAPP_ACQUIRE_TIMEOUT_SEC', '900'))
+
+# Cola persistente de WhatsApp (python manage.py whatsapp_worker)
+WHATSAPP_QUEUE_SAME_RECIPIENT_DELAY_SEC = int(os.getenv('WHATSAPP_QUEUE_SAME_RECIPIENT_DELAY_SEC', '3'))
+WHATSAPP_QUEUE_LEASE_SEC = int(os.getenv('WHATSAPP_QUEUE_LEASE_SEC', '120'))
+WHATSAPP_QUEUE_MAX_ATTEMPTS = int(os.getenv('WHATSAPP_QUEUE_MAX_ATTEMPTS', '5'))
+WHATSAPP_QUEUE_RETRY_BASE_SEC = int(os.getenv('WHATSAPP_QUEUE_RETRY_BASE_SEC', '60'))
+WHATSAPP_QUEUE_RETRY_MAX_SEC = int(os.getenv('WHATSAPP_QUEUE_RETRY_MAX_SEC', '3600'))
+WHATSAPP_QUEUE_DEDUPE_WINDOW_SEC = int(os.getenv('WHATSAPP_QUEUE_DEDUPE_WINDOW_SEC', '600'))
+
+# Histórico de envíos WhatsApp en segmentos diarios (logs/whatsapp_delivery/)
+WHATSAPP_DELIVERY_LOG_RETENTION_DAYS = int(os.getenv('WHATSAPP_DELIVERY_LOG_RETENTION_DAYS', '90'))
+WHATSAPP_DELIVERY_LOG_MAX_MB = int(os.getenv('WHATSAPP_DELIVERY_LOG_MAX_MB', '1024'))
+
+# Tareas en segundo plano persistidas en DB (adm/functions/background_tasks.py)
+# thread: se ejecutan en un hilo del worker web; runner: las ejecuta
+# `python manage.py run_background_tasks` en otro proceso
+BACKGROUND_TASKS_MODE = os.getenv('BACKGROUND_TASKS_MODE', 'thread')
+BACKGROUND_TASK_LEASE_SEC = int(os.getenv('BACKGROUND_TASK_LEASE_SEC', '90'))
+BACKGROUND_TASK_HEARTBEAT_SEC = int(os.getenv('BACKGROUND_TASK_HEARTBEAT_SEC', '15'))
+BACKGROUND_TASK_MAX_ATTEMPTS = int(os.getenv('BACKGROUND_TASK_MAX_ATTEMPTS', '2'))
+BACKGROUND_TASK_PENDING_TIMEOUT_SEC = int(os.getenv('BACKGROUND_TASK_PENDING_TIMEOUT_SEC', '600'))
+
+# Índice de cuentas disponibles (adm/functions/account_availability.py):
+# una cuenta apartada y no vendida se libera tras ACCOUNT_HOLD_SEC; si otra
+# venta la ganó, se reintenta con otra hasta ACCOUNT_RESERVATION_ATTEMPTS veces
+ACCOUNT_HOLD_SEC = int(os.getenv('ACCOUNT_HOLD_SEC', '600'))
+ACCOUNT_RESERVATION_ATTEMPTS = int(os.getenv('ACCOUNT_RESERVATION_ATTEMPTS', '3'))
+
+# Listas del admin con paginación por cursor (adm/functions/keyset_pagination.py):
+# arriba de este total estimado se muestra la estimación en vez de hacer COUNT(*)
+KEYSET_EXACT_COUNT_MAX = int(os.getenv('KEYSET_EXACT_COUNT_MAX', '20000'))
+
+# Recomendaciones de audiencia (adm/functions/audience_features.py): candidatos
+# de mayor ingreso que se evalúan por campaña
+MARKETING_AUDIENCE_POOL = int(os.getenv('MARKETING_AUDIENCE_POOL', '800'))
+
+# CustomerFeatures (adm/functions/customer_features.py): el CRM refresca en
+# línea hasta este número de clientes pendientes; arriba de eso lo hace el
+# comando refresh_customer_features del scheduler
+CUSTOMER_FEATURES_INLINE_MAX = int(os.getenv('CUSTOMER_FEATURES_INLINE_MAX', '500'))
+
+# Tienda pública (adm/functions/storefront_cache.py): vida de los fragmentos
+# de inicio/tiendas; se invalidan antes por versión de catálogo
+STOREFRONT_CACHE_TTL = int(os.getenv('STOREFRONT_CACHE_TTL', '3600'))
+
+# Business (pk=1) cacheado en memoria de cada proceso (adm/functions/business.py);
+# las señales lo invalidan y este TTL corrige cambios hechos sin señales
+BUSINESS_CACHE_TTL = int(os.getenv('BUSINESS_CACHE_TTL', '300'))
+
+# Límites de envío de códigos (cada envío cuesta un mensaje saliente)
+OTP_RATE_LIMIT_PER_PHONE = int(os.getenv('OTP_RATE_LIMIT_PER_PHONE', '3'))
+OTP_RATE_LIMIT_PER_IP = int(os.getenv('OTP_RATE_LIMIT_PER_IP', '10'))
+OTP_RATE_WINDOW_SEC = int(os.getenv('OTP_RATE_WINDOW_SEC', '900'))
+EMAIL_VERIFICATION_RATE_LIMIT = int(os.getenv('EMAIL_VERIFICATION_RATE_LIMIT', '5'))
+EMAIL_VERIFICATION_RATE_WINDOW_SEC = int(os.getenv('EMAIL_VERIFICATION_RATE_WINDOW_SEC', '3600'))
+# Proxies frente a Django que agregan a X-Forwarded-For (nginx = 1); con 0 se
+# usa REMOTE_ADDR. Los límites por IP toman la entrada que agregó el proxy
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '1'))
+
 # EMAIL_BACKEND = "naomi.mail.backends.naomi.NaomiBackend"
 # EMAIL_FILE_PATH = "/Users/luinmack/Documents/Proyectos/CuentasMexico/tmp"
 
@@ -258,16 +327,45 @@ CSRF_COOKIE_SECURE = not DEBUG
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
 
-# Configuración de caché para mejorar rendimiento
-CACHES = {
-    'default': {
+# Configuración de caché compartida entre workers
+# CACHE_BACKEND: redis | sqlite | file | locmem
+# - redis: producción (varios workers/máquinas), usa CACHE_URL=redis://host:6379/0
+# - sqlite/file: una sola máquina o pruebas (todos los procesos ven el mismo estado)
+# - locmem: solo desarrollo, cada proceso tiene su propia caché
+CACHE_URL = os.getenv('CACHE_URL', '').strip()
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', '').strip().lower()
+if CACHE_BACKEND not in ('redis', 'sqlite', 'file', 'locmem'):
+    CACHE_BACKEND = 'redis' if CACHE_URL.startswith(('redis://', 'rediss://')) else 'sqlite'
+
+if CACHE_BACKEND == 'redis':
+    _default_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL or 'redis://127.0.0.1:6379/0',
+    }
+elif CACHE_BACKEND == 'file':
+    _default_cache = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'logs', 'django_cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 3},
+    }
+elif CACHE_BACKEND == 'locmem':
+    _default_cache = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
+        'OPTIONS': {'MAX_ENTRIES': 1000, 'CULL_FREQUENCY': 3},
+    }
+else:
+    _default_cache = {
+        'BACKEND': 'CuentasMexico.cache.SQLiteCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'logs', 'django_cache.sqlite3')),
+        'OPTIONS': {'MAX_ENTRIES': 50000, 'CULL_FREQUENCY': 3},
+    }
+
+CACHES = {
+    'default': {
+        **_default_cache,
         'TIMEOUT': 600,  # 10 minutos por defecto
-        'OPTIONS': {
-            'MAX_ENTRIES': 1000,
-            'CULL_FREQUENCY': 3,
-        }
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'cuentasmexico'),
     }
 }
 
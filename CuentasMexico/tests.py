@@ -0,0 +1,157 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from CuentasMexico.cache import SQLiteCache, incr_counter
+from CuentasMexico.ratelimit import SlidingWindowLimiter, client_ip
+
+
+def _shared_cache(path):
+    return SQLiteCache(path, {'TIMEOUT': 600})
+
+
+def _increment_worker(path, key, times):
+    backend = _shared_cache(path)
+    for _ in range(times):
+        incr_counter(key, timeout=60, backend=backend)
+
+
+def _set_worker(path, key, value):
+    _shared_cache(path).set(key, value, timeout=60)
+
+
+def _limiter_worker(path, results, attempts):
+    limiter = SlidingWindowLimiter('otp', limit=12, window_sec=3600, backend=_shared_cache(path))
+    results.put(sum(limiter.hit('5218331234567', now=7201).allowed for _ in range(attempts)))
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.sqlite3')
+        self.cache = _shared_cache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_basic_operations(self):
+        self.cache.set('code', '123456', timeout=60)
+        self.assertEqual(self.cache.get('code'), '123456')
+        self.assertFalse(self.cache.add('code', 'other'))
+        self.assertTrue(self.cache.add('verified', True))
+        self.assertIs(self.cache.get('verified'), True)
+        self.assertTrue(self.cache.delete('code'))
+        self.assertIsNone(self.cache.get('code'))
+        self.cache.set('options', [{'id': '1', 'name': 'VIP'}])
+        self.assertEqual(self.cache.get('options'), [{'id': '1', 'name': 'VIP'}])
+
+    def test_expired_values_are_replaced_by_add(self):
+        self.cache.set('expired', 1, timeout=0)
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertTrue(self.cache.add('expired', 5))
+        self.assertEqual(self.cache.incr('expired', 2), 7)
+
+    def test_incr_missing_key_raises(self):
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_processes_share_state(self):
+        ctx = multiprocessing.get_context('fork')
+        writer = ctx.Process(target=_set_worker, args=(self.path, 'otp', '654321'))
+        writer.start()
+        writer.join(30)
+        self.assertEqual(writer.exitcode, 0)
+        self.assertEqual(self.cache.get('otp'), '654321')
+
+    def test_concurrent_counters_are_atomic(self):
+        ctx = multiprocessing.get_context('fork')
+        workers = [
+            ctx.Process(target=_increment_worker, args=(self.path, 'rl:ip', 50))
+            for _ in range(6)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(self.cache.get('rl:ip'), 300)
+
+
+class SlidingWindowLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = _shared_cache(os.path.join(self.tmpdir, 'cache.sqlite3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_window_slides_instead_of_resetting(self):
+        limiter = SlidingWindowLimiter('test', limit=2, window_sec=60, backend=self.cache)
+        self.assertTrue(limiter.hit('ip', now=6000).allowed)
+        self.assertTrue(limiter.hit('ip', now=6001).allowed)
+        denied = limiter.hit('ip', now=6002)
+        self.assertFalse(denied.allowed)
+        self.assertEqual(denied.retry_after, 58)
+
+        # 10 s dentro de la siguiente ventana la anterior todavía pesa 5/6
+        denied = limiter.hit('ip', now=6070)
+        self.assertFalse(denied.allowed)
+        self.assertEqual(denied.retry_after, 20)
+        self.assertTrue(limiter.hit('ip', now=6090).allowed)
+        # Otra identidad no comparte cupo
+        self.assertTrue(limiter.hit('other', now=6002).allowed)
+
+    def test_concurrent_hits_never_exceed_limit(self):
+        limiter = SlidingWindowLimiter('burst', limit=30, window_sec=3600, backend=self.cache)
+        now = 3600 * 10 + 1
+        allowed = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(10):
+                result = limiter.hit('203.0.113.9', now=now)
+                with lock:
+                    allowed.append(result.allowed)
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(allowed), 100)
+        self.assertEqual(sum(allowed), 30)
+
+    def test_concurrent_processes_never_exceed_limit(self):
+        path = os.path.join(self.tmpdir, 'cache.sqlite3')
+        ctx = multiprocessing.get_context('fork')
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_limiter_worker, args=(path, results, 10)) for _ in range(5)]
+        for worker in workers:
+            worker.start()
+        allowed = sum(results.get(timeout=60) for _ in workers)
+        for worker in workers:
+            worker.join(30)
+        self.assertEqual(allowed, 12)
+
+
+class ClientIpTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_uses_the_hop_added_by_the_proxy(self):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.9', REMOTE_ADDR='172.18.0.5')
+        self.assertEqual(client_ip(request), '203.0.113.9')
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=0)
+    def test_without_proxy_ignores_the_header(self):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='1.2.3.4', REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(client_ip(request), '203.0.113.9')
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=2)
+    def test_short_header_falls_back_to_remote_addr(self):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='203.0.113.9', REMOTE_ADDR='172.18.0.5')
+        self.assertEqual(client_ip(request), '172.18.0.5')
@@ -28,10 +28,19 @@ def _task_to_dict(task):
         "completed_at": task.completed_at.isoformat() if task.completed_at else None,
         "progress": task.progress,
         "result": task.result,
-        "error": task.error
+        "error": task.error,
+        "attempts": task.attempts,
+        "worker": task.worker,
+        "heartbeat_at": task.heartbeat_at.isoformat() if task.heartbeat_at else None,
     }
 
 
+def _run_verify_accounts():
+    """Función importable para que el runner de tareas pueda ejecutarla en otro proceso."""
+    manager = SheetsSyncManager()
+    return manager.verify_accounts_exist()
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def sync_sheets_endpoint(request):
@@ -190,16 +199,12 @@ def verify_accounts_endpoint(request):
         GET /api/verify-accounts/status/?task_id=<task_id>
     """
 
-    def _run_verify():
-        manager = SheetsSyncManager()
-        return manager.verify_accounts_exist()
-
     try:
         task_manager = get_task_manager()
 
         success, message, task = task_manager.start_task(
             task_type="verify_accounts",
-            func=_run_verify
+            func=_run_verify_accounts
         )
 
         if success:
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AdmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'adm'
+
+    def ready(self):
+        from adm import signals  # noqa: F401
@@ -0,0 +1,286 @@
+"""
+Índice de disponibilidad de cuentas (AccountSlot).
+
+Cada cuenta libre (status=True, sin cliente, external_status='Disponible')
+tiene una fila con su puntaje ya calculado, así elegir la mejor cuenta de un
+servicio es leer el primer renglón del índice en vez de recorrer todas las
+cuentas y sus ventas en cada compra.
+
+Criterios (los mismos de Sales.find_best_account_legacy):
+1. Menos cortes estimados.
+2. Más tiempo hasta el primer corte.
+3. Menos perfiles vacíos en el mismo email|password.
+
+Los cortes solo dependen de los días al primer corte y nunca aumentan cuando
+esos días crecen, así que 1 y 2 equivalen a ordenar por la fecha del primer
+corte descendente sin importar los meses comprados. `cut_score` guarda esa
+fecha como timestamp (NO_CUT_SCORE si la credencial no tiene ventas activas)
+y el índice se ordena por (-cut_score, empty_profiles, account).
+
+`peek_best_account` solo consulta (sugerencias, vistas previas). Tomar una
+cuenta para venderla (`pop_best_account`) bloquea el renglón con
+select_for_update(skip_locked=True) y lo aparta hasta `held_until`: dos
+compras simultáneas nunca reciben la misma cuenta. Si la venta no se
+concreta, el apartado vence solo (ver adm/functions/account_reservations.py).
+
+Las señales de Account y Sale (adm/signals.py) refrescan los grupos
+afectados al confirmar la transacción; el comando
+rebuild_account_availability reconstruye todo por si algo se escapó
+(update() masivos, ventas que vencen).
+"""
+
+import hashlib
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from CuentasMexico.db import bulk_upsert
+from adm.models import Account, AccountSlot, Sale
+
+
+logger = logging.getLogger(__name__)
+
+NO_CUT_SCORE = 2 ** 62
+PICK_ORDER = ('-cut_score', 'empty_profiles', 'account_id')
+MAX_POP_ATTEMPTS = 20
+BATCH_SIZE = 500
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def credential_key(email, password) -> str:
+    return hashlib.sha1(f"{email or ''}|{password or ''}".encode('utf-8')).hexdigest()
+
+
+def cut_score(next_cut_at) -> int:
+    return NO_CUT_SCORE if next_cut_at is None else int(next_cut_at.timestamp())
+
+
+def available_accounts():
+    return Account.objects.filter(status=True, customer=None, external_status='Disponible')
+
+
+def _next_cuts(service_id, emails=None, passwords=None, now=None) -> Dict[Tuple[str, str], object]:
+    """Próximo vencimiento de ventas activas por (email, password) del servicio."""
+    sales = Sale.objects.filter(
+        account__account_name_id=service_id,
+        status=True,
+        expiration_date__gte=now or timezone.now(),
+    )
+    if emails is not None:
+        sales = sales.filter(account__email__in=emails, account__password__in=passwords)
+    rows = sales.values('account__email', 'account__password').annotate(next_expiration=Min('expiration_date'))
+    return {(row['account__email'], row['account__password']): row['next_expiration'] for row in rows}
+
+
+def _build_slots(service_id, accounts: List[dict], next_cuts) -> List[AccountSlot]:
+    group_sizes: Dict[Tuple[str, str], int] = defaultdict(int)
+    for account in accounts:
+        group_sizes[(account['email'], account['password'])] += 1
+    slots = []
+    for account in accounts:
+        pair = (account['email'], account['password'])
+        next_cut_at = next_cuts.get(pair)
+        slots.append(AccountSlot(
+            account_id=account['id'],
+            service_id=service_id,
+            credential_key=credential_key(*pair),
+            cut_score=cut_score(next_cut_at),
+            next_cut_at=next_cut_at,
+            empty_profiles=group_sizes[pair],
+        ))
+    return slots
+
+
+def _upsert(slots: List[AccountSlot]):
+    # El apartado no se toca: un refresco no debe liberar una cuenta ya tomada
+    bulk_upsert(
+        AccountSlot,
+        slots,
+        unique_fields=['account'],
+        update_fields=['service', 'credential_key', 'cut_score', 'next_cut_at', 'empty_profiles', 'updated_at'],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def rebuild_service(service_id, now=None) -> int:
+    """Recalcula todos los renglones de un servicio. Devuelve cuántos quedaron."""
+    accounts = list(available_accounts().filter(account_name_id=service_id).values('id', 'email', 'password'))
+    slots = _build_slots(service_id, accounts, _next_cuts(service_id, now=now))
+    with transaction.atomic():
+        _upsert(slots)
+        AccountSlot.objects.filter(service_id=service_id).exclude(
+            account_id__in=[account['id'] for account in accounts]
+        ).delete()
+    return len(slots)
+
+
+def rebuild_all(now=None) -> Dict[int, int]:
+    service_ids = set(available_accounts().values_list('account_name_id', flat=True).distinct())
+    service_ids |= set(AccountSlot.objects.values_list('service_id', flat=True).distinct())
+    return {service_id: rebuild_service(service_id, now=now) for service_id in sorted(service_ids)}
+
+
+def _refresh_credentials(credentials: Set[Tuple[int, str, str]], now=None) -> int:
+    by_service: Dict[int, Set[Tuple[str, str]]] = defaultdict(set)
+    for service_id, email, password in credentials:
+        by_service[service_id].add((email, password))
+
+    refreshed = 0
+    for service_id, pairs in by_service.items():
+        emails = {email for email, _ in pairs}
+        passwords = {password for _, password in pairs}
+        accounts = [
+            account
+            for account in available_accounts()
+            .filter(account_name_id=service_id, email__in=emails, password__in=passwords)
+            .values('id', 'email', 'password')
+            if (account['email'], account['password']) in pairs
+        ]
+        slots = _build_slots(service_id, accounts, _next_cuts(service_id, emails, passwords, now=now))
+        _upsert(slots)
+        AccountSlot.objects.filter(
+            service_id=service_id,
+            credential_key__in=[credential_key(*pair) for pair in pairs],
+        ).exclude(account_id__in=[account['id'] for account in accounts]).delete()
+        refreshed += len(slots)
+    return refreshed
+
+
+def refresh_accounts(account_ids: Iterable[int], now=None, credentials=()) -> int:
+    """
+    Refresca los grupos email|password de esas cuentas: los actuales y en los
+    que estaban antes (si cambió la clave o el servicio). `credentials` son
+    (servicio, email, password) extra, ej. de una cuenta borrada.
+    """
+    ids = {int(account_id) for account_id in account_ids if account_id}
+    credentials = set(credentials)
+    if not ids and not credentials:
+        return 0
+    with transaction.atomic():
+        credentials |= set(Account.objects.filter(pk__in=ids).values_list('account_name_id', 'email', 'password'))
+        previous = set(AccountSlot.objects.filter(account_id__in=ids).values_list('service_id', 'credential_key'))
+        for service_id, key in previous:
+            credentials |= set(
+                Account.objects.filter(availability__service_id=service_id, availability__credential_key=key)
+                .values_list('account_name_id', 'email', 'password')
+            )
+        AccountSlot.objects.filter(account_id__in=ids).exclude(
+            account_id__in=available_accounts().filter(pk__in=ids).values('pk')
+        ).delete()
+        return _refresh_credentials(credentials, now=now)
+
+
+def schedule_refresh(account_ids=(), credentials=()):
+    """Refresca esas cuentas/credenciales al confirmar la transacción actual."""
+    ids = {account_id for account_id in account_ids if account_id}
+    credentials = set(credentials)
+    if ids or credentials:
+        transaction.on_commit(lambda: _safe_refresh(ids, credentials))
+
+
+def _safe_refresh(ids, credentials):
+    try:
+        refresh_accounts(ids, credentials=credentials)
+    except Exception:
+        # El comando rebuild_account_availability corrige lo que falle aquí
+        logger.exception('No se pudo refrescar el índice de disponibilidad para %s', sorted(ids))
+
+
+def hold_seconds_default() -> int:
+    return int(_setting('ACCOUNT_HOLD_SEC', 600))
+
+
+def release_hold(account_id, token) -> bool:
+    """Libera el apartado si sigue siendo de ese token."""
+    return bool(
+        AccountSlot.objects.filter(account_id=account_id, hold_token=token).update(held_until=None, hold_token='')
+    )
+
+
+def _tidy_service(service_id, now):
+    """Libera apartados vencidos y recalcula grupos cuyo primer corte ya pasó."""
+    AccountSlot.objects.filter(service_id=service_id, held_until__lt=now).update(held_until=None, hold_token='')
+    stale = list(
+        AccountSlot.objects.filter(service_id=service_id, next_cut_at__lt=now).values_list('account_id', flat=True)
+    )
+    if stale:
+        refresh_accounts(stale, now=now)
+
+
+def peek_best_account(service_id, now=None) -> Optional[Account]:
+    """
+    Mejor cuenta libre del servicio sin apartarla: para mostrar una sugerencia
+    o para flujos que luego la asignan por su cuenta. Las cuentas apartadas
+    por otra venta se saltan.
+    """
+    now = now or timezone.now()
+    if not AccountSlot.objects.filter(service_id=service_id).exists():
+        rebuild_service(service_id, now=now)
+    _tidy_service(service_id, now)
+
+    for _ in range(MAX_POP_ATTEMPTS):
+        slot = (
+            AccountSlot.objects.filter(service_id=service_id, held_until__isnull=True)
+            .order_by(*PICK_ORDER)
+            .first()
+        )
+        if slot is None:
+            return None
+        account = available_accounts().select_related('account_name').filter(pk=slot.account_id).first()
+        if account is not None:
+            return account
+        refresh_accounts([slot.account_id], now=now)
+    logger.warning('Índice de disponibilidad del servicio %s inconsistente; se reconstruye', service_id)
+    rebuild_service(service_id, now=now)
+    return None
+
+
+def pop_best_account(service_id, now=None, hold_seconds=None, token='') -> Optional[Account]:
+    """
+    Toma la mejor cuenta libre del servicio y la aparta `hold_seconds`
+    (ACCOUNT_HOLD_SEC por defecto) a nombre de `token`.
+    Devuelve la Account o None si no hay disponibles.
+    """
+    now = now or timezone.now()
+    hold_seconds = hold_seconds_default() if hold_seconds is None else hold_seconds
+    if not AccountSlot.objects.filter(service_id=service_id).exists():
+        rebuild_service(service_id, now=now)
+    _tidy_service(service_id, now)
+
+    for _ in range(MAX_POP_ATTEMPTS):
+        with transaction.atomic():
+            slot = (
+                AccountSlot.objects.select_for_update(skip_locked=True)
+                .filter(service_id=service_id, held_until__isnull=True)
+                .order_by(*PICK_ORDER)
+                .first()
+            )
+            if slot is None:
+                return None
+            account = (
+                available_accounts()
+                .select_for_update()
+                .select_related('account_name')
+                .filter(pk=slot.account_id)
+                .first()
+            )
+            if account is None:
+                # El índice estaba atrasado: corregir el grupo y seguir
+                refresh_accounts([slot.account_id], now=now)
+                continue
+            AccountSlot.objects.filter(pk=slot.pk).update(
+                held_until=now + timedelta(seconds=hold_seconds), hold_token=token,
+            )
+            return account
+    logger.warning('Índice de disponibilidad del servicio %s inconsistente; se reconstruye', service_id)
+    rebuild_service(service_id, now=now)
+    return None
@@ -0,0 +1,115 @@
+"""
+Apartado de cuentas para las ventas.
+
+Flujo de una venta:
+1. `reserve_account` toma la mejor cuenta del índice (SELECT ... FOR UPDATE
+   SKIP LOCKED) y la aparta por ACCOUNT_HOLD_SEC con un token propio.
+2. La venta se crea y `claim_account` asigna el cliente con un UPDATE
+   condicionado a que la cuenta siga libre; si otra venta ganó, lanza
+   AccountAlreadyAssigned y no se crea nada.
+3. Al terminar se libera el apartado (si la venta se concretó el renglón ya
+   no existe). Si el proceso muere a medias, el apartado vence solo.
+
+`allocate` junta los tres pasos y reintenta con otra cuenta hasta
+ACCOUNT_RESERVATION_ATTEMPTS veces.
+"""
+
+import logging
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from adm.functions.account_availability import (
+    available_accounts,
+    hold_seconds_default,
+    pop_best_account,
+    release_hold,
+    schedule_refresh,
+)
+from adm.models import Account, AccountSlot
+
+
+logger = logging.getLogger(__name__)
+
+
+class AccountAlreadyAssigned(Exception):
+    """La cuenta ya no estaba libre al momento de asignarla."""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+@dataclass
+class AccountReservation:
+    account: Account
+    token: str
+    expires_at: datetime
+
+    def release(self) -> bool:
+        return release_hold(self.account.pk, self.token)
+
+
+def reserve_account(service_id, hold_seconds=None) -> Optional[AccountReservation]:
+    """Aparta la mejor cuenta libre del servicio o devuelve None si no hay."""
+    hold_seconds = hold_seconds_default() if hold_seconds is None else hold_seconds
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    account = pop_best_account(service_id, now=now, hold_seconds=hold_seconds, token=token)
+    if account is None:
+        return None
+    return AccountReservation(account=account, token=token, expires_at=now + timedelta(seconds=hold_seconds))
+
+
+@contextmanager
+def hold_account(service_id, hold_seconds=None):
+    """Aparta una cuenta durante el bloque y la libera al salir si no se vendió."""
+    reservation = reserve_account(service_id, hold_seconds=hold_seconds)
+    try:
+        yield reservation
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+
+def claim_account(account, customer, modified_by=None):
+    """
+    Asigna la cuenta al cliente solo si sigue libre. Debe llamarse dentro de
+    la misma transacción que crea la venta.
+    """
+    modified_by = modified_by or customer
+    claimed = available_accounts().filter(pk=account.pk).update(customer=customer, modified_by=modified_by)
+    if not claimed:
+        raise AccountAlreadyAssigned(f'La cuenta {account.pk} ya fue asignada')
+    account.customer = customer
+    account.modified_by = modified_by
+    AccountSlot.objects.filter(account_id=account.pk).delete()
+    # update() no dispara señales: recalcular los perfiles del grupo
+    schedule_refresh([account.pk])
+    return account
+
+
+def allocate(service_id, sell: Callable[[Account], Any], attempts=None, hold_seconds=None) -> Tuple[Optional[Account], Any]:
+    """
+    Aparta una cuenta y ejecuta `sell(account)`. Si la cuenta ya fue asignada
+    por otra venta, reintenta con la siguiente. Devuelve (cuenta, resultado
+    de sell) o (None, None) si no hay cuentas.
+    """
+    attempts = attempts or int(_setting('ACCOUNT_RESERVATION_ATTEMPTS', 3))
+    for attempt in range(1, attempts + 1):
+        with hold_account(service_id, hold_seconds=hold_seconds) as reservation:
+            if reservation is None:
+                return None, None
+            try:
+                return reservation.account, sell(reservation.account)
+            except AccountAlreadyAssigned:
+                logger.warning(
+                    'Cuenta %s ya asignada (servicio %s, intento %s/%s); se busca otra',
+                    reservation.account.pk, service_id, attempt, attempts,
+                )
+    return None, None
@@ -0,0 +1,149 @@
+"""
+Búsqueda de cuentas disponibles para el formulario de ventas (SalesSearchView).
+
+Una sola consulta para todos los servicios seleccionados, filtro por email en
+el servidor y paginación por cursor (keyset) en el mismo orden de siempre:
+servicio en el orden seleccionado, prioridad del dominio del email,
+vencimiento descendente.
+
+La respuesta es compacta y se envía por partes (StreamingHttpResponse):
+
+    {"services": {"<id>": {"name": ..., "logo": ...}},
+     "fields": ["id", "service", "email", "password", "expiration_acc", "profile"],
+     "rows": [[...], ...],
+     "total": 1234,          # solo en la primera página
+     "next": "<cursor>"}     # null si no hay más
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.http import StreamingHttpResponse
+
+from adm.models import Account, Service
+
+
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+FIELDS = ['id', 'service', 'email', 'password', 'expiration_acc', 'profile']
+
+# Dominios que se venden primero (mismo orden que antes en SalesSearchView)
+EMAIL_PRIORITY = Case(
+    When(email__iendswith='@berberdna.tn', then=Value(1)),
+    When(email__iendswith='@mangosvip.com', then=Value(2)),
+    When(email__iendswith='@thortry.com', then=Value(3)),
+    When(email__iendswith='@gmail.com', then=Value(5)),
+    default=Value(4),
+    output_field=IntegerField(),
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_service_ids(posted: Iterable[str]) -> List[int]:
+    """IDs de servicio desde `data[]` (JSON {"service": id, ...}), sin repetir y en orden."""
+    service_ids = []
+    for item in posted:
+        try:
+            service_id = int(json.loads(item)['service'])
+        except (TypeError, ValueError, KeyError):
+            continue
+        if service_id not in service_ids:
+            service_ids.append(service_id)
+    return service_ids
+
+
+def encode_cursor(row) -> str:
+    position, priority, expiration, account_id = row
+    raw = json.dumps([position, priority, expiration.isoformat(), account_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str):
+    try:
+        position, priority, expiration, account_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return int(position), int(priority), datetime.fromisoformat(expiration), int(account_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(token)
+
+
+def available_accounts_query(service_ids: List[int], query: str = ''):
+    service_position = Case(
+        *[When(account_name_id=service_id, then=Value(index)) for index, service_id in enumerate(service_ids)],
+        output_field=IntegerField(),
+    )
+    accounts = Account.objects.filter(
+        account_name_id__in=service_ids,
+        customer=None,
+        status=True,
+        external_status='Disponible',
+    )
+    if query:
+        accounts = accounts.filter(email__icontains=query)
+    return accounts.annotate(
+        service_position=service_position,
+        email_priority=EMAIL_PRIORITY,
+    ).order_by('service_position', 'email_priority', '-expiration_date', '-id')
+
+
+def _after(accounts, cursor):
+    position, priority, expiration, account_id = cursor
+    return accounts.filter(
+        Q(service_position__gt=position)
+        | Q(service_position=position, email_priority__gt=priority)
+        | Q(service_position=position, email_priority=priority, expiration_date__lt=expiration)
+        | Q(service_position=position, email_priority=priority, expiration_date=expiration, id__lt=account_id)
+    )
+
+
+def _services_header(service_ids: List[int]) -> dict:
+    # Un solo acceso a storage por servicio para el logo
+    header = {}
+    for service in Service.objects.filter(pk__in=service_ids).only('id', 'description', 'logo'):
+        header[str(service.id)] = {
+            'name': service.description,
+            'logo': service.logo.url if service.logo else '',
+        }
+    return header
+
+
+def _stream(service_ids, accounts, total, limit):
+    encode = DjangoJSONEncoder(separators=(',', ':')).encode
+    yield '{"services":' + encode(_services_header(service_ids))
+    yield ',"fields":' + encode(FIELDS)
+    if total is not None:
+        yield ',"total":' + encode(total)
+    yield ',"rows":['
+
+    rows = accounts.values_list(
+        'id', 'account_name_id', 'email', 'password', 'expiration_date', 'profile',
+        'service_position', 'email_priority',
+    )[:limit + 1]
+    last = None
+    for index, row in enumerate(rows.iterator(chunk_size=500)):
+        if index == limit:
+            yield '],"next":' + encode(encode_cursor(last)) + '}'
+            return
+        yield (',' if index else '') + encode(list(row[:6]))
+        last = (row[6], row[7], row[4], row[0])
+    yield '],"next":null}'
+
+
+def search_response(service_ids: List[int], query: str = '', cursor: Optional[str] = None, limit: int = PAGE_SIZE):
+    """StreamingHttpResponse con una página de cuentas disponibles."""
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    accounts = available_accounts_query(service_ids, query.strip())
+    total = None
+    if cursor:
+        accounts = _after(accounts, decode_cursor(cursor))
+    else:
+        total = accounts.count()
+    response = StreamingHttpResponse(_stream(service_ids, accounts, total, limit), content_type='application/json')
+    response['Cache-Control'] = 'no-store'
+    return response
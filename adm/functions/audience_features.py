@@ -0,0 +1,354 @@
+"""
+Matriz de características de clientes para recomendar audiencias de campañas.
+
+Antes cada campaña recorría hasta 800 clientes haciendo ~5 consultas por
+cliente y un INSERT por recomendación. Ahora:
+
+1. `load_features` arma una sola vez por día (y por vendedor) una matriz
+   columnar: una columna por característica (`array` para números, listas
+   para texto), más estadísticas por servicio y las expiraciones activas de
+   cada cliente. Se lee de la tabla CustomerFeatures (por vendedor, los
+   totales se agregan de sus ventas) y se guarda en cache hasta el fin del
+   día, así todas las campañas del día la reutilizan.
+2. `score_audience` aplica las reglas de exclusión como máscaras sobre
+   columnas completas y calcula el puntaje igual que antes.
+
+Los cálculos que dependen de la hora (días sin compra, ventas activas ahora)
+se hacen con `now` al momento de puntuar, no al armar la matriz.
+"""
+
+import unicodedata
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from adm.functions import customer_features
+from adm.functions.customer_features import parse_iso
+from adm.models import CustomerFeatures, Sale
+
+
+HISTORY_DAYS = 2555
+CACHE_PREFIX = 'marketing:audience_features'
+DAY_SECONDS = 86400
+
+FILTER_STAT_KEYS = [
+    'total_candidates',
+    'selected',
+    'excluded_country_include',
+    'excluded_country_exclude',
+    'excluded_days_inactive',
+    'excluded_orders_range',
+    'excluded_revenue',
+    'excluded_active_global',
+    'excluded_active_cap',
+    'excluded_service_history',
+    'excluded_target_active',
+    'excluded_recent_same_service',
+    'excluded_no_phone',
+    'excluded_cooldown',
+]
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def country_key(value) -> str:
+    """Misma normalización que _normalize_token (adm/views.py): sin acentos ni emojis, minúsculas."""
+    raw = ''.join(ch for ch in str(value or '') if ord(ch) <= 0xFFFF).strip().lower()
+    if not raw:
+        return ''
+    return ''.join(ch for ch in unicodedata.normalize('NFD', raw) if unicodedata.category(ch) != 'Mn')
+
+
+@dataclass
+class CustomerMatrix:
+    """Una fila por cliente con compras en la ventana; columnas paralelas."""
+
+    day: object
+    customer_id: array = field(default_factory=lambda: array('q'))
+    country: List[str] = field(default_factory=list)
+    country_key: List[str] = field(default_factory=list)
+    lada: List[str] = field(default_factory=list)
+    phone_number: List[str] = field(default_factory=list)
+    total_orders: array = field(default_factory=lambda: array('q'))
+    total_revenue: array = field(default_factory=lambda: array('d'))
+    last_purchase: array = field(default_factory=lambda: array('d'))
+    # fila -> expiraciones (timestamp, ordenadas) de ventas activas desde el inicio del día
+    active_expirations: Dict[int, List[float]] = field(default_factory=dict)
+    # servicio -> fila -> (ventas, última compra, expiración activa más lejana o 0)
+    services: Dict[int, Dict[int, Tuple[int, float, float]]] = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.customer_id)
+
+
+def _ts(value) -> float:
+    return value.timestamp() if value else 0.0
+
+
+def _cache_key(day, seller_id) -> str:
+    return f"{CACHE_PREFIX}:{day.isoformat()}:{seller_id or 'all'}"
+
+
+def build_features(seller=None, now=None) -> CustomerMatrix:
+    now = now or timezone.now()
+    day = timezone.localdate(now)
+    day_start_ts = timezone.make_aware(datetime.combine(day, time.min)).timestamp()
+    features = CustomerMatrix(day=day)
+    customer_features.ensure_fresh()
+
+    # Totales del cliente: CustomerFeatures para todos; por vendedor se agregan sus ventas
+    if seller is None:
+        rows = (
+            CustomerFeatures.objects.filter(last_purchase__gte=now - timedelta(days=HISTORY_DAYS))
+            .values(
+                'customer_id',
+                'customer__userdetail__country',
+                'customer__userdetail__lada',
+                'customer__userdetail__phone_number',
+                'total_orders',
+                'total_revenue',
+                'last_purchase',
+            )
+            .order_by('-total_revenue', 'customer_id')
+        )
+    else:
+        rows = (
+            Sale.objects.filter(created_at__gte=now - timedelta(days=HISTORY_DAYS), user_seller=seller)
+            .values(
+                'customer_id',
+                'customer__userdetail__country',
+                'customer__userdetail__lada',
+                'customer__userdetail__phone_number',
+            )
+            .annotate(
+                total_orders=Count('id'),
+                total_revenue=Sum('payment_amount'),
+                last_purchase=Max('created_at'),
+            )
+            .order_by('-total_revenue', 'customer_id')
+        )
+    index: Dict[int, int] = {}
+    for row in rows.iterator(chunk_size=5000):
+        index[row['customer_id']] = len(features.customer_id)
+        country = row.get('customer__userdetail__country') or ''
+        features.customer_id.append(row['customer_id'])
+        features.country.append(country)
+        features.country_key.append(country_key(country))
+        features.lada.append(str(row.get('customer__userdetail__lada') or ''))
+        features.phone_number.append(str(row.get('customer__userdetail__phone_number') or ''))
+        features.total_orders.append(int(row.get('total_orders') or 0))
+        features.total_revenue.append(float(row.get('total_revenue') or 0))
+        features.last_purchase.append(_ts(row.get('last_purchase')))
+
+    # Ventas activas y por servicio: historial completo de todos los vendedores (igual que antes)
+    stored = CustomerFeatures.objects.values_list('customer_id', 'services', 'active_expirations')
+    for customer_id, services, expirations in stored.iterator(chunk_size=5000):
+        position = index.get(customer_id)
+        if position is None:
+            continue
+        active = [ts for ts in (_ts(parse_iso(value)) for value in expirations or []) if ts >= day_start_ts]
+        if active:
+            features.active_expirations[position] = active
+        for service_id, stat in (services or {}).items():
+            features.services.setdefault(int(service_id), {})[position] = (
+                int(stat.get('orders') or 0),
+                _ts(parse_iso(stat.get('last'))),
+                _ts(parse_iso(stat.get('active_until'))),
+            )
+    return features
+
+
+def load_features(seller=None, now=None) -> CustomerMatrix:
+    """Matriz del día desde cache; se arma si no existe."""
+    now = now or timezone.now()
+    day = timezone.localdate(now)
+    key = _cache_key(day, getattr(seller, 'pk', seller))
+    features = cache.get(key)
+    if features is None:
+        features = build_features(seller=seller, now=now)
+        end_of_day = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+        cache.set(key, features, timeout=max(60, int((end_of_day - now).total_seconds())))
+    return features
+
+
+def invalidate_features(seller=None, now=None):
+    day = timezone.localdate(now or timezone.now())
+    cache.delete(_cache_key(day, getattr(seller, 'pk', seller)))
+
+
+def _target_columns(features: CustomerMatrix, rows: List[int], target_service_ids: Iterable[int]):
+    """(historial, última compra, activa hasta) del servicio objetivo para cada fila."""
+    history = [0] * len(rows)
+    last = [0.0] * len(rows)
+    active_until = [0.0] * len(rows)
+    for service_id in target_service_ids:
+        stats = features.services.get(service_id)
+        if not stats:
+            continue
+        for slot, position in enumerate(rows):
+            stat = stats.get(position)
+            if stat:
+                history[slot] += stat[0]
+                last[slot] = max(last[slot], stat[1])
+                active_until[slot] = max(active_until[slot], stat[2])
+    return history, last, active_until
+
+
+def _score(segment_type, objective, revenue, orders, days, service_history, target_days, has_targets):
+    recency = max(0, 180 - days)
+    score = (revenue * 0.03) + (orders * 3) + recency
+    if 'reactiv' in objective:
+        score = (revenue * 0.02) + (orders * 2) + (days * 1.1)
+    if 'alto valor' in objective or 'premium' in objective:
+        score = (revenue * 0.06) + (orders * 2) + recency
+    if has_targets:
+        score += min(service_history * 4, 32)
+
+    if segment_type == 'reactivation':
+        score = (revenue * 0.02) + (service_history * 4) + min(target_days * 0.9, 160)
+    elif segment_type == 'upsell':
+        score = (revenue * 0.05) + (orders * 4) + max(0, 90 - days)
+    elif segment_type == 'cross_sell':
+        score = (revenue * 0.04) + (orders * 3) + max(0, 120 - days)
+    elif segment_type == 'retention':
+        score = (revenue * 0.03) + (orders * 3.5) + max(0, 45 - days) * 2
+    elif segment_type == 'premium':
+        score = (revenue * 0.08) + (orders * 4) + max(0, 120 - days)
+    elif segment_type == 'acquisition':
+        score = (orders * 2) + max(0, days - 30)
+    elif segment_type == 'churn_risk':
+        score = (revenue * 0.03) + (orders * 2) + min(max(days - 20, 0), 140)
+    return score
+
+
+def score_audience(
+    features: CustomerMatrix,
+    strategy: dict,
+    target_service_ids: Set[int],
+    objective: str = '',
+    channel: str = '',
+    cooldown_users: Optional[Set[int]] = None,
+    now=None,
+    limit: int = 250,
+    pool: Optional[int] = None,
+):
+    """
+    Devuelve (recomendaciones, filter_stats). Las recomendaciones son dicts
+    listos para MarketingCampaignRecommendation, solo las seleccionadas y a lo
+    más `limit`, ordenadas por puntaje.
+    """
+    now = now or timezone.now()
+    now_ts = now.timestamp()
+    pool = int(_setting('MARKETING_AUDIENCE_POOL', 800)) if pool is None else pool
+    rows = list(range(min(pool, len(features))))
+    cooldown_users = cooldown_users or set()
+    objective = (objective or '').lower()
+    segment_type = strategy.get('segment_type', 'general')
+
+    # Columnas del grupo de candidatos (los de mayor ingreso, como antes)
+    customer_ids = [features.customer_id[i] for i in rows]
+    orders = [features.total_orders[i] for i in rows]
+    revenue = [features.total_revenue[i] for i in rows]
+    last_ts = [features.last_purchase[i] for i in rows]
+    days = [int((now_ts - ts) // DAY_SECONDS) if ts else 999 for ts in last_ts]
+    countries = [features.country_key[i] for i in rows]
+    active_now = []
+    for i in rows:
+        expirations = features.active_expirations.get(i, ())
+        active_now.append(len(expirations) - bisect_left(expirations, now_ts))
+
+    has_targets = bool(target_service_ids)
+    history, target_last, target_active_until = _target_columns(features, rows, target_service_ids or ())
+    target_days = [int((now_ts - ts) // DAY_SECONDS) if ts else 999 for ts in target_last]
+    recent_days = strategy.get('exclude_recent_same_service_days', 2)
+    recent_cut = now_ts - recent_days * DAY_SECONDS
+
+    countries_include = set(strategy.get('countries_include', []))
+    countries_exclude = set(strategy.get('countries_exclude', []))
+    min_days, max_days = strategy.get('min_days_inactive', 0), strategy.get('max_days_inactive', 3650)
+    min_orders, max_orders = strategy.get('min_total_orders', 0), strategy.get('max_total_orders', 9999)
+    min_revenue = strategy.get('min_total_revenue', 0)
+    max_active = strategy.get('max_active_sales_now', 999)
+    no_target = [False] * len(rows)
+
+    masks = {
+        'excluded_cooldown': [cid in cooldown_users for cid in customer_ids],
+        'excluded_country_include': (
+            [country not in countries_include for country in countries] if countries_include else no_target
+        ),
+        'excluded_country_exclude': [bool(country) and country in countries_exclude for country in countries],
+        'excluded_days_inactive': [d < min_days or d > max_days for d in days],
+        'excluded_orders_range': [o < min_orders or o > max_orders for o in orders],
+        'excluded_revenue': [r < min_revenue for r in revenue],
+        'excluded_active_global': (
+            [n > 0 for n in active_now] if strategy.get('require_no_active_sales') else no_target
+        ),
+        'excluded_active_cap': [n > max_active for n in active_now],
+        'excluded_service_history': (
+            [h <= 0 and not ts for h, ts in zip(history, target_last)]
+            if strategy.get('require_service_history') else no_target
+        ),
+        'excluded_target_active': (
+            [until >= now_ts for until in target_active_until]
+            if strategy.get('require_target_service_inactive') else no_target
+        ),
+        'excluded_recent_same_service': (
+            [bool(ts) and ts >= recent_cut for ts in target_last]
+            if has_targets and recent_days > 0 else no_target
+        ),
+        'excluded_no_phone': (
+            [not features.lada[i] or not features.phone_number[i] for i in rows]
+            if channel in ('whatsapp', 'sms') else no_target
+        ),
+    }
+
+    filter_stats = {key: 0 for key in FILTER_STAT_KEYS}
+    filter_stats['total_candidates'] = len(rows)
+    eligible = [True] * len(rows)
+    for name, mask in masks.items():
+        filter_stats[name] = sum(mask)
+        eligible = [ok and not excluded for ok, excluded in zip(eligible, mask)]
+
+    selected = []
+    for slot, position in enumerate(rows):
+        if not eligible[slot]:
+            continue
+        score = _score(
+            segment_type, objective, revenue[slot], orders[slot], days[slot],
+            history[slot], target_days[slot], has_targets,
+        )
+        if score <= 0:
+            continue
+        selected.append((slot, position, score))
+    filter_stats['selected'] = len(selected)
+
+    # Mismo desempate que antes: puntaje redondeado y luego orden de ingreso
+    selected.sort(key=lambda item: -round(item[2], 2))
+    recommendations = []
+    for slot, position, score in selected[:limit]:
+        recommendations.append({
+            'customer_id': customer_ids[slot],
+            'country': features.country[position],
+            'lada': features.lada[position],
+            'phone_number': features.phone_number[position],
+            'total_orders': orders[slot],
+            'total_revenue': round(revenue[slot], 2),
+            'last_purchase': datetime.fromtimestamp(last_ts[slot], tz=dt_timezone.utc) if last_ts[slot] else None,
+            'score': round(score, 2),
+            'reason': (
+                f"Ordenes={orders[slot]}, Ingreso={round(revenue[slot], 2)}, "
+                f"Dias sin compra={days[slot]}, Historial servicio={history[slot]}, "
+                f"Dias sin compra objetivo={target_days[slot]}, Activas ahora={active_now[slot]}, "
+                f"Segmento={segment_type}, Elegible=True"
+            ),
+        })
+    return recommendations, filter_stats
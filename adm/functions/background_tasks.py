@@ -1,18 +1,43 @@
 """
 Sistema de tareas en segundo plano para operaciones pesadas.
 Permite ejecutar sincronizaciones sin bloquear el servidor.
+
+Las tareas viven en la tabla BackgroundTaskRecord, así cualquier worker de
+gunicorn puede consultar su estado y sobreviven a un reinicio:
+- Una sola tarea activa por tipo en todo el cluster (columna única `active_type`).
+- El worker que ejecuta la tarea renueva su lease con heartbeats; si deja de
+  hacerlo (deploy, OOM) la tarea se marca fallida o, si puede reintentarse,
+  la retoma `python manage.py run_background_tasks`.
+- BACKGROUND_TASKS_MODE=thread (por defecto) ejecuta en un hilo del propio
+  worker web; BACKGROUND_TASKS_MODE=runner solo encola y el runner ejecuta.
 """
 
-import threading
+import inspect
+import json
 import logging
+import os
+import socket
+import threading
 import uuid
-from datetime import datetime
-from typing import Optional, Dict, Any, Callable
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from enum import Enum
+from typing import Optional, Dict, Any, Callable
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from adm.models import BackgroundTaskRecord
 
 logger = logging.getLogger(__name__)
 
+PROGRESS_MIN_INTERVAL_SEC = 1.0
+_PROGRESS_MAX = BackgroundTaskRecord._meta.get_field("progress").max_length
+
 
 class TaskStatus(Enum):
     """Estados posibles de una tarea"""
@@ -33,6 +58,104 @@ class BackgroundTask:
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
     progress: str = ""
+    attempts: int = 0
+    worker: str = ""
+    heartbeat_at: Optional[datetime] = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _func_path(func: Callable) -> str:
+    """Ruta importable de la función; vacío si no se puede importar desde otro proceso."""
+    module = getattr(func, "__module__", None)
+    qualname = getattr(func, "__qualname__", "")
+    if not module or not qualname or "." in qualname or qualname == "<lambda>":
+        return ""
+    return f"{module}.{qualname}"
+
+
+def _is_json_safe(value) -> bool:
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _jsonable(result):
+    """El resultado se guarda como JSON; fechas y decimales pasan a texto."""
+    try:
+        return json.loads(json.dumps(result, cls=DjangoJSONEncoder))
+    except (TypeError, ValueError):
+        return {"value": str(result)}
+
+
+def _call_kwargs(func: Callable, kwargs: dict, task_id: str, progress_callback: Callable) -> dict:
+    """Agrega progress_callback/task_id solo si la función los acepta."""
+    call_kwargs = dict(kwargs)
+    try:
+        parameters = inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return call_kwargs
+    accepts_any = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values())
+    if accepts_any or "progress_callback" in parameters:
+        call_kwargs.setdefault("progress_callback", progress_callback)
+    if accepts_any or "task_id" in parameters:
+        call_kwargs.setdefault("task_id", task_id)
+    return call_kwargs
+
+
+def _to_task(record: Optional[BackgroundTaskRecord]) -> Optional[BackgroundTask]:
+    if record is None:
+        return None
+    return BackgroundTask(
+        task_id=record.task_id,
+        task_type=record.task_type,
+        status=TaskStatus(record.status),
+        started_at=record.started_at or record.created_at,
+        completed_at=record.completed_at,
+        result=record.result,
+        error=record.error or None,
+        progress=record.progress,
+        attempts=record.attempts,
+        worker=record.lease_owner,
+        heartbeat_at=record.heartbeat_at,
+    )
+
+
+class _Heartbeat:
+    """Hilo que renueva el lease de la tarea mientras se ejecuta."""
+
+    def __init__(self, manager: "BackgroundTaskManager", task_id: str, owner: str):
+        self.manager = manager
+        self.task_id = task_id
+        self.owner = owner
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=f"TaskHeartbeat-{task_id}")
+
+    def _loop(self):
+        try:
+            while not self._stop.wait(self.manager.heartbeat_seconds):
+                try:
+                    self.manager.heartbeat(self.task_id, self.owner)
+                except Exception as exc:
+                    logger.warning("Heartbeat de la tarea %s falló: %s", self.task_id, exc)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
 
 
 class BackgroundTaskManager:
@@ -40,9 +163,9 @@ class BackgroundTaskManager:
     Gestor de tareas en segundo plano.
 
     Características:
-    - Ejecuta tareas en hilos separados
-    - Permite consultar el estado de las tareas
-    - Solo permite una tarea del mismo tipo a la vez
+    - Estado persistido en DB: cualquier worker puede consultarlo
+    - Solo permite una tarea del mismo tipo a la vez (en todo el cluster)
+    - Heartbeats + lease para detectar tareas abandonadas
     - Singleton para acceso global
     """
 
@@ -61,36 +184,99 @@ class BackgroundTaskManager:
         if self._initialized:
             return
 
-        self._tasks: Dict[str, BackgroundTask] = {}
-        self._running_types: Dict[str, str] = {}  # task_type -> task_id
+        self._progress_written: Dict[str, float] = {}
         self._tasks_lock = threading.Lock()
+        self.worker_id = default_worker_id()
         self._initialized = True
         logger.info("BackgroundTaskManager inicializado")
 
+    # ------------------------------------------------------------- settings
+
+    @property
+    def mode(self) -> str:
+        return str(_setting("BACKGROUND_TASKS_MODE", "thread") or "thread").strip().lower()
+
+    @property
+    def lease_seconds(self) -> int:
+        return int(_setting("BACKGROUND_TASK_LEASE_SEC", 90))
+
+    @property
+    def heartbeat_seconds(self) -> float:
+        return float(_setting("BACKGROUND_TASK_HEARTBEAT_SEC", 15))
+
+    @property
+    def max_attempts(self) -> int:
+        return int(_setting("BACKGROUND_TASK_MAX_ATTEMPTS", 2))
+
+    @property
+    def pending_timeout_seconds(self) -> int:
+        return int(_setting("BACKGROUND_TASK_PENDING_TIMEOUT_SEC", 600))
+
+    # ---------------------------------------------------------------- leases
+
+    def _lease(self, now):
+        return now + timedelta(seconds=self.lease_seconds)
+
+    def _finish_fields(self, status: str, now, **fields):
+        fields.update(status=status, active_type=None, completed_at=now, leased_until=None)
+        return fields
+
+    def expire_stale(self, now=None) -> int:
+        """
+        Marca como fallidas las tareas abandonadas: en ejecución con lease
+        vencido que no pueden reintentarse, o pendientes que ningún runner
+        tomó a tiempo. Las reintentables quedan para el runner.
+        """
+        now = now or timezone.now()
+        expired = BackgroundTaskRecord.objects.filter(
+            status=BackgroundTaskRecord.STATUS_RUNNING, leased_until__lt=now,
+        ).filter(Q(func_path="") | Q(attempts__gte=self.max_attempts))
+        count = expired.update(**self._finish_fields(
+            BackgroundTaskRecord.STATUS_FAILED, now,
+            error="El worker dejó de responder (lease vencido)",
+            progress="Error: el worker dejó de responder",
+        ))
+        count += BackgroundTaskRecord.objects.filter(
+            status=BackgroundTaskRecord.STATUS_PENDING,
+            heartbeat_at__lt=now - timedelta(seconds=self.pending_timeout_seconds),
+        ).update(**self._finish_fields(
+            BackgroundTaskRecord.STATUS_FAILED, now,
+            error="Ningún runner tomó la tarea a tiempo",
+            progress="Error: sin runner disponible",
+        ))
+        if count:
+            logger.warning(f"⚠️ {count} tareas abandonadas marcadas como fallidas")
+        return count
+
+    def heartbeat(self, task_id: str, owner: str) -> bool:
+        now = timezone.now()
+        return BackgroundTaskRecord.objects.filter(
+            task_id=task_id, status=BackgroundTaskRecord.STATUS_RUNNING, lease_owner=owner,
+        ).update(heartbeat_at=now, leased_until=self._lease(now)) > 0
+
+    # --------------------------------------------------------------- consultas
+
     def is_task_type_running(self, task_type: str) -> bool:
         """Verifica si hay una tarea del tipo especificado en ejecución"""
-        with self._tasks_lock:
-            if task_type in self._running_types:
-                task_id = self._running_types[task_type]
-                task = self._tasks.get(task_id)
-                if task and task.status == TaskStatus.RUNNING:
-                    return True
-                # Limpiar si ya no está corriendo
-                del self._running_types[task_type]
-            return False
+        return self.get_running_task(task_type) is not None
 
     def get_running_task(self, task_type: str) -> Optional[BackgroundTask]:
-        """Obtiene la tarea en ejecución del tipo especificado"""
-        with self._tasks_lock:
-            if task_type in self._running_types:
-                task_id = self._running_types[task_type]
-                return self._tasks.get(task_id)
-            return None
+        """Obtiene la tarea activa (pendiente o en ejecución) del tipo especificado"""
+        self.expire_stale()
+        return _to_task(BackgroundTaskRecord.objects.filter(active_type=task_type).first())
 
     def get_task(self, task_id: str) -> Optional[BackgroundTask]:
         """Obtiene una tarea por su ID"""
-        with self._tasks_lock:
-            return self._tasks.get(task_id)
+        self.expire_stale()
+        return _to_task(BackgroundTaskRecord.objects.filter(task_id=task_id).first())
+
+    def get_all_tasks(self, limit: int = 200) -> Dict[str, BackgroundTask]:
+        """Obtiene las tareas más recientes"""
+        self.expire_stale()
+        records = BackgroundTaskRecord.objects.defer("args", "kwargs").order_by("-created_at")[:limit]
+        return {record.task_id: _to_task(record) for record in records}
+
+    # ---------------------------------------------------------------- inicio
 
     def start_task(
         self,
@@ -110,119 +296,169 @@ class BackgroundTaskManager:
         Returns:
             (success, message, task): Tupla con resultado
         """
-        # Verificar si ya hay una tarea del mismo tipo corriendo
-        if self.is_task_type_running(task_type):
+        self.expire_stale()
+        func_path = _func_path(func)
+        queued = self.mode == "runner" and bool(func_path) and _is_json_safe([list(args), kwargs])
+
+        now = timezone.now()
+        record = BackgroundTaskRecord(
+            task_id=str(uuid.uuid4())[:8],
+            task_type=task_type,
+            active_type=task_type,
+            status=BackgroundTaskRecord.STATUS_PENDING if queued else BackgroundTaskRecord.STATUS_RUNNING,
+            func_path=func_path if queued else "",
+            args=list(args) if queued else [],
+            kwargs=kwargs if queued else {},
+            progress="En cola..." if queued else "Iniciando...",
+            attempts=0 if queued else 1,
+            lease_owner="" if queued else self.worker_id,
+            leased_until=None if queued else self._lease(now),
+            heartbeat_at=now,
+            created_at=now,
+            started_at=None if queued else now,
+        )
+        try:
+            with transaction.atomic():
+                record.save()
+        except IntegrityError:
+            # La columna única active_type ya tiene una tarea de este tipo
             existing_task = self.get_running_task(task_type)
+            since = existing_task.started_at if existing_task else "otro worker"
             return (
                 False,
-                f"Ya hay una tarea '{task_type}' en ejecución desde {existing_task.started_at}",
+                f"Ya hay una tarea '{task_type}' en ejecución desde {since}",
                 existing_task
             )
 
-        # Crear nueva tarea
-        task_id = str(uuid.uuid4())[:8]
-        task = BackgroundTask(
-            task_id=task_id,
-            task_type=task_type,
-            status=TaskStatus.RUNNING,
-            started_at=datetime.now(),
-            progress="Iniciando..."
-        )
+        if not queued:
+            # Ejecutar en hilo separado
+            thread = threading.Thread(
+                target=self._run_in_thread,
+                args=(record.task_id, func, args, kwargs, self.worker_id),
+                daemon=True,
+                name=f"BackgroundTask-{task_type}-{record.task_id}"
+            )
+            thread.start()
 
-        with self._tasks_lock:
-            self._tasks[task_id] = task
-            self._running_types[task_type] = task_id
-
-        # Ejecutar en hilo separado
-        thread = threading.Thread(
-            target=self._run_task,
-            args=(task_id, func, args, kwargs),
-            daemon=True,
-            name=f"BackgroundTask-{task_type}-{task_id}"
-        )
-        thread.start()
+        logger.info(f"🚀 Tarea '{task_type}' {'encolada' if queued else 'iniciada'} con ID: {record.task_id}")
+        return (True, f"Tarea iniciada con ID: {record.task_id}", _to_task(record))
 
-        logger.info(f"🚀 Tarea '{task_type}' iniciada con ID: {task_id}")
-        return (True, f"Tarea iniciada con ID: {task_id}", task)
+    # ------------------------------------------------------------- ejecución
+
+    def _run_in_thread(self, task_id, func, args, kwargs, owner):
+        try:
+            self._run_task(task_id, func, args, kwargs, owner)
+        finally:
+            connection.close()
 
     def _run_task(
         self,
         task_id: str,
         func: Callable,
         args: tuple,
-        kwargs: dict
+        kwargs: dict,
+        owner: str,
     ):
-        """Ejecuta la tarea en segundo plano"""
-        task = self._tasks.get(task_id)
-        if not task:
-            return
-
+        """Ejecuta la tarea con heartbeats y guarda el resultado si el lease sigue siendo nuestro."""
+        owned = BackgroundTaskRecord.objects.filter(
+            task_id=task_id, status=BackgroundTaskRecord.STATUS_RUNNING, lease_owner=owner,
+        )
         try:
-            task.progress = "Ejecutando..."
-            kwargs_with_progress = dict(kwargs)
-            kwargs_with_progress.setdefault(
-                "progress_callback",
-                lambda message: self.set_task_progress(task_id, message)
+            owned.update(progress="Ejecutando...")
+            call_kwargs = _call_kwargs(
+                func, kwargs, task_id, lambda message: self.set_task_progress(task_id, message),
             )
-            kwargs_with_progress.setdefault("task_id", task_id)
-
-            result = func(*args, **kwargs_with_progress)
-
-            with self._tasks_lock:
-                task.status = TaskStatus.COMPLETED
-                task.completed_at = datetime.now()
-                task.result = result
-                task.progress = "Completado"
-
-                # Limpiar de running_types
-                if task.task_type in self._running_types:
-                    del self._running_types[task.task_type]
-
-            logger.info(f"✅ Tarea {task_id} ({task.task_type}) completada")
+            with _Heartbeat(self, task_id, owner):
+                result = func(*args, **call_kwargs)
+
+            now = timezone.now()
+            updated = owned.update(**self._finish_fields(
+                BackgroundTaskRecord.STATUS_COMPLETED, now,
+                result=_jsonable(result), progress="Completado", heartbeat_at=now,
+            ))
+            if updated:
+                logger.info(f"✅ Tarea {task_id} completada")
+            else:
+                logger.warning(f"⚠️ Tarea {task_id} terminó pero otro worker ya había tomado su lease")
 
         except Exception as e:
+            now = timezone.now()
+            owned.update(**self._finish_fields(
+                BackgroundTaskRecord.STATUS_FAILED, now,
+                error=str(e), progress=f"Error: {str(e)}"[:_PROGRESS_MAX], heartbeat_at=now,
+            ))
+            logger.error(f"❌ Tarea {task_id} falló: {e}")
+        finally:
             with self._tasks_lock:
-                task.status = TaskStatus.FAILED
-                task.completed_at = datetime.now()
-                task.error = str(e)
-                task.progress = f"Error: {str(e)}"
-
-                # Limpiar de running_types
-                if task.task_type in self._running_types:
-                    del self._running_types[task.task_type]
+                self._progress_written.pop(task_id, None)
 
-            logger.error(f"❌ Tarea {task_id} ({task.task_type}) falló: {e}")
+    def claim_next(self, owner: str, now=None) -> Optional[BackgroundTaskRecord]:
+        """
+        Reserva para el runner la siguiente tarea pendiente o una en ejecución
+        cuyo lease venció (el worker anterior murió). El UPDATE condicional
+        evita que dos runners tomen la misma.
+        """
+        now = now or timezone.now()
+        self.expire_stale(now)
+        due = BackgroundTaskRecord.objects.filter(
+            Q(status=BackgroundTaskRecord.STATUS_PENDING)
+            | Q(status=BackgroundTaskRecord.STATUS_RUNNING, leased_until__lt=now, attempts__lt=self.max_attempts)
+        ).exclude(func_path="").order_by("created_at")
+        for candidate in due[:20]:
+            claimed = BackgroundTaskRecord.objects.filter(
+                pk=candidate.pk, status=candidate.status, lease_owner=candidate.lease_owner,
+                attempts=candidate.attempts,
+            ).update(
+                status=BackgroundTaskRecord.STATUS_RUNNING,
+                lease_owner=owner,
+                leased_until=self._lease(now),
+                heartbeat_at=now,
+                started_at=candidate.started_at or now,
+                attempts=candidate.attempts + 1,
+                progress="Reintentando..." if candidate.status == BackgroundTaskRecord.STATUS_RUNNING else "Iniciando...",
+            )
+            if claimed:
+                if candidate.status == BackgroundTaskRecord.STATUS_RUNNING:
+                    logger.warning(f"Lease vencido para la tarea {candidate.task_id}; se retoma")
+                return BackgroundTaskRecord.objects.get(pk=candidate.pk)
+        return None
+
+    def run_claimed(self, record: BackgroundTaskRecord, owner: str):
+        """Ejecuta en este proceso una tarea reservada con claim_next."""
+        try:
+            func = import_string(record.func_path)
+        except ImportError as exc:
+            now = timezone.now()
+            BackgroundTaskRecord.objects.filter(pk=record.pk, lease_owner=owner).update(**self._finish_fields(
+                BackgroundTaskRecord.STATUS_FAILED, now,
+                error=f"No se pudo importar {record.func_path}: {exc}", progress="Error: función no encontrada",
+            ))
+            return
+        self._run_task(record.task_id, func, tuple(record.args or []), dict(record.kwargs or {}), owner)
 
     def set_task_progress(self, task_id: str, message: str):
-        """Actualiza el progreso textual de una tarea en ejecución."""
+        """Actualiza el progreso textual de una tarea en ejecución (máx. una escritura por segundo)."""
+        now = timezone.now()
+        stamp = now.timestamp()
         with self._tasks_lock:
-            task = self._tasks.get(task_id)
-            if not task:
+            last = self._progress_written.get(task_id, 0.0)
+            if stamp - last < PROGRESS_MIN_INTERVAL_SEC:
                 return
-            task.progress = str(message or "")
-
-    def get_all_tasks(self) -> Dict[str, BackgroundTask]:
-        """Obtiene todas las tareas"""
-        with self._tasks_lock:
-            return dict(self._tasks)
+            self._progress_written[task_id] = stamp
+        BackgroundTaskRecord.objects.filter(
+            task_id=task_id, status=BackgroundTaskRecord.STATUS_RUNNING,
+        ).update(progress=str(message or "")[:_PROGRESS_MAX], heartbeat_at=now)
 
     def cleanup_old_tasks(self, max_age_hours: int = 24):
         """Limpia tareas antiguas completadas/fallidas"""
-        now = datetime.now()
-        with self._tasks_lock:
-            to_delete = []
-            for task_id, task in self._tasks.items():
-                if task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
-                    if task.completed_at:
-                        age = (now - task.completed_at).total_seconds() / 3600
-                        if age > max_age_hours:
-                            to_delete.append(task_id)
-
-            for task_id in to_delete:
-                del self._tasks[task_id]
-
-            if to_delete:
-                logger.info(f"🧹 Limpiadas {len(to_delete)} tareas antiguas")
+        cutoff = timezone.now() - timedelta(hours=max_age_hours)
+        deleted, _ = BackgroundTaskRecord.objects.filter(
+            status__in=[BackgroundTaskRecord.STATUS_COMPLETED, BackgroundTaskRecord.STATUS_FAILED],
+            completed_at__lt=cutoff,
+        ).delete()
+        if deleted:
+            logger.info(f"🧹 Limpiadas {deleted} tareas antiguas")
+        return deleted
 
 
 # Instancia global
@@ -1,10 +1,55 @@
+import copy
+import threading
+import time
+
 from adm.models import Business, Service, Account, Credits, UserDetail
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Sum
 
+from CuentasMexico.cache import incr_counter
+from adm.functions import request_cache
+
+# Business (pk=1) en memoria del proceso. Las señales de Business suben
+# BUSINESS_VERSION_KEY en la caché compartida y así se entera cada worker;
+# BUSINESS_CACHE_TTL cubre cambios hechos con update() o desde otra app.
+BUSINESS_VERSION_KEY = 'business:version'
+_business_lock = threading.Lock()
+_business = None  # (versión, cargado en, instancia)
+
+
+def business_version():
+    return int(cache.get(BUSINESS_VERSION_KEY) or 0)
+
+
+def invalidate_business():
+    global _business
+    _business = None
+    return incr_counter(BUSINESS_VERSION_KEY, timeout=None)
+
+
+def _load_business():
+    global _business
+    version = business_version()
+    ttl = int(getattr(settings, 'BUSINESS_CACHE_TTL', 300))
+
+    def stale(entry):
+        return entry is None or entry[0] != version or time.monotonic() - entry[1] > ttl
+
+    cached = _business
+    if stale(cached):
+        with _business_lock:
+            cached = _business
+            if stale(cached):
+                cached = _business = (version, time.monotonic(), Business.objects.get(pk=1))
+    # Copia por request: quien la modifique no toca la del proceso
+    return copy.copy(cached[2])
+
+
 class BusinessInfo():
     
     def data():
-        return Business.objects.get(pk=1)
+        return request_cache.memoize('business', _load_business)
 
     def cart_data():
         pass
@@ -17,7 +62,9 @@ class BusinessInfo():
         user = getattr(request, 'user', None)
         if not user or user.is_anonymous:
             return 0
+        return request_cache.memoize(f'credits:{user.pk}', lambda: BusinessInfo._credits(user))
 
+    def _credits(user):
         try:
             user_detail = user.userdetail
             if user_detail.associated_shop:
@@ -5,10 +5,11 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 
 from django.contrib.auth.models import User
-from django.db.models import Avg, Case, CharField, Count, Max, Min, Q, Sum, Value, When
+from django.db.models import Avg, Case, CharField, Count, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
 from django.utils import timezone
 
-from adm.models import PaymentMethod, Sale, Service
+from adm.functions import customer_features
+from adm.models import CustomerFeatures, PaymentMethod, Sale, SaleDailyRollup, Service
 
 
 class CRMAnalytics:
@@ -17,13 +18,14 @@ class CRMAnalytics:
     CHURN_DAYS = 45
 
     @classmethod
-    def _currency_case(cls):
+    def _currency_case(cls, country_field='customer__userdetail__country'):
+        lookup = f'{country_field}__iexact'
         return Case(
-            When(customer__userdetail__country__iexact='Chile', then=Value('CLP')),
-            When(customer__userdetail__country__iexact='CL', then=Value('CLP')),
-            When(customer__userdetail__country__iexact='México', then=Value('MXN')),
-            When(customer__userdetail__country__iexact='Mexico', then=Value('MXN')),
-            When(customer__userdetail__country__iexact='MX', then=Value('MXN')),
+            When(**{lookup: 'Chile'}, then=Value('CLP')),
+            When(**{lookup: 'CL'}, then=Value('CLP')),
+            When(**{lookup: 'México'}, then=Value('MXN')),
+            When(**{lookup: 'Mexico'}, then=Value('MXN')),
+            When(**{lookup: 'MX'}, then=Value('MXN')),
             default=Value('MXN'),
             output_field=CharField(),
         )
@@ -202,21 +204,79 @@ class CRMAnalytics:
 
         return queryset
 
+    @staticmethod
+    def _rollup_supports(filters):
+        """
+        El resumen diario solo guarda día, servicio, país, método de pago y
+        vendedor; cualquier otro filtro obliga a leer las ventas crudas.
+        """
+        if not filters:
+            return False
+        return (
+            filters.get("sale_status") in ("", "all")
+            and filters.get("customer_type") in ("", "all")
+            and filters.get("amount_min") is None
+            and filters.get("amount_max") is None
+            and not filters.get("customer_q")
+        )
+
+    @classmethod
+    def _rollup_queryset(cls, filters):
+        queryset = SaleDailyRollup.objects.filter(
+            day__gte=filters["date_from"],
+            day__lte=filters["date_to"],
+        )
+        if filters["country"]:
+            queryset = queryset.filter(country__iexact=filters["country"])
+        if filters["service_id"]:
+            queryset = queryset.filter(service_id=filters["service_id"])
+        if filters["seller_id"]:
+            queryset = queryset.filter(seller_id=filters["seller_id"])
+        if filters["payment_method_id"]:
+            queryset = queryset.filter(payment_method_id=filters["payment_method_id"])
+        return queryset
+
+    @classmethod
+    def _first_purchase_map(cls, customer_ids):
+        """Primera compra por cliente desde CustomerFeatures; los que falten salen de Sale."""
+        customer_features.ensure_fresh()
+        first_sales = dict(
+            CustomerFeatures.objects.filter(customer_id__in=customer_ids, first_purchase__isnull=False)
+            .values_list("customer_id", "first_purchase")
+        )
+        missing = [customer_id for customer_id in customer_ids if customer_id not in first_sales]
+        if missing:
+            first_sales.update(
+                Sale.objects.filter(customer_id__in=missing)
+                .values("customer_id")
+                .annotate(first_sale=Min("created_at"))
+                .values_list("customer_id", "first_sale")
+            )
+        return first_sales
+
     @classmethod
     def _build_customer_type_map(cls, customer_ids, date_from, date_to):
         if not customer_ids:
             return {}
-        first_sales = (
-            Sale.objects.filter(customer_id__in=customer_ids)
-            .values("customer_id")
-            .annotate(first_sale=Min("created_at"))
-        )
         result = {}
-        for item in first_sales:
-            first_date = timezone.localtime(item["first_sale"]).date() if item["first_sale"] else None
-            result[item["customer_id"]] = bool(first_date and date_from <= first_date <= date_to)
+        for customer_id, first_sale in cls._first_purchase_map(customer_ids).items():
+            first_date = timezone.localtime(first_sale).date() if first_sale else None
+            result[customer_id] = bool(first_date and date_from <= first_date <= date_to)
         return result
 
+    @staticmethod
+    def _has_non_date_filters(filters):
+        return bool(
+            filters.get("country")
+            or filters.get("service_id")
+            or filters.get("seller_id")
+            or filters.get("payment_method_id")
+            or filters.get("sale_status") in ("active", "inactive")
+            or filters.get("amount_min") is not None
+            or filters.get("amount_max") is not None
+            or filters.get("customer_q")
+        )
+
     @classmethod
     def get_filtered_sales(cls, params):
         filters = cls.parse_filters(params)
@@ -230,11 +290,21 @@ class CRMAnalytics:
         return round((part / total) * 100, 2)
 
     @classmethod
-    def get_kpis(cls, sales_qs):
-        base = sales_qs.aggregate(
-            total_sales=Count("id"),
-            unique_customers=Count("customer", distinct=True),
-        )
+    def get_kpis(cls, sales_qs, filters=None):
+        """
+        Si se pasan los filtros y el resumen diario los soporta, ventas e
+        ingresos salen de SaleDailyRollup; los clientes únicos y recurrentes
+        no son sumables por día y siempre se cuentan sobre las ventas.
+        """
+        use_rollup = cls._rollup_supports(filters)
+        if use_rollup:
+            base = sales_qs.aggregate(unique_customers=Count("customer", distinct=True))
+            base["total_sales"] = cls._rollup_queryset(filters).aggregate(total=Sum("sales_count"))["total"]
+        else:
+            base = sales_qs.aggregate(
+                total_sales=Count("id"),
+                unique_customers=Count("customer", distinct=True),
+            )
 
         total_sales = base["total_sales"] or 0
         unique_customers = base["unique_customers"] or 0
@@ -247,11 +317,26 @@ class CRMAnalytics:
         )
         repeat_rate = cls._percentage(customer_repeat, unique_customers)
 
-        revenue_by_currency = (
-            sales_qs.annotate(currency_code=cls._currency_case())
-            .values('currency_code')
-            .annotate(total_revenue=Sum('payment_amount'), avg_ticket=Avg('payment_amount'))
-        )
+        if use_rollup:
+            revenue_by_currency = [
+                {
+                    'currency_code': row['currency_code'],
+                    'total_revenue': row['total_revenue'],
+                    'avg_ticket': (row['total_revenue'] or 0) / row['total_orders'] if row['total_orders'] else 0,
+                }
+                for row in (
+                    cls._rollup_queryset(filters)
+                    .annotate(currency_code=cls._currency_case('country'))
+                    .values('currency_code')
+                    .annotate(total_revenue=Sum('revenue'), total_orders=Sum('sales_count'))
+                )
+            ]
+        else:
+            revenue_by_currency = (
+                sales_qs.annotate(currency_code=cls._currency_case())
+                .values('currency_code')
+                .annotate(total_revenue=Sum('payment_amount'), avg_ticket=Avg('payment_amount'))
+            )
         currency_totals = {
             'MXN': {'total_revenue': 0, 'avg_ticket': 0.0},
             'CLP': {'total_revenue': 0, 'avg_ticket': 0.0},
@@ -341,16 +426,27 @@ class CRMAnalytics:
         return result
 
     @classmethod
-    def get_sales_trend(cls, sales_qs):
-        rows = (
-            sales_qs.annotate(currency_code=cls._currency_case())
-            .values("created_at__date", "currency_code")
-            .annotate(total_revenue=Sum("payment_amount"), total_orders=Count("id"))
-            .order_by("created_at__date", "currency_code")
-        )
+    def get_sales_trend(cls, sales_qs, filters=None):
+        if cls._rollup_supports(filters):
+            rows = (
+                cls._rollup_queryset(filters)
+                .annotate(currency_code=cls._currency_case('country'))
+                .values("day", "currency_code")
+                .annotate(total_revenue=Sum("revenue"), total_orders=Sum("sales_count"))
+                .order_by("day", "currency_code")
+            )
+            date_field = "day"
+        else:
+            rows = (
+                sales_qs.annotate(currency_code=cls._currency_case())
+                .values("created_at__date", "currency_code")
+                .annotate(total_revenue=Sum("payment_amount"), total_orders=Count("id"))
+                .order_by("created_at__date", "currency_code")
+            )
+            date_field = "created_at__date"
         grouped = defaultdict(lambda: {"revenue_mxn": 0, "revenue_clp": 0, "total_orders": 0})
         for row in rows:
-            date_key = row["created_at__date"]
+            date_key = row[date_field]
             currency = row["currency_code"] or "MXN"
             revenue = int(row["total_revenue"] or 0)
             if currency == "CLP":
@@ -373,62 +469,87 @@ class CRMAnalytics:
     def get_churn_customers(cls, filters, limit=200):
         now = timezone.now()
         churn_threshold = now - timedelta(days=cls.CHURN_DAYS)
+        customer_features.ensure_fresh()
+        if not customer_features.is_populated():
+            return cls._churn_customers_from_sales(filters, limit, now, churn_threshold)
 
         # Para churn no usamos el rango de fechas del dashboard en la selección base,
         # porque eso oculta clientes antiguos que precisamente queremos detectar.
-        all_sales = cls._apply_non_date_filters(cls._base_queryset(), filters)
+        # Totales y última compra salen de CustomerFeatures (historial completo ya agregado).
+        rows = CustomerFeatures.objects.filter(last_purchase__lt=churn_threshold)
+        if cls._has_non_date_filters(filters):
+            candidates = cls._apply_non_date_filters(Sale.objects.all(), filters).values("customer_id")
+            rows = rows.filter(customer_id__in=candidates)
 
-        candidate_ids = list(all_sales.values_list("customer_id", flat=True).distinct())
-        if not candidate_ids:
-            return []
+        churn_order = "last_purchase" if filters.get("churn_sort", "desc") == "desc" else "-last_purchase"
+        rows = rows.select_related("customer__userdetail", "last_service").order_by(churn_order, "customer_id")
+
+        result = []
+        for row in rows[:limit]:
+            user = row.customer
+            detail = getattr(user, "userdetail", None)
+            result.append(
+                {
+                    "customer_id": row.customer_id,
+                    "username": user.username or "",
+                    "email": user.email or "",
+                    "phone": getattr(detail, "phone_number", "") or "",
+                    "country": getattr(detail, "country", "") or "",
+                    "currency": cls._currency_from_country(getattr(detail, "country", "")),
+                    "last_purchase": row.last_purchase,
+                    "days_inactive": (now - row.last_purchase).days if row.last_purchase else 0,
+                    "total_revenue": int(row.total_revenue or 0),
+                    "total_orders": row.total_orders or 0,
+                    "last_service": row.last_service.description if row.last_service else "",
+                }
+            )
+        return result
 
+    @classmethod
+    def _churn_customers_from_sales(cls, filters, limit, now, churn_threshold):
+        """Churn agregando Sale directamente, para cuando CustomerFeatures está vacío."""
+        candidates = cls._apply_non_date_filters(Sale.objects.all(), filters).values("customer_id")
         churn_order = "last_purchase" if filters.get("churn_sort", "desc") == "desc" else "-last_purchase"
-        latest_sales = (
-            Sale.objects.filter(customer_id__in=candidate_ids)
-            .values("customer_id")
+        rows = list(
+            Sale.objects.filter(customer_id__in=candidates)
+            .values(
+                "customer_id",
+                "customer__username",
+                "customer__email",
+                "customer__userdetail__phone_number",
+                "customer__userdetail__country",
+            )
             .annotate(last_purchase=Max("created_at"), total_revenue=Sum("payment_amount"), total_orders=Count("id"))
             .filter(last_purchase__lt=churn_threshold)
-            .order_by(churn_order)
+            .order_by(churn_order, "customer_id")[:limit]
         )
-
-        last_service_map = {}
-        raw_last_sales = (
-            Sale.objects.filter(customer_id__in=[x["customer_id"] for x in latest_sales])
-            .select_related("account__account_name")
-            .order_by("customer_id", "-created_at")
+        last_service = (
+            Sale.objects.filter(customer_id=OuterRef("pk"))
+            .order_by("-created_at", "-id")
+            .values("account__account_name__description")[:1]
+        )
+        last_services = dict(
+            User.objects.filter(id__in=[row["customer_id"] for row in rows])
+            .annotate(service=Subquery(last_service))
+            .values_list("id", "service")
         )
-        seen = set()
-        for sale in raw_last_sales:
-            if sale.customer_id in seen:
-                continue
-            seen.add(sale.customer_id)
-            last_service_map[sale.customer_id] = sale.account.account_name.description if sale.account_id else ""
-
-        user_map = {
-            user.id: user
-            for user in User.objects.select_related("userdetail").filter(id__in=[x["customer_id"] for x in latest_sales])
-        }
 
         result = []
-        for row in latest_sales[:limit]:
-            customer_id = row["customer_id"]
-            user = user_map.get(customer_id)
-            if not user:
-                continue
-            days_inactive = (now - row["last_purchase"]).days if row["last_purchase"] else 0
+        for row in rows:
+            country = row["customer__userdetail__country"] or ""
             result.append(
                 {
-                    "customer_id": customer_id,
-                    "username": user.username or "",
-                    "email": user.email or "",
-                    "phone": getattr(getattr(user, "userdetail", None), "phone_number", "") or "",
-                    "country": getattr(getattr(user, "userdetail", None), "country", "") or "",
-                    "currency": cls._currency_from_country(getattr(getattr(user, "userdetail", None), "country", "")),
+                    "customer_id": row["customer_id"],
+                    "username": row["customer__username"] or "",
+                    "email": row["customer__email"] or "",
+                    "phone": row["customer__userdetail__phone_number"] or "",
+                    "country": country,
+                    "currency": cls._currency_from_country(country),
                     "last_purchase": row["last_purchase"],
-                    "days_inactive": days_inactive,
+                    "days_inactive": (now - row["last_purchase"]).days if row["last_purchase"] else 0,
                     "total_revenue": int(row["total_revenue"] or 0),
                     "total_orders": row["total_orders"] or 0,
-                    "last_service": last_service_map.get(customer_id, ""),
+                    "last_service": last_services.get(row["customer_id"]) or "",
                 }
             )
         return result
@@ -439,40 +560,64 @@ class CRMAnalytics:
         Cliente recuperado:
         - Tiene una compra en el rango seleccionado.
         - Esa compra ocurre 45+ días después de su compra inmediatamente anterior.
+
+        CustomerFeatures descarta de entrada a quien no compró en el rango o
+        no tiene historial suficiente; solo se recorren las ventas del resto.
+        Si el store está vacío se recorren las ventas de todos.
         """
         date_from = filters["date_from"]
         date_to = filters["date_to"]
+        customer_features.ensure_fresh()
+        range_start = timezone.make_aware(datetime.combine(date_from, datetime.min.time())) - timedelta(days=1)
+        range_end = timezone.make_aware(datetime.combine(date_to, datetime.max.time())) + timedelta(days=1)
+        sales = Sale.objects.all()
+        if customer_features.is_populated():
+            candidates = CustomerFeatures.objects.filter(
+                last_purchase__gte=range_start,
+                first_purchase__lte=range_end - timedelta(days=cls.CHURN_DAYS),
+            ).values("customer_id")
+            sales = sales.filter(customer_id__in=candidates)
 
         all_sales = (
-            cls._apply_non_date_filters(cls._base_queryset(), filters)
+            cls._apply_non_date_filters(sales, filters)
             .order_by("customer_id", "created_at", "id")
+            .values(
+                "customer_id",
+                "customer__username",
+                "customer__email",
+                "customer__userdetail__phone_number",
+                "customer__userdetail__country",
+                "created_at",
+                "payment_amount",
+                "account__account_name__description",
+            )
         )
 
         last_sale_by_customer = {}
         recovered_events = []
 
-        for sale in all_sales:
-            previous_sale = last_sale_by_customer.get(sale.customer_id)
+        for sale in all_sales.iterator(chunk_size=2000):
+            previous_sale = last_sale_by_customer.get(sale["customer_id"])
             if previous_sale:
-                gap_days = (sale.created_at - previous_sale.created_at).days
+                gap_days = (sale["created_at"] - previous_sale["created_at"]).days
                 if (
                     gap_days >= cls.CHURN_DAYS
-                    and date_from <= sale.created_at.date() <= date_to
+                    and date_from <= sale["created_at"].date() <= date_to
                 ):
-                    country = getattr(getattr(sale.customer, "userdetail", None), "country", "") or ""
+                    country = sale["customer__userdetail__country"] or ""
                     recovered_events.append({
-                        "customer_id": sale.customer_id,
-                        "username": sale.customer.username or "",
-                        "email": sale.customer.email or "",
-                        "phone": getattr(getattr(sale.customer, "userdetail", None), "phone_number", "") or "",
+                        "customer_id": sale["customer_id"],
+                        "username": sale["customer__username"] or "",
+                        "email": sale["customer__email"] or "",
+                        "phone": sale["customer__userdetail__phone_number"] or "",
                         "country": country,
                         "currency": cls._currency_from_country(country),
-                        "recovery_date": sale.created_at,
+                        "recovery_date": sale["created_at"],
                         "days_inactive_before_recovery": gap_days,
-                        "service": sale.account.account_name.description if sale.account_id else "",
-                        "amount": int(sale.payment_amount or 0),
+                        "service": sale["account__account_name__description"] or "",
+                        "amount": int(sale["payment_amount"] or 0),
                     })
-            last_sale_by_customer[sale.customer_id] = sale
+            last_sale_by_customer[sale["customer_id"]] = sale
 
         # Mostrar primero recuperaciones más recientes
         recovered_events.sort(key=lambda x: x["recovery_date"], reverse=True)
@@ -570,23 +715,33 @@ class CRMAnalytics:
     def get_cohort_summary(cls, sales_qs):
         customer_counts = Counter()
         repeat_counts = Counter()
+        new_counts = Counter()
 
-        rows = (
+        rows = list(
             sales_qs.values("customer_id", "created_at__year", "created_at__month")
             .annotate(total=Count("id"))
             .order_by("created_at__year", "created_at__month")
         )
+        # Mes de la primera compra de cada cliente (CustomerFeatures)
+        first_months = {
+            customer_id: (local.year, local.month)
+            for customer_id, first_sale in cls._first_purchase_map({row["customer_id"] for row in rows}).items()
+            for local in [timezone.localtime(first_sale)] if first_sale
+        }
         for row in rows:
             key = f"{row['created_at__year']}-{row['created_at__month']:02d}"
             customer_counts[key] += 1
             if row["total"] >= 2:
                 repeat_counts[key] += 1
+            if first_months.get(row["customer_id"]) == (row["created_at__year"], row["created_at__month"]):
+                new_counts[key] += 1
 
         keys = sorted(customer_counts.keys())
         return [
             {
                 "period": key,
                 "customers": customer_counts[key],
+                "new_customers": new_counts[key],
                 "repeat_customers": repeat_counts[key],
                 "repeat_rate": cls._percentage(repeat_counts[key], customer_counts[key]),
             }
@@ -606,10 +761,10 @@ class CRMAnalytics:
 
         return {
             "filters": filters,
-            "kpis": cls.get_kpis(sales_qs),
+            "kpis": cls.get_kpis(sales_qs, filters),
             "top_customers": top_customers,
             "top_products": top_products,
-            "sales_trend": cls.get_sales_trend(sales_qs),
+            "sales_trend": cls.get_sales_trend(sales_qs, filters),
             "cohort_summary": cls.get_cohort_summary(sales_qs),
             "churn_customers": churn_customers,
             "churn_products": churn_products,
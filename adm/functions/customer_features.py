@@ -0,0 +1,190 @@
+"""
+Mantenimiento de CustomerFeatures: una fila por cliente con su primera y
+última compra, órdenes, ingreso, último servicio, estadísticas por servicio y
+vencimientos de ventas activas.
+
+Refresco incremental: solo se recalculan los clientes con ventas nuevas desde
+la última corrida (id de venta mayor al último visto) o marcados `stale` por
+las señales de Sale (cambio de estado, monto o borrado). El comando
+refresh_customer_features corre en el scheduler; las lecturas del CRM también
+refrescan en línea si lo pendiente es poco (CUSTOMER_FEATURES_INLINE_MAX).
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Set
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from CuentasMexico.db import bulk_upsert
+from adm.models import CustomerFeatures, Sale
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def watermark() -> int:
+    return CustomerFeatures.objects.aggregate(last=Max('last_sale_id'))['last'] or 0
+
+
+def dirty_customer_ids(limit=None) -> List[int]:
+    """Clientes con ventas nuevas desde el último refresco o marcados como stale."""
+    new_sales = (
+        Sale.objects.filter(id__gt=watermark())
+        .values_list('customer_id', flat=True)
+        .distinct()
+    )
+    stale = CustomerFeatures.objects.filter(stale=True).values_list('customer_id', flat=True)
+    if limit is not None:
+        new_sales = new_sales[:limit + 1]
+        stale = stale[:limit + 1]
+    return sorted(set(new_sales) | set(stale))
+
+
+def _build(customer_ids: List[int]) -> List[CustomerFeatures]:
+    sales = Sale.objects.filter(customer_id__in=customer_ids)
+    totals = sales.values('customer_id').annotate(
+        first_purchase=Min('created_at'),
+        last_purchase=Max('created_at'),
+        total_orders=Count('id'),
+        total_revenue=Sum('payment_amount'),
+        last_sale_id=Max('id'),
+    )
+    last_service = (
+        Sale.objects.filter(customer_id=OuterRef('pk'))
+        .order_by('-created_at', '-id')
+        .values('account__account_name_id')[:1]
+    )
+    last_services = dict(
+        User.objects.filter(id__in=customer_ids)
+        .annotate(service_id=Subquery(last_service))
+        .values_list('id', 'service_id')
+    )
+
+    services: Dict[int, dict] = {}
+    for row in sales.values('customer_id', 'account__account_name_id').annotate(
+        orders=Count('id'),
+        last=Max('created_at'),
+        active_until=Max('expiration_date', filter=Q(status=True)),
+    ):
+        if row['account__account_name_id'] is None:
+            continue
+        services.setdefault(row['customer_id'], {})[str(row['account__account_name_id'])] = {
+            'orders': row['orders'],
+            'last': _iso(row['last']),
+            'active_until': _iso(row['active_until']),
+        }
+
+    active: Dict[int, List[str]] = {}
+    for customer_id, expiration in (
+        sales.filter(status=True, expiration_date__gte=timezone.now())
+        .order_by('customer_id', 'expiration_date')
+        .values_list('customer_id', 'expiration_date')
+    ):
+        active.setdefault(customer_id, []).append(_iso(expiration))
+
+    return [
+        CustomerFeatures(
+            customer_id=row['customer_id'],
+            first_purchase=row['first_purchase'],
+            last_purchase=row['last_purchase'],
+            total_orders=row['total_orders'] or 0,
+            total_revenue=int(row['total_revenue'] or 0),
+            last_service_id=last_services.get(row['customer_id']),
+            services=services.get(row['customer_id'], {}),
+            active_expirations=active.get(row['customer_id'], []),
+            last_sale_id=row['last_sale_id'] or 0,
+            stale=False,
+        )
+        for row in totals
+    ]
+
+
+def refresh_customers(customer_ids: Iterable[int]) -> int:
+    """Recalcula esos clientes desde Sale. Devuelve cuántas filas quedaron."""
+    ids = sorted({int(customer_id) for customer_id in customer_ids if customer_id})
+    refreshed = 0
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        rows = _build(batch)
+        with transaction.atomic():
+            bulk_upsert(
+                CustomerFeatures,
+                rows,
+                unique_fields=['customer'],
+                update_fields=[
+                    'first_purchase', 'last_purchase', 'total_orders', 'total_revenue', 'last_service',
+                    'services', 'active_expirations', 'last_sale_id', 'stale', 'refreshed_at',
+                ],
+            )
+            # Clientes que ya no tienen ventas
+            CustomerFeatures.objects.filter(customer_id__in=batch).exclude(
+                customer_id__in=[row.customer_id for row in rows]
+            ).delete()
+        refreshed += len(rows)
+    return refreshed
+
+
+def refresh_pending() -> int:
+    return refresh_customers(dirty_customer_ids())
+
+
+def rebuild_all() -> int:
+    ids = Sale.objects.values_list('customer_id', flat=True).distinct()
+    CustomerFeatures.objects.exclude(customer_id__in=ids).delete()
+    return refresh_customers(ids)
+
+
+def is_populated() -> bool:
+    """Si el store tiene filas; vacío (sin refresco inicial o refresco fallido) se lee de Sale."""
+    return CustomerFeatures.objects.exists()
+
+
+def ensure_fresh():
+    """
+    Refresca en línea lo pendiente si son pocos clientes; si son muchos se
+    deja al comando para no frenar la página.
+    """
+    limit = int(_setting('CUSTOMER_FEATURES_INLINE_MAX', 500))
+    try:
+        pending = dirty_customer_ids(limit=limit)
+        if len(pending) <= limit:
+            refresh_customers(pending)
+        else:
+            logger.info('CustomerFeatures con %s+ clientes pendientes; se deja al comando', limit)
+    except Exception:
+        logger.exception('No se pudo refrescar CustomerFeatures en línea')
+
+
+def mark_stale(customer_ids: Iterable[int], create: bool = False):
+    """
+    Marca clientes para recalcular. Con create=True deja una fila vacía si el
+    cliente aún no tiene (ej. su primera venta), así no depende solo del id.
+    """
+    ids: Set[int] = {customer_id for customer_id in customer_ids if customer_id}
+    if not ids:
+        return
+    if create:
+        CustomerFeatures.objects.bulk_create(
+            [CustomerFeatures(customer_id=customer_id, stale=True) for customer_id in ids],
+            ignore_conflicts=True,
+        )
+    CustomerFeatures.objects.filter(customer_id__in=ids, stale=False).update(stale=True)
@@ -1,5 +1,5 @@
 # Django
-from django.db.models import Sum, Count
+from django.db.models import Sum, Count, Q
 from django.contrib.auth.models import User
 from adm.models import UserDetail, Account, Service, PageVisit
 from django.utils import timezone
@@ -7,97 +7,121 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 from calendar import monthrange,month_name
 # Local
-from adm.models import Sale
+from adm.models import Sale, SaleDailyRollup
 from dateutil.relativedelta import relativedelta
 
 
 
 class Dashboard():
 
-    def sales_per_country_day():
-        today = timezone.localdate()
-        start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
-        end = timezone.make_aware(datetime.combine(today, datetime.max.time()))
-        sales_country = {}
-        countries = Sale.objects.values('customer__userdetail__country').order_by(
-            'customer__userdetail__country').distinct()
-        for country in countries:
-            for key, value in country.items():
-                sales = Sale.objects.filter(
-                    created_at__range=(start, end),
-                    customer__userdetail__country=value
-                )
-                if not value:
-                    continue
-                sales_country[value] = sales.aggregate(Sum('payment_amount'))
-
-        return sales_country
-
-    def sales_per_country_month():
+    def _month_range():
         month = timezone.now().month
         year = timezone.now().year
         last_day = monthrange(year, month)[1]
         start = timezone.make_aware(datetime(year, month, 1, 0, 0, 0))
         end = timezone.make_aware(datetime(year, month, last_day, 23, 59, 59))
+        return start, end
+
+    def _sales_per_country(start, end):
+        """
+        Suma de ventas por país en una sola consulta agrupada.
+        Conserva todos los países con ventas históricas (suma None si no
+        vendieron en el rango), igual que el cálculo anterior por país.
+        """
+        rows = Sale.objects.values('customer__userdetail__country').annotate(
+            payment_amount__sum=Sum(
+                'payment_amount',
+                filter=Q(created_at__range=(start, end))
+            )
+        ).order_by('customer__userdetail__country')
 
         sales_country = {}
-        countries = Sale.objects.values('customer__userdetail__country').order_by(
-            'customer__userdetail__country').distinct()
-        for country in countries:
-            for key, value in country.items():
-                sales = Sale.objects.filter(created_at__range=(
-                    start, end), customer__userdetail__country=value)
-                if not value:
-                    continue
-                sales_country[value] = sales.aggregate(Sum('payment_amount'))
+        for row in rows:
+            country = row['customer__userdetail__country']
+            if not country:
+                continue
+            sales_country[country] = {'payment_amount__sum': row['payment_amount__sum']}
         return sales_country
 
+    def sales_per_country_day():
+        today = timezone.localdate()
+        start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+        end = timezone.make_aware(datetime.combine(today, datetime.max.time()))
+        return Dashboard._sales_per_country(start, end)
+
+    def sales_per_country_month():
+        start, end = Dashboard._month_range()
+        return Dashboard._sales_per_country(start, end)
+
     def sales_per_account():
+        """
+        Cantidad de ventas del mes por servicio (solo servicios con al menos
+        una venta con monto) en una sola consulta agrupada.
+        """
+        start, end = Dashboard._month_range()
+        rows = Sale.objects.filter(created_at__range=(start, end)).values(
+            'account__account_name', 'account__account_name__description'
+        ).annotate(
+            total=Count('payment_amount'),
+            paid=Count('id', filter=~Q(payment_amount=0)),
+        ).filter(paid__gt=0).order_by('account__account_name')
 
-        month = timezone.now().month
-        year = timezone.now().year
-        last_day = monthrange(year, month)[1]
-        start = timezone.make_aware(datetime(year, month, 1, 0, 0, 0))
-        end = timezone.make_aware(datetime(year, month, last_day, 23, 59, 59))
         acc_name = []
         acc_total = []
-        acc = Sale.objects.filter(created_at__range=(start, end)).exclude(payment_amount=0).values(
-            'account__account_name').order_by('account__account_name').distinct()
-        for a in acc:
-            for key, value in a.items():
-                sales = Sale.objects.filter(created_at__range=(
-                    start, end), account__account_name=value)
-                subtotal = sales.aggregate(Count('payment_amount'))
-                acc_name.append(Service.objects.get(pk=value).description)
-                for key, value in subtotal.items():
-                    if value == None:
-                        value = 0
-                    acc_total.append(value)
+        for row in rows:
+            acc_name.append(row['account__account_name__description'])
+            acc_total.append(row['total'] or 0)
         return acc_name, acc_total
 
-    def new_formated_date(date, months):
-        date = date - relativedelta(months=months)
-        return date.strftime('%Y-%m')
+    def _new_user_sales(start, end):
+        """Ventas con monto a clientes de México registrados en [start, end)"""
+        return Sale.objects.filter(
+            customer__date_joined__gte=start,
+            customer__date_joined__lt=end,
+            payment_amount__gt=0,
+            customer__userdetail__lada=52
+        )
 
     def last_year_sales_new_user():
+        """
+        Ventas a clientes nuevos de los últimos 13 meses (mes actual primero),
+        en una sola consulta: un Sum/Count condicional por mes de registro
+        con rangos de fecha (sin convertir date_joined a texto).
+        """
+        current_month = timezone.localdate().replace(day=1)
+        first_month = current_month - relativedelta(months=12)
+        start = timezone.make_aware(datetime.combine(first_month, datetime.min.time()))
+        end = timezone.make_aware(datetime.combine(current_month + relativedelta(months=1), datetime.min.time()))
+
+        months = [current_month - relativedelta(months=i) for i in range(13)]
+        aggregates = {}
+        for i, month_date in enumerate(months):
+            month_start = timezone.make_aware(datetime.combine(month_date, datetime.min.time()))
+            month_end = timezone.make_aware(datetime.combine(month_date + relativedelta(months=1), datetime.min.time()))
+            month_filter = Q(customer__date_joined__gte=month_start, customer__date_joined__lt=month_end)
+            aggregates[f'sales_{i}'] = Sum('payment_amount', filter=month_filter)
+            aggregates[f'new_users_{i}'] = Count('id', filter=month_filter)
+        totals = Dashboard._new_user_sales(start, end).aggregate(**aggregates)
+
         last_year_monts = []
-        date = datetime.now()
-        for i in range(13):
-            sales_new_customer = Sale.objects.filter(customer__date_joined__startswith=Dashboard.new_formated_date(date,i), payment_amount__gt=0,customer__userdetail__lada=52)
-            total = sales_new_customer.aggregate(Sum('payment_amount'))
-            new_date = datetime.strptime(Dashboard.new_formated_date(date, i), "%Y-%m")
-            month = new_date.month 
-            last_year_monts.append({'date':month_name[month],'sales':total['payment_amount__sum'] , 'new_users': sales_new_customer.count()})
+        for i, month_date in enumerate(months):
+            last_year_monts.append({
+                'date': month_name[month_date.month],
+                'sales': totals[f'sales_{i}'],
+                'new_users': totals[f'new_users_{i}']
+            })
 
         return last_year_monts
-    
+
     def sales_per_day_new_user(date):
-        date = date.strftime('%Y-%m-%d')
-        sales = Sale.objects.filter(customer__date_joined__startswith=date, payment_amount__gt=0,customer__userdetail__lada=52)
-        total = sales.aggregate(Sum('payment_amount'))
-        if total['payment_amount__sum'] == None:
-            total['payment_amount__sum'] = 0
-        return {date:{'sales':total['payment_amount__sum'] , 'new_users': sales.count()}}
+        day = date.date() if isinstance(date, datetime) else date
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        end = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+        totals = Dashboard._new_user_sales(start, end).aggregate(
+            sales=Sum('payment_amount'),
+            new_users=Count('id')
+        )
+        return {day.strftime('%Y-%m-%d'): {'sales': totals['sales'] or 0, 'new_users': totals['new_users']}}
 
     # ========== NUEVAS FUNCIONES PARA ESTADÍSTICAS WEB ==========
 
@@ -222,162 +246,95 @@ class Dashboard():
 
     # ========== ESTADÍSTICAS DE VENTAS WEB ==========
 
-    def web_sales_today():
+    def _web_payment_filter(prefix='payment_method__'):
+        """Pasarelas de pago web (MercadoPago, Stripe, PayPal)"""
+        return (
+            Q(**{f'{prefix}description__icontains': 'MercadoPago'}) |
+            Q(**{f'{prefix}description__icontains': 'Mercado Pago'}) |
+            Q(**{f'{prefix}description__icontains': 'Stripe'}) |
+            Q(**{f'{prefix}description__icontains': 'PayPal'})
+        )
+
+    def _web_sales_between(date_from, date_to):
         """
-        Ventas realizadas SOLO por la web HOY (MercadoPago, Stripe, PayPal)
-        Excluye ventas manuales del admin
+        Total y cantidad de ventas web entre dos días locales (inclusive),
+        leídos del resumen diario SaleDailyRollup.
         """
-        from django.db.models import Q
-
-        today = timezone.now().date()
-        start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
-        end = timezone.make_aware(datetime.combine(today, datetime.max.time()))
-
-        # Solo contar ventas con pasarelas de pago (MercadoPago, Stripe, PayPal)
-        web_sales = Sale.objects.filter(
-            created_at__range=(start, end)
-        ).filter(
-            Q(payment_method__description__icontains='MercadoPago') |
-            Q(payment_method__description__icontains='Mercado Pago') |
-            Q(payment_method__description__icontains='Stripe') |
-            Q(payment_method__description__icontains='PayPal')
+        totals = SaleDailyRollup.objects.filter(
+            day__gte=date_from,
+            day__lte=date_to,
+        ).filter(Dashboard._web_payment_filter()).aggregate(
+            total=Sum('revenue'),
+            count=Sum('sales_count'),
         )
-
-        total = web_sales.aggregate(Sum('payment_amount'))
-        count = web_sales.count()
-
         return {
-            'total': total['payment_amount__sum'] or 0,
-            'count': count
+            'total': totals['total'] or 0,
+            'count': totals['count'] or 0
         }
 
+    def web_sales_today():
+        """
+        Ventas realizadas SOLO por la web HOY (MercadoPago, Stripe, PayPal)
+        Excluye ventas manuales del admin
+        """
+        today = timezone.localdate()
+        return Dashboard._web_sales_between(today, today)
+
     def web_sales_weekly():
         """
         Ventas por la web esta semana (solo pasarelas de pago)
         """
-        from django.db.models import Q
-
-        today = timezone.now()
+        today = timezone.localdate()
         week_start = today - timedelta(days=today.weekday())
-        week_start = timezone.make_aware(datetime.combine(week_start.date(), datetime.min.time()))
-
-        # Solo contar ventas con pasarelas de pago
-        web_sales = Sale.objects.filter(
-            created_at__gte=week_start
-        ).filter(
-            Q(payment_method__description__icontains='MercadoPago') |
-            Q(payment_method__description__icontains='Mercado Pago') |
-            Q(payment_method__description__icontains='Stripe') |
-            Q(payment_method__description__icontains='PayPal')
-        )
-
-        total = web_sales.aggregate(Sum('payment_amount'))
-        count = web_sales.count()
-
-        return {
-            'total': total['payment_amount__sum'] or 0,
-            'count': count
-        }
+        return Dashboard._web_sales_between(week_start, today)
 
     def web_sales_monthly():
         """
         Ventas por la web este mes (solo pasarelas de pago)
         """
-        from django.db.models import Q
-
-        month = timezone.now().month
-        year = timezone.now().year
-        last_day = monthrange(year, month)[1]
-
-        start = timezone.make_aware(datetime(year, month, 1, 0, 0, 0))
-        end = timezone.make_aware(datetime(year, month, last_day, 23, 59, 59))
-
-        # Solo contar ventas con pasarelas de pago
-        web_sales = Sale.objects.filter(
-            created_at__range=(start, end)
-        ).filter(
-            Q(payment_method__description__icontains='MercadoPago') |
-            Q(payment_method__description__icontains='Mercado Pago') |
-            Q(payment_method__description__icontains='Stripe') |
-            Q(payment_method__description__icontains='PayPal')
-        )
-
-        total = web_sales.aggregate(Sum('payment_amount'))
-        count = web_sales.count()
-
-        return {
-            'total': total['payment_amount__sum'] or 0,
-            'count': count
-        }
+        today = timezone.localdate()
+        last_day = monthrange(today.year, today.month)[1]
+        return Dashboard._web_sales_between(today.replace(day=1), today.replace(day=last_day))
 
     def web_sales_yearly():
         """
         Ventas por la web este año (solo pasarelas de pago)
         """
-        from django.db.models import Q
-
-        year = timezone.now().year
-
-        start = timezone.make_aware(datetime(year, 1, 1, 0, 0, 0))
-        end = timezone.make_aware(datetime(year, 12, 31, 23, 59, 59))
-
-        # Solo contar ventas con pasarelas de pago
-        web_sales = Sale.objects.filter(
-            created_at__range=(start, end)
-        ).filter(
-            Q(payment_method__description__icontains='MercadoPago') |
-            Q(payment_method__description__icontains='Mercado Pago') |
-            Q(payment_method__description__icontains='Stripe') |
-            Q(payment_method__description__icontains='PayPal')
-        )
-
-        total = web_sales.aggregate(Sum('payment_amount'))
-        count = web_sales.count()
-
-        return {
-            'total': total['payment_amount__sum'] or 0,
-            'count': count
-        }
+        today = timezone.localdate()
+        return Dashboard._web_sales_between(today.replace(month=1, day=1), today.replace(month=12, day=31))
 
     def web_sales_last_12_months():
         """
         Ventas por la web últimos 12 meses (para gráfico)
         Solo incluye ventas con pasarelas de pago (MercadoPago, Stripe, PayPal)
+        Una sola consulta agrupada por mes sobre SaleDailyRollup.
         """
-        from django.db.models import Q
+        today = timezone.localdate()
+        first_month = today.replace(day=1) - relativedelta(months=11)
+
+        rows = SaleDailyRollup.objects.filter(
+            day__gte=first_month,
+            day__lte=today,
+        ).filter(Dashboard._web_payment_filter()).values(
+            'day__year', 'day__month'
+        ).annotate(
+            total=Sum('revenue'),
+            count=Sum('sales_count'),
+        ).order_by('day__year', 'day__month')
+        totals = {(row['day__year'], row['day__month']): row for row in rows}
 
         result = []
-        date = timezone.now()
-
-        for i in range(12):
-            month_date = date - relativedelta(months=i)
-            year = month_date.year
-            month = month_date.month
-            last_day = monthrange(year, month)[1]
-
-            start = timezone.make_aware(datetime(year, month, 1, 0, 0, 0))
-            end = timezone.make_aware(datetime(year, month, last_day, 23, 59, 59))
-
-            # Solo contar ventas con pasarelas de pago usando Q para OR
-            web_sales = Sale.objects.filter(
-                created_at__range=(start, end)
-            ).filter(
-                Q(payment_method__description__icontains='MercadoPago') |
-                Q(payment_method__description__icontains='Mercado Pago') |
-                Q(payment_method__description__icontains='Stripe') |
-                Q(payment_method__description__icontains='PayPal')
-            )
-
-            total = web_sales.aggregate(Sum('payment_amount'))
-
+        for i in range(11, -1, -1):
+            month_date = today - relativedelta(months=i)
+            row = totals.get((month_date.year, month_date.month), {})
             result.append({
-                'month': month_name[month],
-                'year': year,
-                'total': total['payment_amount__sum'] or 0,
-                'count': web_sales.count()
+                'month': month_name[month_date.month],
+                'year': month_date.year,
+                'total': row.get('total') or 0,
+                'count': row.get('count') or 0
             })
 
-        return list(reversed(result))
+        return result
 
     def page_visits_last_30_days_chart():
         """
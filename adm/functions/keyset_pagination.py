@@ -0,0 +1,229 @@
+"""
+Paginación por cursor (keyset / seek) para las listas del admin.
+
+En lugar de COUNT(*) + OFFSET, cada página se pide "después de" (o "antes
+de") la última fila vista usando los valores de las columnas del orden:
+
+    WHERE (created_at < :c) OR (created_at = :c AND profile > :p) OR ...
+
+Con un índice que siga ese orden, la página 1 y la página 50.000 cuestan lo
+mismo. El cursor es un token opaco (base64 de los valores + dirección).
+
+Los NULL se tratan como el valor más chico (así ordenan MySQL y SQLite).
+El orden siempre termina en la llave primaria para que sea total.
+
+Conteo: `estimate_count` pide al motor su estimación (EXPLAIN) y solo si es
+menor que KEYSET_EXACT_COUNT_MAX se hace el COUNT(*) exacto. En SQLite no
+hay estimación y se cuenta siempre.
+"""
+
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'dec': str(value)}
+    return value
+
+
+def _load(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        if 'dec' in value:
+            return Decimal(value['dec'])
+        raise InvalidCursor(value)
+    return value
+
+
+def encode_cursor(values: Sequence[Any], backwards: bool = False) -> str:
+    raw = json.dumps({'v': [_dump(value) for value in values], 'b': bool(backwards)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, size: int):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values = [_load(value) for value in data['v']]
+        backwards = bool(data.get('b'))
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise InvalidCursor(token)
+    if len(values) != size:
+        raise InvalidCursor(token)
+    return values, backwards
+
+
+def estimate_count(queryset) -> Optional[int]:
+    """Filas estimadas por el planificador (None si el motor no lo ofrece)."""
+    connection = connections[queryset.db]
+    if connection.vendor not in ('mysql', 'postgresql'):
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            row = dict(zip(columns, cursor.fetchone()))
+    except Exception:
+        return None
+    rows = row.get('rows') or 0
+    filtered = row.get('filtered') or 100
+    return int(float(rows) * float(filtered) / 100)
+
+
+def smart_count(queryset):
+    """(conteo, es_estimado): exacto si la estimación es chica, estimado si no."""
+    estimate = estimate_count(queryset)
+    if estimate is not None and estimate > int(_setting('KEYSET_EXACT_COUNT_MAX', 20000)):
+        return estimate, True
+    return queryset.count(), False
+
+
+@dataclass
+class KeysetPage:
+    object_list: List[Any]
+    next_cursor: Optional[str] = None
+    previous_cursor: Optional[str] = None
+    count: Optional[int] = None
+    count_is_estimate: bool = False
+    first: bool = True
+    per_page: int = 20
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    paginator = KeysetPaginator(qs, ('-created_at', 'profile'), per_page=20)
+    page = paginator.page(request.GET.get('cursor'))
+    """
+
+    def __init__(self, queryset, ordering: Sequence[str], per_page: int = 20, count: bool = True):
+        pk_name = queryset.model._meta.pk.attname
+        ordering = list(ordering)
+        if ordering[-1].lstrip('-') not in (pk_name, 'pk'):
+            ordering.append('-' + pk_name if ordering[-1].startswith('-') else pk_name)
+        self.queryset = queryset
+        self.ordering = ordering
+        self.fields = [name.lstrip('-') for name in ordering]
+        self.per_page = per_page
+        self.with_count = count
+
+    # ----------------------------------------------------------------- SQL
+
+    @staticmethod
+    def _greater(name, value, descending):
+        """Filas que van después de `value` en esa columna (NULL = mínimo)."""
+        if descending:
+            if value is None:
+                return Q(pk__in=[])
+            return Q(**{f'{name}__lt': value}) | Q(**{f'{name}__isnull': True})
+        if value is None:
+            return Q(**{f'{name}__isnull': False})
+        return Q(**{f'{name}__gt': value})
+
+    @staticmethod
+    def _equal(name, value):
+        return Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+    def _seek(self, values, backwards):
+        condition = Q(pk__in=[])
+        prefix = Q()
+        for name, ordering, value in zip(self.fields, self.ordering, values):
+            descending = ordering.startswith('-') != backwards
+            condition |= prefix & self._greater(name, value, descending)
+            prefix &= self._equal(name, value)
+        return condition
+
+    def _values(self, obj):
+        values = []
+        for name in self.fields:
+            value = obj
+            for part in name.split('__'):
+                value = None if value is None else getattr(value, part)
+            values.append(value)
+        return values
+
+    # ----------------------------------------------------------------- API
+
+    def page(self, cursor: Optional[str] = None) -> KeysetPage:
+        queryset = self.queryset
+        backwards = False
+        if cursor:
+            values, backwards = decode_cursor(cursor, len(self.fields))
+            queryset = queryset.filter(self._seek(values, backwards))
+
+        ordering = self.ordering
+        if backwards:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        page = KeysetPage(object_list=rows, per_page=self.per_page, first=not cursor)
+        if rows:
+            # Hacia adelante: hay siguiente si sobró una fila; hay anterior si vinimos de un cursor.
+            # Hacia atrás es al revés.
+            has_next = more if not backwards else True
+            has_previous = bool(cursor) if not backwards else more
+            if has_next:
+                page.next_cursor = encode_cursor(self._values(rows[-1]))
+            if has_previous:
+                page.previous_cursor = encode_cursor(self._values(rows[0]), backwards=True)
+            page.first = not has_previous
+        if self.with_count:
+            page.count, page.count_is_estimate = smart_count(self.queryset)
+        return page
+
+
+def paginate(queryset, ordering: Sequence[str], cursor: Optional[str] = None, per_page: int = 20, count: bool = True):
+    """Atajo para las vistas: un cursor inválido o viejo regresa a la primera página."""
+    paginator = KeysetPaginator(queryset, ordering, per_page=per_page, count=count)
+    try:
+        return paginator.page(cursor)
+    except InvalidCursor:
+        return paginator.page(None)
@@ -13,6 +13,17 @@ class PromocionManager:
         """
         Obtiene la promoción activa más relevante para un servicio
         Prioriza por orden: específicos > todos > excepto
+        (sale de la tabla compilada en promotion_engine, sin consultar por servicio)
+        """
+        from adm.functions import promotion_engine
+
+        return promotion_engine.resolve(servicio)
+
+    @staticmethod
+    def obtener_promocion_activa_legacy(servicio):
+        """
+        Versión por consultas de obtener_promocion_activa (hasta 3 por
+        servicio). Se conserva como referencia para las pruebas de paridad.
         """
         from adm.models import Promocion
 
@@ -64,7 +75,7 @@ class PromocionManager:
         return promocion
 
     @staticmethod
-    def calcular_precio_con_descuento(servicio, cantidad=1, precio_base=None):
+    def calcular_precio_con_descuento(servicio, cantidad=1, precio_base=None, compiled=None):
         """
         Calcula el precio final de un servicio aplicando las promociones activas
 
@@ -72,50 +83,60 @@ class PromocionManager:
             servicio: Objeto Service
             cantidad: Cantidad de servicios a comprar
             precio_base: Precio base a usar (si None, usa service.price)
+            compiled: Tabla de promotion_engine ya obtenida (para lotes)
 
         Returns:
             dict con información del precio y descuento aplicado
         """
+        from adm.functions import promotion_engine
+
+        promocion = promotion_engine.resolve(servicio, compiled=compiled)
+        return PromocionManager.precio_con_promocion(servicio, promocion, cantidad, precio_base)
+
+    @staticmethod
+    def calcular_precio_con_descuento_legacy(servicio, cantidad=1, precio_base=None):
+        """Cálculo por consultas, referencia para las pruebas de paridad."""
+        promocion = PromocionManager.obtener_promocion_activa_legacy(servicio)
+        if promocion and not (promocion.is_active() and promocion.aplica_a_servicio(servicio)):
+            promocion = None
+        return PromocionManager.precio_con_promocion(servicio, promocion, cantidad, precio_base)
+
+    @staticmethod
+    def precio_con_promocion(servicio, promocion, cantidad=1, precio_base=None):
+        """Aplica al servicio una promoción ya resuelta (o None)."""
         if precio_base is None:
             precio_base = servicio.price
 
         precio_original = precio_base
         precio_final = precio_base
         descuento_aplicado = 0
-        promocion = None
-
-        # Buscar promoción activa
-        promocion_activa = PromocionManager.obtener_promocion_activa(servicio)
-
-        if promocion_activa and promocion_activa.is_active():
-            if promocion_activa.aplica_a_servicio(servicio):
-                promocion = promocion_activa
-
-                # Aplicar descuento según el tipo
-                if promocion.tipo_descuento == 'porcentaje':
-                    descuento = precio_base * (float(promocion.porcentaje_descuento) / 100)
-                    precio_final = int(precio_base - descuento)
-                    descuento_aplicado = int(descuento)
-
-                elif promocion.tipo_descuento == 'monto_fijo':
-                    precio_final = max(0, precio_base - promocion.monto_descuento)
-                    descuento_aplicado = min(precio_base, promocion.monto_descuento)
 
-                elif promocion.tipo_descuento == 'nxm' and cantidad >= promocion.cantidad_llevar:
-                    # LÓGICA CORREGIDA para NxM
-                    # Ejemplo 3x2: llevas 3, pagas 2
-                    # - cantidad_llevar = 3 (lo que lleva el cliente)
-                    # - cantidad_pagar = 2 (lo que paga el cliente)
-                    sets_completos = cantidad // promocion.cantidad_llevar
-                    items_restantes = cantidad % promocion.cantidad_llevar
-
-                    # Precio por set = precio_base * cantidad_pagar
-                    # Ejemplo: $100 * 2 = $200 por cada set de 3
-                    precio_por_set = precio_base * promocion.cantidad_pagar
-                    precio_total = (sets_completos * precio_por_set) + (items_restantes * precio_base)
-
-                    precio_final = int(precio_total)
-                    descuento_aplicado = (precio_base * cantidad) - precio_final
+        if promocion:
+            # Aplicar descuento según el tipo
+            if promocion.tipo_descuento == 'porcentaje':
+                descuento = precio_base * (float(promocion.porcentaje_descuento) / 100)
+                precio_final = int(precio_base - descuento)
+                descuento_aplicado = int(descuento)
+
+            elif promocion.tipo_descuento == 'monto_fijo':
+                precio_final = max(0, precio_base - promocion.monto_descuento)
+                descuento_aplicado = min(precio_base, promocion.monto_descuento)
+
+            elif promocion.tipo_descuento == 'nxm' and cantidad >= promocion.cantidad_llevar:
+                # LÓGICA CORREGIDA para NxM
+                # Ejemplo 3x2: llevas 3, pagas 2
+                # - cantidad_llevar = 3 (lo que lleva el cliente)
+                # - cantidad_pagar = 2 (lo que paga el cliente)
+                sets_completos = cantidad // promocion.cantidad_llevar
+                items_restantes = cantidad % promocion.cantidad_llevar
+
+                # Precio por set = precio_base * cantidad_pagar
+                # Ejemplo: $100 * 2 = $200 por cada set de 3
+                precio_por_set = precio_base * promocion.cantidad_pagar
+                precio_total = (sets_completos * precio_por_set) + (items_restantes * precio_base)
+
+                precio_final = int(precio_total)
+                descuento_aplicado = (precio_base * cantidad) - precio_final
 
         return {
             'precio_original': precio_original,
@@ -170,10 +191,13 @@ class PromocionManager:
         Returns:
             Lista de diccionarios con información de servicios y promociones
         """
+        from adm.functions import promotion_engine
+
         resultado = []
+        compiled = promotion_engine.get_compiled()
 
         for servicio in servicios:
-            precio_info = PromocionManager.calcular_precio_con_descuento(servicio)
+            precio_info = PromocionManager.calcular_precio_con_descuento(servicio, compiled=compiled)
 
             resultado.append({
                 'servicio': servicio,
@@ -0,0 +1,143 @@
+"""
+Resolución compilada de promociones.
+
+En lugar de consultar Promocion por cada servicio (hasta tres consultas con OR
+por servicio), se cargan una sola vez las promociones activas y se compilan en
+una tabla servicio -> mejor promoción, con la misma prioridad que
+PromocionManager: específicos > todos > excepto, y dentro de cada tipo la más
+reciente (-created_at).
+
+La tabla vive en memoria del proceso y se descarta cuando:
+- cambia la versión global (`promociones:version` en la caché compartida), que
+  las señales de Promocion incrementan al guardar/borrar o cambiar servicios;
+- se cruza una frontera de tiempo: inicio de una promoción ya marcada activa o
+  fin de una vigente.
+
+Precio de un catálogo o carrito: una consulta al compilar y cero mientras la
+tabla siga vigente.
+"""
+
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Q
+from django.utils import timezone
+
+from CuentasMexico.cache import incr_counter
+from adm.models import Promocion
+
+
+VERSION_KEY = 'promociones:version'
+
+_lock = threading.Lock()
+_compiled = None
+
+
+def current_version() -> int:
+    return int(cache.get(VERSION_KEY) or 0)
+
+
+def bump_version() -> int:
+    return incr_counter(VERSION_KEY, timeout=None)
+
+
+@dataclass
+class CompiledPromotions:
+    version: int
+    compiled_at: datetime
+    expires_at: Optional[datetime]
+    especificos: Dict[int, Promocion] = field(default_factory=dict)
+    todos: Optional[Promocion] = None
+    excepto: List[Tuple[Promocion, FrozenSet[int]]] = field(default_factory=list)
+
+    def is_current(self, version, now) -> bool:
+        return self.version == version and (self.expires_at is None or now < self.expires_at)
+
+    def resolve(self, service_id) -> Optional[Promocion]:
+        promocion = self.especificos.get(service_id) or self.todos
+        if promocion:
+            return promocion
+        for promocion, excluidos in self.excepto:
+            if service_id not in excluidos:
+                return promocion
+        return None
+
+
+def compile_promotions(now=None, version=None) -> CompiledPromotions:
+    """Carga las promociones con status activa (una consulta) y arma la tabla."""
+    now = now or timezone.now()
+    version = current_version() if version is None else version
+
+    field_names = [model_field.attname for model_field in Promocion._meta.concrete_fields]
+    rows = (
+        Promocion.objects.filter(status='activa')
+        .filter(Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=now))
+        .order_by('-created_at', '-id')
+        .values_list(*field_names, 'servicios')
+    )
+    db = router.db_for_read(Promocion)
+
+    promociones: Dict[int, Promocion] = {}
+    servicios: Dict[int, set] = {}
+    for row in rows:
+        promocion_id = row[0]
+        if promocion_id not in promociones:
+            promociones[promocion_id] = Promocion.from_db(db, field_names, row[:-1])
+            servicios[promocion_id] = set()
+        if row[-1] is not None:
+            servicios[promocion_id].add(row[-1])
+
+    # Fronteras: una activa que aún no inicia entra al llegar su fecha_inicio;
+    # una vigente sale justo después de su fecha_fin (is_active usa now > fin).
+    boundaries = []
+    compiled = CompiledPromotions(version=version, compiled_at=now, expires_at=None)
+    for promocion_id, promocion in promociones.items():
+        if promocion.fecha_inicio and promocion.fecha_inicio > now:
+            boundaries.append(promocion.fecha_inicio)
+            continue
+        if promocion.fecha_fin:
+            boundaries.append(promocion.fecha_fin + timedelta(microseconds=1))
+
+        if promocion.aplicacion == 'especificos':
+            for service_id in servicios[promocion_id]:
+                compiled.especificos.setdefault(service_id, promocion)
+        elif promocion.aplicacion == 'todos':
+            if compiled.todos is None:
+                compiled.todos = promocion
+        elif promocion.aplicacion == 'excepto':
+            compiled.excepto.append((promocion, frozenset(servicios[promocion_id])))
+
+    compiled.expires_at = min(boundaries) if boundaries else None
+    return compiled
+
+
+def get_compiled(now=None) -> CompiledPromotions:
+    """Tabla vigente del proceso; se recompila si cambió la versión o expiró."""
+    global _compiled
+    now = now or timezone.now()
+    version = current_version()
+    compiled = _compiled
+    if compiled is not None and compiled.is_current(version, now):
+        return compiled
+    with _lock:
+        compiled = _compiled
+        if compiled is None or not compiled.is_current(version, now):
+            compiled = _compiled = compile_promotions(now=now, version=version)
+    return compiled
+
+
+def resolve(servicio, now=None, compiled=None) -> Optional[Promocion]:
+    """Mejor promoción activa para el servicio (objeto o id)."""
+    compiled = compiled or get_compiled(now)
+    return compiled.resolve(getattr(servicio, 'pk', servicio))
+
+
+def reset():
+    """Descarta la tabla del proceso (p. ej. entre pruebas)."""
+    global _compiled
+    with _lock:
+        _compiled = None
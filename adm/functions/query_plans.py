@@ -0,0 +1,138 @@
+"""
+Revisión de planes de ejecución de las consultas más usadas de Sale/Account.
+
+Cada consulta canónica reproduce la forma de los filtros reales (cobranza,
+ventas activas del cliente, cuentas disponibles, dashboard) y se pasa por
+EXPLAIN. Si el motor decide recorrer la tabla completa en lugar de usar un
+índice, la consulta se marca como `full_scan`.
+
+Detección por motor:
+- MySQL: renglón de la tabla con type=ALL.
+- PostgreSQL: nodo "Seq Scan" sobre la tabla.
+- SQLite: "SCAN <tabla>" sin "USING INDEX" en EXPLAIN QUERY PLAN.
+
+En SQLite Django escribe `status=True` como `WHERE "status"` (sin comparar),
+así que un índice que empieza por status no aplica; las consultas marcadas
+con sqlite=False se reportan como omitidas en ese motor.
+
+Lo usa el comando check_query_plans.
+"""
+
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, List, Optional
+
+from django.db import connections
+from django.utils import timezone
+
+from adm.models import Account, Sale
+
+
+@dataclass
+class CanonicalQuery:
+    name: str
+    source: str
+    build: Callable[[object], object]
+    sqlite: bool = True
+
+
+@dataclass
+class PlanResult:
+    name: str
+    source: str
+    table: str
+    full_scan: bool
+    plan: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    skipped: bool = False
+
+
+def _day(now):
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1) - timedelta(microseconds=1)
+
+
+CANONICAL_QUERIES = [
+    CanonicalQuery(
+        'receivable_due',
+        'ReceivableView / send_overdue_pending_whatsapp',
+        lambda now: Sale.objects.filter(status=True, expiration_date__lte=now).order_by('-expiration_date', 'account'),
+        sqlite=False,
+    ),
+    CanonicalQuery(
+        'receivable_day',
+        'send_due_today_whatsapp / send_due_tomorrow_whatsapp / send_due_in_5_days_whatsapp',
+        lambda now: Sale.objects.filter(
+            status=True, expiration_date__gte=_day(now)[0], expiration_date__lte=_day(now)[1],
+        ),
+        sqlite=False,
+    ),
+    CanonicalQuery(
+        'customer_active_sales',
+        'get_active_sales_by_user_api / Sales.customer_sales_active',
+        lambda now: Sale.objects.filter(customer_id=1, status=True),
+    ),
+    CanonicalQuery(
+        'sales_in_range',
+        'Dashboard / CRMAnalytics',
+        lambda now: Sale.objects.filter(created_at__range=(now - timedelta(days=30), now)).values('account_id'),
+    ),
+    CanonicalQuery(
+        'available_accounts',
+        'Sales.find_best_account_legacy / SalesSearchView',
+        lambda now: Account.objects.filter(
+            account_name_id=1, status=True, customer=None, external_status='Disponible',
+        ),
+    ),
+    CanonicalQuery(
+        'account_list',
+        'AccountsView',
+        lambda now: Account.objects.filter(business_id=1, status=True, customer=None).order_by('-created_at', 'profile'),
+    ),
+]
+
+
+def _explain(connection, sql, params, table):
+    """(líneas del plan, hubo recorrido completo de `table`)."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            lines = [str(row[-1]) for row in cursor.fetchall()]
+            full_scan = any(
+                line.startswith(f'SCAN {table}') and 'USING' not in line
+                for line in lines
+            )
+            return lines, full_scan
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            lines = [row[0] for row in cursor.fetchall()]
+            return lines, any('Seq Scan on ' + table in line for line in lines)
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        lines = [
+            f"{row.get('table')}: type={row.get('type')} key={row.get('key')} rows={row.get('rows')}"
+            for row in rows
+        ]
+        return lines, any(row.get('table') == table and row.get('type') == 'ALL' for row in rows)
+
+
+def check_query_plans(using='default', names=None, now=None) -> List[PlanResult]:
+    connection = connections[using]
+    now = now or timezone.now()
+    results = []
+    for query in CANONICAL_QUERIES:
+        if names and query.name not in names:
+            continue
+        queryset = query.build(now).using(using)
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'sqlite' and not query.sqlite:
+            results.append(PlanResult(query.name, query.source, table, False, skipped=True))
+            continue
+        try:
+            sql, params = queryset.query.sql_with_params()
+            plan, full_scan = _explain(connection, sql, params, table)
+            results.append(PlanResult(query.name, query.source, table, full_scan, plan))
+        except Exception as exc:
+            results.append(PlanResult(query.name, query.source, table, False, error=str(exc)))
+    return results
@@ -1,11 +1,20 @@
-﻿import json
-import os
-import threading
+﻿"""
+Estado de los envíos masivos de cobranza (ReceivableJob / ReceivableJobRecipient).
+
+Cada destinatario se marca con un UPDATE condicional (solo si sigue pendiente)
+y los totales del job se ajustan con F() en la misma transacción, así una
+corrida con miles de destinatarios hace O(1) trabajo por envío y varios
+procesos (comandos y vistas) pueden tocar el mismo job sin corromperlo.
+"""
+
 from datetime import datetime
 
-from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
 from django.utils import timezone
 
+from adm.models import ReceivableJob, ReceivableJobRecipient
+
 
 JOB_DUE_TODAY = 'due_today'
 JOB_DUE_TOMORROW = 'due_tomorrow'
@@ -13,197 +22,193 @@ JOB_DUE_5_DAYS = 'due_5_days'
 JOB_OVERDUE_PENDING = 'overdue_pending'
 ALL_JOBS = [JOB_DUE_TODAY, JOB_DUE_TOMORROW, JOB_DUE_5_DAYS, JOB_OVERDUE_PENDING]
 
-_STATE_LOCK = threading.Lock()
-
-
-def _state_path():
-    logs_dir = os.path.join(settings.BASE_DIR, 'logs')
-    os.makedirs(logs_dir, exist_ok=True)
-    return os.path.join(logs_dir, 'receivable_bulk_jobs.json')
+FINAL_RECIPIENT_STATUSES = ('sent', 'failed', 'skipped')
+ACTIVE_JOB_STATUSES = (ReceivableJob.STATUS_RUNNING, ReceivableJob.STATUS_PAUSED)
+RECIPIENT_FIELDS = ('sale_id', 'customer', 'phone', 'status', 'note', 'updated_at')
+_MESSAGE_MAX = ReceivableJob._meta.get_field('message').max_length
+_NOTE_MAX = ReceivableJobRecipient._meta.get_field('note').max_length
 
 
-def _empty_state():
-    return {'jobs': {}}
+def _iso(value):
+    return value.isoformat() if value else None
 
 
-def _load_state():
-    path = _state_path()
-    if not os.path.exists(path):
-        return _empty_state()
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if not isinstance(data, dict):
-            return _empty_state()
-        data.setdefault('jobs', {})
-        return data
-    except Exception:
-        return _empty_state()
+def _message(value):
+    return str(value or '')[:_MESSAGE_MAX]
 
 
-def _save_state(state):
-    with open(_state_path(), 'w', encoding='utf-8') as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
-
-
-def _iso_now():
-    return timezone.now().isoformat()
+def _touch(job_key, **fields):
+    """UPDATE directo del job; devuelve True si existía."""
+    fields.setdefault('updated_at', timezone.now())
+    return ReceivableJob.objects.filter(job_key=job_key).update(**fields) > 0
 
 
 def init_job(job_key, recipients):
-    with _STATE_LOCK:
-        state = _load_state()
-        state['jobs'][job_key] = {
-            'job_key': job_key,
-            'status': 'running',
-            'started_at': _iso_now(),
-            'updated_at': _iso_now(),
-            'finished_at': None,
-            'control': {'paused': False, 'stop_requested': False},
-            'totals': {
-                'total': len(recipients),
-                'sent': 0,
-                'failed': 0,
-                'skipped': 0,
-                'pending': len(recipients),
-            },
-            'recipients': recipients,
-            'message': 'Proceso iniciado',
-        }
-        _save_state(state)
+    now = timezone.now()
+    with transaction.atomic():
+        job, _ = ReceivableJob.objects.select_for_update().get_or_create(job_key=job_key)
+        job.recipients.all().delete()
+        ReceivableJobRecipient.objects.bulk_create(
+            [
+                ReceivableJobRecipient(
+                    job=job,
+                    sale_id=rec.get('sale_id'),
+                    customer=str(rec.get('customer') or '')[:150],
+                    phone=str(rec.get('phone') or '')[:40],
+                    status=rec.get('status') or 'pending',
+                    note=str(rec.get('note') or '')[:_NOTE_MAX],
+                )
+                for rec in recipients
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        counts = _status_counts(job)
+        job.status = ReceivableJob.STATUS_RUNNING
+        job.paused = False
+        job.stop_requested = False
+        job.message = 'Proceso iniciado'
+        job.started_at = now
+        job.updated_at = now
+        job.finished_at = None
+        for field, value in counts.items():
+            setattr(job, field, value)
+        job.save()
 
 
 def set_job_message(job_key, message):
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
-        if not job:
-            return
-        job['message'] = message
-        job['updated_at'] = _iso_now()
-        _save_state(state)
+    _touch(job_key, message=_message(message))
 
 
 def update_recipient(job_key, sale_id, status, note=''):
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
-        if not job:
+    now = timezone.now()
+    with transaction.atomic():
+        updated = (
+            ReceivableJobRecipient.objects
+            .filter(job__job_key=job_key, sale_id=sale_id)
+            .exclude(status__in=FINAL_RECIPIENT_STATUSES)
+            .update(status=status, note=str(note or '')[:_NOTE_MAX], updated_at=now)
+        )
+        if not updated:
             return
-        for rec in job.get('recipients', []):
-            if rec.get('sale_id') == sale_id:
-                prev = rec.get('status', 'pending')
-                if prev in ('sent', 'failed', 'skipped'):
-                    return
-                rec['status'] = status
-                rec['note'] = note
-                rec['updated_at'] = _iso_now()
-                break
-        _recompute_totals(job)
-        job['updated_at'] = _iso_now()
-        _save_state(state)
-
-
-def _recompute_totals(job):
-    recs = job.get('recipients', [])
-    sent = sum(1 for r in recs if r.get('status') == 'sent')
-    failed = sum(1 for r in recs if r.get('status') == 'failed')
-    skipped = sum(1 for r in recs if r.get('status') == 'skipped')
-    pending = sum(1 for r in recs if r.get('status') == 'pending')
-    job['totals'] = {
-        'total': len(recs),
-        'sent': sent,
-        'failed': failed,
-        'skipped': skipped,
-        'pending': pending,
-    }
+        fields = {'updated_at': now}
+        if status in FINAL_RECIPIENT_STATUSES:
+            fields[status] = F(status) + 1
+            fields['pending'] = F('pending') - 1
+        _touch(job_key, **fields)
+
+
+def _status_counts(job):
+    counts = {'total': 0, 'sent': 0, 'failed': 0, 'skipped': 0, 'pending': 0}
+    for row in job.recipients.values('status').annotate(n=Count('id')).order_by():
+        counts['total'] += row['n']
+        if row['status'] in counts:
+            counts[row['status']] += row['n']
+    return counts
 
 
 def finish_job(job_key, message='Proceso finalizado'):
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
+    now = timezone.now()
+    with transaction.atomic():
+        job = ReceivableJob.objects.select_for_update().filter(job_key=job_key).first()
         if not job:
             return
-        if job.get('status') != 'stopped':
-            job['status'] = 'completed'
-        job['control'] = {'paused': False, 'stop_requested': False}
-        _recompute_totals(job)
-        job['message'] = message
-        job['updated_at'] = _iso_now()
-        job['finished_at'] = _iso_now()
-        _save_state(state)
+        if job.status != ReceivableJob.STATUS_STOPPED:
+            job.status = ReceivableJob.STATUS_COMPLETED
+        job.paused = False
+        job.stop_requested = False
+        # Reconciliar totales al cierre por si algún proceso murió a medio envío
+        for field, value in _status_counts(job).items():
+            setattr(job, field, value)
+        job.message = _message(message)
+        job.updated_at = now
+        job.finished_at = now
+        job.save()
 
 
 def stop_job(job_key, message='Proceso detenido'):
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
-        if not job:
-            return
-        job['status'] = 'stopped'
-        job['control']['stop_requested'] = True
-        job['control']['paused'] = False
-        job['message'] = message
-        job['updated_at'] = _iso_now()
-        job['finished_at'] = _iso_now()
-        _save_state(state)
+    now = timezone.now()
+    _touch(
+        job_key,
+        status=ReceivableJob.STATUS_STOPPED,
+        stop_requested=True,
+        paused=False,
+        message=_message(message),
+        updated_at=now,
+        finished_at=now,
+    )
 
 
 def set_pause(job_key, paused):
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
-        if not job:
-            return False
-        if job.get('status') not in ('running', 'paused'):
-            return False
-        job['control']['paused'] = bool(paused)
-        job['status'] = 'paused' if paused else 'running'
-        job['message'] = 'Proceso en pausa' if paused else 'Proceso reanudado'
-        job['updated_at'] = _iso_now()
-        _save_state(state)
-        return True
+    return (
+        ReceivableJob.objects
+        .filter(job_key=job_key, status__in=ACTIVE_JOB_STATUSES)
+        .update(
+            paused=bool(paused),
+            status=ReceivableJob.STATUS_PAUSED if paused else ReceivableJob.STATUS_RUNNING,
+            message='Proceso en pausa' if paused else 'Proceso reanudado',
+            updated_at=timezone.now(),
+        )
+        > 0
+    )
 
 
 def request_stop(job_key):
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
-        if not job:
+    with transaction.atomic():
+        if not ReceivableJob.objects.filter(job_key=job_key).update(stop_requested=True):
             return False
-        job['control']['stop_requested'] = True
-        if job.get('status') in ('running', 'paused'):
-            job['message'] = 'Detencion solicitada'
-            job['updated_at'] = _iso_now()
-        _save_state(state)
-        return True
+        ReceivableJob.objects.filter(job_key=job_key, status__in=ACTIVE_JOB_STATUSES).update(
+            message='Detencion solicitada',
+            updated_at=timezone.now(),
+        )
+    return True
 
 
 def get_control(job_key):
-    state = _load_state()
-    job = state.get('jobs', {}).get(job_key, {})
-    return job.get('control', {'paused': False, 'stop_requested': False})
+    control = ReceivableJob.objects.filter(job_key=job_key).values('paused', 'stop_requested').first()
+    return control or {'paused': False, 'stop_requested': False}
+
+
+def _serialize(job, recipients):
+    return {
+        'job_key': job.job_key,
+        'status': job.status,
+        'started_at': _iso(job.started_at),
+        'updated_at': _iso(job.updated_at),
+        'finished_at': _iso(job.finished_at),
+        'control': {'paused': job.paused, 'stop_requested': job.stop_requested},
+        'totals': {
+            'total': job.total,
+            'sent': job.sent,
+            'failed': job.failed,
+            'skipped': job.skipped,
+            'pending': job.pending,
+        },
+        'recipients': [{**rec, 'updated_at': _iso(rec['updated_at'])} for rec in recipients],
+        'message': job.message,
+    }
+
+
+def _snapshots(job_keys):
+    jobs = {job.job_key: job for job in ReceivableJob.objects.filter(job_key__in=job_keys)}
+    recipients = {key: [] for key in jobs}
+    rows = (
+        ReceivableJobRecipient.objects
+        .filter(job__job_key__in=list(jobs))
+        .order_by('job_id', 'id')
+        .values('job__job_key', *RECIPIENT_FIELDS)
+    )
+    for row in rows:
+        recipients[row.pop('job__job_key')].append(row)
+    return {key: _with_estimate(_serialize(jobs[key], recipients[key])) for key in job_keys if key in jobs}
 
 
 def get_jobs_snapshot():
-    state = _load_state()
-    jobs = state.get('jobs', {})
-    result = {}
-    for key in ALL_JOBS:
-        job = jobs.get(key)
-        if not job:
-            continue
-        result[key] = _with_estimate(job)
-    return result
+    return _snapshots(ALL_JOBS)
 
 
 def get_job_snapshot(job_key):
-    state = _load_state()
-    job = state.get('jobs', {}).get(job_key)
-    if not job:
-        return None
-    return _with_estimate(job)
+    return _snapshots([job_key]).get(job_key)
 
 
 def _with_estimate(job):
@@ -232,35 +237,20 @@ def rollover_cleanup_if_stale(job_key):
     Si el job quedó 'running/paused' en un día anterior, lo cierra como detenido
     para evitar estado colgado entre días.
     """
-    with _STATE_LOCK:
-        state = _load_state()
-        job = state.get('jobs', {}).get(job_key)
-        if not job:
-            return False
-
-        if job.get('status') not in ('running', 'paused'):
-            return False
-
-        started_raw = job.get('started_at')
-        if not started_raw:
-            return False
-
-        try:
-            started = datetime.fromisoformat(str(started_raw).replace('Z', '+00:00'))
-            if timezone.is_naive(started):
-                started = timezone.make_aware(started)
-            started_local_day = timezone.localtime(started).date()
-            now_local_day = timezone.localtime(timezone.now()).date()
-            if started_local_day >= now_local_day:
-                return False
-        except Exception:
-            # Si no se puede parsear, preferimos limpiarlo para evitar bloqueo.
-            pass
-
-        job['status'] = 'stopped'
-        job['control'] = {'paused': False, 'stop_requested': False}
-        job['message'] = 'Proceso anterior limpiado automáticamente por cambio de día.'
-        job['updated_at'] = _iso_now()
-        job['finished_at'] = _iso_now()
-        _save_state(state)
-        return True
+    now = timezone.now()
+    today_start = timezone.make_aware(
+        datetime.combine(timezone.localtime(now).date(), datetime.min.time())
+    )
+    return (
+        ReceivableJob.objects
+        .filter(job_key=job_key, status__in=ACTIVE_JOB_STATUSES, started_at__lt=today_start)
+        .update(
+            status=ReceivableJob.STATUS_STOPPED,
+            paused=False,
+            stop_requested=False,
+            message='Proceso anterior limpiado automáticamente por cambio de día.',
+            updated_at=now,
+            finished_at=now,
+        )
+        > 0
+    )
@@ -0,0 +1,498 @@
+"""
+Motor único de notificaciones de cobranza por WhatsApp.
+
+Una sola consulta trae las ventas de todos los buckets pedidos (vence hoy,
+mañana, en 5 días y vencidas sin renovar). Las ventas se agrupan por cliente
+para que un mensaje cubra todas sus cuentas y se envían en un solo ciclo con
+el ritmo del PacingScheduler.
+
+Cada venta deja un checkpoint ReceivableNotification por bucket y día: al
+reanudar (o si otro proceso corre a la vez) lo ya enviado se omite y las
+filas 'sending' funcionan como reclamo para no duplicar mensajes.
+
+El avance se sigue reportando por bucket en receivable_bulk_jobs, así la
+pantalla de cobranza no cambia. Pausar cualquier bucket activo pausa el
+ciclo completo; detener un bucket solo retira sus ventas.
+"""
+
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, time as dt_time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db.models import Q
+from django.utils import timezone
+
+from adm.functions.receivable_bulk_jobs import (
+    JOB_DUE_5_DAYS,
+    JOB_DUE_TODAY,
+    JOB_DUE_TOMORROW,
+    JOB_OVERDUE_PENDING,
+    finish_job,
+    get_control,
+    init_job,
+    rollover_cleanup_if_stale,
+    set_job_message,
+    stop_job,
+    update_recipient,
+)
+from adm.functions.send_whatsapp_notification import Notification
+from adm.functions.whatsapp_pacing import PRIORITY_RECEIVABLE, PacingScheduler
+from adm.models import ReceivableNotification, Sale
+
+
+BUCKET_ORDER = [JOB_DUE_TODAY, JOB_DUE_TOMORROW, JOB_DUE_5_DAYS, JOB_OVERDUE_PENDING]
+# Buckets de la corrida diaria (el scheduler y "Notificar todos")
+DAILY_BUCKETS = [JOB_DUE_TODAY, JOB_DUE_5_DAYS, JOB_OVERDUE_PENDING]
+BUCKET_OFFSETS = {JOB_DUE_TODAY: 0, JOB_DUE_TOMORROW: 1, JOB_DUE_5_DAYS: 5}
+BUCKET_DISCOUNTS = {JOB_DUE_TODAY: 20, JOB_DUE_TOMORROW: 25, JOB_DUE_5_DAYS: 25, JOB_OVERDUE_PENDING: 20}
+EMPTY_BUCKET_MESSAGES = {
+    JOB_DUE_TODAY: 'Sin cuentas vencidas hoy',
+    JOB_DUE_TOMORROW: 'Sin cuentas por vencer mañana',
+    JOB_DUE_5_DAYS: 'Sin cuentas por vencer en 5 dias',
+    JOB_OVERDUE_PENDING: 'Sin cuentas vencidas pendientes',
+}
+RENEWAL_CONTACT_URL = 'https://wa.me/5218335355863'
+CLAIM_STALE_MINUTES = 15
+
+SPANISH_WEEKDAYS = ['Lunes', 'Martes', 'Miercoles', 'Jueves', 'Viernes', 'Sabado', 'Domingo']
+SPANISH_MONTHS = [None, 'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+
+def format_spanish_date(date_value):
+    return f"{SPANISH_WEEKDAYS[date_value.weekday()]} {date_value.day} de {SPANISH_MONTHS[date_value.month]} del {date_value.year}"
+
+
+def working_window(day):
+    """Inicio y fin del horario laboral (WORKING_HOURS_START/END) para `day`."""
+    start_hour, start_minute = [int(v) for v in os.getenv('WORKING_HOURS_START', '09:00').split(':')]
+    end_hour, end_minute = [int(v) for v in os.getenv('WORKING_HOURS_END', '21:00').split(':')]
+    work_start = timezone.make_aware(datetime.combine(day, dt_time(start_hour, start_minute)))
+    work_end = timezone.make_aware(datetime.combine(day, dt_time(end_hour, end_minute)))
+    return work_start, work_end
+
+
+def _day_bounds(day):
+    return (
+        timezone.make_aware(datetime.combine(day, dt_time.min)),
+        timezone.make_aware(datetime.combine(day, dt_time.max)),
+    )
+
+
+@dataclass
+class Notice:
+    """Una venta dentro de un bucket."""
+
+    sale: Sale
+    bucket: str
+
+    @property
+    def userdetail(self):
+        return getattr(self.sale.customer, 'userdetail', None)
+
+
+@dataclass
+class CustomerBatch:
+    """Ventas de un mismo cliente que salen en un solo mensaje."""
+
+    customer_id: int
+    notices: List[Notice] = field(default_factory=list)
+
+    @property
+    def userdetail(self):
+        return self.notices[0].userdetail
+
+    @property
+    def recipient(self):
+        ud = self.userdetail
+        return Notification.format_whatsapp_number(ud.lada, ud.phone_number)
+
+    @property
+    def buckets(self) -> List[str]:
+        return sorted({notice.bucket for notice in self.notices}, key=BUCKET_ORDER.index)
+
+
+def bucket_for(sale, base_day, buckets: Iterable[str]) -> Optional[str]:
+    expires_on = timezone.localtime(sale.expiration_date).date()
+    for bucket in BUCKET_ORDER:
+        if bucket not in buckets:
+            continue
+        if bucket == JOB_OVERDUE_PENDING:
+            if expires_on < base_day:
+                return bucket
+        elif expires_on == base_day + timedelta(days=BUCKET_OFFSETS[bucket]):
+            return bucket
+    return None
+
+
+def select_notices(base_day, buckets: Iterable[str]) -> List[Notice]:
+    """Todas las ventas activas de los buckets pedidos en una sola consulta, por urgencia."""
+    buckets = [bucket for bucket in BUCKET_ORDER if bucket in set(buckets)]
+    window = Q()
+    for bucket in buckets:
+        if bucket == JOB_OVERDUE_PENDING:
+            window |= Q(expiration_date__lte=_day_bounds(base_day - timedelta(days=1))[1])
+        else:
+            start, end = _day_bounds(base_day + timedelta(days=BUCKET_OFFSETS[bucket]))
+            window |= Q(expiration_date__gte=start, expiration_date__lte=end)
+    if not buckets:
+        return []
+
+    sales = (
+        Sale.objects.select_related('customer__userdetail', 'account__account_name')
+        .filter(window, status=True)
+        .order_by('expiration_date', 'customer__userdetail__lada', 'customer__userdetail__phone_number')
+    )
+    notices = []
+    for sale in sales:
+        bucket = bucket_for(sale, base_day, buckets)
+        if bucket:
+            notices.append(Notice(sale, bucket))
+    notices.sort(key=lambda notice: BUCKET_ORDER.index(notice.bucket))
+    return notices
+
+
+def group_by_customer(notices: Iterable[Notice]) -> List[CustomerBatch]:
+    """Agrupa por cliente conservando el orden del primer aviso (el más urgente)."""
+    batches: Dict[int, CustomerBatch] = {}
+    for notice in notices:
+        customer_id = notice.sale.customer_id
+        if customer_id not in batches:
+            batches[customer_id] = CustomerBatch(customer_id)
+        batches[customer_id].notices.append(notice)
+    return list(batches.values())
+
+
+# ----------------------------------------------------------------------- mensajes
+
+
+def _sale_facts(sale):
+    service = sale.account.account_name
+    service_name = service.description if service else 'Servicio'
+    service_price = int(service.price or 0) if service else 0
+    return service_name, sale.account.email or 'sin-email', sale.account.profile or 1, service_price
+
+
+def _discounted(bucket, service_price):
+    return int(round(service_price * (100 - BUCKET_DISCOUNTS[bucket]) / 100.0))
+
+
+def _single_message(notice: Notice, base_day) -> str:
+    sale, bucket = notice.sale, notice.bucket
+    service_name, account_email, account_profile, service_price = _sale_facts(sale)
+    discounted_price = _discounted(bucket, service_price)
+    discounted_total_3m = discounted_price * 3
+    percent = BUCKET_DISCOUNTS[bucket]
+
+    if bucket == JOB_DUE_TODAY:
+        return (
+            f'Hola. Tu cuenta {service_name} ({account_email}, perfil {account_profile}) vence hoy, {format_spanish_date(base_day)}.\n\n'
+            f'Si renuevas hoy por 3 meses o mas, tienes {percent} por ciento de descuento: '
+            f'${discounted_price} por mes (precio normal ${service_price} por mes). '
+            f'Total por 3 meses: ${discounted_total_3m}.\n'
+            f'Tambien puedes renovar 1 mes por ${service_price}.\n\n'
+            f'Responde este mensaje para renovarte hoy: {RENEWAL_CONTACT_URL}'
+        )
+
+    if bucket == JOB_OVERDUE_PENDING:
+        expired_on = timezone.localtime(sale.expiration_date).date()
+        grace_days = max(0, (base_day - expired_on).days)
+        intro = (
+            f'Hola. Te compartimos un recordatorio de tu cuenta {service_name} ({account_email}, perfil {account_profile}).\n\n'
+            f'Vencio el {expired_on.strftime("%d-%m-%Y")} y te hemos mantenido el servicio activo por {grace_days} dia(s) para evitarte interrupciones.\n\n'
+        )
+    else:
+        target_day = base_day + timedelta(days=BUCKET_OFFSETS[bucket])
+        when = 'mañana' if bucket == JOB_DUE_TOMORROW else 'en 5 dias'
+        intro = (
+            f'Hola. Tu cuenta {service_name} ({account_email}, perfil {account_profile}) vence {when} '
+            f'({target_day.strftime("%Y-%m-%d")}).\n\n'
+            f'Este descuento aplica solo hoy ({base_day.strftime("%d-%m-%Y")}).\n\n'
+        )
+    return (
+        intro
+        + f'Hoy tienes 2 opciones de renovacion:\n'
+        f'1. Renovar 3 meses con {percent} por ciento de descuento:\n'
+        f'- Precio normal: ${service_price} por mes\n'
+        f'- Precio con descuento: ${discounted_price} por mes\n'
+        f'- Total final por 3 meses: ${discounted_total_3m}\n'
+        f'2. Renovar 1 mes a precio normal: ${service_price}\n\n'
+        f'Cuando gustes te ayudamos a renovarla: {RENEWAL_CONTACT_URL}'
+    )
+
+
+def _status_text(notice: Notice, base_day) -> str:
+    if notice.bucket == JOB_DUE_TODAY:
+        return f'vence hoy, {format_spanish_date(base_day)}'
+    if notice.bucket == JOB_OVERDUE_PENDING:
+        expired_on = timezone.localtime(notice.sale.expiration_date).date()
+        grace_days = max(0, (base_day - expired_on).days)
+        return f'vencio el {expired_on.strftime("%d-%m-%Y")} y la mantuvimos activa {grace_days} dia(s)'
+    target_day = base_day + timedelta(days=BUCKET_OFFSETS[notice.bucket])
+    when = 'mañana' if notice.bucket == JOB_DUE_TOMORROW else 'en 5 dias'
+    return f'vence {when} ({target_day.strftime("%Y-%m-%d")})'
+
+
+def build_message(notices: List[Notice], base_day) -> str:
+    """Un solo mensaje para todas las ventas del cliente; con una venta se usa el texto de su bucket."""
+    if len(notices) == 1:
+        return _single_message(notices[0], base_day)
+
+    lines = ['Hola. Te compartimos el estado de tus cuentas:', '']
+    for notice in notices:
+        service_name, account_email, account_profile, service_price = _sale_facts(notice.sale)
+        discounted_price = _discounted(notice.bucket, service_price)
+        lines.append(f'- {service_name} ({account_email}, perfil {account_profile}): {_status_text(notice, base_day)}.')
+        lines.append(
+            f'  3 meses con {BUCKET_DISCOUNTS[notice.bucket]} por ciento de descuento: ${discounted_price} por mes '
+            f'(total ${discounted_price * 3}). 1 mes: ${service_price}.'
+        )
+    lines += [
+        '',
+        f'Los descuentos aplican solo hoy ({base_day.strftime("%d-%m-%Y")}).',
+        '',
+        f'Cuando gustes te ayudamos a renovarlas: {RENEWAL_CONTACT_URL}',
+    ]
+    return '\n'.join(lines)
+
+
+# -------------------------------------------------------------------------- motor
+
+
+def _default_send(message, lada, phone_number, instance):
+    return Notification.send_whatsapp_notification(
+        message,
+        lada,
+        phone_number,
+        priority=PRIORITY_RECEIVABLE,
+        instance=instance,
+    )
+
+
+class ReceivableNotificationEngine:
+    def __init__(
+        self,
+        base_day,
+        buckets: Iterable[str] = DAILY_BUCKETS,
+        dry_run: bool = False,
+        work_end=None,
+        log: Optional[Callable[[str], None]] = None,
+        send: Optional[Callable] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.base_day = base_day
+        self.buckets = [bucket for bucket in BUCKET_ORDER if bucket in set(buckets)]
+        self.dry_run = dry_run
+        self.work_end = work_end
+        self.log = log or (lambda message: None)
+        self.send = send or _default_send
+        self.sleep = sleep
+        self.active: Set[str] = set()
+        self.summary = {'candidates': 0, 'messages': 0, 'sent': 0, 'failed': 0, 'skipped': 0}
+
+    # ------------------------------------------------------------- checkpoints
+
+    def _sent_keys(self, notices) -> Set[Tuple[int, str]]:
+        sale_ids = {notice.sale.id for notice in notices}
+        if self.dry_run or not sale_ids:
+            return set()
+        rows = ReceivableNotification.objects.filter(
+            day=self.base_day,
+            status=ReceivableNotification.STATUS_SENT,
+            sale_id__in=sale_ids,
+        ).values_list('sale_id', 'bucket')
+        return set(rows)
+
+    def _claim(self, notices: List[Notice]) -> List[Notice]:
+        """Reclama las ventas para este proceso; omite las que otro ya envió o está enviando."""
+        claimed = []
+        stale = timezone.now() - timedelta(minutes=CLAIM_STALE_MINUTES)
+        for notice in notices:
+            row, created = ReceivableNotification.objects.get_or_create(
+                sale_id=notice.sale.id, bucket=notice.bucket, day=self.base_day,
+            )
+            if created:
+                claimed.append(notice)
+                continue
+            reclaimed = (
+                ReceivableNotification.objects.filter(pk=row.pk)
+                .filter(
+                    Q(status=ReceivableNotification.STATUS_FAILED)
+                    | Q(status=ReceivableNotification.STATUS_SENDING, updated_at__lt=stale)
+                )
+                .update(status=ReceivableNotification.STATUS_SENDING, status_code=None, updated_at=timezone.now())
+            )
+            if reclaimed:
+                claimed.append(notice)
+        return claimed
+
+    def _checkpoint(self, notices: List[Notice], status: str, status_code=None):
+        for bucket in {notice.bucket for notice in notices}:
+            rows = ReceivableNotification.objects.filter(
+                day=self.base_day,
+                bucket=bucket,
+                sale_id__in=[notice.sale.id for notice in notices if notice.bucket == bucket],
+            )
+            if status is None:
+                rows.filter(status=ReceivableNotification.STATUS_SENDING).delete()
+                continue
+            rows.update(
+                status=status,
+                status_code=status_code,
+                sent_at=timezone.now() if status == ReceivableNotification.STATUS_SENT else None,
+                updated_at=timezone.now(),
+            )
+
+    # ---------------------------------------------------------------- control
+
+    def _check_controls(self):
+        """Aplica stop/pausa del operador. Con algún bucket en pausa espera."""
+        while True:
+            paused = False
+            for bucket in sorted(self.active, key=BUCKET_ORDER.index):
+                control = get_control(bucket)
+                if control.get('stop_requested'):
+                    stop_job(bucket, 'Detenido por operador')
+                    self.active.discard(bucket)
+                    self.log(f'[{bucket}] Detenido por operador')
+                elif control.get('paused'):
+                    paused = True
+            if not paused or not self.active:
+                return
+            self.sleep(2)
+
+    def _out_of_hours(self) -> bool:
+        return self.work_end is not None and timezone.localtime() > self.work_end
+
+    def _wait_for_send_slot(self, recipient) -> Optional[str]:
+        """
+        Espera turno de cobranza en el scheduler de WhatsApp. None si el
+        operador detuvo los buckets o terminó el horario laboral.
+        """
+        scheduler = PacingScheduler()
+        while True:
+            self._check_controls()
+            if not self.active or self._out_of_hours():
+                return None
+            reservation = scheduler.reserve(PRIORITY_RECEIVABLE, recipient)
+            if reservation.instance:
+                return reservation.instance
+            self.sleep(max(0.5, min(2.0, reservation.wait_seconds)))
+
+    # -------------------------------------------------------------------- run
+
+    def _skip(self, notice: Notice, note: str):
+        update_recipient(notice.bucket, notice.sale.id, 'skipped', note)
+        self.summary['skipped'] += 1
+
+    def _prepare(self) -> List[CustomerBatch]:
+        for bucket in self.buckets:
+            rollover_cleanup_if_stale(bucket)
+
+        notices = select_notices(self.base_day, self.buckets)
+        self.summary['candidates'] = len(notices)
+        by_bucket = {bucket: [] for bucket in self.buckets}
+        for notice in notices:
+            by_bucket[notice.bucket].append(notice)
+        for bucket, items in by_bucket.items():
+            init_job(bucket, [
+                {
+                    'sale_id': notice.sale.id,
+                    'customer': notice.sale.customer.username,
+                    'phone': f"+{getattr(notice.userdetail, 'lada', '')}{getattr(notice.userdetail, 'phone_number', '')}",
+                    'status': 'pending',
+                    'note': '',
+                }
+                for notice in items
+            ])
+            self.log(f'[{bucket}] Candidatos: {len(items)}')
+            if items:
+                self.active.add(bucket)
+            else:
+                finish_job(bucket, EMPTY_BUCKET_MESSAGES[bucket])
+
+        sent = self._sent_keys(notices)
+        pending = []
+        for notice in notices:
+            sale_id = notice.sale.id
+            # Una venta avisada hoy como "vence hoy" no recibe además el de vencida
+            if (sale_id, notice.bucket) in sent or (
+                notice.bucket == JOB_OVERDUE_PENDING and (sale_id, JOB_DUE_TODAY) in sent
+            ):
+                self._skip(notice, 'Ya notificado hoy')
+                continue
+            ud = notice.userdetail
+            if not ud or not ud.phone_number or not ud.lada:
+                self._skip(notice, 'Sin telefono/lada')
+                continue
+            pending.append(notice)
+        return group_by_customer(pending)
+
+    def run(self) -> Dict:
+        batches = self._prepare()
+        self.log(f'[receivable] Mensajes por enviar: {len(batches)}')
+
+        for batch in batches:
+            self._check_controls()
+            if not self.active:
+                break
+            if self._out_of_hours():
+                for bucket in list(self.active):
+                    finish_job(bucket, 'Finalizado por fin de horario')
+                self.active.clear()
+                break
+
+            notices = [notice for notice in batch.notices if notice.bucket in self.active]
+            if not notices:
+                continue
+            if not self.dry_run:
+                claimed = self._claim(notices)
+                for notice in notices:
+                    if notice not in claimed:
+                        self._skip(notice, 'Ya notificado hoy')
+                notices = claimed
+                if not notices:
+                    continue
+
+            sale_ids = ', '.join(str(notice.sale.id) for notice in notices)
+            for bucket in {notice.bucket for notice in notices}:
+                set_job_message(bucket, f'Enviando a venta {sale_ids}')
+            message = build_message(notices, self.base_day)
+            self.log(f'[receivable] Procesando cliente={batch.customer_id} ventas={sale_ids}')
+
+            if self.dry_run:
+                self._finish_notices(notices, 'sent', 'Dry run')
+                self.summary['messages'] += 1
+                continue
+
+            instance = self._wait_for_send_slot(batch.recipient)
+            if instance is None:
+                self._checkpoint(notices, None)
+                continue
+
+            ud = batch.userdetail
+            status_code = self.send(message, ud.lada, ud.phone_number, instance)
+            self.summary['messages'] += 1
+            if status_code in (200, 201):
+                self._checkpoint(notices, ReceivableNotification.STATUS_SENT, status_code)
+                self._finish_notices(notices, 'sent', f'Enviado ({status_code})')
+                self.log(f'[receivable] OK ventas={sale_ids} status={status_code}')
+            else:
+                self._checkpoint(notices, ReceivableNotification.STATUS_FAILED, status_code)
+                self._finish_notices(notices, 'failed', f'Error ({status_code})')
+                self.log(f'[receivable] FAIL ventas={sale_ids} status={status_code}')
+
+        if self._out_of_hours():
+            for bucket in list(self.active):
+                finish_job(bucket, 'Finalizado por fin de horario')
+            self.active.clear()
+        for bucket in list(self.active):
+            finish_job(bucket, 'Proceso finalizado')
+        self.log('[receivable] Proceso finalizado')
+        return self.summary
+
+    def _finish_notices(self, notices: List[Notice], status: str, note: str):
+        for notice in notices:
+            update_recipient(notice.bucket, notice.sale.id, status, note)
+        self.summary[status] += len(notices)
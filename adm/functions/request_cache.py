@@ -0,0 +1,41 @@
+"""
+Caché con alcance de un request.
+
+RequestCacheMiddleware abre un diccionario por request (en un ContextVar, así
+sirve igual con hilos o async) y `memoize` guarda ahí lo que se pide varias
+veces durante el mismo render: negocio, créditos del usuario, contexto de
+afiliado. Fuera de un request (comandos, tareas) `memoize` solo calcula.
+
+Las señales de Credits/Affiliate llaman `forget` para que una vista que
+modifica créditos y luego renderiza vea el valor nuevo.
+"""
+
+import contextvars
+
+
+_store = contextvars.ContextVar('cm_request_cache', default=None)
+
+
+def begin():
+    return _store.set({})
+
+
+def end(token):
+    _store.reset(token)
+
+
+def memoize(key, build):
+    store = _store.get()
+    if store is None:
+        return build()
+    if key not in store:
+        store[key] = build()
+    return store[key]
+
+
+def forget(prefix):
+    """Olvida las llaves que empiezan con `prefix` en el request actual."""
+    store = _store.get()
+    if store:
+        for key in [key for key in store if key.startswith(prefix)]:
+            del store[key]
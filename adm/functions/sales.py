@@ -7,7 +7,6 @@ from adm.models import (
     PaymentMethod,
     Sale,
     Status,
-    Business,
     Credits,
     AccountChangeHistory,
     MarketingCampaign,
@@ -24,6 +23,9 @@ from django.urls import reverse, reverse_lazy
 from django.db import IntegrityError, transaction
 from django.http import HttpResponseRedirect
 from adm.functions.send_email import Email
+from adm.functions.account_availability import peek_best_account
+from adm.functions.business import BusinessInfo
+from adm.functions.account_reservations import allocate, claim_account
 from adm.functions.marketing_tags import marketing_tags_for_sales_view
 from django.utils import timezone
 from datetime import timedelta
@@ -230,6 +232,32 @@ class Sales():
 
 
     def find_best_account(service_id, months_requested):
+        """
+        Mejor cuenta disponible del índice AccountSlot (mismos criterios que
+        find_best_account_legacy). Solo consulta: no aparta la cuenta. Para
+        vender usa sell_best_account, que aparta y asigna con claim_account.
+
+        Args:
+            service_id: ID del servicio (ej: Netflix)
+            months_requested: Duración en meses que el cliente compró. El orden
+                del índice no depende de los meses (ver account_availability).
+
+        Returns:
+            Account object o None si no hay cuentas disponibles
+        """
+        return peek_best_account(service_id)
+
+    def sell_best_account(service_id, months_requested, **sale_kwargs):
+        """
+        Aparta la mejor cuenta y crea la venta con sale_ok(**sale_kwargs). Si
+        otra venta simultánea ganó la cuenta, reintenta con la siguiente.
+
+        Returns:
+            (Account, resultado de sale_ok) o (None, None) si no hay cuentas
+        """
+        return allocate(service_id, lambda account: Sales.sale_ok(service_obj=account, **sale_kwargs))
+
+    def find_best_account_legacy(service_id, months_requested):
         """
         Encuentra la mejor cuenta disponible basada en 3 criterios de prioridad:
         1. Menor número de cortes estimados (prioridad máxima)
@@ -570,7 +598,7 @@ class Sales():
             bank_selected = Bank.objects.get(bank_name=bank_name)
         except Bank.DoesNotExist:
             bank_selected = Bank.objects.create(
-                business=Business.objects.get(pk=1),
+                business=BusinessInfo.data(),
                 bank_name=bank_name,
                 headline='Cuentas Mexico',
                 card_number='0',
@@ -583,8 +611,10 @@ class Sales():
 
         if c:
             with transaction.atomic():
+                # Solo si la cuenta sigue libre; si no, AccountAlreadyAssigned
+                claim_account(service, customer, modified_by=request.user)
                 sale = Sale.objects.create(
-                    business=Business.objects.get(pk=1),
+                    business=BusinessInfo.data(),
                     user_seller=seller,
                     bank=bank_selected,
                     customer=customer,
@@ -595,9 +625,6 @@ class Sales():
                     payment_amount=price,
                     invoice=ticket
                 )
-                service.customer = customer
-                service.modified_by = request.user
-                service.save()
                 consume_coupon(
                     code_name=cupon.name,
                     customer=customer,
@@ -613,8 +640,26 @@ class Sales():
                     raise Sale.DoesNotExist
             except Sale.MultipleObjectsReturned:
                 if ticket == 'Web':
+                    with transaction.atomic():
+                        claim_account(service, customer, modified_by=customer)
+                        sale = Sale.objects.create(
+                            business=BusinessInfo.data(),
+                            user_seller=customer,
+                            bank=bank_selected,
+                            customer=customer,
+                            account=service,
+                            status=True,
+                            payment_method=payment_used,
+                            expiration_date=expiration_date,
+                            payment_amount=price,
+                            invoice=ticket
+                        )
+                return True, sale
+            except Sale.DoesNotExist:
+                with transaction.atomic():
+                    claim_account(service, customer, modified_by=request.user)
                     sale = Sale.objects.create(
-                        business=Business.objects.get(pk=1),
+                        business=BusinessInfo.data(),
                         user_seller=customer,
                         bank=bank_selected,
                         customer=customer,
@@ -625,26 +670,6 @@ class Sales():
                         payment_amount=price,
                         invoice=ticket
                     )
-                    service.customer = customer
-                    service.modified_by = customer
-                    service.save()
-                return True, sale
-            except Sale.DoesNotExist:
-                sale = Sale.objects.create(
-                    business=Business.objects.get(pk=1),
-                    user_seller=customer,
-                    bank=bank_selected,
-                    customer=customer,
-                    account=service,
-                    status=True,
-                    payment_method=payment_used,
-                    expiration_date=expiration_date,
-                    payment_amount=price,
-                    invoice=ticket
-                )
-                service.customer = customer
-                service.modified_by = request.user
-                service.save()
 
         try:
             token = UserDetail.objects.get(user=customer).token
@@ -980,7 +1005,7 @@ class Sales():
         service = acc
         price = cupon.price
         ticket = cupon.name
-        business = Business.objects.get(pk=1)
+        business = BusinessInfo.data()
         system_user = User.objects.get(pk=1)
         try:
             bank_selected = Bank.objects.get(bank_name='Shops')
@@ -998,6 +1023,7 @@ class Sales():
             payment_used = PaymentMethod.objects.create(description='Codigo')
 
         with transaction.atomic():
+            claim_account(service, customer, modified_by=system_user)
             sale = Sale.objects.create(
                 business=business,
                 user_seller=system_user,
@@ -1010,9 +1036,6 @@ class Sales():
                 payment_amount=price,
                 invoice=ticket
             )
-            service.customer = customer
-            service.modified_by = system_user
-            service.save()
             consume_coupon(
                 code_name=cupon.name,
                 customer=customer,
@@ -1038,12 +1061,29 @@ class Sales():
 
         return True
 
+    def redeem_best_account(request, service_id, code, customer_id, validated_coupon=None):
+        """
+        Aparta la mejor cuenta del servicio y la canjea con redeem(). Si otra
+        venta simultánea ganó la cuenta, reintenta con la siguiente.
+
+        Returns:
+            (True, Account) si se canjeó
+            (False, mensaje_error) si no hay cuentas
+        """
+        account, _ = allocate(
+            service_id,
+            lambda acc: Sales.redeem(request, acc, code, customer_id, validated_coupon=validated_coupon),
+        )
+        if account:
+            return True, account
+        return False, "No hay cuentas disponibles, porfavor comunicate al whats app +521 833 535 5863"
+
     def redeem_renew(request, acc, code, customer_id):
         customer = User.objects.get(pk=customer_id)
         cupon = validate_coupon_from_code(code, customer, service=acc.account_name)
         price = cupon.price
         ticket = cupon.name
-        business = Business.objects.get(pk=1)
+        business = BusinessInfo.data()
         system_user = User.objects.get(pk=1)
         try:
             bank_selected = Bank.objects.get(bank_name='Shops')
@@ -1135,12 +1175,29 @@ class Sales():
         }
         return dict_sale
 
+    def web_sale_best_account(request, service_id, unit_price, months, customer_id=None):
+        """
+        Aparta la mejor cuenta del servicio y la vende con web_sale(). Si otra
+        venta simultánea ganó la cuenta, reintenta con la siguiente.
+
+        Returns:
+            (True, dict de la venta) si se vendió
+            (False, mensaje_error) si no hay cuentas
+        """
+        account, sale = allocate(
+            service_id,
+            lambda acc: Sales.web_sale(request, acc, unit_price, months, customer_id=customer_id),
+        )
+        if account:
+            return True, sale
+        return False, "No hay cuentas disponibles, porfavor comunicate al whats app +521 833 535 5863"
+
     def sale_ok(customer, webhook_provider, payment_type, payment_id, service_obj, expiration_date, unit_price, request=None):
         try:
             bank_selected = Bank.objects.get(bank_name=webhook_provider)
         except Bank.DoesNotExist:
             bank_selected = Bank.objects.create(
-                business=Business.objects.get(pk=1),
+                business=BusinessInfo.data(),
                 bank_name=webhook_provider,
                 headline=webhook_provider,
                 card_number='0',
@@ -1153,23 +1210,22 @@ class Sales():
             payment_used = PaymentMethod.objects.create(
                 description=payment_type)
 
-        # create sale
-        sale = Sale.objects.create(
-            business=Business.objects.get(pk=1),
-            user_seller=customer,
-            bank=bank_selected,
-            customer=customer,
-            account=service_obj,
-            status=True,
-            payment_method=payment_used,
-            expiration_date=expiration_date,
-            payment_amount=unit_price,
-            invoice=payment_id
-        )
-        # update account
-        service_obj.customer = customer
-        service_obj.modified_by = customer
-        service_obj.save()
+        with transaction.atomic():
+            # update account (solo si sigue libre; si no, AccountAlreadyAssigned)
+            claim_account(service_obj, customer)
+            # create sale
+            sale = Sale.objects.create(
+                business=BusinessInfo.data(),
+                user_seller=customer,
+                bank=bank_selected,
+                customer=customer,
+                account=service_obj,
+                status=True,
+                payment_method=payment_used,
+                expiration_date=expiration_date,
+                payment_amount=unit_price,
+                invoice=payment_id
+            )
 
         Sales._send_account_delivery_whatsapp(customer, sale)
 
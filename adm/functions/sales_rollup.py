@@ -0,0 +1,215 @@
+"""
+Mantenimiento del resumen diario de ventas (SaleDailyRollup).
+
+Una venta nueva se suma a su fila con F() dentro de la misma transacción que
+la crea (`add_sale`), sin releer el día. Los cambios que no se pueden expresar
+como una suma (edición o borrado de una venta, cambio de país del cliente)
+reconstruyen el día completo a partir de sus Sale. Ambos caminos bloquean
+antes la fila del día en SaleRollupDay, así una reconstrucción nunca pisa una
+venta confirmada mientras armaba sus filas. El dashboard y el CRM leen de
+esta tabla en vez de recorrer todas las ventas.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from adm.models import Sale, SaleDailyRollup, SaleRollupDay
+
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_DIMENSIONS = ('service_id', 'country', 'payment_method_id', 'seller_id')
+SALE_VALUES = (
+    'customer_id',
+    'created_at',
+    'payment_amount',
+    'payment_method_id',
+    'user_seller_id',
+    'account__account_name_id',
+    'customer__userdetail__country',
+)
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day, time.max))
+    return start, end
+
+
+def sale_local_day(sale):
+    created_at = sale.created_at or timezone.now()
+    return timezone.localtime(created_at).date()
+
+
+def _first_sale_map(customer_ids):
+    if not customer_ids:
+        return {}
+    rows = (
+        Sale.objects.filter(customer_id__in=customer_ids)
+        .values('customer_id')
+        .annotate(first_sale=Min('created_at'))
+    )
+    return {row['customer_id']: row['first_sale'] for row in rows}
+
+
+def _sale_key(sale):
+    return (
+        sale['account__account_name_id'],
+        sale['customer__userdetail__country'] or '',
+        sale['payment_method_id'],
+        sale['user_seller_id'],
+    )
+
+
+def build_day_rows(day):
+    """Calcula (sin guardar) las filas del resumen para un día local."""
+    start, end = _day_bounds(day)
+    sales = list(Sale.objects.filter(created_at__range=(start, end)).values(*SALE_VALUES))
+    first_sales = _first_sale_map({sale['customer_id'] for sale in sales})
+
+    buckets = defaultdict(lambda: {
+        'sales_count': 0,
+        'revenue': 0,
+        'new_customer_sales': 0,
+        'new_customer_revenue': 0,
+        'returning_sales': 0,
+        'returning_revenue': 0,
+    })
+    for sale in sales:
+        key = _sale_key(sale)
+        amount = int(sale['payment_amount'] or 0)
+        bucket = buckets[key]
+        bucket['sales_count'] += 1
+        bucket['revenue'] += amount
+        if first_sales.get(sale['customer_id']) == sale['created_at']:
+            bucket['new_customer_sales'] += 1
+            bucket['new_customer_revenue'] += amount
+        else:
+            bucket['returning_sales'] += 1
+            bucket['returning_revenue'] += amount
+
+    rows = []
+    for key, totals in buckets.items():
+        row = SaleDailyRollup(day=day, **dict(zip(ROLLUP_DIMENSIONS, key)), **totals)
+        # bulk_create no pasa por save()
+        row.fill_keys()
+        rows.append(row)
+    return rows
+
+
+def rebuild_day(day):
+    # La fila del candado se crea fuera de la transacción: en MySQL el
+    # bloqueo debe ser la primera lectura para que build_day_rows vea todas
+    # las ventas confirmadas hasta obtenerlo
+    SaleRollupDay.objects.get_or_create(day=day)
+    with transaction.atomic():
+        lock = SaleRollupDay.objects.select_for_update().get(day=day)
+        rows = build_day_rows(day)
+        SaleDailyRollup.objects.filter(day=day).delete()
+        SaleDailyRollup.objects.bulk_create(rows)
+        lock.rebuilt_at = timezone.now()
+        lock.save(update_fields=['rebuilt_at'])
+    return len(rows)
+
+
+def add_sale(sale):
+    """
+    Suma una venta recién creada a su fila del resumen con F(). Debe correr
+    dentro de la transacción que creó la venta: el candado del día se libera
+    al confirmarla, así una reconstrucción concurrente la cuenta una sola vez.
+    Devuelve False si no aplica (sin transacción o día sin candado aún) y
+    el día se debe reconstruir.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        return False
+    day = sale_local_day(sale)
+    if SaleRollupDay.objects.select_for_update().filter(day=day).first() is None:
+        return False
+
+    values = Sale.objects.filter(pk=sale.pk).values(*SALE_VALUES).first()
+    if values is None:
+        return False
+    amount = int(values['payment_amount'] or 0)
+    is_new = bool(values['customer_id']) and not Sale.objects.filter(
+        customer_id=values['customer_id'], created_at__lt=values['created_at'],
+    ).exists()
+    prefix = 'new_customer' if is_new else 'returning'
+    deltas = {
+        'sales_count': 1,
+        'revenue': amount,
+        f'{prefix}_sales': 1,
+        f'{prefix}_revenue': amount,
+    }
+
+    row = SaleDailyRollup(day=day, **dict(zip(ROLLUP_DIMENSIONS, _sale_key(values))))
+    row.fill_keys()
+    updated = SaleDailyRollup.objects.filter(
+        day=day,
+        service_key=row.service_key,
+        country=row.country,
+        payment_method_key=row.payment_method_key,
+        seller_key=row.seller_key,
+    ).update(updated_at=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()})
+    if not updated:
+        for field, delta in deltas.items():
+            setattr(row, field, delta)
+        row.save()
+    return True
+
+
+def rebuild_range(date_from, date_to):
+    """Reconstruye todos los días entre date_from y date_to (inclusive)."""
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    days = 0
+    rows = 0
+    current = date_from
+    while current <= date_to:
+        rows += rebuild_day(current)
+        days += 1
+        current += timedelta(days=1)
+    return {'days': days, 'rows': rows}
+
+
+def rebuild_days(days):
+    for day in sorted(set(days)):
+        try:
+            rebuild_day(day)
+        except Exception:
+            logger.exception('No se pudo reconstruir SaleDailyRollup para %s', day)
+
+
+def _first_sale_days(customer_ids):
+    return {
+        timezone.localtime(value).date()
+        for value in _first_sale_map(customer_ids).values()
+        if value
+    }
+
+
+def schedule_rebuild(days, first_sale_of=()):
+    """
+    Reconstruye los días indicados al confirmar la transacción actual.
+    `first_sale_of` agrega el día de la primera venta (ya confirmada) de esos
+    clientes: al borrar su primera venta, otra pasa a ser la de cliente nuevo.
+    """
+    days = set(days)
+    customer_ids = {customer_id for customer_id in first_sale_of if customer_id}
+    if days or customer_ids:
+        transaction.on_commit(lambda: rebuild_days(days | _first_sale_days(customer_ids)))
+
+
+def schedule_rebuild_for_customers(customer_ids):
+    """
+    Reconstruye los días de todas las ventas de esos clientes; se usa cuando
+    las ventas cambian de cliente con un update() masivo (sin señales) y
+    cuando cambia el país de un cliente. Los cambios hechos con update() sobre
+    UserDetail no pasan por aquí; los corrige `manage.py rebuild_sale_rollup`,
+    que el scheduler corre en cada ciclo.
+    """
+    created = Sale.objects.filter(customer_id__in=customer_ids).values_list('created_at', flat=True)
+    schedule_rebuild(timezone.localtime(value).date() for value in created if value)
@@ -4,6 +4,8 @@ from django.core.cache import cache
 import re
 import unicodedata
 
+from adm.functions.whatsapp_pacing import PRIORITY_TRANSACTIONAL, acquire_for_send, primary_instance, report_send
+
 
 class Notification():
     @staticmethod
@@ -38,16 +40,37 @@ class Notification():
         normalized = ''.join(ch for ch in normalized if unicodedata.category(ch) != 'Mn')
         return re.sub(r'\s+', ' ', normalized).strip()
     @staticmethod
-    def _evo_config():
+    def _evo_config(instance=None):
+        """
+        Configuración de Evolution API. EVO_INSTANCE puede ser un pool
+        separado por comas; sin `instance` se usa la instancia principal.
+        """
         evo_api_url = settings.EVO_WHATSAPP_API_URL
-        evo_instance = settings.EVO_INSTANCE
+        evo_instance = primary_instance()
         evo_api_key = settings.EVO_API_KEY
         if not evo_api_url or not evo_instance or not evo_api_key:
             return None
-        return evo_api_url, evo_instance, evo_api_key
+        return evo_api_url, instance or evo_instance, evo_api_key
+
+    @staticmethod
+    def _reserve_instance(priority, recipient, instance=None, only_instance=None):
+        """Instancia con turno reservado en el scheduler (None si no hubo cupo a tiempo)."""
+        if instance:
+            return instance
+        return acquire_for_send(priority, recipient, only_instance=only_instance)
 
     @staticmethod
-    def send_whatsapp_notification_details(message, lada, phone_number):
+    def _no_budget_result(full_phone):
+        return {
+            "success": False,
+            "status_code": 429,
+            "full_phone": full_phone,
+            "error": "Sin cupo de envio",
+            "detail": "Ninguna instancia de Evolution API tiene presupuesto disponible en este momento.",
+        }
+
+    @staticmethod
+    def send_whatsapp_notification_details(message, lada, phone_number, priority=PRIORITY_TRANSACTIONAL, instance=None):
         full_phone = Notification.format_whatsapp_number(lada, phone_number)
         config = Notification._evo_config()
         if not config:
@@ -66,13 +89,17 @@ class Notification():
                 "detail": f"Faltan variables de entorno/configuracion: {', '.join(missing)}",
             }
 
-        evo_api_url, evo_instance, evo_api_key = config
+        instance = Notification._reserve_instance(priority, full_phone, instance)
+        if not instance:
+            return Notification._no_budget_result(full_phone)
+        evo_api_url, evo_instance, evo_api_key = Notification._evo_config(instance)
         endpoint = f"{evo_api_url}/message/sendText/{evo_instance}"
         payload = {"number": full_phone, "text": message}
         headers = {"apikey": evo_api_key, "Content-Type": "application/json"}
 
         try:
             response = requests.post(endpoint, json=payload, headers=headers, timeout=30)
+            report_send(evo_instance, response.status_code)
             response_text = (response.text or "").strip()
             success = response.status_code in [200, 201]
             return {
@@ -90,6 +117,7 @@ class Notification():
                 ),
             }
         except requests.exceptions.Timeout:
+            report_send(evo_instance, 408)
             return {
                 "success": False,
                 "status_code": 408,
@@ -100,6 +128,7 @@ class Notification():
                 "detail": "La solicitud a Evolution API supero 30 segundos sin respuesta.",
             }
         except requests.exceptions.RequestException as e:
+            report_send(evo_instance, 500)
             return {
                 "success": False,
                 "status_code": 500,
@@ -110,7 +139,7 @@ class Notification():
                 "detail": f"{type(e).__name__}: {str(e)}",
             }
 
-    def send_whatsapp_notification(message, lada, phone_number):
+    def send_whatsapp_notification(message, lada, phone_number, priority=PRIORITY_TRANSACTIONAL, instance=None):
         """
         Send WhatsApp notification via Evolution API
         
@@ -118,6 +147,8 @@ class Notification():
             message: Message text to send
             lada: Country code (e.g., 52 for Mexico)
             phone_number: Phone number without country code
+            priority: PRIORITY_* del scheduler de envío (whatsapp_pacing)
+            instance: Instancia ya reservada en el scheduler (opcional)
             
         Returns:
             int: HTTP status code
@@ -128,15 +159,20 @@ class Notification():
             if not config:
                 print("⚠️ WhatsApp API no configurada en .env")
                 return 500
-            evo_api_url, evo_instance, evo_api_key = config
             
             # Evolution requires Mexican WhatsApp numbers as 52 + 1 + 10 digits.
             full_phone = Notification.format_whatsapp_number(lada, phone_number)
+            instance = Notification._reserve_instance(priority, full_phone, instance)
+            if not instance:
+                print("⚠️ Sin cupo de envío en Evolution API")
+                return 429
+            evo_api_url, evo_instance, evo_api_key = Notification._evo_config(instance)
             
             endpoint = f"{evo_api_url}/message/sendText/{evo_instance}"
             payload = {"number": full_phone, "text": message}
             headers = {"apikey": evo_api_key, "Content-Type": "application/json"}
             response = requests.post(endpoint, json=payload, headers=headers, timeout=30)
+            report_send(evo_instance, response.status_code)
             
             # Log response for debugging
             print(f"📱 WhatsApp API Response: {response.status_code}")
@@ -147,13 +183,16 @@ class Notification():
             
         except requests.exceptions.Timeout:
             print("⚠️ Timeout al enviar WhatsApp")
+            report_send(instance, 408)
             return 408
         except requests.exceptions.RequestException as e:
             print(f"⚠️ Error al enviar WhatsApp: {str(e)}")
+            report_send(instance, 500)
             return 500
 
     @staticmethod
-    def send_whatsapp_notification_with_media(message, lada, phone_number, media_url, mime_type='image/png', file_name='campana.png'):
+    def send_whatsapp_notification_with_media(message, lada, phone_number, media_url, mime_type='image/png', file_name='campana.png',
+                                              priority=PRIORITY_TRANSACTIONAL, instance=None):
         """
         Envía WhatsApp con imagen + caption usando Evolution /message/sendMedia.
         """
@@ -162,8 +201,12 @@ class Notification():
             if not config:
                 print("⚠️ WhatsApp API no configurada en .env")
                 return 500
-            evo_api_url, evo_instance, evo_api_key = config
             full_phone = Notification.format_whatsapp_number(lada, phone_number)
+            instance = Notification._reserve_instance(priority, full_phone, instance)
+            if not instance:
+                print("⚠️ Sin cupo de envío en Evolution API")
+                return 429
+            evo_api_url, evo_instance, evo_api_key = Notification._evo_config(instance)
             endpoint = f"{evo_api_url}/message/sendMedia/{evo_instance}"
             payload = {
                 "number": full_phone,
@@ -175,24 +218,28 @@ class Notification():
             }
             headers = {"apikey": evo_api_key, "Content-Type": "application/json"}
             response = requests.post(endpoint, json=payload, headers=headers, timeout=30)
+            report_send(evo_instance, response.status_code)
             print(f"🖼️ WhatsApp Media API Response: {response.status_code}")
             if response.status_code not in [200, 201]:
                 print(f"⚠️ Media response body: {response.text}")
             return response.status_code
         except requests.exceptions.Timeout:
             print("⚠️ Timeout al enviar WhatsApp media")
+            report_send(instance, 408)
             return 408
         except requests.exceptions.RequestException as e:
             print(f"⚠️ Error al enviar WhatsApp media: {str(e)}")
+            report_send(instance, 500)
             return 500
 
-    def send_whatsapp_group_notification(message, group_id):
+    def send_whatsapp_group_notification(message, group_id, priority=PRIORITY_TRANSACTIONAL):
         """
         Send WhatsApp notification to a group via Evolution API.
 
         Args:
             message: Message text to send
             group_id: WhatsApp group id (example: 1203630...@g.us)
+            priority: PRIORITY_* del scheduler; los grupos siempre salen por la instancia principal
         """
         try:
             config = Notification._evo_config()
@@ -200,11 +247,15 @@ class Notification():
                 print("⚠️ WhatsApp API no configurada en .env")
                 return 500
             evo_api_url, evo_instance, evo_api_key = config
+            if not Notification._reserve_instance(priority, str(group_id).strip(), only_instance=evo_instance):
+                print("⚠️ Sin cupo de envío en Evolution API")
+                return 429
 
             endpoint = f"{evo_api_url}/message/sendText/{evo_instance}"
             payload = {"number": str(group_id).strip(), "text": message}
             headers = {"apikey": evo_api_key, "Content-Type": "application/json"}
             response = requests.post(endpoint, json=payload, headers=headers, timeout=30)
+            report_send(evo_instance, response.status_code)
             print(f"📣 WhatsApp Group API Response: {response.status_code}")
             if response.status_code not in [200, 201]:
                 print(f"⚠️ Group response body: {response.text}")
@@ -214,13 +265,17 @@ class Notification():
             return 500
 
     @staticmethod
-    def send_whatsapp_group_notification_with_media(message, group_id, media_url, mime_type='image/png', file_name='campana.png'):
+    def send_whatsapp_group_notification_with_media(message, group_id, media_url, mime_type='image/png', file_name='campana.png',
+                                                    priority=PRIORITY_TRANSACTIONAL):
         try:
             config = Notification._evo_config()
             if not config:
                 print("⚠️ WhatsApp API no configurada en .env")
                 return 500
             evo_api_url, evo_instance, evo_api_key = config
+            if not Notification._reserve_instance(priority, str(group_id).strip(), only_instance=evo_instance):
+                print("⚠️ Sin cupo de envío en Evolution API")
+                return 429
             endpoint = f"{evo_api_url}/message/sendMedia/{evo_instance}"
             payload = {
                 "number": str(group_id).strip(),
@@ -232,6 +287,7 @@ class Notification():
             }
             headers = {"apikey": evo_api_key, "Content-Type": "application/json"}
             response = requests.post(endpoint, json=payload, headers=headers, timeout=30)
+            report_send(evo_instance, response.status_code)
             print(f"🖼️ WhatsApp Group Media API Response: {response.status_code}")
             if response.status_code not in [200, 201]:
                 print(f"⚠️ Group media response body: {response.text}")
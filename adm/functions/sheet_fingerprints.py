@@ -0,0 +1,197 @@
+"""
+Huellas (hashes) por pestaña y por fila para sincronizar Google Sheets de
+forma incremental.
+
+Cada fila se resume en un hash de email+clave+status+perfil y cada pestaña
+en un hash de todas sus filas. Al comparar contra lo guardado:
+- pestañas con el mismo hash se omiten completas;
+- en las demás solo se procesan las filas nuevas, cambiadas o desaparecidas.
+
+Las filas que no se pudieron aplicar (errores, guardas de borrado) se
+"retienen": conservan su hash anterior y su pestaña queda sin hash, así la
+siguiente corrida las vuelve a evaluar.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from CuentasMexico.db import bulk_upsert
+from adm.models import SheetRowFingerprint, SheetSyncState, SheetTabFingerprint
+
+
+FIELD_SEPARATOR = "\x1f"
+
+
+def row_fingerprint(email, password, status, profile) -> str:
+    values = ["" if value is None else str(value).strip() for value in (email, password, status, profile)]
+    return hashlib.sha1(FIELD_SEPARATOR.join(values).encode("utf-8")).hexdigest()
+
+
+def fingerprint_rows(rows: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+    """
+    {clave: hash} a partir de pares (clave, hash_fila). Si una clave se repite
+    en la pestaña, sus hashes se combinan para que cualquier cambio la marque.
+    """
+    grouped: Dict[str, List[str]] = {}
+    for key, row_hash in rows:
+        grouped.setdefault(key, []).append(row_hash)
+    return {
+        key: hashes[0] if len(hashes) == 1 else hashlib.sha1("".join(sorted(hashes)).encode("utf-8")).hexdigest()
+        for key, hashes in grouped.items()
+    }
+
+
+def tab_fingerprint(rows: Dict[str, str]) -> str:
+    digest = hashlib.sha1()
+    for key in sorted(rows):
+        digest.update(f"{key}={rows[key]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class TabDelta:
+    tab: str
+    content_hash: str
+    rows: Dict[str, str]
+    changed: Set[str] = field(default_factory=set)
+    removed: Set[str] = field(default_factory=set)
+
+    @property
+    def touched(self) -> Set[str]:
+        return self.changed | self.removed
+
+
+@dataclass
+class FingerprintDelta:
+    tabs: Dict[str, TabDelta] = field(default_factory=dict)
+    unchanged: List[str] = field(default_factory=list)
+
+    def touched(self) -> Dict[str, Set[str]]:
+        """Claves a procesar por pestaña (solo pestañas con cambios)."""
+        return {tab: delta.touched for tab, delta in self.tabs.items()}
+
+    @property
+    def changed_rows(self) -> int:
+        return sum(len(delta.changed) for delta in self.tabs.values())
+
+    @property
+    def removed_rows(self) -> int:
+        return sum(len(delta.removed) for delta in self.tabs.values())
+
+
+class SheetFingerprintStore:
+    def __init__(self, source: str, sheet_id: str):
+        self.source = source
+        self.sheet_id = sheet_id
+        self._state: Optional[SheetSyncState] = None
+
+    @property
+    def state(self) -> SheetSyncState:
+        if self._state is None:
+            self._state, _ = SheetSyncState.objects.get_or_create(source=self.source, sheet_id=self.sheet_id)
+        return self._state
+
+    @property
+    def remote_revision(self) -> str:
+        return self.state.remote_revision
+
+    def full_sync_due(self, max_age_hours: float) -> bool:
+        """Sin corrida completa previa o más vieja que max_age_hours (0 = nunca forzar)."""
+        full_synced_at = self.state.full_synced_at
+        if not full_synced_at:
+            return True
+        if max_age_hours <= 0:
+            return False
+        return timezone.now() - full_synced_at >= timedelta(hours=max_age_hours)
+
+    def compare(self, tabs: Dict[str, Dict[str, str]]) -> FingerprintDelta:
+        """Compara {pestaña: {clave: hash}} contra lo guardado. No escribe."""
+        stored_tabs = dict(self.state.tabs.values_list("tab", "content_hash"))
+        delta = FingerprintDelta()
+        for tab in sorted(set(tabs) | set(stored_tabs)):
+            rows = tabs.get(tab, {})
+            content_hash = tab_fingerprint(rows) if tab in tabs else ""
+            if tab in tabs and stored_tabs.get(tab) == content_hash:
+                delta.unchanged.append(tab)
+            else:
+                delta.tabs[tab] = TabDelta(tab=tab, content_hash=content_hash, rows=rows)
+
+        if delta.tabs:
+            stored_rows: Dict[str, Dict[str, str]] = {}
+            for tab, key, row_hash in self.state.rows.filter(tab__in=list(delta.tabs)).values_list(
+                "tab", "row_key", "row_hash"
+            ):
+                stored_rows.setdefault(tab, {})[key] = row_hash
+            for tab, tab_delta in delta.tabs.items():
+                previous = stored_rows.get(tab, {})
+                tab_delta.changed = {key for key, row_hash in tab_delta.rows.items() if previous.get(key) != row_hash}
+                tab_delta.removed = set(previous) - set(tab_delta.rows)
+        return delta
+
+    def commit(
+        self,
+        delta: FingerprintDelta,
+        remote_revision: str = "",
+        full: bool = False,
+        hold: Optional[Dict[str, Set[str]]] = None,
+    ) -> int:
+        """
+        Guarda las huellas ya aplicadas. `hold` = {pestaña: claves} que no se
+        aplicaron y deben reevaluarse; con retenciones no se guarda la
+        revisión remota para que la siguiente corrida vuelva a descargar.
+        """
+        hold = {tab: keys for tab, keys in (hold or {}).items() if keys}
+        now = timezone.now()
+        with transaction.atomic():
+            state = SheetSyncState.objects.select_for_update().get(pk=self.state.pk)
+            state.revision += 1
+            revision = state.revision
+            for tab, tab_delta in delta.tabs.items():
+                held = hold.get(tab, set())
+                upserts = [
+                    SheetRowFingerprint(
+                        state=state, tab=tab, row_key=key, row_hash=tab_delta.rows[key], revision=revision,
+                    )
+                    for key in tab_delta.changed - held
+                ]
+                bulk_upsert(
+                    SheetRowFingerprint,
+                    upserts,
+                    unique_fields=["state", "tab", "row_key"],
+                    update_fields=["row_hash", "revision", "updated_at"],
+                )
+                removed = list(tab_delta.removed - held)
+                for start in range(0, len(removed), 1000):
+                    state.rows.filter(tab=tab, row_key__in=removed[start:start + 1000]).delete()
+
+                if tab_delta.content_hash or held:
+                    SheetTabFingerprint.objects.update_or_create(
+                        state=state,
+                        tab=tab,
+                        defaults={
+                            "content_hash": "" if held else tab_delta.content_hash,
+                            "row_count": len(tab_delta.rows),
+                            "revision": revision,
+                        },
+                    )
+                else:
+                    # La pestaña ya no existe en el sheet
+                    state.tabs.filter(tab=tab).delete()
+
+            state.remote_revision = "" if hold else (remote_revision or "")
+            state.synced_at = now
+            if full:
+                state.full_synced_at = now
+            state.save(update_fields=["revision", "remote_revision", "synced_at", "full_synced_at"])
+        self._state = state
+        return revision
+
+    def reset(self):
+        """Olvida todas las huellas: la siguiente corrida procesa todo."""
+        SheetSyncState.objects.filter(source=self.source, sheet_id=self.sheet_id).delete()
+        self._state = None
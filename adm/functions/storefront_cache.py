@@ -0,0 +1,92 @@
+"""
+Caché de la tienda pública (inicio y ShopListView).
+
+Todo lo que no depende del usuario (negocio, menú de servicios, carrusel,
+imágenes de promoción, banners, catálogo con precios de promoción, tiendas)
+se guarda bajo una versión de catálogo (`storefront:version`). Las señales de
+Service, Promocion, IndexCarouselImage, IndexPromoImage, Business y Shop la
+incrementan, así que las llaves viejas simplemente dejan de usarse.
+
+- Los servicios del menú se cachean como objetos (el negocio ya viene de la
+  caché de proceso de BusinessInfo): base.html los sigue pintando en cada
+  request junto con lo personal (créditos, carrito, sesión).
+- El cuerpo de las páginas se cachea ya renderizado con `{% cache %}`, variando
+  por `storefront_key` (versión + próxima frontera de tiempo de promociones) y
+  `price_level` (descuento del nivel del usuario, None para anónimos).
+
+Un visitante anónimo con caché caliente no toca la base de datos al renderizar.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+
+from CuentasMexico.cache import incr_counter
+from adm.functions import promotion_engine
+from adm.functions.business import BusinessInfo
+from adm.models import Service
+
+
+VERSION_KEY = 'storefront:version'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def fragment_ttl() -> int:
+    return int(_setting('STOREFRONT_CACHE_TTL', 3600))
+
+
+def catalog_version() -> int:
+    return int(cache.get(VERSION_KEY) or 0)
+
+
+def bump_catalog_version() -> int:
+    return incr_counter(VERSION_KEY, timeout=None)
+
+
+def cached(name, build, version=None):
+    """Valor de `build()` guardado bajo la versión de catálogo vigente."""
+    version = catalog_version() if version is None else version
+    key = f'storefront:{version}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout=fragment_ttl())
+    return value
+
+
+def storefront_key(version=None) -> str:
+    """
+    Versión de catálogo más la próxima frontera de tiempo de las promociones
+    (inicio o fin), para que el HTML no muestre precios de una promoción vencida.
+    """
+    version = catalog_version() if version is None else version
+    expires_at = promotion_engine.get_compiled().expires_at
+    return f"{version}:{expires_at.isoformat() if expires_at else '-'}"
+
+
+def price_level(request):
+    """Descuento del nivel del usuario; los anónimos no consultan nada."""
+    user = getattr(request, 'user', None)
+    if not user or not user.is_authenticated:
+        return None
+    try:
+        level = user.userdetail.level
+    except ObjectDoesNotExist:
+        return None
+    return getattr(level, 'discount', None) or None
+
+
+def page_context(request):
+    """Contexto común de las páginas públicas cacheadas."""
+    version = catalog_version()
+    return {
+        'business': BusinessInfo.data(),
+        'services': cached('services', lambda: list(Service.objects.filter(status=True)), version),
+        'credits': BusinessInfo.credits(request),
+        'storefront_key': storefront_key(version),
+        'storefront_ttl': fragment_ttl(),
+        'price_level': price_level(request),
+    }
@@ -12,6 +12,7 @@ from django.utils import timezone
 from django.db.models import Q
 
 from adm.models import Account, Service
+from adm.functions.sheet_fingerprints import SheetFingerprintStore, fingerprint_rows, row_fingerprint
 from adm.functions.send_whatsapp_notification import Notification
 from adm.functions.whatsapp_queue import enqueue_whatsapp
 from adm.functions.whatsapp_delivery_log import append_whatsapp_delivery_log
@@ -23,6 +24,8 @@ logger = logging.getLogger(__name__)
 GOOGLE_SHEETS_API_URL = "https://servertools.bdpyc.cl/api/google-sheets"
 GOOGLE_SHEET_ID = "1eY2EWKjarh1a909CLSrL22lP5HVUF5CZzdM9SDHBT3M"
 BLACKLIST_SERVICES = ["YOUTUBE", "SPOTIFY"]  # No actualizar estos servicios de la misma forma
+FINGERPRINT_SOURCE = "n8n"
+FULL_SYNC_EVERY_HOURS = 24  # Corrida completa aunque las filas no cambien
 
 
 class SheetsSyncManager:
@@ -38,6 +41,10 @@ class SheetsSyncManager:
             "status_changes": [],
             "errors": []
         }
+        self.failed_sheets = set()
+        self.fingerprints = SheetFingerprintStore(FINGERPRINT_SOURCE, GOOGLE_SHEET_ID)
+        self._delta = None
+        self._full = False
     
     def fetch_sheets_data(self) -> List[Dict]:
         """
@@ -90,6 +97,57 @@ class SheetsSyncManager:
         self.logger.info(f"📊 Datos agrupados en {len(grouped)} hojas: {list(grouped.keys())}")
         return grouped
     
+    @staticmethod
+    def _record_key(record: Dict) -> str:
+        return str(record.get("EMAIL") or "").strip().lower()
+
+    def filter_changed(self, grouped_data: Dict[str, List[Dict]], full: bool = False) -> Dict[str, List[Dict]]:
+        """
+        Deja solo los registros cuyo hash (EMAIL+CLAVE+STATUS+PERFIL) cambió
+        desde la última corrida; las hojas sin cambios se omiten completas.
+        Con `full` (o si la última corrida completa es vieja) no filtra nada.
+        """
+        self._full = full or self.fingerprints.full_sync_due(FULL_SYNC_EVERY_HOURS)
+        self._delta = self.fingerprints.compare({
+            sheet_name: fingerprint_rows(
+                (self._record_key(record), row_fingerprint(
+                    record.get("EMAIL"), record.get("CLAVE"), record.get("STATUS"), record.get("PERFIL")
+                ))
+                for record in records
+                if self._record_key(record)
+            )
+            for sheet_name, records in grouped_data.items()
+        })
+        if self._full:
+            return grouped_data
+
+        touched = self._delta.touched()
+        filtered = {}
+        for sheet_name, records in grouped_data.items():
+            keys = touched.get(sheet_name)
+            if not keys:
+                continue
+            changed = [record for record in records if self._record_key(record) in keys]
+            if changed:
+                filtered[sheet_name] = changed
+
+        self.logger.info(
+            f"🧮 Sync incremental: {len(self._delta.unchanged)} hojas sin cambios, "
+            f"{self._delta.changed_rows} filas cambiadas, {self._delta.removed_rows} desaparecidas"
+        )
+        return filtered
+
+    def commit_fingerprints(self):
+        """Guarda los hashes; las hojas con errores se reevalúan en la siguiente corrida."""
+        if self._delta is None:
+            return
+        hold = {
+            sheet_name: self._delta.tabs[sheet_name].changed
+            for sheet_name in self.failed_sheets
+            if sheet_name in self._delta.tabs
+        }
+        self.fingerprints.commit(self._delta, full=self._full, hold=hold)
+
     def validate_record(self, record: Dict) -> Tuple[bool, str]:
         """
         Valida si un registro tiene datos mínimos requeridos.
@@ -186,7 +244,10 @@ class SheetsSyncManager:
             for idx, rec in enumerate(records[:2]):
                 self.logger.info(f"   [Registro {idx}] EMAIL={rec.get('EMAIL')}, SERVICIO={rec.get('SERVICIO')}, CLAVE={rec.get('CLAVE')}")
             
+            errors_before = len(self.changes_log["errors"])
             self._sync_password_updates(records, sheet_name)
+            if len(self.changes_log["errors"]) > errors_before:
+                self.failed_sheets.add(sheet_name)
     
     def _sync_password_updates(self, records: List[Dict], sheet_name: str = None):
         """
@@ -725,10 +786,12 @@ También puedes hacer compras con entregas inmediatas (y con descuento) en https
             return deleted_summary
 
 
-def sync_google_sheets():
+def sync_google_sheets(full: bool = False):
     """
     Función principal para sincronizar Google Sheets con la BD.
     Puede llamarse desde una tarea programada, webhook o cron.
+    Es incremental: solo procesa filas cambiadas (ver filter_changed);
+    `full=True` procesa todas.
     
     Returns:
         Diccionario con resumen de cambios
@@ -743,9 +806,11 @@ def sync_google_sheets():
         
         # Agrupar por hoja
         grouped_data = manager.group_by_sheet(sheets_data)
+        grouped_data = manager.filter_changed(grouped_data, full=full)
         
         # Sincronizar
         manager.sync_accounts(grouped_data)
+        manager.commit_fingerprints()
         
         # Log final
         summary = manager.get_summary()
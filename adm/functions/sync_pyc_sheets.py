@@ -7,9 +7,10 @@ import json
 import logging
 import os
 import time
+from collections import defaultdict
 from datetime import datetime
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import requests
 from cryptography.hazmat.primitives import hashes, serialization
@@ -17,6 +18,8 @@ from cryptography.hazmat.primitives.asymmetric import padding
 from django.conf import settings
 from django.db import transaction
 
+from adm.functions.account_availability import schedule_refresh
+from adm.functions.sheet_fingerprints import SheetFingerprintStore, fingerprint_rows, row_fingerprint
 from adm.functions.whatsapp_queue import enqueue_whatsapp
 from adm.models import Account, Sale, AccountChangeHistory, PaymentMethod, UserDetail
 
@@ -24,6 +27,7 @@ from adm.models import Account, Sale, AccountChangeHistory, PaymentMethod, UserD
 logger = logging.getLogger(__name__)
 
 DEFAULT_SHEET_ID = "1eY2EWKjarh1a909CLSrL22lP5HVUF5CZzdM9SDHBT3M"
+FINGERPRINT_SOURCE = "pyc"
 PASSWORD_HISTORY_FILE = "sync_pyc_password_changes_history.jsonl"
 
 # Mapeo explícito de servicio -> pestaña objetivo
@@ -69,6 +73,71 @@ class SheetRow:
     profile: Optional[int]
 
 
+@dataclass
+class AccountChange:
+    """Cambio calculado para una cuenta PYC (etapa diff); se aplica en bloque."""
+
+    account: Account
+    tab_name: str
+    match_type: str
+    fields: Dict[str, object] = field(default_factory=dict)
+    previous: Dict[str, object] = field(default_factory=dict)
+    deleted: bool = False
+    replace: bool = False
+    applied: bool = False
+
+    def set(self, name: str, value):
+        self.previous[name] = getattr(self.account, name)
+        self.fields[name] = value
+
+    def report(self) -> Dict:
+        changes = {}
+        for name, value in self.fields.items():
+            old = self.previous.get(name)
+            if name == "password":
+                old, value = "***", "***"
+            changes[name] = {"old": old, "new": value}
+        return {
+            "account_id": self.account.id,
+            "email": self.account.email,
+            "service": self.account.account_name.description,
+            "tab": self.tab_name,
+            "match": self.match_type,
+            "action": "delete" if self.deleted else ("update" if self.fields else "none"),
+            "replace_customer_account": self.replace,
+            "changes": changes,
+        }
+
+
+@dataclass
+class SyncDiff:
+    """Resultado de comparar el sheet contra las cuentas PYC, sin tocar la DB."""
+
+    changes: List[AccountChange] = field(default_factory=list)
+
+    @property
+    def writes(self) -> List[AccountChange]:
+        return [change for change in self.changes if change.fields]
+
+    def report(self, limit: int = 0) -> Dict:
+        writes = self.writes
+        counts = defaultdict(int)
+        for change in self.changes:
+            if change.deleted:
+                counts["would_mark_deleted"] += 1
+            for name in change.fields:
+                if not change.deleted:
+                    counts[f"would_change_{name}"] += 1
+            if change.replace:
+                counts["would_replace_customer_account"] += 1
+        items = [change.report() for change in self.changes if change.fields or change.replace]
+        return {
+            "accounts_with_changes": len(writes),
+            "counts": dict(counts),
+            "changes": items[:limit] if limit else items,
+        }
+
+
 def _normalize_text(value: Optional[str]) -> str:
     return (value or "").strip().lower()
 
@@ -84,6 +153,18 @@ def _normalize_sheet_status_for_db(value: Optional[str]) -> str:
     return (value or "").strip()
 
 
+def _sheets_api_base() -> str:
+    return os.getenv("GOOGLE_SHEETS_API_BASE", "https://sheets.googleapis.com/v4").rstrip("/")
+
+
+def _drive_api_base() -> str:
+    return os.getenv("GOOGLE_DRIVE_API_BASE", "https://www.googleapis.com/drive/v3").rstrip("/")
+
+
+def _loose_key(email: Optional[str]) -> str:
+    return _normalize_text(email).replace(" ", "")
+
+
 def _b64url_encode(payload: bytes) -> str:
     return base64.urlsafe_b64encode(payload).rstrip(b"=").decode("utf-8")
 
@@ -123,7 +204,10 @@ def _build_google_access_token() -> str:
     now = int(time.time())
     claims = {
         "iss": service_account_email,
-        "scope": "https://www.googleapis.com/auth/spreadsheets.readonly",
+        "scope": (
+            "https://www.googleapis.com/auth/spreadsheets.readonly "
+            "https://www.googleapis.com/auth/drive.metadata.readonly"
+        ),
         "aud": "https://oauth2.googleapis.com/token",
         "iat": now,
         "exp": now + 3600,
@@ -193,6 +277,19 @@ def append_password_change_history(entry: Dict):
         fh.write(json.dumps(payload, ensure_ascii=False) + "\n")
 
 
+def append_password_change_history_many(entries: Iterable[Dict]):
+    """Igual que append_password_change_history pero con una sola escritura."""
+    timestamp = datetime.utcnow().isoformat() + "Z"
+    lines = []
+    for entry in entries:
+        payload = dict(entry)
+        payload.setdefault("timestamp", timestamp)
+        lines.append(json.dumps(payload, ensure_ascii=False) + "\n")
+    if lines:
+        with open(_password_history_path(), "a", encoding="utf-8") as fh:
+            fh.write("".join(lines))
+
+
 def read_password_change_history(limit: int = 200) -> List[Dict]:
     path = _password_history_path()
     if not os.path.exists(path):
@@ -228,6 +325,10 @@ class PycSheetSyncService:
             "notified_whatsapp": 0,
             "notified_email": 0,
             "replaced_deleted_accounts": 0,
+            "incremental": False,
+            "unchanged": False,
+            "skipped_tabs": 0,
+            "skipped_unchanged": 0,
             "aborted": False,
             "abort_reason": "",
             "warnings": [],
@@ -244,6 +345,12 @@ class PycSheetSyncService:
             "1", "true", "yes", "on"
         }
         self._initial_customer_account_ids = set()
+        self._apply_chunk_size = max(1, int(os.getenv("PYC_SYNC_CHUNK_SIZE", "500")))
+        # Corrida completa (todas las cuentas) cada N horas aunque el sheet no cambie,
+        # para corregir cambios hechos directo en la DB. 0 = solo la primera vez.
+        self._full_sync_hours = float(os.getenv("PYC_SYNC_FULL_EVERY_HOURS", "24"))
+        # Filas que no se aplicaron y deben reevaluarse en la siguiente corrida
+        self._hold: Dict[str, Set[str]] = defaultdict(set)
 
     def _progress(self, message: str):
         if self.progress_callback:
@@ -409,7 +516,7 @@ class PycSheetSyncService:
             )
 
     def _fetch_sheet_names(self, token: str) -> List[str]:
-        url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}"
+        url = f"{_sheets_api_base()}/spreadsheets/{self.sheet_id}"
         response = _google_get_with_retry(
             url,
             headers={"Authorization": f"Bearer {token}"},
@@ -423,6 +530,31 @@ class PycSheetSyncService:
             if sheet.get("properties", {}).get("title")
         ]
 
+    def _fetch_revision(self, token: str) -> str:
+        """Versión del archivo en Drive; cambia con cada edición. Vacío si no se pudo leer."""
+        try:
+            response = _google_get_with_retry(
+                f"{_drive_api_base()}/files/{self.sheet_id}",
+                headers={"Authorization": f"Bearer {token}"},
+                params={"fields": "version", "supportsAllDrives": "true"},
+                timeout=15,
+                max_attempts=2,
+            )
+            return str(response.json().get("version") or "")
+        except Exception as exc:
+            logger.warning("No se pudo leer la revisión del sheet PYC: %s", exc)
+            return ""
+
+    @staticmethod
+    def _tab_fingerprints(tab_index: Dict[str, Dict[str, SheetRow]]) -> Dict[str, Dict[str, str]]:
+        return {
+            tab_name: fingerprint_rows(
+                (email.replace(" ", ""), row_fingerprint(row.email, row.password, row.status, row.profile))
+                for email, row in rows.items()
+            )
+            for tab_name, rows in tab_index.items()
+        }
+
     def _build_tab_index(self, token: str) -> Tuple[Dict[str, Dict[str, SheetRow]], Dict[str, Dict[str, List[SheetRow]]]]:
         tab_index: Dict[str, Dict[str, SheetRow]] = {}
         tab_loose_index: Dict[str, Dict[str, List[SheetRow]]] = {}
@@ -437,7 +569,7 @@ class PycSheetSyncService:
             return tab_index, tab_loose_index
 
         response = _google_get_with_retry(
-            f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values:batchGet",
+            f"{_sheets_api_base()}/spreadsheets/{self.sheet_id}/values:batchGet",
             headers={"Authorization": f"Bearer {token}"},
             params=[("ranges", f"'{tab_name}'!A1:ZZ") for tab_name in existing_tabs],
             timeout=60,
@@ -491,12 +623,27 @@ class PycSheetSyncService:
             "Gracias por tu preferencia."
         )
 
-    def _send_notifications(self, account: Account, new_password: str):
+    @staticmethod
+    def _last_sale_expirations(account_ids: Iterable[int]) -> Dict[int, object]:
+        """Vencimiento de la última venta activa por cuenta, en una sola consulta."""
+        expirations: Dict[int, object] = {}
+        rows = (
+            Sale.objects.filter(account_id__in=list(account_ids), status=True)
+            .order_by("account_id", "-expiration_date")
+            .values_list("account_id", "expiration_date")
+        )
+        for account_id, expiration in rows:
+            expirations.setdefault(account_id, expiration)
+        return expirations
+
+    def _send_notifications(self, account: Account, new_password: str, last_expiration=False):
         if not account.customer:
             return
 
-        last_sale = Sale.objects.filter(account=account, status=True).order_by("-expiration_date").first()
-        expiration_text = last_sale.expiration_date.strftime("%d/%m/%Y") if last_sale and last_sale.expiration_date else "No definida"
+        if last_expiration is False:
+            last_sale = Sale.objects.filter(account=account, status=True).order_by("-expiration_date").first()
+            last_expiration = last_sale.expiration_date if last_sale else None
+        expiration_text = last_expiration.strftime("%d/%m/%Y") if last_expiration else "No definida"
 
         message = self._build_notification_message(account, new_password, expiration_text)
 
@@ -550,43 +697,21 @@ class PycSheetSyncService:
         except Exception as exc:
             self.summary["errors"].append(f"Error enviando email account_id={account.id}: {exc}")
 
-    def _apply_sheet_row(self, account: Account, row: SheetRow):
-        changes = []
-        password_changed = False
-        old_password = account.password
-
+    def _diff_sheet_row(self, change: AccountChange, row: SheetRow):
+        account = change.account
         normalized_status = _normalize_sheet_status_for_db(row.status)
         if normalized_status and account.external_status != normalized_status:
-            account.external_status = normalized_status
-            self.summary["updated_external_status"] += 1
-            changes.append("external_status")
-
+            change.set("external_status", normalized_status)
         if row.password and account.password != row.password:
-            account.password = row.password
-            self.summary["updated_password"] += 1
-            password_changed = True
-            changes.append("password")
-            append_password_change_history(
-                {
-                    "source": "sync_pyc_full",
-                    "task_id": self.task_id,
-                    "account_id": account.id,
-                    "service": account.account_name.description,
-                    "email": account.email,
-                    "old_password": old_password,
-                    "new_password": row.password,
-                }
-            )
-
+            change.set("password", row.password)
         if row.profile is not None and account.profile != row.profile:
-            account.profile = row.profile
-            self.summary["updated_profile"] += 1
-            changes.append("profile")
+            change.set("profile", row.profile)
 
-        if changes:
-            account.save(update_fields=changes)
-            if password_changed:
-                self._send_notifications(account, row.password)
+        external_status = change.fields.get("external_status", account.external_status)
+        change.replace = (
+            _needs_replacement_by_external_status(external_status)
+            and account.id in self._initial_customer_account_ids
+        )
 
     def _find_row_with_double_check(
         self,
@@ -612,37 +737,36 @@ class PycSheetSyncService:
 
         return None, "not_found"
 
-    def run(self) -> Dict:
-        token = _build_google_access_token()
-        tab_index, tab_loose_index = self._build_tab_index(token)
-
-        pyc_accounts = (
+    def _load_accounts(self) -> List[Account]:
+        return list(
             Account.objects.select_related("account_name", "customer", "customer__userdetail")
             .filter(supplier__name__iexact="pyc")
             .order_by("id")
         )
-        pyc_accounts_list = list(pyc_accounts)
-        self._initial_customer_account_ids = {a.id for a in pyc_accounts_list if a.customer_id}
-        self._total_accounts = len(pyc_accounts_list)
-        self._progress(f"Iniciando sync PYC: 0/{self._total_accounts}")
 
-        indexed_rows = sum(len(rows) for rows in tab_index.values())
-        if indexed_rows < self._min_index_rows:
-            reason = (
-                f"Sync abortado por seguridad: filas indexadas en sheet muy bajas "
-                f"({indexed_rows} < {self._min_index_rows})."
-            )
-            self.summary["aborted"] = True
-            self.summary["abort_reason"] = reason
-            self.summary["errors"].append(reason)
-            self._progress(reason)
-            return self.summary
+    def diff(
+        self,
+        tab_index: Dict[str, Dict[str, SheetRow]],
+        tab_loose_index: Dict[str, Dict[str, List[SheetRow]]],
+        accounts: List[Account],
+        touched: Optional[Dict[str, Set[str]]] = None,
+    ) -> SyncDiff:
+        """
+        Compara el índice del sheet contra las cuentas ya cargadas y devuelve
+        el conjunto de cambios. No escribe en la DB.
+
+        Con `touched` ({pestaña: emails sin espacios}) solo se evalúan las
+        cuentas cuya fila cambió o desapareció; las guardas de faltantes se
+        siguen calculando sobre todas las cuentas.
+        """
+        self._initial_customer_account_ids = {a.id for a in accounts if a.customer_id}
+        result = SyncDiff()
 
         expected_accounts = 0
         missing_candidates = 0
         per_tab_expected: Dict[str, int] = {}
         per_tab_missing: Dict[str, int] = {}
-        for account in pyc_accounts_list:
+        for account in accounts:
             tab_name = _tab_from_service(account.account_name.description)
             if not tab_name:
                 continue
@@ -660,7 +784,7 @@ class PycSheetSyncService:
                 f"Auto-deleted por ausencia {'ACTIVO' if self._allow_missing_delete else 'DESACTIVADO'}."
             )
 
-        for idx, account in enumerate(pyc_accounts_list, start=1):
+        for idx, account in enumerate(accounts, start=1):
             self.summary["processed"] += 1
             try:
                 if _is_explicit_ignored_unmapped_service(account.account_name.description):
@@ -671,6 +795,9 @@ class PycSheetSyncService:
                 if not tab_name:
                     self.summary["ignored_unmapped"] += 1
                     continue
+                if touched is not None and _loose_key(account.email) not in touched.get(tab_name, ()):
+                    self.summary["skipped_unchanged"] += 1
+                    continue
 
                 row, match_type = self._find_row_with_double_check(
                     account=account,
@@ -678,55 +805,215 @@ class PycSheetSyncService:
                     tab_index=tab_index,
                     tab_loose_index=tab_loose_index,
                 )
+                change = AccountChange(account=account, tab_name=tab_name, match_type=match_type)
                 if not row:
-                    if self._allow_missing_delete:
-                        tab_expected = per_tab_expected.get(tab_name, 0)
-                        tab_missing = per_tab_missing.get(tab_name, 0)
-                        tab_missing_ratio = (tab_missing / tab_expected) if tab_expected else 1
-                        can_delete_for_tab = (
-                            tab_expected >= self._service_missing_min_expected
-                            and tab_missing_ratio <= self._service_missing_ratio_guard
-                        )
-                        if match_type == "not_found" and can_delete_for_tab:
-                            account.external_status = "deleted"
-                            account.status = False
-                            account.save(update_fields=["external_status", "status"])
-                            self.summary["marked_deleted"] += 1
-                            if account.id in self._initial_customer_account_ids:
-                                self._replace_deleted_account_for_customer(account, trigger="missing_in_sheet")
-                        elif match_type == "not_found":
-                            self.summary["skipped_delete_by_service_guard"] += 1
+                    if not self._allow_missing_delete or match_type != "not_found":
+                        continue
+                    tab_expected = per_tab_expected.get(tab_name, 0)
+                    tab_missing = per_tab_missing.get(tab_name, 0)
+                    tab_missing_ratio = (tab_missing / tab_expected) if tab_expected else 1
+                    if (
+                        tab_expected >= self._service_missing_min_expected
+                        and tab_missing_ratio <= self._service_missing_ratio_guard
+                    ):
+                        change.deleted = True
+                        if account.external_status != "deleted":
+                            change.set("external_status", "deleted")
+                        if account.status:
+                            change.set("status", False)
+                        change.replace = account.id in self._initial_customer_account_ids
+                        result.changes.append(change)
+                    else:
+                        self.summary["skipped_delete_by_service_guard"] += 1
+                        self._hold[tab_name].add(_loose_key(account.email))
                     continue
 
-                self._apply_sheet_row(account, row)
-                if _needs_replacement_by_external_status(account.external_status):
-                    if account.id in self._initial_customer_account_ids:
-                        self._replace_deleted_account_for_customer(account, trigger="status_from_sheet")
+                self._diff_sheet_row(change, row)
+                if change.fields or change.replace:
+                    result.changes.append(change)
             except Exception as exc:
                 self.summary["errors"].append(f"Error account_id={account.id}: {exc}")
-                continue
+                tab_name = _tab_from_service(account.account_name.description)
+                if tab_name:
+                    self._hold[tab_name].add(_loose_key(account.email))
             finally:
-                self._progress(
-                    f"Procesadas {idx}/{self._total_accounts} | "
-                    f"claves cambiadas: {self.summary['updated_password']} | "
-                    f"estados cambiados: {self.summary['updated_external_status']} | "
-                    f"reactivadas: {self.summary['reactivated_accounts']} | "
-                    f"reemplazos: {self.summary['replaced_deleted_accounts']}"
-                )
+                if idx % self._apply_chunk_size == 0 or idx == len(accounts):
+                    self._progress(f"Comparando {idx}/{self._total_accounts} | cambios: {len(result.writes)}")
+
+        return result
+
+    def _write_chunk(self, chunk: List[AccountChange]):
+        """
+        Escribe un bloque en una transacción. Cambios idénticos (mismo estado,
+        mismo perfil...) van en un UPDATE ... WHERE id IN; el resto con
+        bulk_update agrupado por campos.
+        """
+        by_values: Dict[Tuple, List[AccountChange]] = defaultdict(list)
+        for change in chunk:
+            by_values[tuple(sorted(change.fields.items(), key=lambda item: item[0]))].append(change)
+
+        by_fields: Dict[Tuple[str, ...], List[Account]] = defaultdict(list)
+        with transaction.atomic():
+            for values, changes in by_values.items():
+                if len(changes) > 1:
+                    Account.objects.filter(pk__in=[c.account.pk for c in changes]).update(**dict(values))
+                else:
+                    by_fields[tuple(name for name, _ in values)].append(changes[0].account)
+                for change in changes:
+                    for name, value in change.fields.items():
+                        setattr(change.account, name, value)
+            for fields, accounts in by_fields.items():
+                Account.objects.bulk_update(accounts, list(fields), batch_size=len(accounts))
+            # update()/bulk_update no disparan señales: refrescar el índice a mano
+            schedule_refresh([change.account.pk for change in chunk])
+        for change in chunk:
+            change.applied = True
+
+    def _write_rows(self, chunk: List[AccountChange]):
+        """Respaldo fila por fila si el bloque falló, para aislar la cuenta con error."""
+        for change in chunk:
+            try:
+                with transaction.atomic():
+                    for name, value in change.fields.items():
+                        setattr(change.account, name, value)
+                    change.account.save(update_fields=list(change.fields))
+                change.applied = True
+            except Exception as exc:
+                for name, value in change.previous.items():
+                    setattr(change.account, name, value)
+                self.summary["errors"].append(f"Error account_id={change.account.id}: {exc}")
+
+    def _count_applied(self, change: AccountChange):
+        if change.deleted:
+            self.summary["marked_deleted"] += 1
+            return
+        for name in ("password", "external_status", "profile"):
+            if name in change.fields:
+                self.summary[f"updated_{name}"] += 1
+
+    def apply(self, result: SyncDiff):
+        """Aplica el diff en bloques de PYC_SYNC_CHUNK_SIZE y luego notifica/reemplaza."""
+        writes = result.writes
+        for start in range(0, len(writes), self._apply_chunk_size):
+            chunk = writes[start:start + self._apply_chunk_size]
+            try:
+                self._write_chunk(chunk)
+            except Exception as exc:
+                logger.warning("Bloque PYC falló (%s); reintentando fila por fila", exc)
+                self._write_rows(chunk)
+            self._progress(f"Aplicando cambios {min(start + len(chunk), len(writes))}/{len(writes)}")
+
+        # Los cambios sin escritura (p. ej. ya deleted) también cuentan como antes
+        for change in result.changes:
+            if not change.fields:
+                change.applied = True
+            if change.applied:
+                self._count_applied(change)
+            else:
+                self._hold[change.tab_name].add(_loose_key(change.account.email))
+
+        password_changes = [c for c in result.changes if c.applied and "password" in c.fields]
+        append_password_change_history_many(
+            {
+                "source": "sync_pyc_full",
+                "task_id": self.task_id,
+                "account_id": change.account.id,
+                "service": change.account.account_name.description,
+                "email": change.account.email,
+                "old_password": change.previous["password"],
+                "new_password": change.fields["password"],
+            }
+            for change in password_changes
+        )
+        notify = [c for c in password_changes if c.account.customer_id]
+        expirations = self._last_sale_expirations(c.account.id for c in notify)
+        for change in notify:
+            self._send_notifications(change.account, change.fields["password"], expirations.get(change.account.id))
+
+        for change in result.changes:
+            if change.applied and change.replace:
+                trigger = "missing_in_sheet" if change.deleted else "status_from_sheet"
+                self._replace_deleted_account_for_customer(change.account, trigger=trigger)
+
+        self._progress(
+            f"Procesadas {self._total_accounts}/{self._total_accounts} | "
+            f"claves cambiadas: {self.summary['updated_password']} | "
+            f"estados cambiados: {self.summary['updated_external_status']} | "
+            f"reactivadas: {self.summary['reactivated_accounts']} | "
+            f"reemplazos: {self.summary['replaced_deleted_accounts']}"
+        )
+
+    def run(self, dry_run: bool = False, full: bool = False) -> Dict:
+        """
+        Sync incremental: si la revisión del sheet no cambió no descarga nada;
+        si cambió, solo evalúa las cuentas cuyas filas cambiaron o
+        desaparecieron. `full=True` (o PYC_SYNC_FULL_EVERY_HOURS vencido)
+        evalúa todas las cuentas.
+        """
+        token = _build_google_access_token()
+        store = SheetFingerprintStore(FINGERPRINT_SOURCE, self.sheet_id)
+        full = full or store.full_sync_due(self._full_sync_hours)
+        self.summary["incremental"] = not full
+
+        revision = self._fetch_revision(token)
+        if not full and revision and revision == store.remote_revision:
+            self.summary["unchanged"] = True
+            self._progress(f"Sheet PYC sin cambios (revisión {revision}); nada que sincronizar")
+            return self.summary
+
+        tab_index, tab_loose_index = self._build_tab_index(token)
+
+        pyc_accounts_list = self._load_accounts()
+        self._total_accounts = len(pyc_accounts_list)
+        self._progress(f"Iniciando sync PYC: 0/{self._total_accounts}")
+
+        indexed_rows = sum(len(rows) for rows in tab_index.values())
+        if indexed_rows < self._min_index_rows:
+            reason = (
+                f"Sync abortado por seguridad: filas indexadas en sheet muy bajas "
+                f"({indexed_rows} < {self._min_index_rows})."
+            )
+            self.summary["aborted"] = True
+            self.summary["abort_reason"] = reason
+            self.summary["errors"].append(reason)
+            self._progress(reason)
+            return self.summary
+
+        delta = store.compare(self._tab_fingerprints(tab_index))
+        self.summary["skipped_tabs"] = len(delta.unchanged)
+        if not full:
+            self._progress(
+                f"Pestañas sin cambios: {len(delta.unchanged)} | filas cambiadas: {delta.changed_rows} | "
+                f"filas desaparecidas: {delta.removed_rows}"
+            )
+
+        result = self.diff(tab_index, tab_loose_index, pyc_accounts_list, touched=None if full else delta.touched())
+        if dry_run:
+            self.summary["dry_run"] = True
+            self.summary["diff"] = result.report()
+            return self.summary
 
+        self.apply(result)
+        store.commit(delta, remote_revision=revision, full=full, hold=self._hold)
         return self.summary
 
 
-def sync_pyc_sheets(progress_callback=None, task_id: Optional[str] = None) -> Dict:
+def sync_pyc_sheets(
+    progress_callback=None, task_id: Optional[str] = None, dry_run: bool = False, full: bool = False
+) -> Dict:
     service = PycSheetSyncService(progress_callback=progress_callback, task_id=task_id)
-    summary = service.run()
+    summary = service.run(dry_run=dry_run, full=full)
     logger.info(
-        "PYC sync complete processed=%s updated_password=%s updated_external_status=%s updated_profile=%s deleted=%s",
+        "PYC sync complete processed=%s updated_password=%s updated_external_status=%s updated_profile=%s deleted=%s "
+        "incremental=%s unchanged=%s skipped_unchanged=%s",
         summary["processed"],
         summary["updated_password"],
         summary["updated_external_status"],
         summary["updated_profile"],
         summary["marked_deleted"],
+        summary["incremental"],
+        summary["unchanged"],
+        summary["skipped_unchanged"],
     )
     return summary
 
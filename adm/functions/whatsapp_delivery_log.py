@@ -1,20 +1,133 @@
+"""
+Histórico de envíos de WhatsApp en segmentos diarios.
+
+Cada día (fecha del timestamp) se escribe en `logs/whatsapp_delivery/YYYY-MM-DD.jsonl`
+con un índice `YYYY-MM-DD.idx` al lado: registros binarios (offset, timestamp)
+cada ~64 KB del segmento. Las lecturas van del segmento más reciente hacia
+atrás leyendo bloques desde el final del archivo, así "últimos N" no depende
+del tamaño del histórico; el índice permite saltar directo a un instante
+(`before`) sin recorrer el día completo.
+
+La retención borra segmentos más viejos que WHATSAPP_DELIVERY_LOG_RETENTION_DAYS
+o que excedan WHATSAPP_DELIVERY_LOG_MAX_MB en total.
+"""
+
+import bisect
 import json
 import os
+import re
+import struct
 import threading
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterator, List, Optional
 
 from django.conf import settings
 from django.utils import timezone
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
 
 WHATSAPP_DELIVERY_LOG_FILE = "whatsapp_delivery_history.jsonl"
+SEGMENT_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+INDEX_STRIDE_BYTES = 64 * 1024
+READ_BLOCK_BYTES = 64 * 1024
+_INDEX_RECORD = struct.Struct("<Qd")
+_SEGMENT_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.jsonl$")
 _log_lock = threading.Lock()
 
 
-def _log_path() -> str:
+def _logs_dir() -> str:
     logs_dir = os.path.join(settings.BASE_DIR, "logs")
     os.makedirs(logs_dir, exist_ok=True)
-    return os.path.join(logs_dir, WHATSAPP_DELIVERY_LOG_FILE)
+    return logs_dir
+
+
+def _segments_dir() -> str:
+    path = getattr(settings, "WHATSAPP_DELIVERY_LOG_DIR", "") or os.path.join(_logs_dir(), "whatsapp_delivery")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _legacy_path() -> str:
+    return os.path.join(_logs_dir(), WHATSAPP_DELIVERY_LOG_FILE)
+
+
+def _segment_path(day: str) -> str:
+    return os.path.join(_segments_dir(), f"{day}{SEGMENT_SUFFIX}")
+
+
+def _index_path(segment_path: str) -> str:
+    return segment_path[: -len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def _timestamp_epoch(value) -> float:
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def list_segment_days(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[str]:
+    """Días con segmento dentro del rango, del más reciente al más viejo."""
+    days = []
+    for name in os.listdir(_segments_dir()):
+        match = _SEGMENT_RE.match(name)
+        if not match:
+            continue
+        day = match.group(1)
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        days.append(day)
+    return sorted(days, reverse=True)
+
+
+# --------------------------------------------------------------------- escritura
+
+
+class _locked_append:
+    """Abre un segmento en modo append con bloqueo entre procesos (flock)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fh = open(self.path, "ab")
+        if fcntl:
+            fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+        return self.fh
+
+    def __exit__(self, *exc):
+        try:
+            self.fh.flush()
+            if fcntl:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.fh.close()
+
+
+def _write_lines(day: str, items) -> None:
+    """Agrega [(bytes, epoch)] al segmento del día manteniendo su índice."""
+    path = _segment_path(day)
+    index_records = []
+    with _locked_append(path) as fh:
+        offset = fh.seek(0, os.SEEK_END)
+        chunks = []
+        for line, epoch in items:
+            # Un registro de índice por cada bloque de INDEX_STRIDE_BYTES que empieza una línea
+            if offset == 0 or offset // INDEX_STRIDE_BYTES != (offset + len(line)) // INDEX_STRIDE_BYTES:
+                index_records.append(_INDEX_RECORD.pack(offset, epoch))
+            chunks.append(line)
+            offset += len(line)
+        fh.write(b"".join(chunks))
+        if index_records:
+            with open(_index_path(path), "ab") as index_fh:
+                index_fh.write(b"".join(index_records))
 
 
 def append_whatsapp_delivery_log(entry: Dict):
@@ -22,36 +135,234 @@ def append_whatsapp_delivery_log(entry: Dict):
     payload.setdefault("timestamp", timezone.now().isoformat())
     payload.setdefault("event", "unknown")
     payload.setdefault("level", "info")
+    line = (json.dumps(payload, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    day = str(payload["timestamp"])[:10]
+    is_new_segment = not os.path.exists(_segment_path(day))
     with _log_lock:
-        with open(_log_path(), "a", encoding="utf-8") as fh:
-            fh.write(json.dumps(payload, ensure_ascii=False, default=str) + "\n")
+        _write_lines(day, [(line, _timestamp_epoch(payload["timestamp"]))])
+    if is_new_segment:
+        prune_whatsapp_delivery_log()
+
+
+# ----------------------------------------------------------------------- lectura
+
+
+def _load_index(segment_path: str):
+    try:
+        with open(_index_path(segment_path), "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return [], []
+    usable = len(data) - len(data) % _INDEX_RECORD.size
+    records = [_INDEX_RECORD.unpack_from(data, pos) for pos in range(0, usable, _INDEX_RECORD.size)]
+    return [offset for offset, _ in records], [epoch for _, epoch in records]
+
+
+def _end_offset_before(segment_path: str, before_epoch: float) -> Optional[int]:
+    """Offset desde el que ya no hay líneas anteriores a `before_epoch` (None = fin del archivo)."""
+    offsets, epochs = _load_index(segment_path)
+    if not offsets:
+        return None
+    position = bisect.bisect_right(epochs, before_epoch)
+    if position >= len(offsets):
+        return None
+    # El bloque siguiente empieza después de `before`; sus líneas no se necesitan
+    return offsets[position]
+
+
+def _reverse_lines(path: str, end: Optional[int] = None) -> Iterator[bytes]:
+    """Líneas del archivo de la última a la primera, leyendo bloques desde el final."""
+    with open(path, "rb") as fh:
+        position = fh.seek(0, os.SEEK_END) if end is None else end
+        remainder = b""
+        while position > 0:
+            size = min(READ_BLOCK_BYTES, position)
+            position -= size
+            fh.seek(position)
+            lines = (fh.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if remainder.strip():
+            yield remainder
+
+
+def _phone_digits(value) -> str:
+    return re.sub(r"\D", "", str(value or ""))
+
+
+def _matches(row: Dict, event_id: Optional[str], phone_digits: Optional[str]) -> bool:
+    if event_id and str(row.get("event_id") or "") != event_id:
+        return False
+    if phone_digits:
+        candidates = (_phone_digits(row.get("full_phone")), _phone_digits(row.get("phone_number")))
+        if not any(value and (value.endswith(phone_digits) or phone_digits.endswith(value)) for value in candidates):
+            return False
+    return True
+
+
+def _iter_rows(
+    date_from: Optional[str],
+    date_to: Optional[str],
+    event_id: Optional[str],
+    phone: Optional[str],
+    before_epoch: Optional[float],
+) -> Iterator[Dict]:
+    phone_digits = _phone_digits(phone)[-10:] or None
+    # Filtro barato sobre bytes antes de parsear JSON
+    needle = (event_id or phone_digits or "").encode("utf-8")
+    before_day = (
+        datetime.fromtimestamp(before_epoch, tz=dt_timezone.utc).date().isoformat() if before_epoch is not None else None
+    )
+
+    sources = []
+    for day in list_segment_days(date_from, date_to):
+        if before_day and day > before_day:
+            continue
+        path = _segment_path(day)
+        end = _end_offset_before(path, before_epoch) if before_day == day else None
+        sources.append((path, end, False))
+    legacy = _legacy_path()
+    if os.path.exists(legacy):
+        # Histórico anterior a los segmentos diarios (ver split_legacy_whatsapp_delivery_log)
+        sources.append((legacy, None, True))
+
+    for path, end, check_day in sources:
+        for raw in _reverse_lines(path, end):
+            if needle and needle not in raw:
+                continue
+            try:
+                row = json.loads(raw)
+            except ValueError:
+                continue
+            if check_day:
+                day = str(row.get("timestamp") or "")[:10]
+                if date_from and day and day < date_from:
+                    continue
+                if date_to and day and day > date_to:
+                    continue
+            if before_epoch is not None and _timestamp_epoch(row.get("timestamp")) >= before_epoch:
+                continue
+            if _matches(row, event_id, phone_digits):
+                yield row
 
 
 def read_whatsapp_delivery_log(
     limit: int = 200,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
+    event_id: Optional[str] = None,
+    phone: Optional[str] = None,
+    before: Optional[str] = None,
 ) -> List[Dict]:
-    path = _log_path()
-    if not os.path.exists(path):
-        return []
-
+    """
+    Últimos `limit` eventos (más recientes primero). `before` (timestamp ISO)
+    pagina hacia atrás: devuelve solo eventos anteriores a ese instante.
+    """
+    before_epoch = _timestamp_epoch(before) if before else None
     rows: List[Dict] = []
-    with open(path, "r", encoding="utf-8") as fh:
+    for row in _iter_rows(date_from, date_to, event_id or None, phone or None, before_epoch):
+        rows.append(row)
+        if len(rows) >= max(1, limit):
+            break
+    return rows
+
+
+# ------------------------------------------------------------------ mantenimiento
+
+
+def prune_whatsapp_delivery_log(today=None) -> List[str]:
+    """Aplica la retención por días y por tamaño total. Devuelve los días borrados."""
+    retention_days = int(getattr(settings, "WHATSAPP_DELIVERY_LOG_RETENTION_DAYS", 90))
+    max_bytes = int(getattr(settings, "WHATSAPP_DELIVERY_LOG_MAX_MB", 1024)) * 1024 * 1024
+    today = today or timezone.now().date()
+    cutoff = (today - timedelta(days=retention_days)).isoformat() if retention_days > 0 else None
+
+    removed = []
+    days = list_segment_days()
+    sizes = {}
+    for day in days:
+        try:
+            sizes[day] = os.path.getsize(_segment_path(day))
+        except OSError:
+            sizes[day] = 0
+    total = sum(sizes.values())
+
+    for day in reversed(days):  # del más viejo al más nuevo
+        too_old = cutoff is not None and day < cutoff
+        too_big = max_bytes > 0 and total > max_bytes and day != today.isoformat()
+        if not (too_old or too_big):
+            continue
+        path = _segment_path(day)
+        for target in (path, _index_path(path)):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+        total -= sizes[day]
+        removed.append(day)
+    return removed
+
+
+def rebuild_index(day: str) -> int:
+    """Regenera el índice de un segmento. Devuelve el número de registros."""
+    path = _segment_path(day)
+    records = []
+    offset = 0
+    with open(path, "rb") as fh:
         for line in fh:
-            line = line.strip()
-            if not line:
+            if offset == 0 or offset // INDEX_STRIDE_BYTES != (offset + len(line)) // INDEX_STRIDE_BYTES:
+                try:
+                    epoch = _timestamp_epoch(json.loads(line).get("timestamp"))
+                except ValueError:
+                    epoch = records[-1][1] if records else 0.0
+                records.append((offset, epoch))
+            offset += len(line)
+    with open(_index_path(path), "wb") as fh:
+        fh.write(b"".join(_INDEX_RECORD.pack(*record) for record in records))
+    return len(records)
+
+
+def split_legacy_whatsapp_delivery_log(batch_lines: int = 5000) -> Dict:
+    """
+    Reparte el archivo único anterior (whatsapp_delivery_history.jsonl) en
+    segmentos diarios y lo renombra a `.migrated`.
+    """
+    legacy = _legacy_path()
+    if not os.path.exists(legacy):
+        return {"lines": 0, "days": 0}
+
+    pending = {}
+    days = set()
+    lines = 0
+
+    def flush():
+        for day, items in pending.items():
+            _write_lines(day, items)
+        pending.clear()
+
+    with _log_lock, open(legacy, "rb") as fh:
+        buffered = 0
+        for raw in fh:
+            if not raw.strip():
                 continue
             try:
-                row = json.loads(line)
-            except Exception:
+                timestamp = json.loads(raw).get("timestamp")
+            except ValueError:
                 continue
-
-            day = str(row.get("timestamp") or "")[:10]
-            if date_from and day and day < date_from:
-                continue
-            if date_to and day and day > date_to:
+            day = str(timestamp or "")[:10]
+            if not re.match(r"^\d{4}-\d{2}-\d{2}$", day):
                 continue
-            rows.append(row)
-
-    return list(reversed(rows[-max(1, limit):]))
+            if not raw.endswith(b"\n"):
+                raw += b"\n"
+            pending.setdefault(day, []).append((raw, _timestamp_epoch(timestamp)))
+            days.add(day)
+            lines += 1
+            buffered += 1
+            if buffered >= batch_lines:
+                flush()
+                buffered = 0
+        flush()
+    os.replace(legacy, legacy + ".migrated")
+    return {"lines": lines, "days": len(days)}
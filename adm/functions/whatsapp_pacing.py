@@ -0,0 +1,282 @@
+"""
+Ritmo de envío central para Evolution API.
+
+`EVO_INSTANCE` es un pool separado por comas; cada instancia puede declarar
+su presupuesto como `nombre:por_minuto/por_hora/por_dia` (si no, se usan
+WHATSAPP_BUDGET_PER_*). Cada instancia tiene una fila WhatsAppSendClock con
+sus contadores por ventana, el siguiente turno y la penalización vigente.
+
+Prioridades:
+- transaccional (códigos, confirmaciones de venta): no espera el intervalo
+  entre mensajes y puede usar todo el presupuesto.
+- cobranza: respeta el intervalo y usa hasta WHATSAPP_RECEIVABLE_BUDGET_SHARE
+  del presupuesto por hora/día.
+- marketing: igual, hasta WHATSAPP_MARKETING_BUDGET_SHARE.
+Así siempre queda cupo para lo transaccional aunque haya campañas grandes.
+
+Ante 408/429/5xx la instancia sube su nivel de penalización: entra en
+enfriamiento con backoff exponencial y su intervalo se duplica por nivel.
+Cada envío exitoso baja un nivel.
+"""
+
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from adm.models import WhatsAppOutboundMessage, WhatsAppSendClock
+
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_TRANSACTIONAL = WhatsAppOutboundMessage.PRIORITY_TRANSACTIONAL
+PRIORITY_RECEIVABLE = WhatsAppOutboundMessage.PRIORITY_RECEIVABLE
+PRIORITY_MARKETING = WhatsAppOutboundMessage.PRIORITY_MARKETING
+
+DEFAULT_INSTANCE_NAME = 'default'
+MAX_PENALTY_LEVEL = 5
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+@dataclass(frozen=True)
+class InstanceConfig:
+    name: str
+    per_minute: int
+    per_hour: int
+    per_day: int
+
+    @property
+    def interval(self) -> float:
+        """Segundos entre mensajes para repartir el presupuesto por hora de forma pareja."""
+        spacing = [60.0 / self.per_minute if self.per_minute else 0.0]
+        spacing.append(3600.0 / self.per_hour if self.per_hour else 0.0)
+        return max(spacing)
+
+
+def _parse_instance(entry: str) -> InstanceConfig:
+    name, _, limits = entry.partition(':')
+    defaults = [
+        int(_setting('WHATSAPP_BUDGET_PER_MINUTE', 6)),
+        int(_setting('WHATSAPP_BUDGET_PER_HOUR', 240)),
+        int(_setting('WHATSAPP_BUDGET_PER_DAY', 2500)),
+    ]
+    values = [part.strip() for part in limits.split('/')] if limits else []
+    for index, value in enumerate(values[:3]):
+        if value.isdigit():
+            defaults[index] = int(value)
+    return InstanceConfig(name.strip(), *defaults)
+
+
+def instance_pool() -> List[InstanceConfig]:
+    entries = [item.strip() for item in str(_setting('EVO_INSTANCE', '') or '').split(',') if item.strip()]
+    if not entries:
+        # Sin instancias configuradas: un reloj local para no romper el ritmo
+        return [_parse_instance(DEFAULT_INSTANCE_NAME)]
+    return [_parse_instance(entry) for entry in entries]
+
+
+def primary_instance() -> str:
+    entries = [item.strip() for item in str(_setting('EVO_INSTANCE', '') or '').split(',') if item.strip()]
+    return entries[0].partition(':')[0].strip() if entries else ''
+
+
+def budget_share(priority: int) -> float:
+    if priority <= PRIORITY_TRANSACTIONAL:
+        return 1.0
+    if priority <= PRIORITY_RECEIVABLE:
+        return float(_setting('WHATSAPP_RECEIVABLE_BUDGET_SHARE', 0.9))
+    return float(_setting('WHATSAPP_MARKETING_BUDGET_SHARE', 0.6))
+
+
+def is_throttle_signal(status_code: Optional[int]) -> bool:
+    return status_code is None or status_code in (408, 429) or status_code >= 500
+
+
+@dataclass
+class Reservation:
+    instance: Optional[str]
+    wait_seconds: float = 0.0
+
+
+class PacingScheduler:
+    def __init__(self, pool: Optional[List[InstanceConfig]] = None):
+        self.pool = pool or instance_pool()
+        self._configs = {config.name: config for config in self.pool}
+
+    # ---------------------------------------------------------------- helpers
+
+    @property
+    def same_recipient_delay(self) -> float:
+        return float(_setting('WHATSAPP_QUEUE_SAME_RECIPIENT_DELAY_SEC', 3))
+
+    def lock_clocks(self, names=None):
+        names = sorted(names or self._configs)
+        existing = set(WhatsAppSendClock.objects.filter(name__in=names).values_list('name', flat=True))
+        for name in names:
+            if name not in existing:
+                WhatsAppSendClock.objects.get_or_create(name=name)
+        clocks = WhatsAppSendClock.objects.select_for_update().filter(name__in=names).order_by('name')
+        return {clock.name: clock for clock in clocks}
+
+    @staticmethod
+    def _windows(now):
+        local = timezone.localtime(now)
+        minute = now.replace(second=0, microsecond=0)
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        return minute, hour, local.date()
+
+    def _roll_windows(self, clock, now):
+        minute, hour, day = self._windows(now)
+        if clock.minute_window != minute:
+            clock.minute_window, clock.minute_count = minute, 0
+        if clock.hour_window != hour:
+            clock.hour_window, clock.hour_count = hour, 0
+        if clock.day_window != day:
+            clock.day_window, clock.day_count = day, 0
+
+    def _ready_in(self, clock, config, priority, recipient, now) -> float:
+        """Segundos que faltan para que la instancia acepte un mensaje de esa prioridad (0 = ya)."""
+        minute, hour, day = self._windows(now)
+        share = budget_share(priority)
+        waits = []
+        if clock.cooldown_until and clock.cooldown_until > now:
+            waits.append((clock.cooldown_until - now).total_seconds())
+        if config.per_minute and clock.minute_count >= config.per_minute:
+            waits.append((minute + timedelta(minutes=1) - now).total_seconds())
+        if config.per_hour and clock.hour_count >= math.ceil(config.per_hour * share):
+            waits.append((hour + timedelta(hours=1) - now).total_seconds())
+        if config.per_day and clock.day_count >= math.ceil(config.per_day * share):
+            next_day = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+            waits.append((next_day - now).total_seconds())
+        if priority > PRIORITY_TRANSACTIONAL and clock.next_send_at and clock.next_send_at > now:
+            follow_up = (
+                recipient
+                and recipient == clock.last_recipient
+                and clock.last_sent_at
+                and now >= clock.last_sent_at + timedelta(seconds=self.same_recipient_delay)
+            )
+            if not follow_up:
+                waits.append((clock.next_send_at - now).total_seconds())
+        return max(waits) if waits else 0.0
+
+    # -------------------------------------------------------------------- API
+
+    def reserve(self, priority: int = PRIORITY_TRANSACTIONAL, recipient: str = '', now=None) -> Reservation:
+        """
+        Reserva un turno de envío sin bloquear. Devuelve la instancia elegida
+        o, si ninguna tiene cupo, cuántos segundos esperar.
+        """
+        with transaction.atomic():
+            clocks = self.lock_clocks()
+            now = now or timezone.now()
+            ready = []
+            min_wait = None
+            for config in self.pool:
+                clock = clocks[config.name]
+                self._roll_windows(clock, now)
+                wait = self._ready_in(clock, config, priority, recipient, now)
+                if wait <= 0:
+                    ready.append((clock.penalty_level, clock.hour_count, config.name))
+                else:
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+
+            if not ready:
+                return Reservation(None, min_wait or 0.0)
+
+            name = min(ready)[2]
+            clock, config = clocks[name], self._configs[name]
+            clock.minute_count += 1
+            clock.hour_count += 1
+            clock.day_count += 1
+            clock.last_sent_at = now
+            clock.last_recipient = recipient or ''
+            if priority > PRIORITY_TRANSACTIONAL:
+                spacing = config.interval * (2 ** clock.penalty_level) * random.uniform(0.8, 1.2)
+                clock.next_send_at = now + timedelta(seconds=spacing)
+            clock.save()
+            return Reservation(name)
+
+    def acquire(
+        self,
+        priority: int = PRIORITY_TRANSACTIONAL,
+        recipient: str = '',
+        timeout: Optional[float] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> Optional[str]:
+        """Espera (hasta `timeout`) un turno de envío. Devuelve la instancia o None."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            reservation = self.reserve(priority, recipient)
+            if reservation.instance:
+                return reservation.instance
+            if should_stop and should_stop():
+                return None
+            pause = min(reservation.wait_seconds or 1.0, 2.0)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                pause = min(pause, remaining)
+            sleep(max(0.05, pause))
+
+    def report(self, instance: Optional[str], status_code: Optional[int], now=None):
+        """Ajusta la penalización de la instancia según la respuesta de Evolution API."""
+        if not instance or instance not in self._configs:
+            return
+        with transaction.atomic():
+            clock = self.lock_clocks([instance])[instance]
+            now = now or timezone.now()
+            if is_throttle_signal(status_code):
+                clock.penalty_level = min(clock.penalty_level + 1, MAX_PENALTY_LEVEL)
+                base = float(_setting('WHATSAPP_BACKOFF_BASE_SEC', 30))
+                cap = float(_setting('WHATSAPP_BACKOFF_MAX_SEC', 900))
+                cooldown = min(cap, base * (2 ** (clock.penalty_level - 1)))
+                clock.cooldown_until = now + timedelta(seconds=cooldown)
+                logger.warning(
+                    'Evolution %s respondió %s; enfriamiento %.0fs (nivel %s)',
+                    instance, status_code, cooldown, clock.penalty_level,
+                )
+            elif status_code in (200, 201) and clock.penalty_level:
+                clock.penalty_level -= 1
+            else:
+                return
+            clock.save(update_fields=['penalty_level', 'cooldown_until', 'updated_at'])
+
+
+def acquire_for_send(priority: int, recipient: str = '', only_instance: Optional[str] = None) -> Optional[str]:
+    """
+    Turno para un envío directo (fuera de la cola). Lo transaccional no
+    espera (corre dentro del request web): toma turno si hay cupo y si no
+    sale de inmediato por la instancia principal para no perder el mensaje.
+    El resto espera hasta WHATSAPP_ACQUIRE_TIMEOUT_SEC.
+    `only_instance` limita el turno a una instancia (ej. grupos).
+    """
+    pool = instance_pool()
+    if only_instance:
+        pool = [config for config in pool if config.name == only_instance] or pool[:1]
+    scheduler = PacingScheduler(pool)
+    if priority <= PRIORITY_TRANSACTIONAL:
+        instance = scheduler.reserve(priority, recipient).instance
+        if instance is None:
+            logger.warning('Sin cupo en el pool de Evolution; envío transaccional por la instancia principal')
+            instance = scheduler.pool[0].name
+        return instance
+    return scheduler.acquire(priority, recipient, timeout=float(_setting('WHATSAPP_ACQUIRE_TIMEOUT_SEC', 900)))
+
+
+def report_send(instance: Optional[str], status_code: Optional[int]):
+    try:
+        PacingScheduler().report(instance, status_code)
+    except Exception:
+        logger.exception('No se pudo registrar la respuesta de Evolution para %s', instance)
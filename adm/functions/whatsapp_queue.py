@@ -1,245 +1,355 @@
 """
-Cola asincrona para mensajes de WhatsApp.
-Evita bloqueos por spam enviando mensajes con delays aleatorios.
+Cola persistente para mensajes de WhatsApp.
+
+Los mensajes se guardan en la tabla WhatsAppOutboundMessage y los envía el
+proceso `python manage.py whatsapp_worker`. Así un reinicio de gunicorn no
+pierde mensajes y todos los workers comparten el mismo ritmo de envío:
+
+- Lease/ack: un worker reclama un mensaje por `WHATSAPP_QUEUE_LEASE_SEC`
+  segundos; si muere sin confirmar, otro worker lo vuelve a tomar al vencer
+  el lease.
+- Ritmo global: cada reclamo reserva turno en el PacingScheduler
+  (adm/functions/whatsapp_pacing.py), que reparte los envíos entre las
+  instancias de Evolution según presupuesto y prioridad.
+- Dedupe: el mismo texto al mismo número no se encola dos veces mientras
+  esté pendiente o dentro de `WHATSAPP_QUEUE_DEDUPE_WINDOW_SEC`.
+- Reintentos: errores de red/429/5xx se reintentan con backoff exponencial
+  hasta `WHATSAPP_QUEUE_MAX_ATTEMPTS`.
 """
 
+import hashlib
 import logging
-import queue
+import os
 import random
-import threading
-import time
+import socket
 import uuid
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import timedelta
 from typing import Dict, Optional
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
 from adm.functions.whatsapp_delivery_log import append_whatsapp_delivery_log
+from adm.functions.whatsapp_pacing import PRIORITY_TRANSACTIONAL, PacingScheduler
+from adm.models import WhatsAppOutboundMessage
 
 
 logger = logging.getLogger(__name__)
 
+CLAIM_SCAN_LIMIT = 50
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def dedupe_key_for(full_phone: str, message: str) -> str:
+    raw = f"{full_phone}|{(message or '').strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff exponencial con jitter para el intento número `attempts`."""
+    base = float(_setting("WHATSAPP_QUEUE_RETRY_BASE_SEC", 60))
+    cap = float(_setting("WHATSAPP_QUEUE_RETRY_MAX_SEC", 3600))
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def is_retryable(status_code: Optional[int]) -> bool:
+    if status_code is None:
+        return True
+    return status_code in (408, 429) or status_code >= 500
+
 
 @dataclass
-class WhatsAppMessage:
-    message: str
-    lada: str
-    phone_number: str
-    event_id: str
-    metadata: Dict
+class ClaimResult:
+    message: Optional[WhatsAppOutboundMessage]
+    wait_seconds: float = 0.0
 
 
 class WhatsAppQueue:
     """
-    Cola asincrona para enviar mensajes de WhatsApp.
+    Cola de WhatsApp respaldada por base de datos.
 
-    - Envia mensajes en un hilo separado.
-    - Aplica delay entre mensajes para evitar bloqueos por spam.
-    - Persiste logs de cola/envio/error para diagnostico web.
+    - `enqueue` inserta el mensaje (o lo descarta si es duplicado).
+    - `claim` reserva el siguiente mensaje y el turno en el reloj global.
+    - `ack`/`nack` confirman el envío o programan el reintento.
+    - `process_next` hace un ciclo completo; lo usa el comando whatsapp_worker.
     """
 
-    _instance: Optional["WhatsAppQueue"] = None
-    _lock = threading.Lock()
-
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-                    cls._instance._initialized = False
-        return cls._instance
-
-    def __init__(self):
-        if self._initialized:
-            return
-
-        self._queue: queue.Queue[WhatsAppMessage] = queue.Queue()
-        self._worker_thread: Optional[threading.Thread] = None
-        self._stop_event = threading.Event()
-        self._min_delay = 180
-        self._max_delay = 300
-        self._same_recipient_delay = 3
-        self._last_send_time: Optional[datetime] = None
-        self._last_recipient: Optional[str] = None
-        self._send_lock = threading.Lock()
-        self._initialized = True
-        logger.info("WhatsAppQueue inicializada")
-
-    def _wait_for_rate_limit(self, current_recipient: str):
-        with self._send_lock:
-            if self._last_send_time is None:
-                return
-
-            elapsed = (datetime.now() - self._last_send_time).total_seconds()
-            if self._last_recipient and self._last_recipient == current_recipient:
-                required_delay = float(self._same_recipient_delay)
-            else:
-                required_delay = random.uniform(self._min_delay, self._max_delay)
-
-            if elapsed >= required_delay:
-                return
-
-            wait_time = required_delay - elapsed
-            logger.info(
-                "Rate limit WhatsApp: esperando %.1fs mas (elapsed %.1fs, required %.1fs)",
-                wait_time,
-                elapsed,
-                required_delay,
-            )
-            waited = 0
-            while waited < wait_time and not self._stop_event.is_set():
-                time.sleep(0.5)
-                waited += 0.5
-
-    def _update_last_send_time(self, recipient: str):
-        with self._send_lock:
-            self._last_send_time = datetime.now()
-            self._last_recipient = recipient
-
-    def _worker(self):
-        from adm.functions.send_whatsapp_notification import Notification
+    # ----------------------------------------------------------------- config
 
-        logger.info("WhatsApp Queue Worker iniciado")
-        messages_sent = 0
+    @property
+    def lease_seconds(self) -> int:
+        return int(_setting("WHATSAPP_QUEUE_LEASE_SEC", 120))
 
-        while not self._stop_event.is_set() or not self._queue.empty():
-            try:
-                try:
-                    msg = self._queue.get(timeout=1)
-                except queue.Empty:
-                    continue
+    # ---------------------------------------------------------------- enqueue
 
-                current_recipient = Notification.format_whatsapp_number(msg.lada, msg.phone_number)
-                if messages_sent > 0:
-                    self._wait_for_rate_limit(current_recipient)
-
-                try:
-                    append_whatsapp_delivery_log({
-                        "event_id": msg.event_id,
-                        "event": "sending",
-                        "level": "info",
-                        "message": "Intentando enviar WhatsApp por Evolution API.",
-                        "lada": msg.lada,
-                        "phone_number": msg.phone_number,
-                        "full_phone": current_recipient,
-                        "queue_remaining": self._queue.qsize(),
-                        "metadata": msg.metadata,
-                    })
-                    result = Notification.send_whatsapp_notification_details(
-                        msg.message,
-                        msg.lada,
-                        msg.phone_number,
-                    )
-                    self._update_last_send_time(current_recipient)
-
-                    if result.get("success"):
-                        messages_sent += 1
-                        append_whatsapp_delivery_log({
-                            "event_id": msg.event_id,
-                            "event": "sent",
-                            "level": "success",
-                            "message": "Evolution API acepto el WhatsApp.",
-                            "lada": msg.lada,
-                            "phone_number": msg.phone_number,
-                            "full_phone": result.get("full_phone") or current_recipient,
-                            "status_code": result.get("status_code"),
-                            "response_body": result.get("response_body"),
-                            "metadata": msg.metadata,
-                        })
-                        logger.info("WhatsApp enviado exitosamente a %s", current_recipient)
-                    else:
-                        detail = result.get("detail") or result.get("error") or "Error desconocido enviando WhatsApp."
-                        append_whatsapp_delivery_log({
-                            "event_id": msg.event_id,
-                            "event": "failed",
-                            "level": "error",
-                            "message": "No se pudo enviar el WhatsApp.",
-                            "lada": msg.lada,
-                            "phone_number": msg.phone_number,
-                            "full_phone": result.get("full_phone") or current_recipient,
-                            "status_code": result.get("status_code"),
-                            "error": result.get("error"),
-                            "detail": detail,
-                            "response_body": result.get("response_body"),
-                            "metadata": msg.metadata,
-                        })
-                        logger.error("Error enviando WhatsApp a %s: %s", current_recipient, detail)
-                except Exception as exc:
-                    self._update_last_send_time(current_recipient)
-                    append_whatsapp_delivery_log({
-                        "event_id": msg.event_id,
-                        "event": "failed",
-                        "level": "error",
-                        "message": "Excepcion no controlada en el worker de WhatsApp.",
-                        "lada": msg.lada,
-                        "phone_number": msg.phone_number,
-                        "full_phone": current_recipient,
-                        "error": type(exc).__name__,
-                        "detail": str(exc),
-                        "metadata": msg.metadata,
-                    })
-                    logger.exception("Error en WhatsApp Queue Worker para %s", current_recipient)
-                finally:
-                    self._queue.task_done()
-            except Exception as exc:
-                logger.exception("Error general en WhatsApp Queue Worker: %s", exc)
-
-        logger.info("WhatsApp Queue Worker terminado (total enviados: %s)", messages_sent)
-
-    def _ensure_worker_running(self):
-        if self._worker_thread is None or not self._worker_thread.is_alive():
-            self._stop_event.clear()
-            self._worker_thread = threading.Thread(
-                target=self._worker,
-                daemon=True,
-                name="WhatsAppQueueWorker",
-            )
-            self._worker_thread.start()
-
-    def enqueue(self, message: str, lada: str, phone_number: str, metadata: Optional[Dict] = None):
+    def enqueue(
+        self,
+        message: str,
+        lada: str,
+        phone_number: str,
+        metadata: Optional[Dict] = None,
+        priority: int = PRIORITY_TRANSACTIONAL,
+    ) -> str:
         from adm.functions.send_whatsapp_notification import Notification
 
-        event_id = str(uuid.uuid4())
+        lada = str(lada or "").strip()
+        phone_number = str(phone_number or "").strip()
         metadata = dict(metadata or {})
-        msg = WhatsAppMessage(
+        full_phone = Notification.format_whatsapp_number(lada, phone_number)
+        dedupe_key = dedupe_key_for(full_phone, message)
+
+        duplicate = self._find_duplicate(dedupe_key)
+        if duplicate is not None:
+            append_whatsapp_delivery_log({
+                "event_id": duplicate.event_id,
+                "event": "deduplicated",
+                "level": "info",
+                "message": "WhatsApp duplicado: el mismo mensaje ya esta en cola o se envio recientemente.",
+                "lada": lada,
+                "phone_number": phone_number,
+                "full_phone": full_phone,
+                "metadata": metadata,
+            })
+            logger.info("Mensaje duplicado para %s omitido (event_id %s)", full_phone, duplicate.event_id)
+            return duplicate.event_id
+
+        row = WhatsAppOutboundMessage.objects.create(
+            event_id=str(uuid.uuid4()),
             message=message,
-            lada=str(lada or "").strip(),
-            phone_number=str(phone_number or "").strip(),
-            event_id=event_id,
+            lada=lada,
+            phone_number=phone_number,
+            full_phone=full_phone,
+            dedupe_key=dedupe_key,
             metadata=metadata,
+            priority=priority,
+            max_attempts=int(_setting("WHATSAPP_QUEUE_MAX_ATTEMPTS", 5)),
         )
-        self._queue.put(msg)
+        queue_size = self.queue_size()
         append_whatsapp_delivery_log({
-            "event_id": event_id,
+            "event_id": row.event_id,
             "event": "queued",
             "level": "info",
-            "message": "WhatsApp agregado a la cola local; aun no significa que Evolution API lo haya aceptado.",
+            "message": "WhatsApp agregado a la cola; aun no significa que Evolution API lo haya aceptado.",
+            "lada": lada,
+            "phone_number": phone_number,
+            "full_phone": full_phone,
+            "queue_size": queue_size,
+            "metadata": metadata,
+        })
+        logger.info("Mensaje encolado para %s (cola: %s mensajes)", full_phone, queue_size)
+        return row.event_id
+
+    def _find_duplicate(self, dedupe_key: str) -> Optional[WhatsAppOutboundMessage]:
+        window = int(_setting("WHATSAPP_QUEUE_DEDUPE_WINDOW_SEC", 600))
+        recent = timezone.now() - timedelta(seconds=window)
+        return (
+            WhatsAppOutboundMessage.objects.filter(dedupe_key=dedupe_key)
+            .filter(
+                Q(status__in=[WhatsAppOutboundMessage.STATUS_PENDING, WhatsAppOutboundMessage.STATUS_LEASED])
+                | Q(status=WhatsAppOutboundMessage.STATUS_SENT, sent_at__gte=recent)
+            )
+            .only("id", "event_id")
+            .first()
+        )
+
+    # ------------------------------------------------------------------ claim
+
+    def _due_messages(self, now):
+        return WhatsAppOutboundMessage.objects.filter(
+            Q(status=WhatsAppOutboundMessage.STATUS_PENDING, available_at__lte=now)
+            | Q(status=WhatsAppOutboundMessage.STATUS_LEASED, leased_until__lte=now)
+        ).order_by("priority", "available_at", "id")
+
+    def claim(self, worker_id: str, now=None) -> ClaimResult:
+        """
+        Reserva el siguiente mensaje listo (por prioridad) y su turno en el
+        scheduler. Si ninguna instancia tiene cupo devuelve cuántos segundos
+        esperar.
+        """
+        scheduler = PacingScheduler()
+        with transaction.atomic():
+            # Bloquear los relojes primero serializa los reclamos entre workers
+            clocks = scheduler.lock_clocks()
+            recent_recipients = {clock.last_recipient for clock in clocks.values() if clock.last_recipient}
+            now = now or timezone.now()
+            blocked = {}
+            for candidate in self._due_messages(now)[:CLAIM_SCAN_LIMIT]:
+                if candidate.attempts >= candidate.max_attempts:
+                    # Lease vencido sin confirmación en el último intento
+                    self._mark_failed(candidate, candidate.last_status_code, "lease_expired",
+                                      "El worker no confirmo el envio antes de vencer el lease.")
+                    continue
+                if candidate.priority in blocked and candidate.full_phone not in recent_recipients:
+                    # Ya se sabe que esa prioridad no tiene cupo; solo un seguimiento al mismo número podría salir
+                    continue
+
+                reservation = scheduler.reserve(candidate.priority, candidate.full_phone, now=now)
+                if not reservation.instance:
+                    blocked.setdefault(candidate.priority, reservation.wait_seconds)
+                    continue
+
+                if candidate.status == WhatsAppOutboundMessage.STATUS_LEASED:
+                    logger.warning("Lease vencido para %s; se reintenta el envío", candidate.event_id)
+                candidate.status = WhatsAppOutboundMessage.STATUS_LEASED
+                candidate.instance = reservation.instance
+                candidate.lease_owner = worker_id
+                candidate.leased_until = now + timedelta(seconds=self.lease_seconds)
+                candidate.attempts += 1
+                candidate.save(update_fields=[
+                    "status", "instance", "lease_owner", "leased_until", "attempts", "updated_at",
+                ])
+                return ClaimResult(candidate)
+
+            return ClaimResult(None, min(blocked.values()) if blocked else 0.0)
+
+    # -------------------------------------------------------------- ack/nack
+
+    def _owned(self, msg: WhatsAppOutboundMessage):
+        return WhatsAppOutboundMessage.objects.filter(
+            pk=msg.pk,
+            status=WhatsAppOutboundMessage.STATUS_LEASED,
+            lease_owner=msg.lease_owner,
+        )
+
+    def ack(self, msg: WhatsAppOutboundMessage, result: Dict) -> bool:
+        updated = self._owned(msg).update(
+            status=WhatsAppOutboundMessage.STATUS_SENT,
+            sent_at=timezone.now(),
+            leased_until=None,
+            last_status_code=result.get("status_code"),
+            last_error="",
+            updated_at=timezone.now(),
+        )
+        append_whatsapp_delivery_log({
+            "event_id": msg.event_id,
+            "event": "sent",
+            "level": "success",
+            "message": "Evolution API acepto el WhatsApp.",
             "lada": msg.lada,
             "phone_number": msg.phone_number,
-            "full_phone": Notification.format_whatsapp_number(msg.lada, msg.phone_number),
-            "queue_size": self._queue.qsize(),
-            "metadata": metadata,
+            "full_phone": result.get("full_phone") or msg.full_phone,
+            "status_code": result.get("status_code"),
+            "response_body": result.get("response_body"),
+            "attempt": msg.attempts,
+            "metadata": msg.metadata,
         })
-        logger.info(
-            "Mensaje encolado para %s (cola: %s mensajes)",
-            Notification.format_whatsapp_number(msg.lada, msg.phone_number),
-            self._queue.qsize(),
+        if not updated:
+            logger.warning("Lease perdido al confirmar %s; otro worker pudo reenviarlo", msg.event_id)
+        return bool(updated)
+
+    def nack(self, msg: WhatsAppOutboundMessage, result: Dict) -> str:
+        """Programa un reintento o marca el mensaje como fallido. Devuelve el nuevo estado."""
+        status_code = result.get("status_code")
+        detail = result.get("detail") or result.get("error") or "Error desconocido enviando WhatsApp."
+        retry = is_retryable(status_code) and msg.attempts < msg.max_attempts
+
+        if retry:
+            delay = retry_delay(msg.attempts)
+            self._owned(msg).update(
+                status=WhatsAppOutboundMessage.STATUS_PENDING,
+                available_at=timezone.now() + timedelta(seconds=delay),
+                leased_until=None,
+                last_status_code=status_code,
+                last_error=str(detail)[:2000],
+                updated_at=timezone.now(),
+            )
+        else:
+            self._mark_failed(msg, status_code, result.get("error"), detail, owned_only=True)
+
+        append_whatsapp_delivery_log({
+            "event_id": msg.event_id,
+            "event": "retry_scheduled" if retry else "failed",
+            "level": "warning" if retry else "error",
+            "message": (
+                "No se pudo enviar el WhatsApp; se reintentara."
+                if retry
+                else "No se pudo enviar el WhatsApp."
+            ),
+            "lada": msg.lada,
+            "phone_number": msg.phone_number,
+            "full_phone": result.get("full_phone") or msg.full_phone,
+            "status_code": status_code,
+            "error": result.get("error"),
+            "detail": detail,
+            "response_body": result.get("response_body"),
+            "attempt": msg.attempts,
+            "metadata": msg.metadata,
+        })
+        logger.error("Error enviando WhatsApp a %s (intento %s): %s", msg.full_phone, msg.attempts, detail)
+        return WhatsAppOutboundMessage.STATUS_PENDING if retry else WhatsAppOutboundMessage.STATUS_FAILED
+
+    def _mark_failed(self, msg, status_code, error, detail, owned_only=False):
+        queryset = self._owned(msg) if owned_only else WhatsAppOutboundMessage.objects.filter(pk=msg.pk)
+        queryset.update(
+            status=WhatsAppOutboundMessage.STATUS_FAILED,
+            leased_until=None,
+            last_status_code=status_code,
+            last_error=str(detail or error or "")[:2000],
+            updated_at=timezone.now(),
         )
-        self._ensure_worker_running()
 
-    def queue_size(self) -> int:
-        return self._queue.qsize()
+    # ---------------------------------------------------------------- worker
+
+    def process_next(self, worker_id: str) -> ClaimResult:
+        """Reclama y envía un mensaje. Devuelve el ClaimResult usado."""
+        from adm.functions.send_whatsapp_notification import Notification
+
+        claim = self.claim(worker_id)
+        msg = claim.message
+        if msg is None:
+            return claim
 
-    def wait_until_empty(self, timeout: Optional[float] = None) -> bool:
+        append_whatsapp_delivery_log({
+            "event_id": msg.event_id,
+            "event": "sending",
+            "level": "info",
+            "message": "Intentando enviar WhatsApp por Evolution API.",
+            "lada": msg.lada,
+            "phone_number": msg.phone_number,
+            "full_phone": msg.full_phone,
+            "queue_remaining": self.queue_size(),
+            "attempt": msg.attempts,
+            "metadata": msg.metadata,
+        })
         try:
-            self._queue.join()
-            return True
-        except Exception:
-            return False
+            result = Notification.send_whatsapp_notification_details(
+                msg.message,
+                msg.lada,
+                msg.phone_number,
+                priority=msg.priority,
+                instance=msg.instance,
+            )
+        except Exception as exc:
+            logger.exception("Error en WhatsApp worker para %s", msg.full_phone)
+            result = {
+                "success": False,
+                "status_code": None,
+                "error": type(exc).__name__,
+                "detail": str(exc),
+            }
+
+        if result.get("success"):
+            self.ack(msg, result)
+            logger.info("WhatsApp enviado exitosamente a %s", msg.full_phone)
+        else:
+            self.nack(msg, result)
+        return claim
 
-    def stop(self):
-        self._stop_event.set()
-        if self._worker_thread and self._worker_thread.is_alive():
-            self._worker_thread.join(timeout=60)
+    def queue_size(self) -> int:
+        return WhatsAppOutboundMessage.objects.filter(
+            status__in=[WhatsAppOutboundMessage.STATUS_PENDING, WhatsAppOutboundMessage.STATUS_LEASED]
+        ).count()
 
 
 _whatsapp_queue: Optional[WhatsAppQueue] = None
@@ -252,5 +362,11 @@ def get_whatsapp_queue() -> WhatsAppQueue:
     return _whatsapp_queue
 
 
-def enqueue_whatsapp(message: str, lada: str, phone_number: str, metadata: Optional[Dict] = None):
-    get_whatsapp_queue().enqueue(message, lada, phone_number, metadata=metadata)
+def enqueue_whatsapp(
+    message: str,
+    lada: str,
+    phone_number: str,
+    metadata: Optional[Dict] = None,
+    priority: int = PRIORITY_TRANSACTIONAL,
+):
+    get_whatsapp_queue().enqueue(message, lada, phone_number, metadata=metadata, priority=priority)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from adm.functions.query_plans import CANONICAL_QUERIES, check_query_plans
+
+
+class Command(BaseCommand):
+    help = 'Corre EXPLAIN sobre las consultas canónicas de Sale/Account y falla si alguna recorre la tabla completa.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Alias de la base de datos')
+        parser.add_argument(
+            '--query',
+            action='append',
+            choices=[query.name for query in CANONICAL_QUERIES],
+            help='Revisar solo esta consulta (se puede repetir)',
+        )
+        parser.add_argument('--verbose-plan', action='store_true', help='Imprime el plan completo de cada consulta')
+
+    def handle(self, *args, **options):
+        results = check_query_plans(using=options['database'], names=options.get('query'))
+        failed = []
+        for result in results:
+            if result.skipped:
+                self.stdout.write(self.style.WARNING(f'[SKIP] {result.name} ({result.source}): no aplica en este motor'))
+                continue
+            if result.error:
+                failed.append(result.name)
+                self.stdout.write(self.style.ERROR(f'[ERROR] {result.name} ({result.source}): {result.error}'))
+                continue
+            if result.full_scan:
+                failed.append(result.name)
+                self.stdout.write(self.style.ERROR(f'[FULL SCAN] {result.name} ({result.source}) en {result.table}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'[OK] {result.name} ({result.source})'))
+            if result.full_scan or options['verbose_plan']:
+                for line in result.plan:
+                    self.stdout.write(f'    {line}')
+
+        if failed:
+            raise CommandError(f"Consultas sin índice: {', '.join(failed)}")
+        checked = len([result for result in results if not result.skipped])
+        self.stdout.write(self.style.SUCCESS(f'{checked} consultas usan índice'))
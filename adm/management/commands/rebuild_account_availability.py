@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from adm.functions.account_availability import rebuild_all, rebuild_service
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de cuentas disponibles (AccountSlot).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--service', type=int, default=None, help='Solo este servicio (id)')
+
+    def handle(self, *args, **options):
+        if options.get('service'):
+            summary = {options['service']: rebuild_service(options['service'])}
+        else:
+            summary = rebuild_all()
+        total = sum(summary.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Índice de disponibilidad reconstruido\n- services: {len(summary)}\n- slots: {total}"
+            )
+        )
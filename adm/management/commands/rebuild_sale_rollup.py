@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from adm.functions.sales_rollup import rebuild_range
+from adm.models import Sale
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el resumen diario de ventas (SaleDailyRollup) para un rango de fechas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=str, help='YYYY-MM-DD (inclusive)')
+        parser.add_argument('--date-to', type=str, help='YYYY-MM-DD (inclusive, por defecto hoy)')
+        parser.add_argument('--days', type=int, default=None, help='Últimos N días hasta --date-to')
+        parser.add_argument('--all', action='store_true', help='Desde la primera venta registrada')
+
+    def _parse_date(self, value, name):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise CommandError(f'{name} debe tener formato YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        date_to = self._parse_date(options['date_to'], '--date-to') if options.get('date_to') else today
+
+        if options.get('all'):
+            first_sale = Sale.objects.aggregate(first=Min('created_at'))['first']
+            if not first_sale:
+                self.stdout.write(self.style.WARNING('No hay ventas registradas.'))
+                return
+            date_from = timezone.localtime(first_sale).date()
+        elif options.get('date_from'):
+            date_from = self._parse_date(options['date_from'], '--date-from')
+        else:
+            days = options.get('days') or 30
+            date_from = date_to - timedelta(days=days - 1)
+
+        self.stdout.write(f'[sale_rollup] Reconstruyendo {date_from} -> {date_to}')
+        summary = rebuild_range(date_from, date_to)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Resumen reconstruido\n- days: {summary['days']}\n- rows: {summary['rows']}"
+            )
+        )
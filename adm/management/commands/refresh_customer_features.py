@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from adm.functions.customer_features import dirty_customer_ids, rebuild_all, refresh_customers
+
+
+class Command(BaseCommand):
+    help = 'Refresca CustomerFeatures solo para clientes con ventas nuevas o cambiadas (--full recalcula todos).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recalcula todos los clientes con ventas')
+
+    def handle(self, *args, **options):
+        if options.get('full'):
+            refreshed = rebuild_all()
+            mode = 'full'
+        else:
+            refreshed = refresh_customers(dirty_customer_ids())
+            mode = 'incremental'
+        self.stdout.write(
+            self.style.SUCCESS(f"CustomerFeatures actualizado\n- mode: {mode}\n- customers: {refreshed}")
+        )
@@ -0,0 +1,62 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adm.functions.background_tasks import default_worker_id, get_task_manager
+
+
+CLEANUP_EVERY_SEC = 3600
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta las tareas en segundo plano persistidas (BACKGROUND_TASKS_MODE=runner) y retoma las abandonadas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Ejecuta a lo más una tarea y termina')
+        parser.add_argument('--idle-sleep', type=float, default=3.0, help='Segundos de espera sin tareas pendientes')
+        parser.add_argument('--worker-id', type=str, default='', help='Identificador del runner (por defecto host:pid)')
+        parser.add_argument('--keep-hours', type=int, default=168, help='Horas que se conservan las tareas terminadas')
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        manager = get_task_manager()
+        worker_id = options.get('worker_id') or default_worker_id()
+        idle_sleep = max(0.1, options.get('idle_sleep') or 3.0)
+        keep_hours = max(1, options.get('keep_hours') or 168)
+        processed = 0
+        last_cleanup = 0.0
+
+        self.stdout.write(f'[run_background_tasks] iniciado worker_id={worker_id}')
+        while not self._stopping:
+            close_old_connections()
+            if time.monotonic() - last_cleanup >= CLEANUP_EVERY_SEC:
+                manager.cleanup_old_tasks(max_age_hours=keep_hours)
+                last_cleanup = time.monotonic()
+
+            record = manager.claim_next(worker_id)
+            if record is not None:
+                processed += 1
+                self.stdout.write(f'[run_background_tasks] {record.task_type} {record.task_id} (intento {record.attempts})')
+                # Un SIGTERM a media tarea deja que termine; si el proceso muere, otro runner la retoma al vencer el lease
+                manager.run_claimed(record, worker_id)
+                if options.get('once'):
+                    break
+                continue
+            if options.get('once'):
+                break
+            self._sleep(idle_sleep)
+
+        self.stdout.write(self.style.SUCCESS(f'[run_background_tasks] terminado (ejecutadas: {processed})'))
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self._stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.5, deadline - time.monotonic())))
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from adm.functions.receivable_notifications import (
+    BUCKET_ORDER,
+    DAILY_BUCKETS,
+    ReceivableNotificationEngine,
+    working_window,
+)
+
+
+class Command(BaseCommand):
+    help = 'Envia WhatsApp de cobranza (vence hoy, mañana, en 5 dias y vencidas) en un solo ciclo agrupado por cliente.'
+
+    # Los comandos por bucket heredan de este y fijan su bucket
+    fixed_buckets = None
+    label = 'receivable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--date', type=str)
+        parser.add_argument('--ignore-schedule', action='store_true')
+        if self.fixed_buckets is None:
+            parser.add_argument(
+                '--bucket',
+                action='append',
+                choices=BUCKET_ORDER + ['all'],
+                help='Bucket a enviar (repetible). Por defecto: ' + ', '.join(DAILY_BUCKETS),
+            )
+
+    def _buckets(self, options):
+        if self.fixed_buckets is not None:
+            return list(self.fixed_buckets)
+        selected = options.get('bucket') or DAILY_BUCKETS
+        return list(BUCKET_ORDER) if 'all' in selected else selected
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        target_date = options.get('date')
+        ignore_schedule = options.get('ignore_schedule', False)
+        buckets = self._buckets(options)
+
+        now = timezone.localtime()
+        base_day = now.date() if target_date is None else datetime.strptime(target_date, '%Y-%m-%d').date()
+        work_start, work_end = working_window(base_day)
+        self.stdout.write(
+            f'[{self.label}] now={now} start={work_start} end={work_end} buckets={",".join(buckets)} dry_run={dry_run}'
+        )
+
+        # Sin dormir hasta el horario: el scheduler vuelve a ejecutar el comando cada pocos minutos
+        if not ignore_schedule and not (work_start <= now <= work_end):
+            self.stdout.write(f'[{self.label}] Fuera de horario, sin ejecucion')
+            return
+
+        engine = ReceivableNotificationEngine(
+            base_day,
+            buckets,
+            dry_run=dry_run,
+            work_end=None if ignore_schedule else work_end,
+            log=self.stdout.write,
+        )
+        summary = engine.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"[{self.label}] Candidatos={summary['candidates']} mensajes={summary['messages']} "
+            f"enviados={summary['sent']} fallidos={summary['failed']} omitidos={summary['skipped']}"
+        ))
@@ -4,6 +4,7 @@ Comando Django para sincronizar Google Sheets.
 Uso:
     python manage.py sync_google_sheets
     python manage.py sync_google_sheets --verbose
+    python manage.py sync_google_sheets --full
 """
 
 from django.core.management.base import BaseCommand
@@ -19,6 +20,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Muestra información detallada',
         )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Procesa todas las filas aunque no hayan cambiado desde la última corrida',
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(
@@ -26,7 +32,7 @@ class Command(BaseCommand):
         )
         
         try:
-            summary = sync_google_sheets()
+            summary = sync_google_sheets(full=options['full'])
             
             # Mostrar resumen
             self.stdout.write(
@@ -1,19 +1,56 @@
 from django.core.management.base import BaseCommand
 
-from adm.functions.sync_pyc_sheets import sync_pyc_sheets
+from adm.functions.sheet_fingerprints import SheetFingerprintStore
+from adm.functions.sync_pyc_sheets import FINGERPRINT_SOURCE, PycSheetSyncService, sync_pyc_sheets
 
 
 class Command(BaseCommand):
     help = "Sincroniza cuentas PYC desde Google Sheets hacia base de datos"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Calcula el diff y lo muestra sin modificar la DB.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=50,
+            help="Máximo de cuentas a listar en el diff (0 = todas).",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Evalúa todas las cuentas aunque sus filas no hayan cambiado.",
+        )
+        parser.add_argument(
+            "--reset-fingerprints",
+            action="store_true",
+            help="Olvida los hashes guardados antes de sincronizar (implica --full).",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS("Iniciando sync PYC desde Google Sheets..."))
-        summary = sync_pyc_sheets()
+        full = bool(options.get("full"))
+        if options.get("reset_fingerprints"):
+            SheetFingerprintStore(FINGERPRINT_SOURCE, PycSheetSyncService().sheet_id).reset()
+            full = True
+        if options.get("dry_run"):
+            self._print_diff(sync_pyc_sheets(dry_run=True, full=full), max(0, int(options.get("limit") or 0)))
+            return
+        summary = sync_pyc_sheets(full=full)
+        if summary.get("unchanged"):
+            self.stdout.write(self.style.SUCCESS("Sheet PYC sin cambios desde la última corrida."))
+            return
         self.stdout.write(
             self.style.SUCCESS(
                 (
                     "Sync PYC completado\n"
                     f"- processed: {summary['processed']}\n"
+                    f"- incremental: {summary.get('incremental', False)}\n"
+                    f"- skipped_tabs: {summary.get('skipped_tabs', 0)}\n"
+                    f"- skipped_unchanged: {summary.get('skipped_unchanged', 0)}\n"
                     f"- updated_password: {summary['updated_password']}\n"
                     f"- updated_external_status: {summary['updated_external_status']}\n"
                     f"- updated_profile: {summary['updated_profile']}\n"
@@ -29,3 +66,31 @@ class Command(BaseCommand):
                 )
             )
         )
+
+    def _print_diff(self, summary, limit):
+        if summary.get("aborted"):
+            self.stdout.write(self.style.ERROR(summary.get("abort_reason", "")))
+            return
+        if summary.get("unchanged"):
+            self.stdout.write(self.style.SUCCESS("Sheet PYC sin cambios desde la última corrida."))
+            return
+        diff = summary.get("diff", {})
+        changes = diff.get("changes", [])
+        for item in changes[:limit] if limit else changes:
+            self.stdout.write(
+                f"[{item['action'].upper()}] account_id={item['account_id']} email={item['email']} "
+                f"service={item['service']} tab={item['tab']} match={item['match']}"
+            )
+            for name, values in item["changes"].items():
+                self.stdout.write(f"  - {name}: {values['old']} -> {values['new']}")
+            if item["replace_customer_account"]:
+                self.stdout.write("  - tiene customer -> intentaría reemplazo automático")
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS("Diff sync PYC (dry-run)"))
+        self.stdout.write(f"- processed: {summary['processed']}")
+        self.stdout.write(f"- accounts_with_changes: {diff.get('accounts_with_changes', 0)}")
+        for name, count in sorted(diff.get("counts", {}).items()):
+            self.stdout.write(f"- {name}: {count}")
+        self.stdout.write(f"- skipped_delete_by_service_guard: {summary['skipped_delete_by_service_guard']}")
+        self.stdout.write(f"- warnings: {len(summary['warnings'])}")
+        self.stdout.write(f"- errors: {len(summary['errors'])}")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from adm.functions.whatsapp_delivery_log import (
+    list_segment_days,
+    prune_whatsapp_delivery_log,
+    rebuild_index,
+    split_legacy_whatsapp_delivery_log,
+)
+
+
+class Command(BaseCommand):
+    help = 'Mantenimiento del histórico de WhatsApp: migra el archivo único, aplica retención y regenera índices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--split-legacy', action='store_true', help='Reparte whatsapp_delivery_history.jsonl en segmentos diarios')
+        parser.add_argument('--prune', action='store_true', help='Aplica la retención configurada')
+        parser.add_argument('--rebuild-index', action='store_true', help='Regenera los índices .idx de todos los segmentos')
+
+    def handle(self, *args, **options):
+        if not any(options.get(key) for key in ('split_legacy', 'prune', 'rebuild_index')):
+            self.stdout.write(self.style.WARNING('Nada que hacer: usa --split-legacy, --prune o --rebuild-index'))
+            return
+
+        if options.get('split_legacy'):
+            summary = split_legacy_whatsapp_delivery_log()
+            self.stdout.write(f"[whatsapp_log] Migradas {summary['lines']} líneas en {summary['days']} segmentos")
+
+        if options.get('rebuild_index'):
+            days = list_segment_days()
+            for day in days:
+                rebuild_index(day)
+            self.stdout.write(f'[whatsapp_log] Índices regenerados: {len(days)}')
+
+        if options.get('prune'):
+            removed = prune_whatsapp_delivery_log()
+            self.stdout.write(f'[whatsapp_log] Segmentos eliminados: {len(removed)}')
+
+        self.stdout.write(self.style.SUCCESS('Mantenimiento terminado'))
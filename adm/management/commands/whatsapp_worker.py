@@ -0,0 +1,54 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adm.functions.whatsapp_queue import default_worker_id, get_whatsapp_queue
+
+
+class Command(BaseCommand):
+    help = 'Consume la cola persistente de WhatsApp respetando el ritmo global de envío.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Procesa a lo más un mensaje y termina')
+        parser.add_argument('--max-messages', type=int, default=0, help='Termina tras N mensajes (0 = sin límite)')
+        parser.add_argument('--idle-sleep', type=float, default=5.0, help='Segundos de espera con la cola vacía')
+        parser.add_argument('--worker-id', type=str, default='', help='Identificador del worker (por defecto host:pid)')
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        queue = get_whatsapp_queue()
+        worker_id = options.get('worker_id') or default_worker_id()
+        max_messages = options.get('max_messages') or 0
+        idle_sleep = max(0.1, options.get('idle_sleep') or 5.0)
+        processed = 0
+
+        self.stdout.write(f'[whatsapp_worker] iniciado worker_id={worker_id}')
+        while not self._stopping:
+            close_old_connections()
+            claim = queue.process_next(worker_id)
+            if claim.message is not None:
+                processed += 1
+                self.stdout.write(f'[whatsapp_worker] {claim.message.event_id} -> {claim.message.full_phone}')
+                if options.get('once') or (max_messages and processed >= max_messages):
+                    break
+                continue
+            if options.get('once'):
+                break
+            wait = claim.wait_seconds if claim.wait_seconds > 0 else idle_sleep
+            self._sleep(min(wait, 60))
+
+        self.stdout.write(self.style.SUCCESS(f'[whatsapp_worker] terminado (procesados: {processed})'))
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _sleep(self, seconds):
+        # Dormir en pasos cortos para atender SIGTERM sin esperar el intervalo completo
+        deadline = time.monotonic() + seconds
+        while not self._stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.5, deadline - time.monotonic())))
@@ -1,7 +1,25 @@
 from django.utils.deprecation import MiddlewareMixin
+from adm.functions import request_cache
 from adm.models import PageVisit
 
 
+class RequestCacheMiddleware:
+    """
+    Abre la caché por request de adm.functions.request_cache (negocio,
+    créditos, contexto de afiliado) y la descarta al terminar la respuesta
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = request_cache.begin()
+        try:
+            return self.get_response(request)
+        finally:
+            request_cache.end(token)
+
+
 class PageVisitMiddleware(MiddlewareMixin):
     """
     Middleware para rastrear visitas de páginas automáticamente
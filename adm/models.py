@@ -233,6 +233,14 @@ class Account(models.Model):
         max_length=50, default='Disponible', 
         choices=[('Disponible', 'Disponible'), ('No Disponible', 'No Disponible'), ('Suspendida', 'Suspendida')])
 
+    class Meta:
+        indexes = [
+            # Lista del admin (AccountsView): paginación por cursor
+            models.Index(fields=['business', 'status', 'customer', '-created_at', 'profile'], name='account_list_idx'),
+            # Cuentas libres por servicio (find_best_account, SalesSearchView)
+            models.Index(fields=['account_name', 'status', 'customer', 'external_status'], name='account_available_idx'),
+        ]
+
     def __str__(self):
         return self.account_name.description + "," + self.email
 
@@ -256,10 +264,123 @@ class Sale(models.Model):
     comment = models.CharField(max_length=255, blank=True, null=True)
     old_acc = models.IntegerField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Cuentas por cobrar (ReceivableView): paginación por cursor
+            models.Index(fields=['status', '-expiration_date', 'account'], name='sale_receivable_idx'),
+            # Ventas activas del cliente (get_active_sales_by_user_api, customer_sales_active)
+            models.Index(fields=['customer', 'status'], name='sale_customer_status_idx'),
+            # Ventas por fecha con su cuenta (Dashboard, CRM)
+            models.Index(fields=['created_at', 'account'], name='sale_created_account_idx'),
+        ]
+
     def __str__(self):
         return self.customer.userdetail.phone_number
 
 
+class SaleDailyRollup(models.Model):
+    """
+    Resumen diario de ventas por día × servicio × país × método de pago × vendedor.
+    Se mantiene desde los guardados de Sale (ver adm.functions.sales_rollup)
+    y se reconstruye con `manage.py rebuild_sale_rollup`.
+    """
+    day = models.DateField()
+    service = models.ForeignKey(
+        Service, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='daily_rollups')
+    country = models.CharField(max_length=40, blank=True, default='')
+    payment_method = models.ForeignKey(
+        PaymentMethod, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='daily_rollups')
+    seller = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='sale_daily_rollups')
+    sales_count = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+    new_customer_sales = models.IntegerField(default=0)
+    new_customer_revenue = models.BigIntegerField(default=0)
+    returning_sales = models.IntegerField(default=0)
+    returning_revenue = models.BigIntegerField(default=0)
+    # MySQL no considera iguales dos NULL en un índice único: la llave usa
+    # los ids con 0 en lugar de NULL (ver fill_keys)
+    service_key = models.PositiveIntegerField(default=0, editable=False)
+    payment_method_key = models.PositiveIntegerField(default=0, editable=False)
+    seller_key = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Resumen Diario de Ventas"
+        verbose_name_plural = "Resúmenes Diarios de Ventas"
+        unique_together = ['day', 'service_key', 'country', 'payment_method_key', 'seller_key']
+        indexes = [
+            models.Index(fields=['day']),
+            models.Index(fields=['service', 'day']),
+            models.Index(fields=['payment_method', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} | {self.service_id} | {self.country} | {self.sales_count} ventas"
+
+    def fill_keys(self):
+        self.service_key = self.service_id or 0
+        self.payment_method_key = self.payment_method_id or 0
+        self.seller_key = self.seller_id or 0
+
+    def save(self, *args, **kwargs):
+        self.fill_keys()
+        super().save(*args, **kwargs)
+
+
+class SaleRollupDay(models.Model):
+    """
+    Candado por día de SaleDailyRollup: se bloquea con select_for_update antes
+    de reconstruir o ajustar las filas de ese día, así dos workers no
+    escriben el mismo día con fotos distintas de las ventas.
+    """
+    day = models.DateField(unique=True)
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Día del Resumen de Ventas"
+        verbose_name_plural = "Días del Resumen de Ventas"
+
+    def __str__(self):
+        return f"{self.day}"
+
+
+class CustomerFeatures(models.Model):
+    """
+    Resumen de compras por cliente (primera/última compra, órdenes, ingreso,
+    servicios). Lo leen el CRM y marketing en vez de agregar todo el historial
+    de Sale; se refresca por cliente con `manage.py refresh_customer_features`
+    (ver adm.functions.customer_features).
+    """
+    customer = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='purchase_features')
+    first_purchase = models.DateTimeField(null=True, blank=True)
+    last_purchase = models.DateTimeField(null=True, blank=True)
+    total_orders = models.IntegerField(default=0)
+    total_revenue = models.BigIntegerField(default=0)
+    last_service = models.ForeignKey(
+        Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # {"<service_id>": {"orders": n, "last": iso, "active_until": iso|null}}
+    services = models.JSONField(default=dict, blank=True)
+    # Vencimientos (iso, ordenados) de ventas activas al momento del refresco
+    active_expirations = models.JSONField(default=list, blank=True)
+    last_sale_id = models.BigIntegerField(default=0)
+    stale = models.BooleanField(default=False)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Características de Cliente"
+        verbose_name_plural = "Características de Clientes"
+        indexes = [
+            models.Index(fields=['last_purchase'], name='customer_features_last_idx'),
+            models.Index(fields=['first_purchase'], name='customer_features_first_idx'),
+            models.Index(fields=['stale'], name='customer_features_stale_idx'),
+            models.Index(fields=['last_sale_id'], name='customer_features_sale_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.total_orders} órdenes"
+
+
 class Credits(models.Model):
     customer = models.ForeignKey(User, on_delete=models.CASCADE)
     shop = models.ForeignKey(
@@ -1312,3 +1433,334 @@ class MarketingUserTag(models.Model):
 
     def __str__(self):
         return f"{self.user.username}: {self.label}"
+
+
+class WhatsAppOutboundMessage(models.Model):
+    """Mensaje de WhatsApp en la cola persistente (ver adm/functions/whatsapp_queue.py)."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_LEASED = 'leased'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En cola'),
+        (STATUS_LEASED, 'Enviando'),
+        (STATUS_SENT, 'Enviado'),
+        (STATUS_FAILED, 'Fallido'),
+    ]
+
+    PRIORITY_TRANSACTIONAL = 0
+    PRIORITY_RECEIVABLE = 10
+    PRIORITY_MARKETING = 20
+
+    PRIORITY_CHOICES = [
+        (PRIORITY_TRANSACTIONAL, 'Transaccional'),
+        (PRIORITY_RECEIVABLE, 'Cobranza'),
+        (PRIORITY_MARKETING, 'Marketing'),
+    ]
+
+    event_id = models.CharField(max_length=36, unique=True)
+    message = models.TextField()
+    lada = models.CharField(max_length=10, blank=True, default='')
+    phone_number = models.CharField(max_length=30, blank=True, default='')
+    full_phone = models.CharField(max_length=30, db_index=True)
+    dedupe_key = models.CharField(max_length=64)
+    metadata = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_TRANSACTIONAL)
+    instance = models.CharField(max_length=60, blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)
+    lease_owner = models.CharField(max_length=120, blank=True, default='')
+    leased_until = models.DateTimeField(null=True, blank=True)
+    last_status_code = models.IntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Mensaje WhatsApp en cola"
+        verbose_name_plural = "Mensajes WhatsApp en cola"
+        ordering = ['priority', 'available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'available_at']),
+            models.Index(fields=['status', 'leased_until']),
+            models.Index(fields=['dedupe_key', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.full_phone} ({self.status})"
+
+
+class WhatsAppSendClock(models.Model):
+    """
+    Reloj global de envío: una fila por instancia de Evolution API con sus
+    contadores de presupuesto y penalización. Se bloquea con
+    select_for_update al reservar turno (ver adm/functions/whatsapp_pacing.py),
+    así todos los workers respetan el mismo ritmo.
+    """
+
+    name = models.CharField(max_length=60, unique=True)
+    last_sent_at = models.DateTimeField(null=True, blank=True)
+    last_recipient = models.CharField(max_length=30, blank=True, default='')
+    next_send_at = models.DateTimeField(null=True, blank=True)
+    minute_window = models.DateTimeField(null=True, blank=True)
+    minute_count = models.PositiveIntegerField(default=0)
+    hour_window = models.DateTimeField(null=True, blank=True)
+    hour_count = models.PositiveIntegerField(default=0)
+    day_window = models.DateField(null=True, blank=True)
+    day_count = models.PositiveIntegerField(default=0)
+    penalty_level = models.PositiveSmallIntegerField(default=0)
+    cooldown_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ReceivableJob(models.Model):
+    """
+    Estado de un envío masivo de cobranza (ver adm/functions/receivable_bulk_jobs.py).
+    Los totales se mantienen con UPDATE atómicos al marcar cada destinatario.
+    """
+
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_STOPPED = 'stopped'
+    STATUS_COMPLETED = 'completed'
+
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'En proceso'),
+        (STATUS_PAUSED, 'En pausa'),
+        (STATUS_STOPPED, 'Detenido'),
+        (STATUS_COMPLETED, 'Completado'),
+    ]
+
+    job_key = models.CharField(max_length=40, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    paused = models.BooleanField(default=False)
+    stop_requested = models.BooleanField(default=False)
+    message = models.CharField(max_length=255, blank=True, default='')
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    pending = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Envío masivo de cobranza"
+        verbose_name_plural = "Envíos masivos de cobranza"
+
+    def __str__(self):
+        return f"{self.job_key} ({self.status})"
+
+
+class ReceivableJobRecipient(models.Model):
+    """Destinatario de un ReceivableJob; se marca una sola vez como sent/failed/skipped."""
+
+    job = models.ForeignKey(ReceivableJob, on_delete=models.CASCADE, related_name='recipients')
+    sale_id = models.IntegerField()
+    customer = models.CharField(max_length=150, blank=True, default='')
+    phone = models.CharField(max_length=40, blank=True, default='')
+    status = models.CharField(max_length=20, default='pending')
+    note = models.CharField(max_length=255, blank=True, default='')
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'sale_id'], name='uniq_receivable_job_recipient_sale'),
+        ]
+
+    def __str__(self):
+        return f"{self.job.job_key}: {self.sale_id} ({self.status})"
+
+
+class ReceivableNotification(models.Model):
+    """
+    Checkpoint de cobranza por venta, bucket y día: reemplaza los registros
+    JSON de enviados. Una fila 'sending' actúa como reclamo entre procesos;
+    'sent' evita reenvíos al reanudar (ver adm/functions/receivable_notifications.py).
+    """
+
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_SENDING, 'Enviando'),
+        (STATUS_SENT, 'Enviado'),
+        (STATUS_FAILED, 'Fallido'),
+    ]
+
+    sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='receivable_notifications')
+    bucket = models.CharField(max_length=20)
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_SENDING)
+    status_code = models.IntegerField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sale', 'bucket', 'day'], name='uniq_receivable_notification_sale_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.sale_id} {self.bucket} {self.day} ({self.status})"
+
+
+class SheetSyncState(models.Model):
+    """
+    Estado de la sincronización incremental de un spreadsheet (ver
+    adm/functions/sheet_fingerprints.py). `revision` cuenta las corridas
+    aplicadas; `remote_revision` es la versión que reporta Drive.
+    """
+
+    source = models.CharField(max_length=20)
+    sheet_id = models.CharField(max_length=120)
+    revision = models.PositiveIntegerField(default=0)
+    remote_revision = models.CharField(max_length=64, blank=True, default='')
+    synced_at = models.DateTimeField(null=True, blank=True)
+    full_synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Estado de sync de sheet"
+        verbose_name_plural = "Estados de sync de sheets"
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'sheet_id'], name='uniq_sheet_sync_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.source}:{self.sheet_id} (rev {self.revision})"
+
+
+class SheetTabFingerprint(models.Model):
+    """Hash del contenido completo de una pestaña; si no cambia, la pestaña se omite."""
+
+    state = models.ForeignKey(SheetSyncState, on_delete=models.CASCADE, related_name='tabs')
+    tab = models.CharField(max_length=120)
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    row_count = models.PositiveIntegerField(default=0)
+    revision = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['state', 'tab'], name='uniq_sheet_tab_fingerprint'),
+        ]
+
+    def __str__(self):
+        return f"{self.tab} ({self.row_count} filas, rev {self.revision})"
+
+
+class SheetRowFingerprint(models.Model):
+    """Hash de email+clave+status+perfil de una fila, con la corrida en que cambió por última vez."""
+
+    state = models.ForeignKey(SheetSyncState, on_delete=models.CASCADE, related_name='rows')
+    tab = models.CharField(max_length=120)
+    row_key = models.CharField(max_length=254)
+    row_hash = models.CharField(max_length=40)
+    revision = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['state', 'tab', 'row_key'], name='uniq_sheet_row_fingerprint'),
+        ]
+
+    def __str__(self):
+        return f"{self.tab}: {self.row_key}"
+
+
+class BackgroundTaskRecord(models.Model):
+    """
+    Tarea en segundo plano persistida (ver adm/functions/background_tasks.py).
+    `active_type` solo tiene valor mientras la tarea está pendiente o en
+    ejecución; su unicidad garantiza una tarea activa por tipo en todos los
+    workers. El worker que la ejecuta renueva `leased_until` con heartbeats.
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En cola'),
+        (STATUS_RUNNING, 'En ejecución'),
+        (STATUS_COMPLETED, 'Completada'),
+        (STATUS_FAILED, 'Fallida'),
+    ]
+
+    task_id = models.CharField(max_length=36, unique=True)
+    task_type = models.CharField(max_length=60)
+    active_type = models.CharField(max_length=60, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    func_path = models.CharField(max_length=255, blank=True, default='')
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    progress = models.CharField(max_length=500, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    lease_owner = models.CharField(max_length=120, blank=True, default='')
+    leased_until = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tarea en segundo plano"
+        verbose_name_plural = "Tareas en segundo plano"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['task_type', 'created_at']),
+            models.Index(fields=['status', 'leased_until']),
+        ]
+
+    def __str__(self):
+        return f"{self.task_type} {self.task_id} ({self.status})"
+
+
+class AccountSlot(models.Model):
+    """
+    Índice de disponibilidad: una fila por cuenta libre (status=True, sin
+    cliente, external_status='Disponible') con su puntaje precalculado
+    (ver adm/functions/account_availability.py). `held_until`/`hold_token`
+    apartan la cuenta para una compra mientras se confirma la venta.
+    """
+
+    account = models.OneToOneField(Account, on_delete=models.CASCADE, primary_key=True, related_name='availability')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='availability_slots')
+    credential_key = models.CharField(max_length=40)
+    cut_score = models.BigIntegerField(default=0)
+    next_cut_at = models.DateTimeField(null=True, blank=True)
+    empty_profiles = models.PositiveIntegerField(default=1)
+    held_until = models.DateTimeField(null=True, blank=True)
+    hold_token = models.CharField(max_length=32, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Cuenta disponible (índice)"
+        verbose_name_plural = "Cuentas disponibles (índice)"
+        indexes = [
+            models.Index(
+                fields=['service', 'held_until', '-cut_score', 'empty_profiles', 'account'],
+                name='account_slot_pick_idx',
+            ),
+            models.Index(fields=['service', 'credential_key'], name='account_slot_group_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.service_id}: {self.account_id} (score {self.cut_score})"
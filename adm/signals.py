@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from adm.functions import request_cache
+from adm.functions.account_availability import schedule_refresh
+from adm.functions.business import invalidate_business
+from adm.functions.customer_features import mark_stale
+from adm.functions.promotion_engine import bump_version
+from adm.functions.sales_rollup import add_sale, sale_local_day, schedule_rebuild, schedule_rebuild_for_customers
+from adm.functions.storefront_cache import bump_catalog_version
+from adm.models import (
+    Account, Affiliate, Business, Credits, IndexCarouselImage, IndexPromoImage, Promocion, Sale, Service,
+    UserDetail,
+)
+from cupon.models import Shop
+
+
+@receiver(post_save, sender=Sale)
+def sale_saved_update_rollup(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    # Una venta nueva se suma; una edición puede mover la venta de fila
+    if created and add_sale(instance):
+        return
+    schedule_rebuild([sale_local_day(instance)])
+
+
+@receiver(post_delete, sender=Sale)
+def sale_deleted_update_rollup(sender, instance, **kwargs):
+    # Si era su primera venta, el día de la nueva primera venta también cambia
+    schedule_rebuild([sale_local_day(instance)], first_sale_of=[instance.customer_id])
+
+
+@receiver(pre_save, sender=UserDetail)
+def userdetail_remember_country(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'country' not in update_fields):
+        instance._rollup_country_changed = False
+        return
+    # Sin UserDetail sus ventas se agrupaban con país vacío
+    previous = None
+    if instance.pk:
+        previous = UserDetail.objects.filter(pk=instance.pk).values_list('country', flat=True).first()
+    instance._rollup_country_changed = (previous or '') != (instance.country or '')
+
+
+@receiver(post_save, sender=UserDetail)
+def userdetail_saved_update_rollup(sender, instance, raw=False, **kwargs):
+    # El país del cliente es una dimensión del resumen en todos sus días
+    if raw or not getattr(instance, '_rollup_country_changed', False):
+        return
+    schedule_rebuild_for_customers([instance.user_id])
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def sale_changed_mark_customer_features(sender, instance, raw=False, created=False, **kwargs):
+    # Las ventas creadas sin señales (update/bulk_create) se detectan por id
+    if raw:
+        return
+    mark_stale([instance.customer_id], create=created)
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def sale_changed_update_availability(sender, instance, raw=False, **kwargs):
+    # El próximo corte de la credencial cambia con sus ventas
+    if raw:
+        return
+    schedule_refresh([instance.account_id])
+
+
+@receiver(post_save, sender=Account)
+def account_saved_update_availability(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_refresh([instance.pk])
+
+
+@receiver(post_delete, sender=Account)
+def account_deleted_update_availability(sender, instance, **kwargs):
+    # Su renglón se borra en cascada; falta recalcular los perfiles del grupo
+    schedule_refresh(credentials=[(instance.account_name_id, instance.email, instance.password)])
+
+
+@receiver(post_save, sender=Promocion)
+@receiver(post_delete, sender=Promocion)
+@receiver(m2m_changed, sender=Promocion.servicios.through)
+def promocion_changed_bump_version(sender, raw=False, action=None, **kwargs):
+    # Invalida la tabla compilada de todos los procesos; se repite al confirmar
+    # para que nadie se quede con una tabla armada antes del commit
+    if raw or (action and not action.startswith('post_')):
+        return
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Promocion)
+@receiver(post_delete, sender=Promocion)
+@receiver(m2m_changed, sender=Promocion.servicios.through)
+@receiver(post_save, sender=IndexCarouselImage)
+@receiver(post_delete, sender=IndexCarouselImage)
+@receiver(post_save, sender=IndexPromoImage)
+@receiver(post_delete, sender=IndexPromoImage)
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def storefront_changed_bump_version(sender, raw=False, action=None, **kwargs):
+    # Fragmentos de la tienda pública (inicio y tiendas) quedan obsoletos
+    if raw or (action and not action.startswith('post_')):
+        return
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+def business_changed_invalidate_cache(sender, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_business()
+    request_cache.forget('business')
+    transaction.on_commit(invalidate_business)
+
+
+@receiver(post_save, sender=Credits)
+@receiver(post_delete, sender=Credits)
+def credits_changed_forget_request_cache(sender, **kwargs):
+    # Una vista que descuenta créditos y luego renderiza debe ver el saldo nuevo
+    request_cache.forget('credits:')
+
+
+@receiver(post_save, sender=Affiliate)
+@receiver(post_delete, sender=Affiliate)
+def affiliate_changed_forget_request_cache(sender, **kwargs):
+    request_cache.forget('affiliate:')
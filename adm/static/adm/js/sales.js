@@ -26,6 +26,14 @@ const changeService = document.getElementById('service');
 window.allAccounts = [];
 let allAccounts = window.allAccounts;
 
+// La búsqueda se filtra y pagina en el servidor (cursor), aquí solo se
+// guarda la página actual y el término buscado
+let searchServices = [];
+let searchCursor = null;
+let searchTerm = '';
+let searchRequest = null;
+let searchTimer = null;
+
 const isMobileView = () => window.matchMedia('(max-width: 767.98px)').matches;
 
 function toggleResultCardSelection(event, checkboxId) {
@@ -131,6 +139,30 @@ const renderSalesSearchResults = (accountsData) => {
 
 window.renderSalesSearchResults = renderSalesSearchResults;
 
+const renderLoadMore = () => {
+  if (!searchCursor) return;
+  const button =
+    '<button type="button" class="btn btn-sm btn-outline-primary" onclick="loadMoreAccounts()">Cargar más</button>';
+  if (isMobileView() && resultsBoxMobile) {
+    resultsBoxMobile.innerHTML += `<div class="mobile-result-card text-center">${button}</div>`;
+  } else if (resultsBox) {
+    resultsBox.innerHTML += `<tr><td colspan="6" class="text-center">${button}</td></tr>`;
+  }
+};
+
+// Respuesta compacta: {services, fields, rows, next}
+const expandSearchRows = (res) =>
+  res.rows.map((row) => {
+    const item = {};
+    res.fields.forEach((field, index) => {
+      item[field] = row[index];
+    });
+    const service = res.services[item.service] || {};
+    item.logo = service.logo;
+    item.acc_name = service.name;
+    return item;
+  });
+
 const renderSalesDetailResults = (detailsData) => {
   if (accdetail) {
     accdetail.innerHTML = '';
@@ -189,80 +221,85 @@ const renderSalesDetailResults = (detailsData) => {
   });
 };
 
-const filterResults = (searchTerm) => {
-  console.log('filterResults called with:', searchTerm);
-  console.log('allAccounts length:', allAccounts.length);
-
-  const filteredAccounts = allAccounts.filter((account) => {
-    const matches = account.email.toLowerCase().includes(searchTerm.toLowerCase());
-    console.log(`Checking ${account.email}: ${matches}`);
-    return matches;
-  });
-
-  console.log('Filtered results:', filteredAccounts.length);
-  renderSalesSearchResults(filteredAccounts);
+const filterResults = (term) => {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(() => {
+    searchTerm = term.trim();
+    if (searchServices.length > 0) {
+      sendSearchData(searchServices);
+    }
+  }, 250);
 };
 
 // Event delegation - configurar una sola vez cuando el documento esté listo
 $(document).ready(function () {
-  console.log('Document ready, setting up search listener');
-
-  // Usar event delegation para que funcione incluso si el elemento se carga después
-  $(document).on('input', '#search-email', function (e) {
-    const searchTerm = $(this).val();
-    console.log('🔍 Search term:', searchTerm);
-    console.log('📊 Total accounts:', allAccounts.length);
-    filterResults(searchTerm);
+  $(document).on('input', '#search-email', function () {
+    filterResults($(this).val());
   });
-
-  console.log('✅ Search listener configured');
 });
 
-const sendSearchData = (data) => {
-  try {
-    $.ajax({
-      type: 'POST',
-      url: '/adm/sales/search',
-      headers: {
-        'X-Requested-With': 'XMLHttpRequest',
-      },
-      data: {
-        csrfmiddlewaretoken: csrf,
-        'data[]': data,
-        page: 1,
-      },
-      success: (res) => {
-        console.log('Response:', res);
-        const responseData = res.data;
-
-        if (Array.isArray(responseData)) {
-          allAccounts = responseData;
-          window.allAccounts = responseData;
-          console.log('Total accounts loaded:', allAccounts.length);
-          renderSalesSearchResults(responseData);
-
-          console.log('✅ Accounts loaded and ready for search');
-          console.log('📧 First account email:', responseData[0]?.email);
-        } else {
-          if (resultsBox) {
-            resultsBox.innerHTML = `<tr><td colspan="6"><b>${responseData}</b></td></tr>`;
-          }
-          if (resultsBoxMobile) {
-            resultsBoxMobile.innerHTML = `<div class="mobile-result-card"><b>${responseData}</b></div>`;
-          }
-          allAccounts = [];
-          accounts.classList.add('not-visible');
-        }
-      },
-      error: (error) => {
-        console.error('Error:', error);
-      },
-    });
-  } catch (error) {
-    console.error(error);
+const renderSearchMessage = (message) => {
+  if (resultsBox) {
+    resultsBox.innerHTML = `<tr><td colspan="6"><b>${message}</b></td></tr>`;
+  }
+  if (resultsBoxMobile) {
+    resultsBoxMobile.innerHTML = `<div class="mobile-result-card"><b>${message}</b></div>`;
+  }
+};
+
+const sendSearchData = (data, append = false) => {
+  searchServices = data;
+  if (searchRequest) {
+    searchRequest.abort();
   }
+  searchRequest = $.ajax({
+    type: 'POST',
+    url: '/adm/sales/search',
+    headers: {
+      'X-Requested-With': 'XMLHttpRequest',
+    },
+    data: {
+      csrfmiddlewaretoken: csrf,
+      'data[]': data,
+      q: searchTerm,
+      cursor: append ? searchCursor : '',
+    },
+    success: (res) => {
+      if (!Array.isArray(res.rows)) {
+        renderSearchMessage(res.data);
+        allAccounts = [];
+        window.allAccounts = allAccounts;
+        accounts.classList.add('not-visible');
+        return;
+      }
+      const page = expandSearchRows(res);
+      allAccounts = append ? allAccounts.concat(page) : page;
+      window.allAccounts = allAccounts;
+      searchCursor = res.next;
+
+      if (allAccounts.length === 0 && !searchTerm) {
+        renderSearchMessage('No hay cuentas disponibles');
+        return;
+      }
+      renderSalesSearchResults(allAccounts);
+      renderLoadMore();
+    },
+    error: (error) => {
+      if (error.statusText !== 'abort') {
+        console.error('Error:', error);
+      }
+    },
+  });
 };
 
+function loadMoreAccounts() {
+  if (searchCursor && searchServices.length > 0) {
+    sendSearchData(searchServices, true);
+  }
+}
+
+window.loadMoreAccounts = loadMoreAccounts;
+
 const sendSearchDetailData = (det) => {
   $.ajax({
     type: 'POST',
@@ -23,3 +23,16 @@ def filter_pagination_url(page_number, filter_query=""):
     if filter_query:
         return f"?page={page_number}&{filter_query}"
     return f"?page={page_number}"
+
+@register.simple_tag
+def filter_cursor_url(cursor="", filter_query=""):
+    """
+    URL de paginación por cursor (KeysetPaginator) con filtros preservados.
+    Sin cursor lleva a la primera página.
+    """
+    params = []
+    if cursor:
+        params.append(urlencode({'cursor': cursor}))
+    if filter_query:
+        params.append(filter_query)
+    return f"?{'&'.join(params)}"
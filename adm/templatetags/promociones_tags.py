@@ -44,8 +44,7 @@ def tiene_promocion(servicio):
             ¡En promoción!
         {% endif %}
     """
-    promocion = PromocionManager.obtener_promocion_activa(servicio)
-    return promocion is not None and promocion.is_active()
+    return PromocionManager.obtener_promocion_activa(servicio) is not None
 
 
 @register.inclusion_tag('adm/components/precio_promocion.html')
@@ -1,12 +1,90 @@
-from datetime import timedelta
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
+from adm.functions import account_availability
+from adm.functions.account_reservations import AccountAlreadyAssigned, allocate, claim_account, hold_account
+from adm.functions.background_tasks import TaskStatus, get_task_manager
+from adm.functions import business as business_cache
+from adm.functions import request_cache
+from adm.functions.business import BusinessInfo
+from adm.functions import customer_features
 from adm.functions.crm import CRMAnalytics
-from adm.models import Account, Bank, Business, PaymentMethod, Sale, Service, Supplier, UserDetail
+from adm.functions import audience_features
+from adm.functions.dashboard import Dashboard
+from adm.functions.keyset_pagination import KeysetPaginator, paginate
+from adm.functions import promotion_engine
+from adm.functions.promociones import PromocionManager
+from adm.functions import query_plans
+from adm.functions import receivable_bulk_jobs as bulk_jobs
+from adm.functions.receivable_notifications import (
+    ReceivableNotificationEngine,
+    build_message,
+    group_by_customer,
+    select_notices,
+)
+from adm.functions.sales import Sales
+from adm.functions.sales_rollup import build_day_rows, rebuild_range
+from adm.functions.sync_google_sheets import sync_google_sheets
+from adm.functions.sync_pyc_sheets import PycSheetSyncService, SheetRow
+from adm.functions.whatsapp_delivery_log import (
+    INDEX_STRIDE_BYTES,
+    append_whatsapp_delivery_log,
+    list_segment_days,
+    prune_whatsapp_delivery_log,
+    read_whatsapp_delivery_log,
+    split_legacy_whatsapp_delivery_log,
+)
+from adm.functions.whatsapp_pacing import (
+    PRIORITY_MARKETING,
+    PRIORITY_RECEIVABLE,
+    PRIORITY_TRANSACTIONAL,
+    PacingScheduler,
+    acquire_for_send,
+    instance_pool,
+)
+from adm.functions.whatsapp_queue import WhatsAppQueue, enqueue_whatsapp
+from adm.models import (
+    Account,
+    AccountSlot,
+    BackgroundTaskRecord,
+    Credits,
+    CustomerFeatures,
+    Bank,
+    Business,
+    MarketingCampaign,
+    PaymentMethod,
+    Promocion,
+    ReceivableJob,
+    ReceivableNotification,
+    Sale,
+    SaleDailyRollup,
+    SaleRollupDay,
+    Service,
+    SheetRowFingerprint,
+    SheetSyncState,
+    SheetTabFingerprint,
+    Supplier,
+    UserDetail,
+    WhatsAppOutboundMessage,
+    WhatsAppSendClock,
+)
+from adm.views import ReceivableView, _build_audience_recommendations
+from index.utils_affiliates import calcular_descuento_carrito, calcular_descuento_efectivo
 
 
 class CRMAnalyticsTests(TestCase):
@@ -142,6 +220,256 @@ class CRMAnalyticsTests(TestCase):
         self.assertIn('recovered_user', usernames)
 
 
+class DashboardAggregationTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        self.service_netflix = Service.objects.create(description='Netflix', perfil_quantity=1, price=100)
+        self.service_hbo = Service.objects.create(description='HBO', perfil_quantity=1, price=120)
+        self.service_free = Service.objects.create(description='Free', perfil_quantity=1, price=0)
+        self.supplier = Supplier.objects.create(
+            business=self.business,
+            name='Supplier Test',
+            phone_number='+5218331111111',
+        )
+        self.payment_method = PaymentMethod.objects.create(description='Stripe')
+        self.seller = User.objects.create_user(username='seller', password='pass123')
+        UserDetail.objects.create(business=self.business, user=self.seller, phone_number='8330000000', lada=52, country='MX')
+
+        self.customer_mx = User.objects.create_user(username='mx', password='pass123')
+        self.customer_cl = User.objects.create_user(username='cl', password='pass123')
+        self.customer_co = User.objects.create_user(username='co', password='pass123')
+        UserDetail.objects.create(business=self.business, user=self.customer_mx, phone_number='8331111111', lada=52, country='MX')
+        UserDetail.objects.create(business=self.business, user=self.customer_cl, phone_number='8332222222', lada=56, country='CL')
+        UserDetail.objects.create(business=self.business, user=self.customer_co, phone_number='8333333333', lada=57, country='CO')
+
+        self._create_sale(self.customer_mx, self.service_netflix, 100)
+        self._create_sale(self.customer_mx, self.service_hbo, 50)
+        self._create_sale(self.customer_cl, self.service_netflix, 80)
+        self._create_sale(self.customer_cl, self.service_netflix, 0)
+        self._create_sale(self.customer_cl, self.service_free, 0)
+        # Venta antigua: el país aparece pero sin ventas en el rango actual
+        self._create_sale(self.customer_co, self.service_hbo, 70, created_at=timezone.now() - timedelta(days=400))
+
+    def _create_sale(self, customer, service, amount, created_at=None):
+        account = Account.objects.create(
+            business=self.business,
+            supplier=self.supplier,
+            customer=customer,
+            created_by=self.seller,
+            modified_by=self.seller,
+            account_name=service,
+            expiration_date=timezone.now() + timedelta(days=30),
+            email=f'{customer.username}-{service.description.lower()}@test.com',
+            password='secret123',
+        )
+        sale = Sale.objects.create(
+            business=self.business,
+            user_seller=self.seller,
+            customer=customer,
+            account=account,
+            payment_method=self.payment_method,
+            expiration_date=timezone.now() + timedelta(days=30),
+            payment_amount=amount,
+            invoice=f'INV-{customer.username}-{service.id}-{amount}',
+        )
+        if created_at:
+            Sale.objects.filter(pk=sale.pk).update(created_at=created_at)
+        return sale
+
+    def test_sales_per_country_day_single_query(self):
+        with self.assertNumQueries(1):
+            result = Dashboard.sales_per_country_day()
+        self.assertEqual(list(result.keys()), ['CL', 'CO', 'MX'])
+        self.assertEqual(result['MX'], {'payment_amount__sum': 150})
+        self.assertEqual(result['CL'], {'payment_amount__sum': 80})
+        self.assertEqual(result['CO'], {'payment_amount__sum': None})
+
+    def test_sales_per_country_month_single_query(self):
+        with self.assertNumQueries(1):
+            result = Dashboard.sales_per_country_month()
+        self.assertEqual(result['MX'], {'payment_amount__sum': 150})
+        self.assertEqual(result['CO'], {'payment_amount__sum': None})
+
+    def test_sales_per_account_single_query(self):
+        with self.assertNumQueries(1):
+            acc_name, acc_total = Dashboard.sales_per_account()
+        # "Free" solo tiene ventas en cero y no aparece; Netflix cuenta también la venta en cero
+        self.assertEqual(acc_name, ['Netflix', 'HBO'])
+        self.assertEqual(acc_total, [3, 1])
+
+    def test_new_user_sales_single_query(self):
+        User.objects.filter(pk=self.customer_cl.pk).update(date_joined=timezone.now() - timedelta(days=400))
+
+        with self.assertNumQueries(1):
+            months = Dashboard.last_year_sales_new_user()
+        self.assertEqual(len(months), 13)
+        # Solo el cliente MX (lada 52) registrado este mes, ventas con monto > 0
+        self.assertEqual(months[0]['sales'], 150)
+        self.assertEqual(months[0]['new_users'], 2)
+        self.assertEqual(sum(row['new_users'] for row in months), 2)
+
+        with self.assertNumQueries(1):
+            day = Dashboard.sales_per_day_new_user(timezone.localdate())
+        self.assertEqual(day, {timezone.localdate().strftime('%Y-%m-%d'): {'sales': 150, 'new_users': 2}})
+
+
+class SaleDailyRollupTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        self.service = Service.objects.create(description='Netflix', perfil_quantity=1, price=100)
+        self.supplier = Supplier.objects.create(
+            business=self.business,
+            name='Supplier Test',
+            phone_number='+5218331111111',
+        )
+        self.stripe = PaymentMethod.objects.create(description='Stripe')
+        self.cash = PaymentMethod.objects.create(description='Efectivo')
+        self.seller = User.objects.create_user(username='seller', password='pass123')
+        UserDetail.objects.create(business=self.business, user=self.seller, phone_number='8330000000', lada=52, country='MX')
+        self.customer = User.objects.create_user(username='customer', password='pass123')
+        UserDetail.objects.create(business=self.business, user=self.customer, phone_number='8331111111', lada=52, country='MX')
+
+    def _create_sale(self, amount, payment_method):
+        account = Account.objects.create(
+            business=self.business,
+            supplier=self.supplier,
+            customer=self.customer,
+            created_by=self.seller,
+            modified_by=self.seller,
+            account_name=self.service,
+            expiration_date=timezone.now() + timedelta(days=30),
+            email=f'rollup-{amount}@test.com',
+            password='secret123',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return Sale.objects.create(
+                business=self.business,
+                user_seller=self.seller,
+                customer=self.customer,
+                account=account,
+                payment_method=payment_method,
+                expiration_date=timezone.now() + timedelta(days=30),
+                payment_amount=amount,
+                invoice=f'INV-ROLLUP-{amount}',
+            )
+
+    def test_rollup_follows_sale_saves_and_deletes(self):
+        first = self._create_sale(100, self.stripe)
+        self._create_sale(50, self.stripe)
+        self._create_sale(30, self.cash)
+
+        row = SaleDailyRollup.objects.get(day=timezone.localdate(), payment_method=self.stripe)
+        self.assertEqual(row.sales_count, 2)
+        self.assertEqual(row.revenue, 150)
+        self.assertEqual(row.new_customer_sales, 1)
+        self.assertEqual(row.new_customer_revenue, 100)
+        self.assertEqual(row.returning_revenue, 50)
+        self.assertEqual(row.country, 'MX')
+        self.assertEqual(row.service_id, self.service.id)
+        self.assertEqual(row.seller_id, self.seller.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        row = SaleDailyRollup.objects.get(day=timezone.localdate(), payment_method=self.stripe)
+        self.assertEqual(row.sales_count, 1)
+        self.assertEqual(row.revenue, 50)
+
+    def test_deleting_first_sale_rebuilds_new_first_sale_day(self):
+        first = self._create_sale(100, self.stripe)
+        self._create_sale(50, self.stripe)
+        past = timezone.now() - timedelta(days=10)
+        Sale.objects.filter(pk=first.pk).update(created_at=past)
+        rebuild_range(timezone.localtime(past).date(), timezone.localdate())
+        self.assertEqual(SaleDailyRollup.objects.get(day=timezone.localdate()).new_customer_sales, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Sale.objects.get(pk=first.pk).delete()
+        row = SaleDailyRollup.objects.get(day=timezone.localdate())
+        self.assertEqual(row.new_customer_sales, 1)
+        self.assertEqual(row.new_customer_revenue, 50)
+
+    def test_customer_country_change_rebuilds_their_days(self):
+        self._create_sale(100, self.stripe)
+        detail = UserDetail.objects.get(user=self.customer)
+        detail.country = 'US'
+        with self.captureOnCommitCallbacks(execute=True):
+            detail.save()
+        self.assertEqual(SaleDailyRollup.objects.get().country, 'US')
+
+        # Guardar sin cambiar el país no reconstruye nada
+        with self.captureOnCommitCallbacks() as callbacks:
+            detail.save()
+        self.assertEqual(callbacks, [])
+
+    def test_new_sales_are_added_without_rereading_the_day(self):
+        self._create_sale(100, self.stripe)
+        lock = SaleRollupDay.objects.get(day=timezone.localdate())
+        self.assertIsNotNone(lock.rebuilt_at)
+
+        with patch('adm.functions.sales_rollup.build_day_rows') as build_rows:
+            self._create_sale(50, self.stripe)
+            self._create_sale(30, self.cash)
+        build_rows.assert_not_called()
+
+        self.assertEqual(SaleDailyRollup.objects.get(payment_method=self.stripe).returning_revenue, 50)
+        cash = SaleDailyRollup.objects.get(payment_method=self.cash)
+        self.assertEqual((cash.sales_count, cash.revenue, cash.returning_sales), (1, 30, 1))
+        rows = {row.payment_method_id: row.revenue for row in build_day_rows(timezone.localdate())}
+        self.assertEqual(rows, {self.stripe.id: 150, self.cash.id: 30})
+
+    def test_null_dimensions_are_unique(self):
+        day = timezone.localdate()
+        row = SaleDailyRollup.objects.create(day=day, country='MX', sales_count=1)
+        self.assertEqual((row.service_key, row.payment_method_key, row.seller_key), (0, 0, 0))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SaleDailyRollup.objects.create(day=day, country='MX', sales_count=1)
+
+    def test_dashboard_web_sales_read_rollup(self):
+        self._create_sale(100, self.stripe)
+        self._create_sale(30, self.cash)
+
+        with self.assertNumQueries(1):
+            today = Dashboard.web_sales_today()
+        self.assertEqual(today, {'total': 100, 'count': 1})
+        with self.assertNumQueries(1):
+            chart = Dashboard.web_sales_last_12_months()
+        self.assertEqual(len(chart), 12)
+        self.assertEqual(chart[-1]['total'], 100)
+
+    def test_rebuild_range_picks_up_moved_sales(self):
+        sale = self._create_sale(100, self.stripe)
+        past = timezone.now() - timedelta(days=10)
+        Sale.objects.filter(pk=sale.pk).update(created_at=past)
+        rebuild_range(timezone.localdate() - timedelta(days=15), timezone.localdate())
+
+        self.assertFalse(SaleDailyRollup.objects.filter(day=timezone.localdate()).exists())
+        self.assertEqual(SaleDailyRollup.objects.get(day=timezone.localtime(past).date()).revenue, 100)
+
+    def test_rebuild_command(self):
+        self._create_sale(100, self.stripe)
+        SaleDailyRollup.objects.all().delete()
+        call_command('rebuild_sale_rollup', '--days', '2', stdout=StringIO())
+        self.assertEqual(SaleDailyRollup.objects.get().revenue, 100)
+
+    def test_crm_kpis_and_trend_match_raw_sales(self):
+        self._create_sale(100, self.stripe)
+        self._create_sale(30, self.cash)
+        sales_qs, filters = CRMAnalytics.get_filtered_sales({'preset': 'last_7_days'})
+
+        self.assertEqual(CRMAnalytics.get_kpis(sales_qs, filters), CRMAnalytics.get_kpis(sales_qs))
+        self.assertEqual(CRMAnalytics.get_sales_trend(sales_qs, filters), CRMAnalytics.get_sales_trend(sales_qs))
+
+
 class CRMViewsTests(TestCase):
     def setUp(self):
         self.business = Business.objects.create(
@@ -225,3 +553,1802 @@ class CRMViewsTests(TestCase):
             response = self.client.get(url)
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response['Content-Type'], 'text/csv')
+
+
+@override_settings(EVO_INSTANCE='inst-a', WHATSAPP_BUDGET_PER_MINUTE=6, WHATSAPP_BUDGET_PER_HOUR=240)
+@patch('adm.functions.whatsapp_queue.append_whatsapp_delivery_log')
+class WhatsAppQueueTests(TestCase):
+    def setUp(self):
+        self.queue = WhatsAppQueue()
+        self.now = timezone.now() + timedelta(seconds=1)
+
+    def _send_result(self, success=True, status_code=201):
+        return {'success': success, 'status_code': status_code, 'detail': 'ok' if success else 'error'}
+
+    def test_enqueue_persists_and_dedupes(self, log):
+        enqueue_whatsapp('Hola', '52', '8331234567', metadata={'source': 'test'})
+        enqueue_whatsapp('Hola', 52, ' 8331234567 ')
+        enqueue_whatsapp('Otro mensaje', '52', '8331234567')
+
+        rows = list(WhatsAppOutboundMessage.objects.order_by('id'))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].full_phone, '5218331234567')
+        self.assertEqual(rows[0].metadata, {'source': 'test'})
+        self.assertEqual([call.args[0]['event'] for call in log.call_args_list], ['queued', 'deduplicated', 'queued'])
+
+    def test_global_clock_paces_claims_across_workers(self, log):
+        self.queue.enqueue('Uno', '52', '8331111111', priority=PRIORITY_RECEIVABLE)
+        self.queue.enqueue('Dos', '52', '8332222222', priority=PRIORITY_RECEIVABLE)
+
+        first = self.queue.claim('worker-a', now=self.now)
+        self.assertEqual(first.message.message, 'Uno')
+        self.assertEqual(first.message.instance, 'inst-a')
+        blocked = self.queue.claim('worker-b', now=self.now + timedelta(seconds=5))
+        self.assertIsNone(blocked.message)
+        self.assertGreater(blocked.wait_seconds, 5)
+        self.queue.ack(first.message, self._send_result())
+
+        clock = WhatsAppSendClock.objects.get(name='inst-a')
+        second = self.queue.claim('worker-b', now=clock.next_send_at)
+        self.assertEqual(second.message.message, 'Dos')
+        self.assertEqual(second.message.lease_owner, 'worker-b')
+
+    def test_same_recipient_skips_interval(self, log):
+        self.queue.enqueue('Parte 1', '52', '8331111111', priority=PRIORITY_RECEIVABLE)
+        self.queue.enqueue('Otro cliente', '52', '8332222222', priority=PRIORITY_RECEIVABLE)
+        self.queue.enqueue('Parte 2', '52', '8331111111', priority=PRIORITY_RECEIVABLE)
+
+        self.assertEqual(self.queue.claim('w', now=self.now).message.message, 'Parte 1')
+        follow_up = self.queue.claim('w', now=self.now + timedelta(seconds=4))
+        self.assertEqual(follow_up.message.message, 'Parte 2')
+
+    def test_transactional_messages_jump_the_queue(self, log):
+        self.queue.enqueue('Promo', '52', '8331111111', priority=PRIORITY_MARKETING)
+        self.queue.enqueue('Recordatorio', '52', '8332222222', priority=PRIORITY_RECEIVABLE)
+        self.queue.enqueue('Tu código', '52', '8333333333')
+
+        self.assertEqual(self.queue.claim('w', now=self.now).message.message, 'Tu código')
+        self.assertEqual(self.queue.claim('w', now=self.now).message.message, 'Recordatorio')
+        # Marketing espera el intervalo; otro transaccional no
+        self.assertIsNone(self.queue.claim('w', now=self.now + timedelta(seconds=1)).message)
+        self.queue.enqueue('Otro código', '52', '8334444444')
+        self.assertEqual(self.queue.claim('w', now=self.now + timedelta(seconds=2)).message.message, 'Otro código')
+
+    def test_expired_lease_is_reclaimed(self, log):
+        self.queue.enqueue('Hola', '52', '8331234567')
+        claimed = self.queue.claim('crashed', now=self.now).message
+
+        self.assertIsNone(self.queue.claim('other', now=self.now + timedelta(seconds=60)).message)
+        retaken = self.queue.claim('other', now=self.now + timedelta(seconds=121)).message
+        self.assertEqual(retaken.pk, claimed.pk)
+        self.assertEqual(retaken.attempts, 2)
+        # El worker original ya no puede confirmar
+        self.assertFalse(self.queue.ack(claimed, self._send_result()))
+        self.assertTrue(self.queue.ack(retaken, self._send_result()))
+        self.assertEqual(WhatsAppOutboundMessage.objects.get().status, WhatsAppOutboundMessage.STATUS_SENT)
+
+    def test_retries_with_backoff_then_fails(self, log):
+        self.queue.enqueue('Hola', '52', '8331234567')
+        row = WhatsAppOutboundMessage.objects.get()
+        row.max_attempts = 2
+        row.save()
+
+        msg = self.queue.claim('w', now=self.now).message
+        self.assertEqual(self.queue.nack(msg, self._send_result(False, 503)), WhatsAppOutboundMessage.STATUS_PENDING)
+        row.refresh_from_db()
+        self.assertGreater(row.available_at, timezone.now() + timedelta(seconds=40))
+
+        msg = self.queue.claim('w', now=row.available_at).message
+        self.assertEqual(self.queue.nack(msg, self._send_result(False, 503)), WhatsAppOutboundMessage.STATUS_FAILED)
+        row.refresh_from_db()
+        self.assertEqual(row.status, WhatsAppOutboundMessage.STATUS_FAILED)
+        self.assertEqual(row.last_status_code, 503)
+
+    def test_client_errors_are_not_retried(self, log):
+        self.queue.enqueue('Hola', '52', '8331234567')
+        msg = self.queue.claim('w', now=self.now).message
+        self.assertEqual(self.queue.nack(msg, self._send_result(False, 400)), WhatsAppOutboundMessage.STATUS_FAILED)
+
+    @patch('adm.functions.send_whatsapp_notification.Notification.send_whatsapp_notification_details')
+    def test_worker_command_sends_pending_message(self, send, log):
+        send.return_value = {'success': True, 'status_code': 201, 'full_phone': '5218331234567'}
+        enqueue_whatsapp('Hola', '52', '8331234567')
+
+        out = StringIO()
+        call_command('whatsapp_worker', '--once', stdout=out)
+
+        send.assert_called_once_with('Hola', '52', '8331234567', priority=PRIORITY_TRANSACTIONAL, instance='inst-a')
+        row = WhatsAppOutboundMessage.objects.get()
+        self.assertEqual(row.status, WhatsAppOutboundMessage.STATUS_SENT)
+        self.assertIsNotNone(row.sent_at)
+        self.assertIn('procesados: 1', out.getvalue())
+
+
+@override_settings(
+    EVO_INSTANCE='inst-a,inst-b:60/10/100',
+    WHATSAPP_BUDGET_PER_MINUTE=6,
+    WHATSAPP_BUDGET_PER_HOUR=240,
+    WHATSAPP_BUDGET_PER_DAY=2500,
+)
+class WhatsAppPacingTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def test_instance_pool_parses_budgets(self):
+        pool = instance_pool()
+        self.assertEqual([config.name for config in pool], ['inst-a', 'inst-b'])
+        self.assertEqual((pool[0].per_minute, pool[0].per_hour, pool[0].per_day), (6, 240, 2500))
+        self.assertEqual((pool[1].per_minute, pool[1].per_hour, pool[1].per_day), (60, 10, 100))
+        self.assertEqual(pool[0].interval, 15)
+        self.assertEqual(pool[1].interval, 360)
+
+    def test_receivable_sends_spread_across_instances(self):
+        scheduler = PacingScheduler()
+        first = scheduler.reserve(PRIORITY_RECEIVABLE, '521', now=self.now)
+        second = scheduler.reserve(PRIORITY_RECEIVABLE, '522', now=self.now)
+        third = scheduler.reserve(PRIORITY_RECEIVABLE, '523', now=self.now)
+
+        self.assertEqual({first.instance, second.instance}, {'inst-a', 'inst-b'})
+        self.assertIsNone(third.instance)
+        self.assertGreater(third.wait_seconds, 10)
+        # Un código de verificación no espera el intervalo
+        self.assertIsNotNone(scheduler.reserve(PRIORITY_TRANSACTIONAL, '524', now=self.now).instance)
+
+    def test_budget_shares_keep_room_for_higher_priorities(self):
+        scheduler = PacingScheduler([instance_pool()[1]])
+        scheduler.reserve(PRIORITY_TRANSACTIONAL, now=self.now)
+        WhatsAppSendClock.objects.filter(name='inst-b').update(hour_count=6, next_send_at=None)
+
+        self.assertIsNone(scheduler.reserve(PRIORITY_MARKETING, now=self.now).instance)
+        self.assertEqual(scheduler.reserve(PRIORITY_RECEIVABLE, now=self.now).instance, 'inst-b')
+        WhatsAppSendClock.objects.filter(name='inst-b').update(hour_count=9, next_send_at=None)
+        self.assertIsNone(scheduler.reserve(PRIORITY_RECEIVABLE, now=self.now).instance)
+        self.assertEqual(scheduler.reserve(PRIORITY_TRANSACTIONAL, now=self.now).instance, 'inst-b')
+        blocked = scheduler.reserve(PRIORITY_TRANSACTIONAL, now=self.now)
+        self.assertIsNone(blocked.instance)
+        self.assertLessEqual(blocked.wait_seconds, 3600)
+
+    def test_transactional_send_never_waits_in_the_request(self):
+        PacingScheduler().lock_clocks()
+        WhatsAppSendClock.objects.update(cooldown_until=timezone.now() + timedelta(minutes=5))
+
+        with patch('adm.functions.whatsapp_pacing.time.sleep', side_effect=AssertionError('esperó')):
+            self.assertEqual(acquire_for_send(PRIORITY_TRANSACTIONAL, '521'), 'inst-a')
+        # Con cupo toma turno normal y lo cuenta
+        WhatsAppSendClock.objects.filter(name='inst-b').update(cooldown_until=None)
+        self.assertEqual(acquire_for_send(PRIORITY_TRANSACTIONAL, '522'), 'inst-b')
+        self.assertEqual(WhatsAppSendClock.objects.get(name='inst-b').minute_count, 1)
+
+    def test_throttle_responses_cool_instance_down(self):
+        scheduler = PacingScheduler([instance_pool()[0]])
+        scheduler.report('inst-a', 429, now=self.now)
+        clock = WhatsAppSendClock.objects.get(name='inst-a')
+        self.assertEqual(clock.penalty_level, 1)
+
+        blocked = scheduler.reserve(PRIORITY_TRANSACTIONAL, now=self.now + timedelta(seconds=10))
+        self.assertIsNone(blocked.instance)
+        self.assertAlmostEqual(blocked.wait_seconds, 20, delta=1)
+
+        later = self.now + timedelta(seconds=31)
+        self.assertEqual(scheduler.reserve(PRIORITY_RECEIVABLE, now=later).instance, 'inst-a')
+        clock.refresh_from_db()
+        # El intervalo se duplica mientras dura la penalización
+        self.assertGreater((clock.next_send_at - later).total_seconds(), 15 * 2 * 0.8 - 0.01)
+
+        scheduler.report('inst-a', 201, now=later)
+        clock.refresh_from_db()
+        self.assertEqual(clock.penalty_level, 0)
+
+
+class WhatsAppDeliveryLogTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.segments_dir = os.path.join(self.tmpdir, 'logs', 'whatsapp_delivery')
+        self.settings_override = override_settings(
+            BASE_DIR=self.tmpdir,
+            WHATSAPP_DELIVERY_LOG_DIR=self.segments_dir,
+            # Sin retención automática: los tests escriben fechas fijas en el pasado
+            WHATSAPP_DELIVERY_LOG_RETENTION_DAYS=0,
+            WHATSAPP_DELIVERY_LOG_MAX_MB=0,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _log(self, timestamp, **extra):
+        append_whatsapp_delivery_log({'timestamp': timestamp, 'event': 'sent', **extra})
+
+    def test_segments_per_day_and_tail_reads(self):
+        self._log('2026-01-01T10:00:00+00:00', event_id='a', full_phone='5218331111111')
+        self._log('2026-01-02T09:00:00+00:00', event_id='b', full_phone='5218332222222')
+        self._log('2026-01-02T11:00:00+00:00', event_id='c', full_phone='5218331111111')
+
+        self.assertEqual(list_segment_days(), ['2026-01-02', '2026-01-01'])
+        self.assertTrue(os.path.exists(os.path.join(self.segments_dir, '2026-01-02.idx')))
+        self.assertEqual([row['event_id'] for row in read_whatsapp_delivery_log(limit=2)], ['c', 'b'])
+        self.assertEqual(
+            [row['event_id'] for row in read_whatsapp_delivery_log(date_from='2026-01-01', date_to='2026-01-01')],
+            ['a'],
+        )
+
+    def test_filters_by_event_id_and_phone(self):
+        self._log('2026-01-01T10:00:00+00:00', event_id='evt-1', event='queued', full_phone='5218331111111')
+        self._log('2026-01-01T10:01:00+00:00', event_id='evt-2', full_phone='5218332222222', phone_number='8332222222')
+        self._log('2026-01-01T10:02:00+00:00', event_id='evt-1', full_phone='5218331111111')
+
+        self.assertEqual([row['event'] for row in read_whatsapp_delivery_log(event_id='evt-1')], ['sent', 'queued'])
+        self.assertEqual([row['event_id'] for row in read_whatsapp_delivery_log(phone='833 222 2222')], ['evt-2'])
+        self.assertEqual(read_whatsapp_delivery_log(phone='+52 1 833 999 9999'), [])
+
+    def test_before_cursor_uses_index_within_day(self):
+        base = datetime.fromisoformat('2026-02-01T00:00:00+00:00')
+        padding = 'x' * 400
+        for minute in range(600):
+            self._log((base + timedelta(minutes=minute)).isoformat(), event_id=f'e{minute}', detail=padding)
+        index_size = os.path.getsize(os.path.join(self.segments_dir, '2026-02-01.idx'))
+        self.assertGreater(index_size // 16, 2)
+        self.assertGreater(os.path.getsize(os.path.join(self.segments_dir, '2026-02-01.jsonl')), INDEX_STRIDE_BYTES * 2)
+
+        rows = read_whatsapp_delivery_log(limit=3, before=(base + timedelta(minutes=100)).isoformat())
+        self.assertEqual([row['event_id'] for row in rows], ['e99', 'e98', 'e97'])
+
+    def test_retention_by_age_and_size(self):
+        for day in ('2025-09-01', '2025-12-30', '2026-01-01'):
+            self._log(f'{day}T10:00:00+00:00', detail='y' * 1000)
+
+        with override_settings(WHATSAPP_DELIVERY_LOG_RETENTION_DAYS=90):
+            removed = prune_whatsapp_delivery_log(today=datetime(2026, 1, 1).date())
+        self.assertEqual(removed, ['2025-09-01'])
+        with override_settings(WHATSAPP_DELIVERY_LOG_MAX_MB=1):
+            self.assertEqual(prune_whatsapp_delivery_log(today=datetime(2026, 1, 1).date()), [])
+        self.assertEqual(list_segment_days(), ['2026-01-01', '2025-12-30'])
+
+    def test_legacy_file_is_read_and_split(self):
+        legacy = os.path.join(self.tmpdir, 'logs', 'whatsapp_delivery_history.jsonl')
+        os.makedirs(os.path.dirname(legacy), exist_ok=True)
+        with open(legacy, 'w', encoding='utf-8') as fh:
+            for day, event_id in (('2025-12-01', 'old-1'), ('2025-12-02', 'old-2')):
+                fh.write(json.dumps({'timestamp': f'{day}T10:00:00+00:00', 'event_id': event_id}) + '\n')
+        self._log('2026-01-01T10:00:00+00:00', event_id='new')
+
+        self.assertEqual([row['event_id'] for row in read_whatsapp_delivery_log()], ['new', 'old-2', 'old-1'])
+        self.assertEqual(split_legacy_whatsapp_delivery_log(), {'lines': 2, 'days': 2})
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(list_segment_days(), ['2026-01-01', '2025-12-02', '2025-12-01'])
+        self.assertEqual([row['event_id'] for row in read_whatsapp_delivery_log()], ['new', 'old-2', 'old-1'])
+
+
+class ReceivableBulkJobsTests(TestCase):
+    def _recipients(self, count):
+        return [
+            {'sale_id': sale_id, 'customer': f'cliente{sale_id}', 'phone': f'+52833000{sale_id:04d}', 'status': 'pending', 'note': ''}
+            for sale_id in range(1, count + 1)
+        ]
+
+    def test_recipient_updates_keep_totals_and_ignore_repeats(self):
+        bulk_jobs.init_job(bulk_jobs.JOB_DUE_TODAY, self._recipients(3))
+        bulk_jobs.update_recipient(bulk_jobs.JOB_DUE_TODAY, 1, 'sent', 'Enviado (200)')
+        bulk_jobs.update_recipient(bulk_jobs.JOB_DUE_TODAY, 2, 'skipped', 'Sin telefono/lada')
+        # Un destinatario ya resuelto no cambia de estado
+        bulk_jobs.update_recipient(bulk_jobs.JOB_DUE_TODAY, 1, 'failed', 'Error (500)')
+
+        snapshot = bulk_jobs.get_job_snapshot(bulk_jobs.JOB_DUE_TODAY)
+        self.assertEqual(snapshot['totals'], {'total': 3, 'sent': 1, 'failed': 0, 'skipped': 1, 'pending': 1})
+        self.assertEqual([r['status'] for r in snapshot['recipients']], ['sent', 'skipped', 'pending'])
+        self.assertEqual(snapshot['recipients'][0]['note'], 'Enviado (200)')
+        self.assertIsNotNone(snapshot['eta_seconds'])
+
+        bulk_jobs.finish_job(bulk_jobs.JOB_DUE_TODAY)
+        snapshot = bulk_jobs.get_job_snapshot(bulk_jobs.JOB_DUE_TODAY)
+        self.assertEqual(snapshot['status'], 'completed')
+        self.assertIsNotNone(snapshot['finished_at'])
+
+    def test_update_recipient_cost_does_not_grow_with_job_size(self):
+        bulk_jobs.init_job(bulk_jobs.JOB_DUE_TOMORROW, self._recipients(2000))
+        # UPDATE del destinatario + UPDATE de totales (más SAVEPOINT/RELEASE del test)
+        with self.assertNumQueries(4):
+            bulk_jobs.update_recipient(bulk_jobs.JOB_DUE_TOMORROW, 1500, 'sent')
+        with self.assertNumQueries(2):
+            self.assertEqual(len(bulk_jobs.get_jobs_snapshot()[bulk_jobs.JOB_DUE_TOMORROW]['recipients']), 2000)
+
+    def test_reinit_replaces_previous_recipients(self):
+        bulk_jobs.init_job(bulk_jobs.JOB_DUE_5_DAYS, self._recipients(5))
+        bulk_jobs.update_recipient(bulk_jobs.JOB_DUE_5_DAYS, 1, 'sent')
+        bulk_jobs.init_job(bulk_jobs.JOB_DUE_5_DAYS, self._recipients(2))
+        snapshot = bulk_jobs.get_job_snapshot(bulk_jobs.JOB_DUE_5_DAYS)
+        self.assertEqual(snapshot['totals'], {'total': 2, 'sent': 0, 'failed': 0, 'skipped': 0, 'pending': 2})
+
+    def test_pause_resume_and_stop_controls(self):
+        self.assertFalse(bulk_jobs.set_pause(bulk_jobs.JOB_OVERDUE_PENDING, True))
+        self.assertEqual(bulk_jobs.get_control(bulk_jobs.JOB_OVERDUE_PENDING), {'paused': False, 'stop_requested': False})
+
+        bulk_jobs.init_job(bulk_jobs.JOB_OVERDUE_PENDING, self._recipients(1))
+        self.assertTrue(bulk_jobs.set_pause(bulk_jobs.JOB_OVERDUE_PENDING, True))
+        self.assertEqual(bulk_jobs.get_job_snapshot(bulk_jobs.JOB_OVERDUE_PENDING)['status'], 'paused')
+        self.assertTrue(bulk_jobs.set_pause(bulk_jobs.JOB_OVERDUE_PENDING, False))
+        self.assertTrue(bulk_jobs.request_stop(bulk_jobs.JOB_OVERDUE_PENDING))
+        self.assertEqual(bulk_jobs.get_control(bulk_jobs.JOB_OVERDUE_PENDING), {'paused': False, 'stop_requested': True})
+
+        bulk_jobs.stop_job(bulk_jobs.JOB_OVERDUE_PENDING, 'Detenido por operador')
+        bulk_jobs.finish_job(bulk_jobs.JOB_OVERDUE_PENDING)
+        snapshot = bulk_jobs.get_job_snapshot(bulk_jobs.JOB_OVERDUE_PENDING)
+        self.assertEqual(snapshot['status'], 'stopped')
+        self.assertFalse(bulk_jobs.set_pause(bulk_jobs.JOB_OVERDUE_PENDING, True))
+
+    def test_rollover_closes_jobs_from_previous_day(self):
+        bulk_jobs.init_job(bulk_jobs.JOB_DUE_TODAY, self._recipients(1))
+        self.assertFalse(bulk_jobs.rollover_cleanup_if_stale(bulk_jobs.JOB_DUE_TODAY))
+        ReceivableJob.objects.filter(job_key=bulk_jobs.JOB_DUE_TODAY).update(
+            started_at=timezone.now() - timedelta(days=1, hours=1)
+        )
+        self.assertTrue(bulk_jobs.rollover_cleanup_if_stale(bulk_jobs.JOB_DUE_TODAY))
+        self.assertEqual(bulk_jobs.get_job_snapshot(bulk_jobs.JOB_DUE_TODAY)['status'], 'stopped')
+
+
+@override_settings(EVO_INSTANCE='inst-a:1000/100000/100000')
+class ReceivableNotificationEngineTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        self.service = Service.objects.create(description='Netflix', perfil_quantity=5, price=100)
+        self.supplier = Supplier.objects.create(business=self.business, name='Supplier', phone_number='+5218331111111')
+        self.payment_method = PaymentMethod.objects.create(description='Stripe')
+        self.bank = Bank.objects.create(
+            business=self.business,
+            bank_name='Bank Test',
+            headline='Cuenta',
+            card_number='1234123412341234',
+            clabe='123456789012345678',
+        )
+        self.seller = User.objects.create_user(username='seller', password='pass123')
+        self.base_day = timezone.localtime().date()
+        self.noon = timezone.make_aware(datetime.combine(self.base_day, datetime.min.time())) + timedelta(hours=12)
+        self.sent = []
+
+    def _customer(self, username, phone='8331111111'):
+        customer = User.objects.create_user(username=username, password='pass123')
+        UserDetail.objects.create(business=self.business, user=customer, phone_number=phone, lada=52, country='MX')
+        return customer
+
+    def _sale(self, customer, days, status=True):
+        account = Account.objects.create(
+            business=self.business,
+            supplier=self.supplier,
+            customer=customer,
+            created_by=self.seller,
+            modified_by=self.seller,
+            account_name=self.service,
+            expiration_date=self.noon + timedelta(days=days),
+            renewal_date=self.noon + timedelta(days=days),
+            email=f'{customer.username}{days}@test.com',
+            password='secret123',
+            profile=1,
+        )
+        return Sale.objects.create(
+            business=self.business,
+            user_seller=self.seller,
+            bank=self.bank,
+            customer=customer,
+            account=account,
+            status=status,
+            payment_method=self.payment_method,
+            expiration_date=self.noon + timedelta(days=days),
+            payment_amount=100,
+            invoice=f'INV-{customer.username}-{days}',
+        )
+
+    def _send(self, message, lada, phone_number, instance):
+        self.sent.append((phone_number, message))
+        return 201
+
+    def _engine(self, buckets=None, **kwargs):
+        kwargs.setdefault('send', self._send)
+        kwargs.setdefault('sleep', lambda seconds: None)
+        return ReceivableNotificationEngine(
+            self.base_day,
+            buckets or ['due_today', 'due_tomorrow', 'due_5_days', 'overdue_pending'],
+            **kwargs,
+        )
+
+    def test_single_query_assigns_buckets(self):
+        customer = self._customer('ana')
+        today = self._sale(customer, 0)
+        tomorrow = self._sale(customer, 1)
+        in_five = self._sale(customer, 5)
+        overdue = self._sale(customer, -3)
+        self._sale(customer, 2)
+        self._sale(customer, -1, status=False)
+
+        with self.assertNumQueries(1):
+            notices = select_notices(self.base_day, ['due_today', 'due_tomorrow', 'due_5_days', 'overdue_pending'])
+        self.assertEqual(
+            [(notice.sale.id, notice.bucket) for notice in notices],
+            [(today.id, 'due_today'), (tomorrow.id, 'due_tomorrow'), (in_five.id, 'due_5_days'), (overdue.id, 'overdue_pending')],
+        )
+        self.assertEqual([n.bucket for n in select_notices(self.base_day, ['overdue_pending'])], ['overdue_pending'])
+
+    def test_one_message_per_customer_covers_all_sales(self):
+        ana = self._customer('ana', '8331111111')
+        luis = self._customer('luis', '8332222222')
+        self._sale(ana, 0)
+        self._sale(ana, -4)
+        self._sale(luis, 5)
+
+        summary = self._engine().run()
+
+        self.assertEqual(summary['messages'], 2)
+        self.assertEqual(summary['sent'], 3)
+        self.assertEqual([phone for phone, _ in self.sent], ['8331111111', '8332222222'])
+        combined = self.sent[0][1]
+        self.assertIn('Te compartimos el estado de tus cuentas', combined)
+        self.assertIn('vence hoy', combined)
+        self.assertIn('vencio el', combined)
+        self.assertIn('vence en 5 dias', self.sent[1][1])
+        self.assertEqual(ReceivableNotification.objects.filter(status=ReceivableNotification.STATUS_SENT).count(), 3)
+        self.assertEqual(bulk_jobs.get_job_snapshot('due_today')['totals']['sent'], 1)
+        self.assertEqual(bulk_jobs.get_job_snapshot('overdue_pending')['totals']['sent'], 1)
+        self.assertEqual(bulk_jobs.get_job_snapshot('due_tomorrow')['status'], 'completed')
+
+    def test_resume_skips_sales_already_sent_today(self):
+        ana = self._customer('ana', '8331111111')
+        luis = self._customer('luis', '8332222222')
+        first = self._sale(ana, 0)
+        self._sale(luis, 0)
+        ReceivableNotification.objects.create(
+            sale=first, bucket='due_today', day=self.base_day, status=ReceivableNotification.STATUS_SENT,
+        )
+
+        summary = self._engine(['due_today']).run()
+
+        self.assertEqual([phone for phone, _ in self.sent], ['8332222222'])
+        self.assertEqual(summary['skipped'], 1)
+        recipients = {r['sale_id']: r for r in bulk_jobs.get_job_snapshot('due_today')['recipients']}
+        self.assertEqual(recipients[first.id]['note'], 'Ya notificado hoy')
+
+        # Una segunda corrida el mismo día no reenvía nada
+        self.sent = []
+        self._engine(['due_today']).run()
+        self.assertEqual(self.sent, [])
+
+    def test_failed_sends_are_retried_and_claims_block_duplicates(self):
+        ana = self._customer('ana')
+        sale = self._sale(ana, 0)
+        self._engine(['due_today'], send=lambda *args: 500).run()
+        self.assertEqual(ReceivableNotification.objects.get(sale=sale).status, ReceivableNotification.STATUS_FAILED)
+
+        # Otro proceso tiene la venta reclamada: no se duplica el envío
+        ReceivableNotification.objects.filter(sale=sale).update(status=ReceivableNotification.STATUS_SENDING)
+        self._engine(['due_today']).run()
+        self.assertEqual(self.sent, [])
+
+        ReceivableNotification.objects.filter(sale=sale).update(status=ReceivableNotification.STATUS_FAILED)
+        self._engine(['due_today']).run()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(ReceivableNotification.objects.get(sale=sale).status, ReceivableNotification.STATUS_SENT)
+
+    def test_stop_request_sends_nothing(self):
+        ana = self._customer('ana')
+        self._sale(ana, 0)
+        stop = {'paused': False, 'stop_requested': True}
+        with patch('adm.functions.receivable_notifications.get_control', return_value=stop):
+            self._engine(['due_today']).run()
+
+        self.assertEqual(self.sent, [])
+        self.assertEqual(bulk_jobs.get_job_snapshot('due_today')['status'], 'stopped')
+        self.assertFalse(ReceivableNotification.objects.exists())
+
+    def test_dry_run_and_single_sale_message(self):
+        ana = self._customer('ana')
+        sale = self._sale(ana, 1)
+        summary = self._engine(['due_tomorrow'], dry_run=True).run()
+        self.assertEqual(summary['sent'], 1)
+        self.assertEqual(self.sent, [])
+        self.assertFalse(ReceivableNotification.objects.exists())
+
+        notices = group_by_customer(select_notices(self.base_day, ['due_tomorrow']))[0].notices
+        message = build_message(notices, self.base_day)
+        self.assertIn(f'({sale.account.email}, perfil 1) vence mañana', message)
+        self.assertIn('25 por ciento de descuento', message)
+        self.assertIn('Precio con descuento: $75 por mes', message)
+
+    def test_command_bucket_selector(self):
+        ana = self._customer('ana')
+        self._sale(ana, 0)
+        self._sale(ana, 1)
+        out = StringIO()
+        with patch('adm.functions.receivable_notifications._default_send', side_effect=self._send):
+            call_command('send_receivable_whatsapp', bucket=['due_tomorrow'], ignore_schedule=True, stdout=out)
+        self.assertEqual(len(self.sent), 1)
+        self.assertIn('vence mañana', self.sent[0][1])
+        self.assertIsNone(bulk_jobs.get_job_snapshot('due_today'))
+
+
+class PycSheetSyncDiffTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        self.service = Service.objects.create(description='Netflix', perfil_quantity=5, price=100)
+        self.supplier = Supplier.objects.create(business=self.business, name='PyC', phone_number='+5218331111111')
+        self.seller = User.objects.create_user(username='seller', password='pass123')
+        self.customer = User.objects.create_user(username='cliente', email='cliente@example.com', password='pass123')
+        UserDetail.objects.create(business=self.business, user=self.customer, phone_number='8331111111', lada=52, country='MX')
+        now = timezone.now()
+        self.accounts = [
+            Account.objects.create(
+                business=self.business,
+                supplier=self.supplier,
+                created_by=self.seller,
+                modified_by=self.seller,
+                account_name=self.service,
+                expiration_date=now + timedelta(days=30),
+                renewal_date=now + timedelta(days=30),
+                email=f'pyc{index}@test.com',
+                password='old-pass',
+                profile=1,
+                status=True,
+                external_status='Disponible',
+            )
+            for index in range(25)
+        ]
+        self.rows = {
+            account.email: SheetRow(email=account.email, password='old-pass', status='Activa', profile=1)
+            for account in self.accounts
+        }
+        self.tmpdir = tempfile.mkdtemp()
+        history = patch(
+            'adm.functions.sync_pyc_sheets._password_history_path',
+            return_value=os.path.join(self.tmpdir, 'history.jsonl'),
+        )
+        history.start()
+        self.addCleanup(history.stop)
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+
+    def _index(self):
+        # Relleno en otra pestaña para superar el mínimo de filas indexadas
+        filler = {f'filler{i}@test.com': SheetRow(f'filler{i}@test.com', 'x', 'Activa', 1) for i in range(200)}
+        tab_index = {'Netflix': dict(self.rows), 'Prime Video': filler}
+        loose = {
+            tab: {email.replace(' ', ''): [row] for email, row in rows.items()}
+            for tab, rows in tab_index.items()
+        }
+        return tab_index, loose
+
+    def _run(self, dry_run=False):
+        with patch('adm.functions.sync_pyc_sheets._build_google_access_token', return_value='token'), \
+                patch.object(PycSheetSyncService, '_fetch_revision', return_value=''), \
+                patch.object(PycSheetSyncService, '_build_tab_index', return_value=self._index()):
+            return PycSheetSyncService(sheet_id='sheet').run(dry_run=dry_run)
+
+    def _prepare_changes(self):
+        self.accounts[0].customer = self.customer
+        self.accounts[0].save(update_fields=['customer'])
+        self.rows['pyc0@test.com'] = SheetRow('pyc0@test.com', 'new-pass', 'Activa', 1)
+        self.rows['pyc1@test.com'] = SheetRow('pyc1@test.com', 'new-pass-1', 'Activa', 3)
+        self.rows['pyc2@test.com'] = SheetRow('pyc2@test.com', 'old-pass', 'Caida', 1)
+        del self.rows['pyc3@test.com']
+
+    def test_dry_run_reports_diff_without_writing(self):
+        self._prepare_changes()
+        summary = self._run(dry_run=True)
+
+        diff = summary['diff']
+        self.assertEqual(diff['accounts_with_changes'], 4)
+        self.assertEqual(diff['counts']['would_change_password'], 2)
+        self.assertEqual(diff['counts']['would_mark_deleted'], 1)
+        by_account = {item['account_id']: item for item in diff['changes']}
+        self.assertEqual(by_account[self.accounts[1].id]['changes']['profile'], {'old': 1, 'new': 3})
+        self.assertEqual(by_account[self.accounts[0].id]['changes']['password'], {'old': '***', 'new': '***'})
+        self.assertEqual(summary['updated_password'], 0)
+        self.assertEqual(Account.objects.filter(password='old-pass').count(), 25)
+
+    def test_apply_uses_bulk_updates_and_keeps_counters(self):
+        self._prepare_changes()
+        sale_expiration = timezone.now() + timedelta(days=12)
+        payment_method = PaymentMethod.objects.create(description='Stripe')
+        bank = Bank.objects.create(
+            business=self.business, bank_name='Bank', headline='Cuenta', card_number='1', clabe='1',
+        )
+        Sale.objects.create(
+            business=self.business, user_seller=self.seller, bank=bank, customer=self.customer,
+            account=self.accounts[0], status=True, payment_method=payment_method,
+            expiration_date=sale_expiration, payment_amount=100, invoice='INV-PYC',
+        )
+
+        with patch('adm.functions.sync_pyc_sheets.enqueue_whatsapp') as enqueue, \
+                CaptureQueriesContext(connection) as ctx:
+            summary = self._run()
+
+        account_updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "adm_account"')]
+        self.assertLessEqual(len(account_updates), 4)
+        self.assertEqual(summary['processed'], 25)
+        self.assertEqual(summary['updated_password'], 2)
+        self.assertEqual(summary['updated_profile'], 1)
+        self.assertEqual(summary['updated_external_status'], 1)
+        self.assertEqual(summary['marked_deleted'], 1)
+        self.assertEqual(summary['notified_whatsapp'], 1)
+        self.assertIn(sale_expiration.strftime('%d/%m/%Y'), enqueue.call_args.kwargs['message'])
+
+        refreshed = {a.email: a for a in Account.objects.all()}
+        self.assertEqual(refreshed['pyc1@test.com'].password, 'new-pass-1')
+        self.assertEqual(refreshed['pyc1@test.com'].profile, 3)
+        self.assertEqual(refreshed['pyc2@test.com'].external_status, 'Caida')
+        self.assertEqual(refreshed['pyc3@test.com'].external_status, 'deleted')
+        self.assertFalse(refreshed['pyc3@test.com'].status)
+        with open(os.path.join(self.tmpdir, 'history.jsonl'), encoding='utf-8') as fh:
+            self.assertEqual(len(fh.readlines()), 2)
+
+    def test_failed_chunk_falls_back_to_row_saves(self):
+        self._prepare_changes()
+        with patch('adm.functions.sync_pyc_sheets.enqueue_whatsapp'), \
+                patch.object(Account.objects, 'bulk_update', side_effect=RuntimeError('deadlock')):
+            summary = self._run()
+        self.assertEqual(summary['updated_password'], 2)
+        self.assertEqual(Account.objects.get(email='pyc1@test.com').password, 'new-pass-1')
+        self.assertEqual(summary['errors'], [])
+
+
+SHEETS_TESTDATA_DIR = os.path.join(os.path.dirname(__file__), 'testdata', 'google_sheets')
+
+
+def _load_sheets_testdata(name):
+    with open(os.path.join(SHEETS_TESTDATA_DIR, name), encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+class FakeSheetsServer:
+    """
+    Servidor HTTP local que imita Sheets v4, Drive v3 (versión del archivo)
+    y el endpoint n8n, sirviendo payloads grabados en adm/testdata/google_sheets.
+    """
+
+    def __init__(self, batch_get=None, records=None):
+        self.batch_get = batch_get or {'valueRanges': []}
+        self.records = records or []
+        self.version = 1
+        self.requests = []
+
+    @staticmethod
+    def tab_of(value_range):
+        return value_range['range'].split('!')[0].strip("'")
+
+    def rows(self, tab):
+        for value_range in self.batch_get['valueRanges']:
+            if self.tab_of(value_range) == tab:
+                return value_range['values']
+        raise KeyError(tab)
+
+    def count(self, fragment):
+        return sum(1 for path in self.requests if fragment in path)
+
+    def _respond(self, path, query):
+        if path.startswith('/drive/v3/files/'):
+            return {'version': str(self.version)}
+        if path.endswith('/values:batchGet'):
+            tabs = {value.split('!')[0].strip("'") for value in query.get('ranges', [])}
+            return {
+                'spreadsheetId': self.batch_get.get('spreadsheetId', ''),
+                'valueRanges': [vr for vr in self.batch_get['valueRanges'] if self.tab_of(vr) in tabs],
+            }
+        if path.startswith('/v4/spreadsheets/'):
+            return {'sheets': [{'properties': {'title': self.tab_of(vr)}} for vr in self.batch_get['valueRanges']]}
+        if path.startswith('/api/google-sheets/'):
+            return self.records
+        return None
+
+    def __enter__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from threading import Thread
+        from urllib.parse import parse_qs, urlsplit
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                parts = urlsplit(self.path)
+                fake.requests.append(parts.path)
+                payload = fake._respond(parts.path, parse_qs(parts.query))
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(404 if payload is None else 200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self._handle()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class PycSheetIncrementalSyncTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        supplier = Supplier.objects.create(business=self.business, name='PyC', phone_number='+5218331111111')
+        seller = User.objects.create_user(username='seller', password='pass123')
+        services = {
+            'Netflix': Service.objects.create(description='Netflix', perfil_quantity=5, price=100),
+            'Prime Video': Service.objects.create(description='Prime Video', perfil_quantity=5, price=80),
+        }
+        self.server = FakeSheetsServer(batch_get=_load_sheets_testdata('pyc_batchget.json'))
+        now = timezone.now()
+        for tab, service in services.items():
+            for email, password, _status, profile, *_ in self.server.rows(tab)[1:]:
+                Account.objects.create(
+                    business=self.business, supplier=supplier, created_by=seller, modified_by=seller,
+                    account_name=service, expiration_date=now + timedelta(days=30),
+                    renewal_date=now + timedelta(days=30), email=email, password=password,
+                    profile=int(profile), status=True, external_status='Disponible',
+                )
+
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        for target, kwargs in (
+            ('adm.functions.sync_pyc_sheets._build_google_access_token', {'return_value': 'token'}),
+            ('adm.functions.sync_pyc_sheets._password_history_path', {
+                'return_value': os.path.join(self.tmpdir, 'history.jsonl'),
+            }),
+            ('adm.functions.sync_pyc_sheets.enqueue_whatsapp', {}),
+        ):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        env = patch.dict(os.environ, {
+            'GOOGLE_SHEETS_API_BASE': f'{self.server.url}/v4',
+            'GOOGLE_DRIVE_API_BASE': f'{self.server.url}/drive/v3',
+        })
+        env.start()
+        self.addCleanup(env.stop)
+
+    def _run(self, missing_ratio_guard=0.5):
+        service = PycSheetSyncService(sheet_id='sheet-test')
+        service._min_index_rows = 0
+        service._service_missing_min_expected = 0
+        service._service_missing_ratio_guard = missing_ratio_guard
+        return service.run()
+
+    def _edit_sheet(self, tab, email, password=None, remove=False):
+        rows = self.server.rows(tab)
+        index = next(i for i, row in enumerate(rows) if row[0] == email)
+        if remove:
+            rows.pop(index)
+        else:
+            rows[index][1] = password
+        self.server.version += 1
+
+    def test_unchanged_revision_skips_download(self):
+        first = self._run()
+        self.assertFalse(first['incremental'])
+        self.assertEqual(SheetRowFingerprint.objects.count(), 9)
+        self.assertEqual(SheetTabFingerprint.objects.count(), 2)
+
+        second = self._run()
+        self.assertTrue(second['incremental'])
+        self.assertTrue(second['unchanged'])
+        self.assertEqual(self.server.count('values:batchGet'), 1)
+
+    def test_only_changed_rows_are_processed(self):
+        self._run()
+        self._edit_sheet('Netflix', 'pyc.netflix2@mail.com', password='nf-rotated')
+
+        summary = self._run()
+
+        self.assertTrue(summary['incremental'])
+        self.assertEqual(summary['skipped_tabs'], 1)
+        self.assertEqual(summary['skipped_unchanged'], 8)
+        self.assertEqual(summary['updated_password'], 1)
+        self.assertEqual(Account.objects.get(email='pyc.netflix2@mail.com').password, 'nf-rotated')
+        revisions = dict(SheetRowFingerprint.objects.filter(tab='Netflix').values_list('row_key', 'revision'))
+        self.assertEqual(revisions['pyc.netflix2@mail.com'], 2)
+        self.assertEqual(revisions['pyc.netflix0@mail.com'], 1)
+        self.assertEqual(SheetSyncState.objects.get(source='pyc').remote_revision, '2')
+
+    def test_fingerprints_commit_without_upsert_target_support(self):
+        # En MySQL bulk_create no acepta unique_fields; se usa el camino manual
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            self._run()
+            self._edit_sheet('Netflix', 'pyc.netflix2@mail.com', password='nf-rotated')
+            summary = self._run()
+
+        self.assertEqual(summary['updated_password'], 1)
+        self.assertEqual(SheetRowFingerprint.objects.count(), 9)
+        revisions = dict(SheetRowFingerprint.objects.filter(tab='Netflix').values_list('row_key', 'revision'))
+        self.assertEqual(revisions['pyc.netflix2@mail.com'], 2)
+        self.assertEqual(revisions['pyc.netflix0@mail.com'], 1)
+
+    def test_disappeared_row_marks_account_deleted(self):
+        self._run()
+        self._edit_sheet('Netflix', 'pyc.netflix5@mail.com', remove=True)
+
+        summary = self._run()
+
+        self.assertEqual(summary['marked_deleted'], 1)
+        account = Account.objects.get(email='pyc.netflix5@mail.com')
+        self.assertEqual(account.external_status, 'deleted')
+        self.assertFalse(account.status)
+        self.assertFalse(SheetRowFingerprint.objects.filter(row_key='pyc.netflix5@mail.com').exists())
+
+    def test_guarded_rows_are_retried_next_run(self):
+        self._run()
+        self._edit_sheet('Netflix', 'pyc.netflix5@mail.com', remove=True)
+
+        blocked = self._run(missing_ratio_guard=0.0)
+        self.assertEqual(blocked['skipped_delete_by_service_guard'], 1)
+        self.assertTrue(SheetRowFingerprint.objects.filter(row_key='pyc.netflix5@mail.com').exists())
+        self.assertEqual(SheetSyncState.objects.get(source='pyc').remote_revision, '')
+
+        # Misma revisión del sheet, pero la fila retenida obliga a reevaluar
+        retried = self._run()
+        self.assertFalse(retried['unchanged'])
+        self.assertEqual(retried['marked_deleted'], 1)
+
+
+class GoogleSheetIncrementalSyncTests(TestCase):
+    def setUp(self):
+        business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        supplier = Supplier.objects.create(business=business, name='Cuentas Mexico', phone_number='+5218331111111')
+        seller = User.objects.create_user(username='seller', password='pass123')
+        services = {
+            'NETFLIX': Service.objects.create(description='NETFLIX', perfil_quantity=5, price=100),
+            'MAX': Service.objects.create(description='MAX', perfil_quantity=5, price=80),
+        }
+        self.server = FakeSheetsServer(records=_load_sheets_testdata('n8n_records.json'))
+        now = timezone.now()
+        for record in self.server.records:
+            Account.objects.create(
+                business=business, supplier=supplier, created_by=seller, modified_by=seller,
+                account_name=services[record['SERVICIO']], expiration_date=now + timedelta(days=30),
+                renewal_date=now + timedelta(days=30), email=record['EMAIL'], password='old',
+                profile=record['PERFIL'], status=True, external_status='Disponible',
+            )
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        api_url = patch('adm.functions.sync_google_sheets.GOOGLE_SHEETS_API_URL', f'{self.server.url}/api/google-sheets')
+        api_url.start()
+        self.addCleanup(api_url.stop)
+
+    def test_second_run_only_processes_changed_records(self):
+        first = sync_google_sheets()
+        self.assertEqual(first['total_updated'], 6)
+        self.assertEqual(first['password_changes'], 6)
+
+        self.server.records[1]['CLAVE'] = 'cm-rotated'
+        second = sync_google_sheets()
+        self.assertEqual(second['total_updated'], 1)
+        self.assertEqual(second['password_changes'], 1)
+        self.assertEqual(Account.objects.get(email='cm.netflix1@mail.com').password, 'cm-rotated')
+
+        full = sync_google_sheets(full=True)
+        self.assertEqual(full['total_updated'], 6)
+        self.assertEqual(full['password_changes'], 0)
+
+
+def _sample_background_task(value, progress_callback=None):
+    progress_callback('a la mitad')
+    return {'value': value * 2, 'at': timezone.now()}
+
+
+class BackgroundTaskRegistryTests(TestCase):
+    def setUp(self):
+        self.manager = get_task_manager()
+        # Sin hilos en los tests: la tarea se ejecuta a mano con _run_task
+        thread = patch('adm.functions.background_tasks.threading.Thread')
+        self.thread = thread.start()
+        self.addCleanup(thread.stop)
+
+    def test_state_is_shared_and_one_task_per_type(self):
+        started, _, task = self.manager.start_task('sync_sheets', _sample_background_task, 21)
+        self.assertTrue(started)
+        self.assertEqual(task.status, TaskStatus.RUNNING)
+
+        again, message, running = self.manager.start_task('sync_sheets', _sample_background_task, 1)
+        self.assertFalse(again)
+        self.assertEqual(running.task_id, task.task_id)
+        self.assertIn('sync_sheets', message)
+
+        self.manager._run_task(*self.thread.call_args.kwargs['args'])
+
+        # Cualquier worker lee el mismo estado desde la DB
+        record = BackgroundTaskRecord.objects.get(task_id=task.task_id)
+        self.assertEqual(record.status, BackgroundTaskRecord.STATUS_COMPLETED)
+        self.assertIsNone(record.active_type)
+        self.assertEqual(record.result['value'], 42)
+        done = self.manager.get_task(task.task_id)
+        self.assertEqual(done.status, TaskStatus.COMPLETED)
+        self.assertEqual(done.progress, 'Completado')
+        self.assertTrue(self.manager.start_task('sync_sheets', _sample_background_task, 1)[0])
+
+    def test_functions_without_progress_callback_still_run(self):
+        _, _, task = self.manager.start_task('verify_accounts', lambda: {'ok': True})
+        self.manager._run_task(*self.thread.call_args.kwargs['args'])
+        self.assertEqual(self.manager.get_task(task.task_id).result, {'ok': True})
+
+    def test_stale_lease_is_expired_and_type_released(self):
+        _, _, task = self.manager.start_task('sync_pyc_sheets', _sample_background_task, 1)
+        BackgroundTaskRecord.objects.filter(task_id=task.task_id).update(
+            leased_until=timezone.now() - timedelta(seconds=5),
+        )
+
+        stale = self.manager.get_task(task.task_id)
+        self.assertEqual(stale.status, TaskStatus.FAILED)
+        self.assertIn('lease', stale.error)
+        self.assertTrue(self.manager.start_task('sync_pyc_sheets', _sample_background_task, 1)[0])
+
+    def test_late_finish_does_not_override_takeover(self):
+        _, _, task = self.manager.start_task('sync_sheets', _sample_background_task, 1)
+        args = self.thread.call_args.kwargs['args']
+        BackgroundTaskRecord.objects.filter(task_id=task.task_id).update(lease_owner='otro-worker:1')
+        self.manager._run_task(*args)
+        self.assertEqual(BackgroundTaskRecord.objects.get(task_id=task.task_id).status, 'running')
+
+    @override_settings(BACKGROUND_TASKS_MODE='runner')
+    def test_runner_claims_queued_and_abandoned_tasks(self):
+        started, _, task = self.manager.start_task('sync_sheets', _sample_background_task, 5)
+        self.assertTrue(started)
+        self.assertEqual(task.status, TaskStatus.PENDING)
+        self.thread.assert_not_called()
+
+        record = self.manager.claim_next('runner-a:1')
+        self.assertEqual(record.task_id, task.task_id)
+        self.assertEqual(record.attempts, 1)
+        self.assertIsNone(self.manager.claim_next('runner-b:1'))
+
+        # runner-a muere: al vencer el lease otro runner la retoma
+        BackgroundTaskRecord.objects.filter(pk=record.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        retaken = self.manager.claim_next('runner-b:1')
+        self.assertEqual(retaken.lease_owner, 'runner-b:1')
+        self.assertEqual(retaken.attempts, 2)
+
+        self.manager.run_claimed(retaken, 'runner-b:1')
+        done = BackgroundTaskRecord.objects.get(pk=record.pk)
+        self.assertEqual(done.status, BackgroundTaskRecord.STATUS_COMPLETED)
+        self.assertEqual(done.result['value'], 10)
+
+    @override_settings(BACKGROUND_TASKS_MODE='runner')
+    def test_runner_command_runs_one_task(self):
+        _, _, task = self.manager.start_task('sync_sheets', _sample_background_task, 3)
+        out = StringIO()
+        call_command('run_background_tasks', '--once', '--worker-id', 'runner-test', stdout=out)
+        self.assertIn(task.task_id, out.getvalue())
+        self.assertEqual(self.manager.get_task(task.task_id).result['value'], 6)
+
+
+class AccountIndexFixtureMixin:
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        self.service = Service.objects.create(description='Netflix', perfil_quantity=5, price=100)
+        self.supplier = Supplier.objects.create(business=self.business, name='PyC', phone_number='+5218331111111')
+        self.seller = User.objects.create_user(username='seller', password='pass123')
+        self.buyer = User.objects.create_user(username='cliente', password='pass123')
+        self.now = timezone.now()
+
+    def _account(self, email, password='pass', customer=None):
+        return Account.objects.create(
+            business=self.business,
+            supplier=self.supplier,
+            created_by=self.seller,
+            modified_by=self.seller,
+            account_name=self.service,
+            expiration_date=self.now + timedelta(days=60),
+            email=email,
+            password=password,
+            customer=customer,
+        )
+
+    def _sale(self, account, days):
+        return Sale.objects.create(
+            business=self.business,
+            user_seller=self.seller,
+            customer=self.buyer,
+            account=account,
+            expiration_date=self.now + timedelta(days=days),
+            payment_amount=100,
+            invoice='test',
+        )
+
+    def _group(self, email, free, sold_days=()):
+        for days in sold_days:
+            self._sale(self._account(email, customer=self.buyer), days)
+        return [self._account(email) for _ in range(free)]
+
+    def _sell(self, account):
+        with self.captureOnCommitCallbacks(execute=True):
+            account.customer = self.buyer
+            account.save()
+
+
+class AccountAvailabilityIndexTests(AccountIndexFixtureMixin, TestCase):
+    def test_pop_order_matches_legacy_scan(self):
+        self._group('nueva@test.com', 2)
+        self._group('lejos@test.com', 3, sold_days=[75, 90])
+        self._group('media@test.com', 1, sold_days=[40])
+        self._group('cerca@test.com', 2, sold_days=[5])
+        self._group('vencida@test.com', 1, sold_days=[-3])
+        account_availability.rebuild_service(self.service.id)
+
+        for months in (1, 3, 1, 2, 1, 1, 3, 1, 1):
+            expected = Sales.find_best_account_legacy(self.service.id, months)
+            popped = Sales.find_best_account(self.service.id, months)
+            self.assertEqual(popped, expected)
+            self._sell(popped)
+        self.assertIsNone(Sales.find_best_account_legacy(self.service.id, 1))
+        self.assertIsNone(Sales.find_best_account(self.service.id, 1))
+
+    def test_search_better_acc_only_peeks(self):
+        first, second = self._group('vista@test.com', 2)
+        ok, suggested = Sales.search_better_acc(self.service.id, self.now + timedelta(days=30))
+        self.assertTrue(ok)
+        self.assertEqual(Sales.find_best_account(self.service.id, 1), suggested)
+        self.assertFalse(AccountSlot.objects.filter(held_until__isnull=False).exists())
+        # La vista previa no le quita la cuenta a una venta real
+        self.assertEqual(account_availability.pop_best_account(self.service.id), suggested)
+        self.assertNotEqual(Sales.find_best_account(self.service.id, 1), suggested)
+
+    def test_popped_account_is_not_handed_out_twice(self):
+        first, second = self._group('dupla@test.com', 2)
+        picked = {
+            account_availability.pop_best_account(self.service.id).pk,
+            account_availability.pop_best_account(self.service.id).pk,
+        }
+        self.assertEqual(picked, {first.pk, second.pk})
+        self.assertIsNone(account_availability.pop_best_account(self.service.id))
+
+    @override_settings(ACCOUNT_HOLD_SEC=60)
+    def test_unsold_pop_is_released_after_ttl(self):
+        account = self._group('solo@test.com', 1)[0]
+        self.assertEqual(account_availability.pop_best_account(self.service.id, now=self.now), account)
+        self.assertIsNone(account_availability.pop_best_account(self.service.id, now=self.now + timedelta(seconds=30)))
+        again = account_availability.pop_best_account(self.service.id, now=self.now + timedelta(seconds=90))
+        self.assertEqual(again, account)
+
+    def test_signals_keep_slots_in_sync(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = self._group('grupo@test.com', 2)
+        self.assertEqual(
+            list(AccountSlot.objects.order_by('account_id').values_list('empty_profiles', 'cut_score')),
+            [(2, account_availability.NO_CUT_SCORE)] * 2,
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.customer = self.buyer
+            first.save()
+            sale = self._sale(first, 20)
+        slot = AccountSlot.objects.get()
+        self.assertEqual(slot.account_id, second.pk)
+        self.assertEqual(slot.empty_profiles, 1)
+        self.assertEqual(slot.next_cut_at, sale.expiration_date)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.external_status = 'No Disponible'
+            second.save()
+        self.assertFalse(AccountSlot.objects.exists())
+
+    def test_stale_slot_is_skipped_and_dropped(self):
+        stale, fresh = self._group('x@test.com', 1) + self._group('y@test.com', 1, sold_days=[10])
+        account_availability.rebuild_service(self.service.id)
+        # update() masivo sin señales: el índice queda atrasado
+        Account.objects.filter(pk=stale.pk).update(status=False)
+        self.assertEqual(account_availability.pop_best_account(self.service.id), fresh)
+        self.assertFalse(AccountSlot.objects.filter(account_id=stale.pk).exists())
+
+    def test_rebuild_without_upsert_target_support_keeps_holds(self):
+        # MySQL no soporta bulk_create(update_conflicts=True, unique_fields=...)
+        first, second = self._group('mysql@test.com', 2)
+        account_availability.rebuild_service(self.service.id)
+        held = account_availability.pop_best_account(self.service.id)
+        self._sale(self._account('mysql@test.com', customer=self.buyer), 15)
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                patch.object(AccountSlot.objects, 'bulk_create', wraps=AccountSlot.objects.bulk_create) as bulk_create:
+            self.assertEqual(account_availability.rebuild_service(self.service.id), 2)
+            third = self._account('mysql@test.com')
+            account_availability.rebuild_service(self.service.id)
+        for call in bulk_create.call_args_list:
+            self.assertNotIn('unique_fields', call.kwargs)
+        slots = {slot.account_id: slot for slot in AccountSlot.objects.all()}
+        self.assertEqual(set(slots), {first.pk, second.pk, third.pk})
+        self.assertTrue(slots[held.pk].held_until)
+        self.assertEqual({slot.empty_profiles for slot in slots.values()}, {3})
+        self.assertNotEqual(slots[first.pk].cut_score, account_availability.NO_CUT_SCORE)
+
+
+class AccountReservationTests(AccountIndexFixtureMixin, TestCase):
+    def test_hold_is_released_when_sale_does_not_happen(self):
+        account = self._group('solo@test.com', 1)[0]
+        with hold_account(self.service.id) as reservation:
+            self.assertEqual(reservation.account, account)
+            self.assertIsNone(account_availability.pop_best_account(self.service.id))
+        slot = AccountSlot.objects.get(account=account)
+        self.assertIsNone(slot.held_until)
+        self.assertEqual(slot.hold_token, '')
+
+    def test_claim_refuses_an_assigned_account(self):
+        account = self._group('solo@test.com', 1)[0]
+        Account.objects.filter(pk=account.pk).update(customer=self.seller)
+        with self.assertRaises(AccountAlreadyAssigned):
+            claim_account(account, self.buyer)
+        self.assertEqual(Account.objects.get(pk=account.pk).customer, self.seller)
+
+    def test_api_sale_claims_account_inside_the_sale(self):
+        from adm.functions import account_reservations
+        from api.functions import salesApi
+
+        self._group('api@test.com', 2)
+        real_reserve = account_reservations.reserve_account
+        reserved = []
+
+        def racing_reserve(service_id, hold_seconds=None):
+            reservation = real_reserve(service_id, hold_seconds=hold_seconds)
+            reserved.append(reservation.account.pk)
+            if len(reserved) == 1:
+                # Otra venta (sin apartado) asigna la cuenta entre el apartado y la venta
+                Account.objects.filter(pk=reservation.account.pk).update(customer=self.seller)
+            return reservation
+
+        expiration = self.now + timedelta(days=30)
+        with patch.object(salesApi.Business.objects, 'get', return_value=self.business), \
+                patch.object(account_reservations, 'reserve_account', side_effect=racing_reserve):
+            sale = salesApi.SalesApi.SalesCreateApi(None, 'cliente', self.service.id, expiration, 'PayPal', 100, 'ORD-1')
+
+        self.assertEqual(len(reserved), 2)
+        self.assertEqual(sale.account_id, reserved[1])
+        self.assertEqual(Account.objects.get(pk=reserved[1]).customer, self.buyer)
+        self.assertEqual(Account.objects.get(pk=reserved[0]).customer, self.seller)
+        self.assertEqual(Sale.objects.filter(invoice='ORD-1').count(), 1)
+
+    def test_distributor_web_sale_claims_account_inside_the_sale(self):
+        from adm.functions import account_reservations
+
+        self.service.logo = 'services/netflix.png'
+        self.service.save()
+        self._group('web@test.com', 2)
+        real_reserve = account_reservations.reserve_account
+        reserved = []
+
+        def racing_reserve(service_id, hold_seconds=None):
+            reservation = real_reserve(service_id, hold_seconds=hold_seconds)
+            reserved.append(reservation.account.pk)
+            if len(reserved) == 1:
+                # Otra compra con créditos asigna la cuenta entre el apartado y la venta
+                Account.objects.filter(pk=reservation.account.pk).update(customer=self.seller)
+            return reservation
+
+        request = RequestFactory().post('/distributor_sale')
+        request.user = self.buyer
+        with patch('adm.functions.sales.BusinessInfo.data', return_value=self.business), \
+                patch('adm.functions.sales.Email.email_passwords'), \
+                patch.object(account_reservations, 'reserve_account', side_effect=racing_reserve):
+            ok, sale = Sales.web_sale_best_account(request, self.service.id, 100, 1)
+
+        self.assertTrue(ok)
+        self.assertEqual(len(reserved), 2)
+        self.assertEqual(Sale.objects.get(pk=sale['id']).account_id, reserved[1])
+        self.assertEqual(Account.objects.get(pk=reserved[1]).customer, self.buyer)
+        self.assertEqual(Account.objects.get(pk=reserved[0]).customer, self.seller)
+        self.assertEqual(Sale.objects.filter(invoice='Web').count(), 1)
+
+    def test_coupon_sale_refuses_an_assigned_account(self):
+        account = self._group('cupon@test.com', 1)[0]
+        Account.objects.filter(pk=account.pk).update(customer=self.seller)
+        cupon = SimpleNamespace(name='CUP-1', price=50, get_expiration_date=lambda now: now + timedelta(days=30))
+        request = RequestFactory().post('/cupon', {'code': 'CUP-1', 'serv': account.pk, 'customer': self.buyer.pk})
+        request.user = self.seller
+
+        with patch('adm.functions.sales.BusinessInfo.data', return_value=self.business), \
+                patch('adm.functions.sales.validate_coupon_from_code', return_value=cupon), \
+                patch('adm.functions.sales.consume_coupon') as consume, \
+                self.assertRaises(AccountAlreadyAssigned):
+            Sales.cupon_sale(request)
+
+        consume.assert_not_called()
+        self.assertFalse(Sale.objects.filter(invoice='CUP-1').exists())
+        self.assertEqual(Account.objects.get(pk=account.pk).customer, self.seller)
+
+    def test_allocate_retries_when_another_sale_wins(self):
+        first, second = self._group('dupla@test.com', 2)
+        attempts = []
+
+        def sell(account):
+            attempts.append(account.pk)
+            if len(attempts) == 1:
+                # Otra venta asigna la cuenta entre el apartado y la venta
+                Account.objects.filter(pk=account.pk).update(customer=self.seller)
+            claim_account(account, self.buyer)
+            return 'ok'
+
+        account, result = allocate(self.service.id, sell)
+        self.assertEqual(result, 'ok')
+        self.assertEqual(attempts, [first.pk, second.pk])
+        self.assertEqual(account, second)
+        self.assertEqual(Account.objects.get(pk=second.pk).customer, self.buyer)
+
+    def test_sell_best_account_creates_one_sale_per_account(self):
+        accounts = self._group('grupo@test.com', 2)
+        sale_kwargs = {
+            'customer': self.buyer,
+            'webhook_provider': 'Stripe',
+            'payment_type': 'stripe',
+            'payment_id': 'cs_test',
+            'expiration_date': self.now + timedelta(days=30),
+            'unit_price': 100,
+        }
+        with patch.object(Sales, '_send_account_delivery_whatsapp'):
+            sold = [Sales.sell_best_account(self.service.id, 1, **sale_kwargs) for _ in range(3)]
+        self.assertEqual({account.pk for account, _ in sold[:2]}, {account.pk for account in accounts})
+        self.assertEqual(sold[2], (None, None))
+        self.assertEqual(Sale.objects.filter(invoice='cs_test').count(), 2)
+        self.assertFalse(AccountSlot.objects.exists())
+
+
+class SalesSearchViewTests(TestCase):
+    def setUp(self):
+        self.business = Business.objects.create(
+            name='Test Biz',
+            email='biz@test.com',
+            url='https://test.biz',
+            phone_number='+5218331234567',
+        )
+        self.supplier = Supplier.objects.create(business=self.business, name='PyC', phone_number='+5218331111111')
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', 'pass123')
+        self.services = [
+            Service.objects.create(description=name, perfil_quantity=5, price=100)
+            for name in ('Netflix', 'Disney', 'Max')
+        ]
+        now = timezone.now()
+        self.expected = {}
+        for service_index, service in enumerate(self.services):
+            accounts = []
+            for index in range(7):
+                domain = 'gmail.com' if index % 3 == 0 else 'berberdna.tn'
+                accounts.append(Account.objects.create(
+                    business=self.business,
+                    supplier=self.supplier,
+                    created_by=self.admin,
+                    modified_by=self.admin,
+                    account_name=service,
+                    expiration_date=now + timedelta(days=10 + index % 4),
+                    email=f's{service_index}a{index}@{domain}',
+                    password='pass',
+                ))
+            self.expected[service.id] = accounts
+        self.client.force_login(self.admin)
+
+    def _post(self, service_ids, **extra):
+        data = {'data[]': [json.dumps({'service': str(pk), 'duration': '1'}) for pk in service_ids]}
+        data.update(extra)
+        response = self.client.post(reverse('adm:sales_search'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def _legacy_order(self, service_ids):
+        priority = {'berberdna.tn': 1, 'gmail.com': 5}
+        ordered = []
+        for service_id in service_ids:
+            accounts = sorted(
+                self.expected[service_id],
+                key=lambda acc: (priority[acc.email.split('@')[1]], -acc.expiration_date.timestamp(), -acc.id),
+            )
+            ordered.extend(acc.id for acc in accounts)
+        return ordered
+
+    def test_cursor_pages_cover_selection_in_order(self):
+        service_ids = [self.services[2].id, self.services[0].id]
+        with CaptureQueriesContext(connection) as single:
+            self._post(service_ids[:1], limit='4')
+        with CaptureQueriesContext(connection) as queries:
+            page = self._post(service_ids, limit='4')
+        # Las consultas no crecen con los servicios elegidos
+        self.assertEqual(len(queries), len(single))
+        self.assertEqual(page['total'], 14)
+        self.assertEqual(page['fields'][:3], ['id', 'service', 'email'])
+        self.assertEqual(set(page['services']), {str(pk) for pk in service_ids})
+
+        seen = [row[0] for row in page['rows']]
+        while page['next']:
+            page = self._post(service_ids, limit='4', cursor=page['next'])
+            self.assertNotIn('total', page)
+            seen.extend(row[0] for row in page['rows'])
+        self.assertEqual(seen, self._legacy_order(service_ids))
+
+    def test_email_filter_runs_on_server(self):
+        page = self._post([service.id for service in self.services], q='@GMAIL')
+        self.assertEqual(page['total'], 9)
+        self.assertTrue(all(row[2].endswith('@gmail.com') for row in page['rows']))
+        self.assertIsNone(page['next'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.post(
+            reverse('adm:sales_search'),
+            {'data[]': [json.dumps({'service': self.services[0].id})], 'cursor': 'nope'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTests(AccountIndexFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        UserDetail.objects.create(business=self.business, user=self.seller, phone_number='8330000000', lada=52, country='MX')
+        self.seller.is_staff = True
+        self.seller.is_superuser = True
+        self.seller.save()
+        for index, profile in enumerate([None, 3, 1, None, 2, 1, 5, None, 4, 2, 1, 3, 2]):
+            account = self._account(f'k{index}@test.com')
+            Account.objects.filter(pk=account.pk).update(
+                profile=profile,
+                created_at=self.now - timedelta(days=index % 3),
+            )
+        self.accounts = Account.objects.filter(business=self.business)
+        self.expected = list(self.accounts.order_by('-created_at', 'profile', 'id').values_list('id', flat=True))
+
+    def test_pages_follow_ordering_forward_and_backward(self):
+        paginator = KeysetPaginator(self.accounts, ('-created_at', 'profile'), per_page=4)
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([account.id for account in page])
+            self.assertEqual(page.count, len(self.expected))
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(ids) for ids in pages], [4, 4, 4, 1])
+
+        back = []
+        while page.has_previous:
+            page = paginator.page(page.previous_cursor)
+            back.insert(0, [account.id for account in page])
+        self.assertEqual(back, pages[:-1])
+        self.assertFalse(page.has_previous)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = paginate(self.accounts, ('-created_at', 'profile'), 'no-es-cursor', per_page=5)
+        self.assertEqual([account.id for account in page], self.expected[:5])
+        self.assertFalse(page.has_previous)
+
+    def test_accounts_view_pages_with_cursor(self):
+        self.client.force_login(self.seller)
+        first = self.client.get(reverse('adm:accounts'))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([account.id for account in first.context['venues']], self.expected)
+
+        page = paginate(self.accounts, ('-created_at', 'profile'), per_page=4)
+        response = self.client.get(reverse('adm:accounts'), {'email': 'test.com', 'cursor': page.next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([account.id for account in response.context['venues']], self.expected[4:13])
+        self.assertContains(response, 'en total')
+
+    def test_receivable_view_pages_with_cursor(self):
+        accounts = list(self.accounts.order_by('id'))
+        for index, account in enumerate(accounts[:5]):
+            self._sale(account, -index - 1)
+        self.client.force_login(self.seller)
+        with patch.object(ReceivableView, 'paginate_by', 2):
+            first = self.client.get(reverse('adm:receivable'))
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(first.context['left'], 5)
+            cursor = first.context['page_obj'].next_cursor
+            second = self.client.get(reverse('adm:receivable'), {'cursor': cursor})
+        self.assertEqual(second.status_code, 200)
+        expected = [account.id for account in accounts[:5]]
+        self.assertEqual(
+            [sale.account_id for sale in first.context['object_list']] + [sale.account_id for sale in second.context['object_list']],
+            expected[:4],
+        )
+
+
+class QueryPlanCheckTests(TestCase):
+    def test_canonical_queries_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('[OK] available_accounts', out.getvalue())
+        self.assertIn('[OK] sales_in_range', out.getvalue())
+
+    def test_full_scan_fails(self):
+        unindexed = query_plans.CanonicalQuery('invoice', 'test', lambda now: Sale.objects.filter(invoice='x'))
+        with patch.object(query_plans, 'CANONICAL_QUERIES', [unindexed]):
+            with self.assertRaises(CommandError):
+                call_command('check_query_plans', stdout=StringIO())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'audience-tests'}})
+class AudienceRecommendationTests(AccountIndexFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        audience_features.invalidate_features(now=self.now)
+        self.disney = Service.objects.create(description='Disney', perfil_quantity=5, price=100)
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', 'pass123')
+        self.customers = {}
+        for name, country, phone, purchases in [
+            ('fiel', 'México', '8331111111', [(self.service, 100), (self.service, 130), (self.disney, 60)]),
+            ('reciente', 'México', '8332222222', [(self.service, 1)]),
+            ('sin_tel', 'México', '', [(self.service, 90)]),
+            ('enfriado', 'México', '8333333333', [(self.service, 80)]),
+            ('chile', 'Chile', '8334444444', [(self.service, 70)]),
+        ]:
+            user = User.objects.create_user(username=name, password='pass123')
+            UserDetail.objects.create(business=self.business, user=user, phone_number=phone, lada=52, country=country)
+            for service, days_ago in purchases:
+                self._purchase(user, service, days_ago)
+            self.customers[name] = user
+        self.strategy = {
+            'segment_type': 'general',
+            'min_days_inactive': 0,
+            'max_days_inactive': 3650,
+            'require_no_active_sales': False,
+            'require_target_service_inactive': False,
+            'require_service_history': False,
+            'exclude_recent_same_service_days': 2,
+            'min_total_orders': 0,
+            'max_total_orders': 9999,
+            'min_total_revenue': 0,
+            'max_active_sales_now': 999,
+            'countries_include': [],
+            'countries_exclude': ['chile'],
+            'service_keywords': [],
+        }
+
+    def _purchase(self, user, service, days_ago):
+        account = Account.objects.create(
+            business=self.business,
+            supplier=self.supplier,
+            created_by=self.seller,
+            modified_by=self.seller,
+            account_name=service,
+            expiration_date=self.now + timedelta(days=30),
+            email=f'{user.username}{days_ago}@test.com',
+            password='pass',
+        )
+        sale = Sale.objects.create(
+            business=self.business,
+            user_seller=self.seller,
+            customer=user,
+            account=account,
+            expiration_date=self.now - timedelta(days=days_ago) + timedelta(days=30),
+            payment_amount=100,
+            invoice='test',
+            status=False,
+        )
+        Sale.objects.filter(pk=sale.pk).update(created_at=self.now - timedelta(days=days_ago))
+
+    def _campaign(self, name='Regresa a Netflix'):
+        return MarketingCampaign.objects.create(name=name, channel='whatsapp', created_by=self.admin)
+
+    def test_rules_exclude_and_recommendations_are_bulk_written(self):
+        campaign = self._campaign()
+        cooldown = {self.customers['enfriado'].id}
+        with patch('adm.views._infer_audience_strategy', return_value=dict(self.strategy)), \
+                patch('adm.views.users_with_active_cooldown', return_value=cooldown):
+            _build_audience_recommendations(campaign)
+
+        selected = list(campaign.recommendations.values_list('customer__username', flat=True))
+        self.assertEqual(selected, ['fiel'])
+        stats = campaign.audience_filters['audience_filter_stats']
+        self.assertEqual(stats['total_candidates'], 5)
+        self.assertEqual(stats['selected'], 1)
+        self.assertEqual(stats['excluded_recent_same_service'], 1)
+        self.assertEqual(stats['excluded_no_phone'], 1)
+        self.assertEqual(stats['excluded_cooldown'], 1)
+        self.assertEqual(stats['excluded_country_exclude'], 1)
+
+        recommendation = campaign.recommendations.get()
+        self.assertEqual(recommendation.total_orders, 3)
+        self.assertEqual(float(recommendation.score), 300 * 0.03 + 3 * 3 + 120 + min(2 * 4, 32))
+        self.assertIn('Historial servicio=2', recommendation.reason)
+
+    def test_target_service_rules_use_per_service_columns(self):
+        strategy = dict(self.strategy, require_target_service_inactive=True, require_service_history=True)
+        self._purchase(self.customers['chile'], self.disney, 3)
+        Sale.objects.filter(customer=self.customers['chile'], account__account_name=self.disney).update(
+            status=True, expiration_date=self.now + timedelta(days=10),
+        )
+        features = audience_features.build_features(now=self.now)
+        _, stats = audience_features.score_audience(
+            features, strategy, {self.disney.id}, channel='email', now=self.now,
+        )
+        # Solo fiel y chile compraron Disney; chile lo tiene activo
+        self.assertEqual(stats['excluded_service_history'], 3)
+        self.assertEqual(stats['excluded_target_active'], 1)
+
+    def test_feature_matrix_is_cached_per_day_and_query_count_is_flat(self):
+        with CaptureQueriesContext(connection) as small:
+            audience_features.build_features(now=self.now)
+        for index in range(10):
+            user = User.objects.create_user(username=f'extra{index}', password='pass123')
+            UserDetail.objects.create(business=self.business, user=user, phone_number='8330000000', lada=52, country='MX')
+            self._purchase(user, self.service, 40 + index)
+        with CaptureQueriesContext(connection) as large:
+            audience_features.build_features(now=self.now)
+        self.assertEqual(len(large), len(small))
+
+        audience_features.invalidate_features(now=self.now)
+        with patch.object(audience_features, 'build_features', wraps=audience_features.build_features) as build:
+            first = audience_features.load_features(now=self.now)
+            second = audience_features.load_features(now=self.now + timedelta(minutes=5))
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(len(first), len(second))
+
+
+class CustomerFeaturesTests(AccountIndexFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='otro', password='pass123')
+        self.sale = self._sale(self._account('a@test.com', customer=self.buyer), 30)
+        Sale.objects.filter(pk=self.sale.pk).update(created_at=self.now - timedelta(days=90))
+        self._sale(self._account('b@test.com', customer=self.buyer), 10)
+
+    def test_incremental_refresh_tracks_new_changed_and_deleted_sales(self):
+        self.assertEqual(customer_features.dirty_customer_ids(), [self.buyer.id])
+        call_command('refresh_customer_features', stdout=StringIO())
+        self.assertEqual(customer_features.dirty_customer_ids(), [])
+        row = CustomerFeatures.objects.get(customer=self.buyer)
+        self.assertEqual((row.total_orders, row.total_revenue), (2, 200))
+        self.assertEqual(row.first_purchase, Sale.objects.get(pk=self.sale.pk).created_at)
+        self.assertEqual(row.last_service_id, self.service.id)
+        self.assertEqual(row.services[str(self.service.id)]['orders'], 2)
+        self.assertEqual(len(row.active_expirations), 2)
+
+        # Venta sin señales (bulk_create): se detecta por id
+        Sale.objects.bulk_create([Sale(
+            business=self.business, user_seller=self.seller, customer=self.other,
+            account=self._account('c@test.com', customer=self.other),
+            expiration_date=self.now + timedelta(days=5), payment_amount=50, invoice='bulk',
+        )])
+        # Cambio de una venta existente: la señal marca al cliente
+        self.sale.status = False
+        self.sale.save()
+        self.assertEqual(customer_features.dirty_customer_ids(), sorted([self.buyer.id, self.other.id]))
+
+        self.assertEqual(customer_features.refresh_pending(), 2)
+        self.assertEqual(len(CustomerFeatures.objects.get(customer=self.buyer).active_expirations), 1)
+        self.assertEqual(CustomerFeatures.objects.get(customer=self.other).total_orders, 1)
+
+        Sale.objects.filter(customer=self.other).delete()
+        customer_features.mark_stale([self.other.id])
+        customer_features.refresh_pending()
+        self.assertFalse(CustomerFeatures.objects.filter(customer=self.other).exists())
+
+    def test_churn_reads_store_with_flat_query_count(self):
+        filters = CRMAnalytics.parse_filters({'preset': 'last_90_days'})
+        customer_features.refresh_pending()
+        CRMAnalytics.get_churn_customers(filters)
+        with CaptureQueriesContext(connection) as few:
+            CRMAnalytics.get_churn_customers(filters)
+        for index in range(5):
+            user = User.objects.create_user(username=f'churn{index}', password='pass123')
+            sale = self._sale(self._account(f'churn{index}@test.com', customer=user), 5)
+            Sale.objects.filter(pk=sale.pk).update(customer=user, created_at=self.now - timedelta(days=60 + index))
+        customer_features.refresh_pending()
+        with CaptureQueriesContext(connection) as many:
+            churn = CRMAnalytics.get_churn_customers(filters)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual([row['username'] for row in churn], [f'churn{index}' for index in range(4, -1, -1)])
+
+
+    def test_refresh_without_upsert_target_support(self):
+        customer_features.refresh_pending()
+        self._sale(self._account('c@test.com', customer=self.buyer), 20)
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            self.assertEqual(customer_features.refresh_pending(), 1)
+        row = CustomerFeatures.objects.get(customer=self.buyer)
+        self.assertEqual((row.total_orders, row.total_revenue, row.stale), (3, 300, False))
+
+    def test_empty_store_falls_back_to_sales(self):
+        for index in range(2):
+            user = User.objects.create_user(username=f'churn{index}', password='pass123')
+            sale = self._sale(self._account(f'churn{index}@test.com', customer=user), 5)
+            Sale.objects.filter(pk=sale.pk).update(customer=user, created_at=self.now - timedelta(days=60 + index))
+        comeback = self._sale(self._account('d@test.com', customer=self.buyer), 30)
+        Sale.objects.filter(pk=comeback.pk).update(created_at=self.now - timedelta(days=20))
+        filters = CRMAnalytics.parse_filters({'preset': 'last_30_days'})
+
+        customer_features.refresh_pending()
+        expected_churn = CRMAnalytics.get_churn_customers(filters)
+        expected_recovered = CRMAnalytics.get_recovered_customers(filters)
+        self.assertEqual([row['username'] for row in expected_churn], ['churn1', 'churn0'])
+        self.assertEqual([row['customer_id'] for row in expected_recovered], [self.buyer.id])
+
+        # Refresco que falla (p. ej. el backend) y store vacío
+        CustomerFeatures.objects.all().delete()
+        with patch('adm.functions.customer_features.ensure_fresh'):
+            self.assertEqual(CRMAnalytics.get_churn_customers(filters), expected_churn)
+            self.assertEqual(CRMAnalytics.get_recovered_customers(filters), expected_recovered)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PromotionEngineTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.delete(promotion_engine.VERSION_KEY)
+        promotion_engine.reset()
+        self.now = timezone.now()
+        self.services = [
+            Service.objects.create(description=f'Servicio {index}', perfil_quantity=1, price=100 + index * 15)
+            for index in range(5)
+        ]
+        s0, s1, s2, s3, s4 = self.services
+
+        self.especifico_viejo = self._promo('Viejo', 'especificos', [s0, s1], porcentaje_descuento=10, days_ago=5)
+        self.especifico_nuevo = self._promo('Nuevo', 'especificos', [s1], tipo_descuento='monto_fijo', monto_descuento=30, days_ago=1)
+        self.excepto = self._promo('Excepto', 'excepto', [s2], porcentaje_descuento=20, days_ago=3)
+        self._promo('3x2', 'especificos', [s3], tipo_descuento='nxm', cantidad_llevar=3, cantidad_pagar=2, days_ago=2)
+        self._promo('Inactiva', 'todos', [], porcentaje_descuento=90, status='inactiva', days_ago=0)
+        expirada = self._promo('Expirada', 'todos', [], porcentaje_descuento=80, days_ago=4)
+        futura = self._promo('Futura', 'especificos', [s4], porcentaje_descuento=70, days_ago=4)
+        # Sin pasar por save(): quedan activas con fechas fuera de rango
+        Promocion.objects.filter(pk=expirada.pk).update(fecha_fin=self.now - timedelta(hours=1))
+        Promocion.objects.filter(pk=futura.pk).update(fecha_inicio=self.now + timedelta(hours=1))
+        promotion_engine.bump_version()
+
+    def tearDown(self):
+        promotion_engine.reset()
+
+    def _promo(self, nombre, aplicacion, servicios, days_ago, status='activa', **fields):
+        fields.setdefault('tipo_descuento', 'porcentaje')
+        promocion = Promocion.objects.create(nombre=nombre, aplicacion=aplicacion, status=status, **fields)
+        promocion.servicios.set(servicios)
+        Promocion.objects.filter(pk=promocion.pk).update(created_at=self.now - timedelta(days=days_ago))
+        return promocion
+
+    def _assert_parity(self):
+        for servicio in Service.objects.all():
+            for cantidad in (1, 2, 3, 4, 7):
+                compiled = PromocionManager.calcular_precio_con_descuento(servicio, cantidad)
+                legacy = PromocionManager.calcular_precio_con_descuento_legacy(servicio, cantidad)
+                self.assertEqual(getattr(compiled.pop('promocion'), 'pk', None), getattr(legacy.pop('promocion'), 'pk', None))
+                self.assertEqual(compiled, legacy, (servicio.description, cantidad))
+
+    def test_compiled_resolver_matches_query_path(self):
+        s0, s1, s2, s3, s4 = self.services
+        self._assert_parity()
+        self.assertEqual(PromocionManager.obtener_promocion_activa(s0).pk, self.especifico_viejo.pk)
+        self.assertEqual(PromocionManager.obtener_promocion_activa(s1).pk, self.especifico_nuevo.pk)
+        self.assertIsNone(PromocionManager.obtener_promocion_activa(s2))
+        self.assertEqual(PromocionManager.obtener_promocion_activa(s4).pk, self.excepto.pk)
+
+        # Con una promoción para todos, gana sobre la de "excepto"
+        self._promo('Todos', 'todos', [], porcentaje_descuento=5, days_ago=6)
+        self._assert_parity()
+        self.assertEqual(PromocionManager.obtener_promocion_activa(s2).nombre, 'Todos')
+
+    def test_catalog_and_cart_price_without_per_service_queries(self):
+        servicios = list(Service.objects.all())
+        with self.assertNumQueries(1):
+            PromocionManager.aplicar_promociones_a_servicios(servicios)
+        with self.assertNumQueries(0):
+            catalogo = PromocionManager.aplicar_promociones_a_servicios(servicios)
+        self.assertEqual(catalogo[1]['precio_final'], servicios[1].price - 30)
+
+        request = RequestFactory().get('/')
+        request.session = {'cart_number': {
+            str(index): {'product_id': servicio.id, 'price': servicio.price}
+            for index, servicio in enumerate(servicios)
+        }}
+        with self.assertNumQueries(1):
+            carrito = calcular_descuento_carrito(request)
+        self.assertEqual(carrito['tipo_descuento'], 'promocion')
+        with self.assertNumQueries(0):
+            efectivo = calcular_descuento_efectivo(request, servicios[0])
+        self.assertEqual((efectivo['precio_final'], efectivo['nombre_descuento']), (90, 'Viejo'))
+
+    def test_version_and_time_boundaries_invalidate_table(self):
+        s0, s1, s2, s3, s4 = self.services
+        first = promotion_engine.get_compiled()
+        self.assertIs(promotion_engine.get_compiled(), first)
+        self.assertEqual(first.expires_at, self.now + timedelta(hours=1))
+
+        # Cambiar los servicios de una promoción (m2m) invalida
+        self.excepto.servicios.add(s4)
+        self.assertIsNone(PromocionManager.obtener_promocion_activa(s4))
+
+        self.especifico_nuevo.delete()
+        self.assertEqual(PromocionManager.obtener_promocion_activa(s1).pk, self.especifico_viejo.pk)
+
+        # Al llegar la fecha de inicio de la promoción "Futura" se recompila
+        later = self.now + timedelta(hours=2)
+        self.assertEqual(promotion_engine.resolve(s4, now=later).nombre, 'Futura')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RequestScopedLookupTests(AccountIndexFixtureMixin, TestCase):
+    TABLES = ('adm_business', 'adm_credits', 'adm_affiliate')
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        promotion_engine.reset()
+        super().setUp()
+        Business.objects.filter(pk=self.business.pk).update(id=1)
+        self.business = Business.objects.get(pk=1)
+        business_cache.invalidate_business()
+        self.admin = User.objects.create_superuser(username='jefe', password='pass123', email='jefe@test.com')
+        UserDetail.objects.create(business=self.business, user=self.admin, phone_number='8330000000', lada=52, country='MX')
+        Credits.objects.create(customer=self.admin, credits=50)
+
+    def tearDown(self):
+        promotion_engine.reset()
+
+    def _lookups(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return {
+            table: sum(f'FROM "{table}"' in query['sql'] for query in queries.captured_queries)
+            for table in self.TABLES
+        }
+
+    def test_storefront_and_admin_pages_look_up_once_per_request(self):
+        self.client.login(username='jefe', password='pass123')
+        pages = [
+            '/',
+            reverse('service_detail', args=[self.service.pk]),
+            reverse('shop'),
+            reverse('adm:index'),
+            reverse('adm:accounts'),
+        ]
+        for url in pages:
+            for table, count in self._lookups(url).items():
+                self.assertLessEqual(count, 1, (url, table))
+        # Con la caché de proceso caliente el negocio ya no se consulta
+        self.assertEqual(self._lookups(reverse('service_detail', args=[self.service.pk]))['adm_business'], 0)
+
+    def test_business_cache_follows_signals_and_request_sees_new_credits(self):
+        self.assertEqual(BusinessInfo.data().name, 'Test Biz')
+        with self.assertNumQueries(0):
+            BusinessInfo.data()
+        self.business.name = 'Nuevo nombre'
+        self.business.save()
+        self.assertEqual(BusinessInfo.data().name, 'Nuevo nombre')
+
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        token = request_cache.begin()
+        try:
+            self.assertEqual(BusinessInfo.credits(request), 50)
+            with self.assertNumQueries(0):
+                BusinessInfo.credits(request)
+            Credits.objects.create(customer=self.admin, credits=-20)
+            self.assertEqual(BusinessInfo.credits(request), 30)
+        finally:
+            request_cache.end(token)
+
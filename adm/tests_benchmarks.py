@@ -0,0 +1,573 @@
+"""
+Benchmarks con volúmenes grandes de datos.
+
+No corren por defecto; activarlos con:
+    CM_RUN_BENCHMARKS=1 python manage.py test adm.tests_benchmarks
+"""
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from calendar import month_name
+from datetime import datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db.models import Sum
+from django.db import connection, connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from adm.functions.account_availability import rebuild_service
+from adm.functions import audience_features
+from adm.functions.account_search import search_response
+from adm.functions.dashboard import Dashboard
+from adm.functions.keyset_pagination import KeysetPaginator, encode_cursor
+from adm.functions.sales import Sales
+from adm.functions.sync_pyc_sheets import PycSheetSyncService, SheetRow
+from adm.functions.whatsapp_delivery_log import read_whatsapp_delivery_log, rebuild_index
+from adm.models import Account, Bank, Business, PaymentMethod, Sale, Service, Supplier, UserDetail
+
+
+RUN_BENCHMARKS = os.getenv('CM_RUN_BENCHMARKS', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _timed(fn, *args, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class _QueryCounter:
+    """Cuenta consultas sin depender del log de DEBUG (limitado a 9000 entradas)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _report(name, before, after):
+    ratio = before / after if after else float('inf')
+    print(f'\n[benchmark] {name}: antes={before * 1000:.1f}ms despues={after * 1000:.1f}ms ({ratio:.1f}x)')
+
+
+class BenchmarkFixtureMixin:
+    """Crea negocio, servicio, proveedor y vendedor base para los benchmarks."""
+
+    def _create_base(self):
+        self.business = Business.objects.create(
+            name='Bench Biz',
+            email='bench@test.com',
+            url='https://bench.test',
+            phone_number='+5218331234567',
+        )
+        self.service = Service.objects.create(description='Netflix', perfil_quantity=5, price=100)
+        self.supplier = Supplier.objects.create(business=self.business, name='Bench', phone_number='+5218331111111')
+        self.seller = User.objects.create_user(username='bench-seller', password='pass123')
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+class NewUserSalesBenchmark(BenchmarkFixtureMixin, TransactionTestCase):
+    USERS = 50_000
+    SALES = 200_000
+
+    @staticmethod
+    def _legacy_last_year_sales_new_user():
+        # Implementación anterior: 13 meses × (aggregate + count) con startswith
+        result = []
+        date = datetime.now()
+        for i in range(13):
+            month_key = (date - relativedelta(months=i)).strftime('%Y-%m')
+            sales = Sale.objects.filter(
+                customer__date_joined__startswith=month_key, payment_amount__gt=0, customer__userdetail__lada=52)
+            total = sales.aggregate(Sum('payment_amount'))
+            month = datetime.strptime(month_key, '%Y-%m').month
+            result.append({'date': month_name[month], 'sales': total['payment_amount__sum'], 'new_users': sales.count()})
+        return result
+
+    def setUp(self):
+        self._create_base()
+        rng = random.Random(42)
+        now = timezone.now()
+        # Registro a mediodía local para que el mes local y el de UTC coincidan
+        noon = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time())) + timedelta(hours=12)
+
+        users = [
+            User(username=f'bench-user-{i}', date_joined=noon - timedelta(days=rng.randint(0, 720)))
+            for i in range(self.USERS)
+        ]
+        User.objects.bulk_create(users, batch_size=5000)
+        users = list(User.objects.filter(username__startswith='bench-user-'))
+        UserDetail.objects.bulk_create(
+            [
+                UserDetail(business=self.business, user=user, phone_number=f'83{i:08d}', lada=rng.choice([52, 52, 56]), country='MX')
+                for i, user in enumerate(users)
+            ],
+            batch_size=5000,
+        )
+        account = Account.objects.create(
+            business=self.business,
+            supplier=self.supplier,
+            created_by=self.seller,
+            modified_by=self.seller,
+            account_name=self.service,
+            expiration_date=now + timedelta(days=30),
+            email='bench@test.com',
+            password='secret',
+        )
+        Sale.objects.bulk_create(
+            [
+                Sale(
+                    business=self.business,
+                    user_seller=self.seller,
+                    customer=rng.choice(users),
+                    account=account,
+                    expiration_date=now + timedelta(days=30),
+                    payment_amount=rng.choice([0, 85, 100, 150]),
+                    invoice='BENCH',
+                )
+                for _ in range(self.SALES)
+            ],
+            batch_size=5000,
+        )
+
+    def test_last_year_sales_new_user(self):
+        before, legacy = _timed(self._legacy_last_year_sales_new_user)
+        after, current = _timed(Dashboard.last_year_sales_new_user)
+        _report('last_year_sales_new_user', before, after)
+        self.assertEqual(sum(row['new_users'] for row in current), sum(row['new_users'] for row in legacy))
+
+    def test_sales_per_day_new_user(self):
+        day = timezone.localdate() - timedelta(days=3)
+
+        def legacy(value):
+            key = value.strftime('%Y-%m-%d')
+            sales = Sale.objects.filter(customer__date_joined__startswith=key, payment_amount__gt=0, customer__userdetail__lada=52)
+            total = sales.aggregate(Sum('payment_amount'))['payment_amount__sum'] or 0
+            return {key: {'sales': total, 'new_users': sales.count()}}
+
+        before, _ = _timed(legacy, day)
+        after, _ = _timed(Dashboard.sales_per_day_new_user, day)
+        _report('sales_per_day_new_user', before, after)
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+class WhatsAppDeliveryLogBenchmark(SimpleTestCase):
+    # Tamaños del histórico; CM_BENCH_LOG_LINES=50000,500000,5000000 para la corrida completa
+    SIZES = [int(size) for size in os.getenv('CM_BENCH_LOG_LINES', '50000,500000').split(',') if size.strip()]
+    LINES_PER_DAY = 20_000
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write_history(self, lines):
+        segments_dir = os.path.join(self.tmpdir, str(lines), 'segments')
+        os.makedirs(segments_dir)
+        legacy_path = os.path.join(self.tmpdir, str(lines), 'legacy.jsonl')
+        start = datetime.fromisoformat('2026-01-01T00:00:00+00:00')
+        step = timedelta(seconds=86400 / self.LINES_PER_DAY)
+        days = []
+        with open(legacy_path, 'w', encoding='utf-8') as legacy:
+            for day_number in range(0, lines, self.LINES_PER_DAY):
+                day_start = start + step * day_number
+                day = day_start.date().isoformat()
+                chunk = []
+                for offset in range(min(self.LINES_PER_DAY, lines - day_number)):
+                    chunk.append(json.dumps({
+                        'timestamp': (day_start + step * offset).isoformat(),
+                        'event': 'sent',
+                        'event_id': f'evt-{day_number + offset}',
+                        'full_phone': f'521833{(day_number + offset) % 10_000_000:07d}',
+                        'detail': 'Mensaje de prueba para el benchmark',
+                    }) + '\n')
+                block = ''.join(chunk)
+                legacy.write(block)
+                with open(os.path.join(segments_dir, f'{day}.jsonl'), 'w', encoding='utf-8') as segment:
+                    segment.write(block)
+                days.append(day)
+        return segments_dir, legacy_path, days
+
+    @staticmethod
+    def _legacy_tail(path, limit=200):
+        # Implementación anterior: parsear todo el archivo y quedarse con los últimos N
+        rows = []
+        with open(path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                rows.append(json.loads(line))
+        return list(reversed(rows[-limit:]))
+
+    def test_tail_read_is_flat_with_history_size(self):
+        for lines in self.SIZES:
+            segments_dir, legacy_path, days = self._write_history(lines)
+            with override_settings(
+                BASE_DIR=os.path.join(self.tmpdir, str(lines)),
+                WHATSAPP_DELIVERY_LOG_DIR=segments_dir,
+            ):
+                for day in days:
+                    rebuild_index(day)
+                after, rows = _timed(read_whatsapp_delivery_log, 200)
+                middle = rows[-1]['timestamp']
+                paged, _ = _timed(lambda: read_whatsapp_delivery_log(200, before=middle))
+                phone, _ = _timed(lambda: read_whatsapp_delivery_log(50, phone=rows[0]['full_phone']), repeat=1)
+            self.assertEqual(len(rows), 200)
+            before, legacy_rows = _timed(self._legacy_tail, legacy_path, repeat=1)
+            self.assertEqual([row['event_id'] for row in legacy_rows], [row['event_id'] for row in rows])
+            _report(f'whatsapp_delivery_log tail 200 ({lines} líneas)', before, after)
+            print(f'[benchmark] página siguiente={paged * 1000:.1f}ms filtro teléfono={phone * 1000:.1f}ms')
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+class PycSheetSyncBenchmark(BenchmarkFixtureMixin, TransactionTestCase):
+    ROWS = int(os.getenv('CM_BENCH_PYC_ROWS', '20000'))
+
+    def setUp(self):
+        self._create_base()
+        self.supplier.name = 'PyC'
+        self.supplier.save(update_fields=['name'])
+        now = timezone.now()
+        Account.objects.bulk_create(
+            [
+                Account(
+                    business=self.business,
+                    supplier=self.supplier,
+                    created_by=self.seller,
+                    modified_by=self.seller,
+                    account_name=self.service,
+                    expiration_date=now + timedelta(days=30),
+                    email=f'pyc{i}@bench.test',
+                    password='old-pass',
+                    profile=1,
+                    external_status='Disponible',
+                )
+                for i in range(self.ROWS)
+            ],
+            batch_size=5000,
+        )
+        rng = random.Random(7)
+        rows = {}
+        for i in range(self.ROWS):
+            email = f'pyc{i}@bench.test'
+            roll = rng.random()
+            # ~20% cambia clave, ~10% cambia estado, ~5% cambia perfil
+            rows[email] = SheetRow(
+                email=email,
+                password=f'new-pass-{i}' if roll < 0.2 else 'old-pass',
+                status='Caida' if 0.2 <= roll < 0.3 else 'Activa',
+                profile=2 if 0.3 <= roll < 0.35 else 1,
+            )
+        self.tab_index = {'Netflix': rows}
+        self.loose_index = {'Netflix': {email: [row] for email, row in rows.items()}}
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _reset(self):
+        Account.objects.update(password='old-pass', profile=1, external_status='Disponible', status=True)
+
+    def _legacy_apply(self, accounts):
+        # Implementación anterior: save(update_fields) por cuenta + consulta de venta por cambio de clave
+        service = PycSheetSyncService(sheet_id='bench')
+        for account in accounts:
+            row, _ = service._find_row_with_double_check(account, 'Netflix', self.tab_index, self.loose_index)
+            changes = []
+            if row.status == 'Caida' and account.external_status != 'Caida':
+                account.external_status = 'Caida'
+                changes.append('external_status')
+            if account.password != row.password:
+                account.password = row.password
+                changes.append('password')
+                Sale.objects.filter(account=account, status=True).order_by('-expiration_date').first()
+            if account.profile != row.profile:
+                account.profile = row.profile
+                changes.append('profile')
+            if changes:
+                account.save(update_fields=changes)
+
+    def test_apply_20k_rows(self):
+        # Se mide solo la etapa de escritura: la carga de cuentas es igual en ambas versiones
+        history = os.path.join(self.tmpdir, 'history.jsonl')
+        with patch('adm.functions.sync_pyc_sheets._password_history_path', return_value=history):
+            accounts = PycSheetSyncService(sheet_id='bench')._load_accounts()
+            legacy_queries = _QueryCounter()
+            with connection.execute_wrapper(legacy_queries):
+                before, _ = _timed(self._legacy_apply, accounts, repeat=1)
+            self._reset()
+
+            service = PycSheetSyncService(sheet_id='bench')
+            accounts = service._load_accounts()
+            diff_time, result = _timed(service.diff, self.tab_index, self.loose_index, accounts, repeat=1)
+            bulk_queries = _QueryCounter()
+            with connection.execute_wrapper(bulk_queries):
+                after, _ = _timed(service.apply, result, repeat=1)
+        _report(f'PycSheetSyncService apply ({self.ROWS} filas)', before, after)
+        print(
+            f'[benchmark] diff={diff_time * 1000:.1f}ms consultas antes={legacy_queries.count} '
+            f'despues={bulk_queries.count}'
+        )
+        self.assertEqual(Account.objects.filter(password__startswith='new-pass').count(), service.summary['updated_password'])
+        self.assertGreater(service.summary['updated_password'], 0)
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+class SalesSearchBenchmark(BenchmarkFixtureMixin, TransactionTestCase):
+    ACCOUNTS = int(os.getenv('CM_BENCH_SEARCH_ACCOUNTS', '50000'))
+
+    def setUp(self):
+        self._create_base()
+        self.other = Service.objects.create(description='Disney', perfil_quantity=5, price=100)
+        now = timezone.now()
+        rng = random.Random(3)
+        Account.objects.bulk_create(
+            [
+                Account(
+                    business=self.business,
+                    supplier=self.supplier,
+                    created_by=self.seller,
+                    modified_by=self.seller,
+                    account_name=self.service if i % 2 else self.other,
+                    expiration_date=now + timedelta(days=rng.randint(1, 90)),
+                    email=f'bench{i}@{rng.choice(["gmail.com", "berberdna.tn", "otro.mx"])}',
+                    password='pass',
+                )
+                for i in range(self.ACCOUNTS)
+            ],
+            batch_size=5000,
+        )
+
+    def _page(self, **kwargs):
+        response = search_response([self.service.id, self.other.id], **kwargs)
+        return json.loads(b''.join(response.streaming_content))
+
+    def _legacy(self):
+        # Implementación anterior: todas las cuentas, una consulta por servicio
+        rows = []
+        for service in (self.service, self.other):
+            for acc in Account.objects.filter(
+                account_name=service, customer=None, status=True, external_status='Disponible'
+            ).select_related('account_name').order_by('-expiration_date'):
+                rows.append({
+                    'id': acc.id,
+                    'acc_name': acc.account_name.description,
+                    'email': acc.email,
+                    'password': acc.password,
+                    'expiration_acc': acc.expiration_date,
+                    'profile': acc.profile,
+                })
+        return json.dumps({'data': rows}, default=str)
+
+    def test_first_and_deep_pages(self):
+        before, _ = _timed(self._legacy)
+        first_time, first = _timed(self._page)
+        cursor = first['next']
+        for _ in range(20):
+            cursor = self._page(cursor=cursor)['next']
+        deep_time, deep = _timed(lambda: self._page(cursor=cursor))
+        search_time, _ = _timed(lambda: self._page(query='bench123'))
+        _report(f'SalesSearch primera página ({self.ACCOUNTS} cuentas)', before, first_time)
+        print(f'[benchmark] página 21={deep_time * 1000:.1f}ms búsqueda email={search_time * 1000:.1f}ms')
+        self.assertEqual(first['total'], self.ACCOUNTS)
+        self.assertEqual(len(deep['rows']), 200)
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+class KeysetPaginationBenchmark(BenchmarkFixtureMixin, TransactionTestCase):
+    # CM_BENCH_KEYSET_ROWS=100000 para una corrida rápida
+    ROWS = int(os.getenv('CM_BENCH_KEYSET_ROWS', '1000000'))
+    ORDERING = ('-created_at', 'profile')
+
+    def setUp(self):
+        self._create_base()
+        now = timezone.now()
+        rng = random.Random(5)
+        batch = []
+        for i in range(self.ROWS):
+            batch.append(Account(
+                business=self.business,
+                supplier=self.supplier,
+                created_by=self.seller,
+                modified_by=self.seller,
+                account_name=self.service,
+                expiration_date=now + timedelta(days=30),
+                email=f'bench{i}@gmail.com',
+                password='pass',
+                profile=rng.choice([None, 1, 2, 3, 4, 5]),
+            ))
+            if len(batch) == 20000:
+                Account.objects.bulk_create(batch)
+                batch = []
+        Account.objects.bulk_create(batch)
+        self.accounts = Account.objects.select_related('account_name').filter(business=self.business)
+
+    def test_deep_page(self):
+        depth = (self.ROWS // 20) - 10
+        offset_paginator = Paginator(self.accounts.order_by(*self.ORDERING, 'id'), 20)
+        keyset = KeysetPaginator(self.accounts, self.ORDERING, per_page=20, count=False)
+        # Cursor de la misma profundidad (como si se hubiera llegado navegando)
+        anchor = self.accounts.order_by(*self.ORDERING, 'id')[(depth - 1) * 20 - 1]
+        cursor = encode_cursor(keyset._values(anchor))
+
+        before, offset_page = _timed(lambda: list(offset_paginator.page(depth)))
+        after, keyset_page = _timed(lambda: keyset.page(cursor))
+        count_time, _ = _timed(lambda: KeysetPaginator(self.accounts, self.ORDERING, count=True).page(cursor))
+        _report(f'Página {depth} de cuentas ({self.ROWS} filas)', before, after)
+        print(f'[benchmark] con conteo={count_time * 1000:.1f}ms')
+        self.assertEqual([acc.id for acc in keyset_page], [acc.id for acc in offset_page])
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'}})
+class AudienceScoringBenchmark(BenchmarkFixtureMixin, TransactionTestCase):
+    CUSTOMERS = int(os.getenv('CM_BENCH_AUDIENCE_CUSTOMERS', '100000'))
+
+    def setUp(self):
+        self._create_base()
+        now = timezone.now()
+        rng = random.Random(11)
+        User.objects.bulk_create(
+            [User(username=f'aud{i}', password='x') for i in range(self.CUSTOMERS)], batch_size=5000,
+        )
+        users = list(User.objects.filter(username__startswith='aud').values_list('id', flat=True))
+        UserDetail.objects.bulk_create(
+            [
+                UserDetail(business=self.business, user_id=user_id, phone_number='8330000000', lada=52,
+                           country=rng.choice(['México', 'Chile', 'Perú']))
+                for user_id in users
+            ],
+            batch_size=5000,
+        )
+        account = Account.objects.create(
+            business=self.business, supplier=self.supplier, created_by=self.seller, modified_by=self.seller,
+            account_name=self.service, expiration_date=now, email='aud@test.com', password='pass',
+        )
+        Sale.objects.bulk_create(
+            [
+                Sale(
+                    business=self.business, user_seller=self.seller, customer_id=user_id, account=account,
+                    expiration_date=now + timedelta(days=rng.randint(-200, 30)),
+                    payment_amount=rng.randint(50, 500), invoice='bench', status=rng.random() < 0.3,
+                )
+                for user_id in users
+                for _ in range(2)
+            ],
+            batch_size=5000,
+        )
+
+    def test_score_campaigns(self):
+        strategy = {'segment_type': 'reactivation', 'min_days_inactive': 0, 'countries_exclude': ['chile']}
+        audience_features.invalidate_features()
+        started = time.perf_counter()
+        features = audience_features.load_features()
+        build_time = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(3):
+            features = audience_features.load_features()
+            recommendations, stats = audience_features.score_audience(
+                features, strategy, {self.service.id}, channel='whatsapp', limit=300,
+            )
+        score_time = (time.perf_counter() - started) / 3
+        print(
+            f'\n[benchmark] Audiencia ({self.CUSTOMERS} clientes): matriz={build_time * 1000:.1f}ms '
+            f'por campaña={score_time * 1000:.1f}ms'
+        )
+        self.assertEqual(len(features), self.CUSTOMERS)
+        self.assertLessEqual(len(recommendations), 300)
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'CM_RUN_BENCHMARKS no está activo')
+class AccountReservationStressTest(BenchmarkFixtureMixin, TransactionTestCase):
+    """
+    Compras simultáneas de un mismo servicio. SQLite no tiene SELECT ... FOR
+    UPDATE SKIP LOCKED ni escrituras concurrentes: correr contra MySQL.
+    """
+
+    reset_sequences = True
+    PURCHASES = int(os.getenv('CM_BENCH_PURCHASES', '200'))
+    WORKERS = int(os.getenv('CM_BENCH_PURCHASE_WORKERS', '20'))
+    MAX_P99_SEC = float(os.getenv('CM_BENCH_PURCHASE_MAX_P99_SEC', '5'))
+
+    def setUp(self):
+        if not connection.features.has_select_for_update_skip_locked:
+            self.skipTest('La base de pruebas no soporta SKIP LOCKED')
+        self._create_base()
+        # Banco y método de pago ya existen en producción; sale_ok solo los lee
+        Bank.objects.create(business=self.business, bank_name='Stripe', headline='Stripe', card_number='0', clabe='0')
+        PaymentMethod.objects.create(description='stripe')
+        now = timezone.now()
+        Account.objects.bulk_create(
+            [
+                Account(
+                    business=self.business,
+                    supplier=self.supplier,
+                    created_by=self.seller,
+                    modified_by=self.seller,
+                    account_name=self.service,
+                    expiration_date=now + timedelta(days=30),
+                    email=f'stress{i // 5}@bench.test',
+                    password='pass',
+                    profile=i % 5 + 1,
+                )
+                for i in range(self.PURCHASES + 20)
+            ]
+        )
+        self.buyers = [User(username=f'buyer{i}') for i in range(self.PURCHASES)]
+        User.objects.bulk_create(self.buyers)
+        self.buyers = list(User.objects.filter(username__startswith='buyer'))
+        rebuild_service(self.service.id)
+
+    def _purchase(self, buyer):
+        started = time.perf_counter()
+        try:
+            account, result = Sales.sell_best_account(
+                service_id=self.service.id,
+                months_requested=1,
+                customer=buyer,
+                webhook_provider='Stripe',
+                payment_type='stripe',
+                payment_id=f'stress-{buyer.pk}',
+                expiration_date=timezone.now() + timedelta(days=30),
+                unit_price=100,
+            )
+            return account.pk if account else None, time.perf_counter() - started
+        finally:
+            connections.close_all()
+
+    def test_concurrent_purchases_never_share_an_account(self):
+        with patch.object(Sales, '_send_account_delivery_whatsapp'):
+            with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+                results = list(pool.map(self._purchase, self.buyers))
+
+        latencies = sorted(elapsed for _, elapsed in results)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f'\n[benchmark] {self.PURCHASES} compras / {self.WORKERS} hilos: '
+            f'p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms'
+        )
+
+        picked = [account_id for account_id, _ in results]
+        self.assertNotIn(None, picked)
+        self.assertEqual(len(set(picked)), self.PURCHASES)
+        per_account = Counter(Sale.objects.values_list('account_id', flat=True))
+        self.assertEqual(sum(per_account.values()), self.PURCHASES)
+        self.assertEqual(max(per_account.values()), 1)
+        self.assertLess(p99, self.MAX_P99_SEC)
@@ -37,6 +37,7 @@ import sys
 import os
 import pyperclip as clipboard
 from adm.functions.send_whatsapp_notification import Notification
+from adm.functions.whatsapp_pacing import PRIORITY_MARKETING
 from adm.functions.receivable_bulk_jobs import (
     ALL_JOBS,
     JOB_DUE_5_DAYS,
@@ -48,6 +49,10 @@ from adm.functions.receivable_bulk_jobs import (
     request_stop,
     set_pause,
 )
+from adm.functions.receivable_notifications import DAILY_BUCKETS
+from adm.functions.account_search import PAGE_SIZE, parse_service_ids, search_response
+from adm.functions.keyset_pagination import paginate, smart_count
+from adm.functions import audience_features
 from api.functions.notifications import send_push_notification
 from django.db.models import DurationField
 # import pandas as pd
@@ -85,6 +90,9 @@ from .functions.active_inactive import Active_Inactive
 from .functions.dashboard import Dashboard
 from adm.functions.duplicated import NoDuplicate
 from adm.functions.sales import Sales
+from adm.functions.account_reservations import AccountAlreadyAssigned
+from adm.functions.sales_rollup import schedule_rebuild_for_customers
+from adm.functions.customer_features import mark_stale as mark_customer_features_stale
 from adm.functions.crm import CRMAnalytics
 from adm.functions.marketing_tags import (
     apply_campaign_sent_tags,
@@ -133,6 +141,13 @@ SEND_OVERDUE_PENDING_WHATSAPP_LOCKFILE = os.path.join(
     'logs',
     'send_overdue_pending_whatsapp.lock',
 )
+SEND_RECEIVABLE_WHATSAPP_LOCK = threading.Lock()
+SEND_RECEIVABLE_WHATSAPP_THREAD = None
+SEND_RECEIVABLE_WHATSAPP_LOCKFILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'logs',
+    'send_receivable_whatsapp.lock',
+)
 
 def is_ajax(request):
     return request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest'
@@ -187,37 +202,37 @@ def _start_receivable_job(lock_obj, lockfile_path, runner_fn, already_running_me
 
 
 def _run_notify_all_sequence():
-    _start_receivable_job(
-        SEND_DUE_TODAY_WHATSAPP_LOCK,
-        SEND_DUE_TODAY_WHATSAPP_LOCKFILE,
-        _run_send_due_today_whatsapp,
-        'Cobranza: ya estaba en progreso.',
-        'Cobranza iniciada.',
-        ignore_schedule=True,
-        force=True,
-    )
-    time_module.sleep(60)
-    _start_receivable_job(
-        SEND_DUE_IN_5_DAYS_WHATSAPP_LOCK,
-        SEND_DUE_IN_5_DAYS_WHATSAPP_LOCKFILE,
-        _run_send_due_in_5_days_whatsapp,
-        'Vence 5 dias: ya estaba en progreso.',
-        'Vence 5 dias iniciado.',
-        ignore_schedule=True,
-        force=True,
-    )
-    time_module.sleep(60)
-    _start_receivable_job(
-        SEND_OVERDUE_PENDING_WHATSAPP_LOCK,
-        SEND_OVERDUE_PENDING_WHATSAPP_LOCKFILE,
-        _run_send_overdue_pending_whatsapp,
-        'Vencidas pendientes: ya estaba en progreso.',
-        'Vencidas pendientes iniciado.',
+    # Un solo ciclo del motor de cobranza para los buckets diarios (agrupa por cliente)
+    return _start_receivable_job(
+        SEND_RECEIVABLE_WHATSAPP_LOCK,
+        SEND_RECEIVABLE_WHATSAPP_LOCKFILE,
+        _run_send_receivable_whatsapp,
+        'Notificar todos: ya estaba en progreso.',
+        'Notificar todos iniciado.',
         ignore_schedule=True,
         force=True,
     )
 
 
+def _run_send_receivable_whatsapp(ignore_schedule=False):
+    global SEND_RECEIVABLE_WHATSAPP_THREAD
+    from django.core.management import call_command
+
+    logger = logging.getLogger(__name__)
+    try:
+        call_command('send_receivable_whatsapp', bucket=DAILY_BUCKETS, ignore_schedule=ignore_schedule)
+    except Exception:
+        logger.exception('Error al ejecutar send_receivable_whatsapp')
+    finally:
+        try:
+            if os.path.exists(SEND_RECEIVABLE_WHATSAPP_LOCKFILE):
+                os.remove(SEND_RECEIVABLE_WHATSAPP_LOCKFILE)
+        except OSError:
+            logger.exception('No se pudo remover lockfile de send_receivable_whatsapp')
+        with SEND_RECEIVABLE_WHATSAPP_LOCK:
+            SEND_RECEIVABLE_WHATSAPP_THREAD = None
+
+
 def _run_send_due_today_whatsapp(ignore_schedule=False):
     global SEND_DUE_TODAY_WHATSAPP_THREAD
     from django.core.management import call_command
@@ -403,16 +418,15 @@ def TriggerNotifyAllReceivable(request):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'message': 'Método no permitido'}, status=405)
 
-    Thread(target=_run_notify_all_sequence, daemon=True).start()
+    res = _run_notify_all_sequence()
     detail_messages = [
-        'Cobranza: inicio inmediato.',
-        'Vence 5 dias: inicio programado en 60 segundos.',
-        'Vencidas pendientes: inicio programado en 120 segundos.',
+        'Cobranza, vence 5 dias y vencidas pendientes se envian en un solo proceso.',
+        'Cada cliente recibe un solo mensaje con todas sus cuentas.',
     ]
     response_payload = {
-        'success': True,
-        'message': 'Notificar todos ejecutado. Los 3 procesos se iniciaran en secuencia con 60 segundos entre cada uno.',
-        'details': detail_messages,
+        'success': res['success'],
+        'message': res['message'],
+        'details': detail_messages if res['started'] else [],
     }
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse(response_payload)
@@ -1207,6 +1221,8 @@ def MergeCustomerByEmailView(request, pk):
             target_detail.save()
 
             moved_sales = Sale.objects.filter(customer=source_user).update(customer=target_user)
+            schedule_rebuild_for_customers([target_user.id])
+            mark_customer_features_stale([source_user.id, target_user.id])
             moved_accounts = Account.objects.filter(customer=source_user).update(customer=target_user)
             moved_credits = Credits.objects.filter(customer=source_user).update(customer=target_user)
             moved_cupons = Cupon.objects.filter(customer=source_user).update(customer=target_user)
@@ -1419,6 +1435,9 @@ def ActiveInactiveService(request, status, pk):
     service.save()
     return redirect(reverse('adm:services'))
 
+ACCOUNT_LIST_ORDERING = ('-created_at', 'profile')
+
+
 @permission_required('is_staff', 'adm:no-permission')
 def AccountsView(request):
     """
@@ -1437,7 +1456,7 @@ def AccountsView(request):
     external_status = request.POST.get('external_status') or request.GET.get('external_status', '')
     without_customer = request.POST.get('without_customer') or request.GET.get('without_customer', '')
     ignore_external_status = external_status == '__ignore__'
-    page = request.GET.get('page', 1)
+    cursor = request.GET.get('cursor')
     
     # Base queryset optimizado con select_related para evitar consultas N+1
     base_queryset = Account.objects.select_related(
@@ -1465,9 +1484,6 @@ def AccountsView(request):
         if external_status and not ignore_external_status:
             base_queryset = base_queryset.filter(external_status=external_status)
         
-        # Ordenar de manera eficiente
-        accounts = base_queryset.order_by('-created_at', 'profile')
-        
         # Preparar datos del formulario
         form_data = {
             'account_name': account_name,
@@ -1478,13 +1494,8 @@ def AccountsView(request):
             'without_customer': without_customer,
         }
         
-        # Paginación optimizada
-        p = Paginator(accounts, 20)
-        
-        try:
-            venues = p.page(page)
-        except (PageNotAnInteger, EmptyPage):
-            venues = p.page(1)
+        # Paginación por cursor (sin OFFSET ni COUNT en tablas grandes)
+        venues = paginate(base_queryset, ACCOUNT_LIST_ORDERING, cursor, per_page=20)
         
         # Query string optimizado
         filter_params = []
@@ -1521,15 +1532,10 @@ def AccountsView(request):
         accounts = base_queryset.filter(
             status=True, 
             customer__isnull=True
-        ).order_by('-created_at', 'profile')
-        
-        # Paginación
-        p = Paginator(accounts, 20)
+        )
         
-        try:
-            venues = p.page(page)
-        except (PageNotAnInteger, EmptyPage):
-            venues = p.page(1)
+        # Paginación por cursor
+        venues = paginate(accounts, ACCOUNT_LIST_ORDERING, cursor, per_page=20)
         
         context = {
             "venues": venues,
@@ -2164,70 +2170,20 @@ def SalesUpdateStatusView(request, pk, customer, status):
 @csrf_exempt
 @permission_required('is_staff', 'adm:no-permission')
 def SalesSearchView(request):
-    logger = logging.getLogger('django')
-    
     if is_ajax(request):
-        services = request.POST.getlist('data[]', '')
-        page = int(request.POST.get('page', 1))
-        items_per_page = 20
-        
-        if not services:
+        service_ids = parse_service_ids(request.POST.getlist('data[]'))
+        if not service_ids:
             return JsonResponse({'data': "No hay cuentas seleccionadas"})
-        
-        # Recolectar todas las cuentas de todos los servicios
-        all_accounts = []
-        
-        for s in services:
-            service_data = json.loads(s)
-            service_id = service_data['service']
-            
-            service = Service.objects.get(pk=int(service_id))
-            
-            # Obtener todas las cuentas para este servicio
-            accounts_query = Account.objects.filter(
-                account_name=service, 
-                customer=None, 
-                status=True,
-                external_status='Disponible'
-            ).select_related('account_name').only(
-                'id', 'email', 'password', 'expiration_date', 'profile', 'account_name'
-            ).annotate(
-                email_priority=Case(
-                    When(email__iendswith='@berberdna.tn', then=1),
-                    When(email__iendswith='@mangosvip.com', then=2),
-                    When(email__iendswith='@thortry.com', then=3),
-                    When(email__iendswith='@gmail.com', then=5),
-                    default=4,
-                    output_field=IntegerField(),
-                )
-            ).order_by('email_priority', '-expiration_date')
-            
-            for acc in accounts_query:
-                logo_url = acc.account_name.logo.url
-                logger.info(f"[SalesSearch] Enviando logo URL: {logo_url}")
-                all_accounts.append({
-                    'id': acc.id,
-                    'logo': logo_url,
-                    'acc_name': acc.account_name.description,
-                    'email': acc.email,
-                    'password': acc.password,
-                    'expiration_acc': acc.expiration_date,
-                    'profile': acc.profile
-                })
-        
-        total_count = len(all_accounts)
-        
-        if not all_accounts:
-            return JsonResponse({
-                'data': "No hay cuentas disponibles",
-                'total': 0
-            })
-        
-        # Devolver TODAS las cuentas sin paginar para que el filtro funcione correctamente
-        return JsonResponse({
-            'data': all_accounts,
-            'total': total_count
-        })
+        try:
+            return search_response(
+                service_ids,
+                query=request.POST.get('q', ''),
+                cursor=request.POST.get('cursor') or None,
+                limit=request.POST.get('limit') or PAGE_SIZE,
+            )
+        except ValueError:
+            # Incluye InvalidCursor
+            return JsonResponse({'data': 'Parámetros de búsqueda inválidos'}, status=400)
     elif request.method == 'POST':
         data_array = []
         data = json.loads(request.body)
@@ -2747,6 +2703,9 @@ def CuponRedeemEndView(request):
         except CouponRedeemError as exc:
             customer = User.objects.get(pk=customer)
             return Sales.render_view(request, customer, message=str(exc))
+        except AccountAlreadyAssigned:
+            customer = User.objects.get(pk=customer)
+            return Sales.render_view(request, customer, message='La cuenta ya fue asignada a otro cliente, elige otra.')
 
 class ReceivableView(UserAccessMixin, ListView):
     permission_required = 'is_staff'
@@ -2790,18 +2749,37 @@ class ReceivableView(UserAccessMixin, ListView):
                 expiration_date__lte=end_of_day,
                 status=True
             ).order_by('-expiration_date', 'account__email')
+            self.keyset_ordering = ('-expiration_date', 'account__email')
+            self.lists_all_due = True
         return qs
+
+    keyset_ordering = ('-expiration_date', 'account_id')
+    lists_all_due = False
+
+    def paginate_queryset(self, queryset, page_size):
+        # Paginación por cursor: el costo no crece con la página
+        page = paginate(queryset, self.keyset_ordering, self.request.GET.get('cursor'), per_page=page_size)
+        return (None, page, page.object_list, page.has_other_pages())
+
     def get_context_data(self, **kwargs):
         from datetime import datetime as dt
         context = super().get_context_data(**kwargs)
         context['tomorrow'] = timezone.now().date() + timedelta(days=1)
+        params = self.request.GET.copy()
+        params.pop('cursor', None)
+        params.pop('page', None)
+        context['filter_query'] = params.urlencode()
         # Contar todas las cuentas vencidas (hoy y en el pasado)
-        today = timezone.now().date()
-        end_of_day = timezone.make_aware(dt.combine(today, dt.max.time()))
-        context['left'] = Sale.objects.filter(
-            expiration_date__lte=end_of_day,
-            status=True
-        ).count()
+        page = context.get('page_obj')
+        if self.lists_all_due and page is not None and page.count is not None:
+            context['left'] = page.count
+        else:
+            today = timezone.now().date()
+            end_of_day = timezone.make_aware(dt.combine(today, dt.max.time()))
+            context['left'], _ = smart_count(Sale.objects.filter(
+                expiration_date__lte=end_of_day,
+                status=True
+            ))
         return context
 
 @permission_required('is_staff', 'adm:no-permission')
@@ -4203,6 +4181,8 @@ def sync_logs_view(request):
     # Obtener filtros de fecha del request
     date_from = request.GET.get('date_from', '')
     date_to = request.GET.get('date_to', '')
+    wa_event_id = request.GET.get('wa_event_id', '').strip()
+    wa_phone = request.GET.get('wa_phone', '').strip()
     
     # Parámetros de paginación
     lines_per_page = 100
@@ -4280,13 +4260,21 @@ def sync_logs_view(request):
     
     context = {
         'logs': colorized_logs,
-        'whatsapp_logs': read_whatsapp_delivery_log(limit=200, date_from=date_from or None, date_to=date_to or None),
+        'whatsapp_logs': read_whatsapp_delivery_log(
+            limit=200,
+            date_from=date_from or None,
+            date_to=date_to or None,
+            event_id=wa_event_id or None,
+            phone=wa_phone or None,
+        ),
         'paginator': paginator,
         'page_obj': logs_page,
         'total_lines': len(all_lines),
         'has_logs': len(all_lines) > 0,
         'date_from': date_from,
         'date_to': date_to,
+        'wa_event_id': wa_event_id,
+        'wa_phone': wa_phone,
     }
     
     return render(request, 'adm/sync_logs.html', context)
@@ -4819,10 +4807,12 @@ def _run_whatsapp_dispatch_worker(campaign_id):
                 if rec.lada and rec.phone_number and wa_message:
                     if image_url:
                         status_code = Notification.send_whatsapp_notification_with_media(
-                            wa_message, rec.lada, rec.phone_number, image_url
+                            wa_message, rec.lada, rec.phone_number, image_url, priority=PRIORITY_MARKETING
                         )
                     else:
-                        status_code = Notification.send_whatsapp_notification(wa_message, rec.lada, rec.phone_number)
+                        status_code = Notification.send_whatsapp_notification(
+                            wa_message, rec.lada, rec.phone_number, priority=PRIORITY_MARKETING
+                        )
                     if status_code not in [200, 201]:
                         raise RuntimeError(f'Envío WhatsApp respondió {status_code}')
                     status_value = 'sent'
@@ -5365,9 +5355,11 @@ def _build_audience_recommendations(campaign, limit=250):
     campaign.recommendations.all().delete()
     now = timezone.now()
     # Historial completo de compras (incluye ventas ya no activas) para detectar inactividad real.
-    base_qs = Sale.objects.filter(created_at__gte=now - timedelta(days=2555))
+    base_qs = Sale.objects.filter(created_at__gte=now - timedelta(days=audience_features.HISTORY_DAYS))
+    seller = None
     if campaign.created_by and not campaign.created_by.is_superuser:
-        base_qs = base_qs.filter(user_seller=campaign.created_by)
+        seller = campaign.created_by
+        base_qs = base_qs.filter(user_seller=seller)
 
     catalog_rows = list(
         base_qs.values('account__account_name_id', 'account__account_name__description')
@@ -5388,176 +5380,29 @@ def _build_audience_recommendations(campaign, limit=250):
             desc = str(item.get('account__account_name__description') or '').strip().lower()
             if keyword and keyword in desc:
                 target_service_ids.add(item['account__account_name_id'])
-    countries_include = set(strategy.get('countries_include', []))
-    countries_exclude = set(strategy.get('countries_exclude', []))
-    filter_stats = {
-        'total_candidates': 0,
-        'selected': 0,
-        'excluded_country_include': 0,
-        'excluded_country_exclude': 0,
-        'excluded_days_inactive': 0,
-        'excluded_orders_range': 0,
-        'excluded_revenue': 0,
-        'excluded_active_global': 0,
-        'excluded_active_cap': 0,
-        'excluded_service_history': 0,
-        'excluded_target_active': 0,
-        'excluded_recent_same_service': 0,
-        'excluded_no_phone': 0,
-        'excluded_cooldown': 0,
-    }
-    cooldown_blocked_users = users_with_active_cooldown(campaign.channel)
-
-    rows = (
-        base_qs.values(
-            'customer_id',
-            'customer__username',
-            'customer__email',
-            'customer__userdetail__country',
-            'customer__userdetail__lada',
-            'customer__userdetail__phone_number',
-        )
-        .annotate(
-            total_orders=Count('id'),
-            total_revenue=Sum('payment_amount'),
-            last_purchase=Max('created_at'),
-        )
-        .order_by('-total_revenue')[:800]
-    )
-
-    objective = (campaign.objective or '').lower()
-    for row in rows:
-        filter_stats['total_candidates'] += 1
-        total_revenue = float(row.get('total_revenue') or 0)
-        total_orders = int(row.get('total_orders') or 0)
-        last_purchase = row.get('last_purchase')
-        days_inactive = (now - last_purchase).days if last_purchase else 999
-        recency_score = max(0, 180 - days_inactive)
-        score = (total_revenue * 0.03) + (total_orders * 3) + recency_score
-        if 'reactiv' in objective:
-            score = (total_revenue * 0.02) + (total_orders * 2) + (days_inactive * 1.1)
-        if 'alto valor' in objective or 'premium' in objective:
-            score = (total_revenue * 0.06) + (total_orders * 2) + recency_score
-
-        recent_same_service = False
-        service_history = 0
-        target_last_purchase = None
-        target_days_inactive = 999
-        target_active_now = False
-        active_sales_now = Sale.objects.filter(
-            customer_id=row['customer_id'],
-            status=True,
-            expiration_date__gte=now,
-        ).count()
-        if target_service_ids:
-            recent_same_service = Sale.objects.filter(
-                customer_id=row['customer_id'],
-                account__account_name_id__in=target_service_ids,
-                created_at__gte=now - timedelta(days=strategy.get('exclude_recent_same_service_days', 2)),
-            ).exists()
-            service_history = Sale.objects.filter(
-                customer_id=row['customer_id'],
-                account__account_name_id__in=target_service_ids,
-            ).count()
-            target_last_purchase = Sale.objects.filter(
-                customer_id=row['customer_id'],
-                account__account_name_id__in=target_service_ids,
-            ).aggregate(last=Max('created_at')).get('last')
-            if target_last_purchase:
-                target_days_inactive = (now - target_last_purchase).days
-            target_active_now = Sale.objects.filter(
-                customer_id=row['customer_id'],
-                account__account_name_id__in=target_service_ids,
-                status=True,
-                expiration_date__gte=now,
-            ).exists()
-            score += min(service_history * 4, 32)
-
-        eligible = True
-        if row['customer_id'] in cooldown_blocked_users:
-            eligible = False
-            filter_stats['excluded_cooldown'] += 1
-        country_value = _normalize_token(row.get('customer__userdetail__country') or '')
-        if countries_include and country_value not in countries_include:
-            eligible = False
-            filter_stats['excluded_country_include'] += 1
-        if country_value and country_value in countries_exclude:
-            eligible = False
-            filter_stats['excluded_country_exclude'] += 1
-        if days_inactive < strategy.get('min_days_inactive', 0) or days_inactive > strategy.get('max_days_inactive', 3650):
-            eligible = False
-            filter_stats['excluded_days_inactive'] += 1
-        if total_orders < strategy.get('min_total_orders', 0) or total_orders > strategy.get('max_total_orders', 9999):
-            eligible = False
-            filter_stats['excluded_orders_range'] += 1
-        if total_revenue < strategy.get('min_total_revenue', 0):
-            eligible = False
-            filter_stats['excluded_revenue'] += 1
-        if strategy.get('require_no_active_sales') and active_sales_now > 0:
-            eligible = False
-            filter_stats['excluded_active_global'] += 1
-        if active_sales_now > strategy.get('max_active_sales_now', 999):
-            eligible = False
-            filter_stats['excluded_active_cap'] += 1
-        if strategy.get('require_service_history') and service_history <= 0 and not target_last_purchase:
-            eligible = False
-            filter_stats['excluded_service_history'] += 1
-        if strategy.get('require_target_service_inactive') and target_active_now:
-            eligible = False
-            filter_stats['excluded_target_active'] += 1
-        if recent_same_service and strategy.get('exclude_recent_same_service_days', 0) > 0:
-            eligible = False
-            filter_stats['excluded_recent_same_service'] += 1
-
-        has_phone = bool(row.get('customer__userdetail__lada')) and bool(row.get('customer__userdetail__phone_number'))
-        if campaign.channel in ('whatsapp', 'sms') and not has_phone:
-            eligible = False
-            filter_stats['excluded_no_phone'] += 1
-
-        segment_type = strategy.get('segment_type', 'general')
-        if segment_type == 'reactivation':
-            score = (total_revenue * 0.02) + (service_history * 4) + min(target_days_inactive * 0.9, 160)
-        elif segment_type == 'upsell':
-            score = (total_revenue * 0.05) + (total_orders * 4) + max(0, 90 - days_inactive)
-        elif segment_type == 'cross_sell':
-            score = (total_revenue * 0.04) + (total_orders * 3) + max(0, 120 - days_inactive)
-        elif segment_type == 'retention':
-            score = (total_revenue * 0.03) + (total_orders * 3.5) + max(0, 45 - days_inactive) * 2
-        elif segment_type == 'premium':
-            score = (total_revenue * 0.08) + (total_orders * 4) + max(0, 120 - days_inactive)
-        elif segment_type == 'acquisition':
-            score = (total_orders * 2) + max(0, days_inactive - 30)
-        elif segment_type == 'churn_risk':
-            score = (total_revenue * 0.03) + (total_orders * 2) + min(max(days_inactive - 20, 0), 140)
-        if not eligible:
-            score = 0
-
-        reason = (
-            f"Ordenes={total_orders}, Ingreso={round(total_revenue, 2)}, "
-            f"Dias sin compra={days_inactive}, Historial servicio={service_history}, "
-            f"Dias sin compra objetivo={target_days_inactive}, Activas ahora={active_sales_now}, "
-            f"Segmento={strategy.get('segment_type', 'general')}, Elegible={eligible}"
-        )
-        MarketingCampaignRecommendation.objects.create(
-            campaign=campaign,
-            customer_id=row['customer_id'],
-            country=row.get('customer__userdetail__country') or '',
-            lada=str(row.get('customer__userdetail__lada') or ''),
-            phone_number=str(row.get('customer__userdetail__phone_number') or ''),
-            total_orders=total_orders,
-            total_revenue=round(total_revenue, 2),
-            last_purchase=last_purchase,
-            score=round(score, 2),
-            reason=reason,
-            selected=eligible and score > 0,
-        )
-        if eligible and score > 0:
-            filter_stats['selected'] += 1
 
-    keep_ids = list(
-        campaign.recommendations.filter(selected=True).order_by('-score').values_list('id', flat=True)[:limit]
+    # Matriz de clientes del día (cache compartido entre campañas) y reglas como máscaras
+    features = audience_features.load_features(seller=seller, now=now)
+    recommendations, filter_stats = audience_features.score_audience(
+        features,
+        strategy,
+        target_service_ids,
+        objective=campaign.objective,
+        channel=campaign.channel,
+        cooldown_users=users_with_active_cooldown(campaign.channel),
+        now=now,
+        limit=limit,
+    )
+    # La matriz puede ser de horas atrás: omitir clientes borrados desde entonces
+    existing = set(User.objects.filter(id__in=[row['customer_id'] for row in recommendations]).values_list('id', flat=True))
+    MarketingCampaignRecommendation.objects.bulk_create(
+        [
+            MarketingCampaignRecommendation(campaign=campaign, selected=True, **row)
+            for row in recommendations
+            if row['customer_id'] in existing
+        ],
+        batch_size=500,
     )
-    campaign.recommendations.exclude(id__in=keep_ids).delete()
     campaign.audience_filters = campaign.audience_filters or {}
     campaign.audience_filters['audience_strategy'] = strategy
     campaign.audience_filters['audience_filter_stats'] = filter_stats
@@ -1,7 +1,8 @@
+from adm.functions.account_reservations import AccountAlreadyAssigned, allocate, claim_account
 from adm.functions.send_email import Email
 from adm.models import Account, Business, PaymentMethod, Sale, Service, UserDetail
 from django.contrib.auth.models import User
-from adm.functions.sales import Sales
+from django.db import transaction
 from api.functions.notifications import send_push_notification
 
 
@@ -28,27 +29,24 @@ class SalesApi():
             payment_method = PaymentMethod.objects.create(
                 description=payment_method)
 
-        best_account = Sales.search_better_acc(
-            service_id=service_id, exp=expiration_date)
-        if best_account != None and best_account[0] == True:
-            account = best_account[1]
-
-            # Create Sale
-            sale = Sale.objects.create(
-                business=business,
-                user_seller=seller,
-                customer=payer,
-                account=account,
-                payment_method=payment_method,
-                expiration_date=expiration_date,
-                payment_amount=int(payment_amount),
-                invoice=order_id
-            )
-            # Update Account
-            account.customer = payer
-            account.modified_by = seller
-            account.save()
+        def _sell(account):
+            # Asignar y crear la venta en la misma transacción: si otra venta
+            # ganó la cuenta, claim_account lanza AccountAlreadyAssigned.
+            with transaction.atomic():
+                claim_account(account, payer, modified_by=seller)
+                return Sale.objects.create(
+                    business=business,
+                    user_seller=seller,
+                    customer=payer,
+                    account=account,
+                    payment_method=payment_method,
+                    expiration_date=expiration_date,
+                    payment_amount=int(payment_amount),
+                    invoice=order_id
+                )
 
+        account, sale = allocate(service_id, _sell)
+        if account:
             # send Notification
             # try:
             #     token = UserDetail.objects.get(user=payer).token
@@ -70,26 +68,14 @@ class SalesApi():
                 return False
             except Service.MultipleObjectsReturned:
                 return False
+            # Respaldo si el índice no tiene la cuenta: se toma la primera libre
             acc = Account.objects.filter(
                 status=True, customer=None, account_name=account_obj, external_status='Disponible')
-            if acc.count() > 0:
-                account = acc[0]
-
-                # Create Sale
-                sale = Sale.objects.create(
-                    business=business,
-                    user_seller=seller,
-                    customer=payer,
-                    account=account,
-                    payment_method=payment_method,
-                    expiration_date=expiration_date,
-                    payment_amount=int(payment_amount),
-                    invoice=order_id
-                )
-                # Update Account
-                account.customer = payer
-                account.modified_by = seller
-                account.save()
+            for account in acc[:3]:
+                try:
+                    sale = _sell(account)
+                except AccountAlreadyAssigned:
+                    continue
 
                 # send Notification
                 # try:
@@ -105,8 +91,7 @@ class SalesApi():
                 # if not account.email == 'example@example.com':
                 #     Email.email_passwords(request, account.email, (sale,))
                 return sale
-            else:
-                return False
+            return False
 
     def add_free_days(request, customer_id):
         try:
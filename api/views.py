@@ -29,6 +29,7 @@ from adm.models import Account, Business, Sale, Service, UserDetail, PageVisit,
 from cupon.models import Shop
 from .functions.notifications import send_push_notification
 from .functions.salesApi import SalesApi
+from adm.functions.account_reservations import allocate, claim_account
 from adm.functions.sales import Sales
 from adm.functions.send_whatsapp_notification import Notification
 from django.db.models import Q
@@ -318,40 +319,41 @@ def sell_account_api(request):
     if projected_balance < -shop.credit_limit:
         return JsonResponse(status=402, data={'detail': 'insufficient shop credit', 'balance': balance, 'credit_limit': shop.credit_limit})
 
-    account = Sales.find_best_account(service_id, months)
+    def _sell(account):
+        with transaction.atomic():
+            bank, _ = Bank.objects.get_or_create(
+                bank_name='Shops',
+                defaults={'business': Business.objects.get(pk=1), 'headline': 'Cuentas Mexico', 'card_number': '0', 'clabe': '0'}
+            )
+            payment_method, _ = PaymentMethod.objects.get_or_create(description='Shop')
+            customer = _get_or_create_shop_sale_customer(data, seller_user)
+            claim_account(account, customer, modified_by=seller_user)
+            sale = Sale.objects.create(
+                business=Business.objects.get(pk=1),
+                user_seller=seller_user,
+                bank=bank,
+                customer=customer,
+                account=account,
+                payment_method=payment_method,
+                expiration_date=timezone.now() + relativedelta(months=months),
+                payment_amount=price,
+                invoice=f'SHOP-{shop.id}-{int(time.time())}',
+            )
+            Credits.objects.create(
+                customer=seller_user,
+                shop=shop,
+                credits=-price,
+                detail=f'Venta tienda {service.description} {months} mes(es) a {customer.username}',
+            )
+            if projected_balance < 0 and not shop.last_negative_balance_since:
+                shop.last_negative_balance_since = timezone.now()
+                shop.save(update_fields=['last_negative_balance_since'])
+            return customer, sale
+
+    account, sold = allocate(service_id, _sell)
     if not account:
         return JsonResponse(status=404, data={'detail': 'no account available'})
-
-    with transaction.atomic():
-        bank, _ = Bank.objects.get_or_create(
-            bank_name='Shops',
-            defaults={'business': Business.objects.get(pk=1), 'headline': 'Cuentas Mexico', 'card_number': '0', 'clabe': '0'}
-        )
-        payment_method, _ = PaymentMethod.objects.get_or_create(description='Shop')
-        customer = _get_or_create_shop_sale_customer(data, seller_user)
-        sale = Sale.objects.create(
-            business=Business.objects.get(pk=1),
-            user_seller=seller_user,
-            bank=bank,
-            customer=customer,
-            account=account,
-            payment_method=payment_method,
-            expiration_date=timezone.now() + relativedelta(months=months),
-            payment_amount=price,
-            invoice=f'SHOP-{shop.id}-{int(time.time())}',
-        )
-        account.customer = customer
-        account.modified_by = seller_user
-        account.save(update_fields=['customer', 'modified_by'])
-        Credits.objects.create(
-            customer=seller_user,
-            shop=shop,
-            credits=-price,
-            detail=f'Venta tienda {service.description} {months} mes(es) a {customer.username}',
-        )
-        if projected_balance < 0 and not shop.last_negative_balance_since:
-            shop.last_negative_balance_since = timezone.now()
-            shop.save(update_fields=['last_negative_balance_since'])
+    customer, sale = sold
 
     whatsapp_sent = Sales._send_account_delivery_whatsapp(customer, sale)
     return JsonResponse(status=201, data={
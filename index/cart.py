@@ -145,7 +145,7 @@ class CartDb:
 
         return cart_detail
 
-    def create_full_cart(self):
+    def create_full_cart(self, pricing=None):
         cart_data = self.request.session.get('cart_number')
         if cart_data:
             # Check if user is authenticated
@@ -158,14 +158,18 @@ class CartDb:
                 affiliate_code=affiliate_code
             )
             print(cart.id)
-            for item in cart_data.items():
-                service = Service.objects.get(description=item[1]['name'])
-                CartDb.create_cart_details(
-                    item[1]['quantity'],
-                    item[1]['profiles'],
-                    item[1]['unitPrice'],
-                    cart,
-                    service
-                )
+            # Servicios ya cargados por CartPricer; por nombre solo si falta el id
+            services = {line.item_id: line.service for line in pricing.lines} if pricing else {}
+            details = []
+            for item_id, item in cart_data.items():
+                service = services.get(item_id) or Service.objects.get(description=item['name'])
+                details.append(IndexCartdetail(
+                    long=item['quantity'],
+                    quantity=item['profiles'],
+                    price=item['unitPrice'],
+                    cart=cart,
+                    service=service,
+                ))
+            IndexCartdetail.objects.bulk_create(details)
             return cart
         return None
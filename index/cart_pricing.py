@@ -0,0 +1,261 @@
+"""
+Precio del carrito en una sola pasada.
+
+`CartPricer` toma el carrito de sesión (el que arma CartProcessor), carga de
+una vez los servicios (una consulta), el afiliado del código en sesión (una
+consulta) y la tabla compilada de promociones (cero consultas si está
+vigente), y devuelve un `CartPricing` inmutable.
+
+Con ese resultado se arman el resumen de descuento del carrito y los
+payloads de Stripe, PayPal y MercadoPago, sin volver a leer la sesión ni la
+base de datos. El número de consultas no depende de cuántas líneas tenga el
+carrito.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from adm.functions import promotion_engine, request_cache
+from adm.functions.promociones import PromocionManager
+from adm.models import Affiliate, Service
+from index.payment_methods.utils import get_masked_description, get_masked_product_name
+
+
+def _as_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class PricedLine:
+    item_id: str
+    product_id: object
+    service: Optional[Service]
+    name: str
+    image: str
+    quantity: int
+    profiles: int
+    unit_price: int
+    price: int
+    descuento: int
+    precio_final: int
+
+    @property
+    def masked_name(self):
+        return get_masked_product_name(self.product_id, self.item_id)
+
+    @property
+    def masked_description(self):
+        return get_masked_description(self.profiles, self.quantity, self.product_id)
+
+
+@dataclass(frozen=True)
+class CartPricing:
+    lines: Tuple[PricedLine, ...]
+    subtotal: int
+    descuento_total: int
+    porcentaje_descuento: float
+    tipo_descuento: Optional[str]
+    nombre_descuento: Optional[str]
+
+    @property
+    def total_final(self):
+        return self.subtotal - self.descuento_total
+
+    @property
+    def tiene_descuento(self):
+        return self.descuento_total > 0
+
+    @property
+    def discount_rate(self):
+        """Porcentaje real descontado del subtotal; lo usan las pasarelas."""
+        if self.descuento_total > 0 and self.subtotal > 0:
+            return (self.descuento_total / self.subtotal) * 100
+        return 0
+
+    def discount_info(self):
+        """Mismo dict que devolvía calcular_descuento_carrito."""
+        return {
+            'subtotal': self.subtotal,
+            'descuento_total': self.descuento_total,
+            'total_final': self.total_final,
+            'porcentaje_descuento': self.porcentaje_descuento,
+            'tipo_descuento': self.tipo_descuento,
+            'nombre_descuento': self.nombre_descuento,
+            'tiene_descuento': self.tiene_descuento,
+            'items': [
+                {
+                    'id': line.item_id,
+                    'nombre': line.name,
+                    'precio_original': line.price,
+                    'descuento': line.descuento,
+                    'precio_final': line.precio_final,
+                }
+                for line in self.lines
+            ],
+        }
+
+    def stripe_items(self):
+        """(items, subtotal) para el SDK de Stripe en el carrito."""
+        if not self.lines:
+            return None, 0
+        rate = self.discount_rate
+        items = []
+        subtotal = 0
+        for line in self.lines:
+            # Precio por perfil (unitPrice * meses), con descuento si existe
+            item_cost = float(line.unit_price) * float(line.quantity)
+            if rate > 0:
+                item_cost = item_cost * (1 - rate / 100)
+            item_total = item_cost * float(line.profiles)
+            subtotal += item_total
+            items.append({
+                "name": line.masked_name[:127],
+                "description": line.masked_description,
+                "quantity": line.profiles,
+                "itemCost": round(item_cost, 2),
+                "itemTotal": round(item_total, 2)
+            })
+        return items, round(subtotal, 2)
+
+    def stripe_line_items(self):
+        """line_items para stripe.checkout.Session.create (centavos MXN)."""
+        rate = self.discount_rate
+        line_items = []
+        for line in self.lines:
+            item_cost = float(line.unit_price) * float(line.quantity)
+            if rate > 0:
+                item_cost = item_cost * (1 - rate / 100)
+            line_items.append({
+                'price_data': {
+                    'currency': 'mxn',
+                    'product_data': {
+                        'name': line.masked_name[:127],
+                        'description': line.masked_description,
+                    },
+                    'unit_amount': int(round(item_cost * 100)),
+                },
+                'quantity': int(line.profiles),
+            })
+        return line_items
+
+    def paypal_items(self):
+        """(items, subtotal) para la orden de PayPal."""
+        if not self.lines:
+            return None, 0
+        rate = self.discount_rate
+        items = []
+        subtotal = 0
+        for line in self.lines:
+            item_cost = float(line.unit_price) * float(line.quantity)
+            item_total = item_cost * float(line.profiles)
+            if rate > 0:
+                item_cost = item_cost * (1 - rate / 100)
+                item_total = item_total * (1 - rate / 100)
+            subtotal += item_total
+            items.append({
+                "name": line.masked_name[:127],  # PayPal limita a 127 caracteres
+                "description": line.masked_description,
+                "quantity": line.profiles,
+                "itemCost": round(item_cost, 2),
+                "itemTotal": round(item_total, 2)
+            })
+        return items, round(subtotal, 2)
+
+    def mercadopago_items(self):
+        """items de la preferencia de MercadoPago (precio de lista, como antes)."""
+        return [
+            {
+                "id": str(line.item_id),  # ID del item para homologación
+                "title": line.masked_name,
+                "description": line.masked_description,
+                "category_id": "services",  # Categoría del item para homologación
+                "quantity": line.profiles,
+                "currency_id": "MXN",
+                "unit_price": line.unit_price * line.quantity,
+                "picture_url": f'https://cuentasmexico.com/{line.image}',
+            }
+            for line in self.lines
+        ]
+
+
+class CartPricer:
+    """Calcula el CartPricing del carrito en sesión de un request."""
+
+    def __init__(self, request):
+        self.request = request
+        self.cart = request.session.get('cart_number') or {}
+        self.affiliate_code = request.session.get('affiliate_code')
+
+    def price(self) -> CartPricing:
+        # Se memoiza por request mientras el carrito y el código no cambien
+        fingerprint = json.dumps([self.cart, self.affiliate_code], sort_keys=True, default=str)
+        return request_cache.memoize(f'cart_pricing:{fingerprint}', self._price)
+
+    def _affiliate(self):
+        if not self.affiliate_code:
+            return None
+        return Affiliate.objects.filter(codigo_afiliado=self.affiliate_code, status='activo').first()
+
+    def _price(self) -> CartPricing:
+        mejor_descuento_porcentaje = 0
+        tipo_descuento = None
+        nombre_descuento = None
+
+        # 1. Código de afiliado en sesión
+        affiliate = self._affiliate()
+        if affiliate:
+            mejor_descuento_porcentaje = float(affiliate.porcentaje_descuento)
+            tipo_descuento = 'afiliado'
+            nombre_descuento = f'Codigo {affiliate.codigo_descuento}'
+
+        # 2. Mayor descuento de promoción entre los servicios del carrito
+        product_ids = {_as_pk(item_data.get('product_id')) for item_data in self.cart.values()}
+        services = Service.objects.in_bulk([pk for pk in product_ids if pk]) if product_ids else {}
+        compiled = promotion_engine.get_compiled()
+        for item_data in self.cart.values():
+            service = services.get(_as_pk(item_data.get('product_id')))
+            if service is None:
+                continue
+            promo_info = PromocionManager.calcular_precio_con_descuento(service, compiled=compiled)
+            if promo_info['porcentaje_descuento'] > mejor_descuento_porcentaje:
+                mejor_descuento_porcentaje = promo_info['porcentaje_descuento']
+                tipo_descuento = 'promocion'
+                nombre_descuento = promo_info.get('promocion_nombre', 'Promocion')
+
+        # 3. Totales con el mejor descuento
+        lines = []
+        subtotal = 0
+        descuento_total = 0
+        for item_id, item_data in self.cart.items():
+            precio_item = int(item_data.get('price', 0))
+            subtotal += precio_item
+            descuento_item = 0
+            if mejor_descuento_porcentaje > 0:
+                descuento_item = int(precio_item * (mejor_descuento_porcentaje / 100))
+                descuento_total += descuento_item
+            lines.append(PricedLine(
+                item_id=item_id,
+                product_id=item_data.get('product_id', item_id),
+                service=services.get(_as_pk(item_data.get('product_id'))),
+                name=item_data.get('name', ''),
+                image=item_data.get('image', ''),
+                quantity=item_data.get('quantity', 0),
+                profiles=item_data.get('profiles', 0),
+                unit_price=item_data.get('unitPrice', 0),
+                price=precio_item,
+                descuento=descuento_item,
+                precio_final=precio_item - descuento_item,
+            ))
+
+        return CartPricing(
+            lines=tuple(lines),
+            subtotal=subtotal,
+            descuento_total=descuento_total,
+            porcentaje_descuento=mejor_descuento_porcentaje,
+            tipo_descuento=tipo_descuento,
+            nombre_descuento=nombre_descuento,
+        )
@@ -1,25 +1,32 @@
 """
 Context processors para la app index.
 """
+from adm.functions import request_cache
 from adm.models import Affiliate
 
 
 def affiliate_context(request):
     """
     Agrega informacion de afiliado al contexto de templates.
+    Se calcula una vez por request aunque se rendericen varios templates.
     """
+    if not request.user.is_authenticated:
+        return {'user_is_affiliate': False, 'user_affiliate': None}
+    return request_cache.memoize(f'affiliate:{request.user.pk}', lambda: _affiliate_context(request.user))
+
+
+def _affiliate_context(user):
     context = {
         'user_is_affiliate': False,
         'user_affiliate': None,
     }
 
-    if request.user.is_authenticated:
-        try:
-            affiliate = request.user.affiliate
-            if affiliate.status == 'activo':
-                context['user_is_affiliate'] = True
-                context['user_affiliate'] = affiliate
-        except Affiliate.DoesNotExist:
-            pass
+    try:
+        affiliate = user.affiliate
+        if affiliate.status == 'activo':
+            context['user_is_affiliate'] = True
+            context['user_affiliate'] = affiliate
+    except Affiliate.DoesNotExist:
+        pass
 
     return context
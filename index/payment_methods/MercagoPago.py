@@ -10,7 +10,7 @@ from django.utils import timezone
 
 # Local
 from index.models import IndexCart, IndexCartdetail
-from index.payment_methods.utils import get_masked_product_name, get_masked_description
+from index.cart_pricing import CartPricer
 
 
 class MercadoPago():
@@ -20,41 +20,19 @@ class MercadoPago():
         self.mp_access_token = os.environ.get('MP_ACCESS_TOKEN')
         self.site_url = os.environ.get('SITE_URL', 'https://www.cuentasmexico.com')
 
-    def Mp_ExpressCheckout(self, cart_id):
+    def Mp_ExpressCheckout(self, cart_id, pricing=None):
         # Validar que el token esté configurado
         if not self.mp_access_token:
             print("WARNING: MP_ACCESS_TOKEN no está configurado en .env")
             return None
 
-        cart = self.request.session.get('cart_number')
+        pricing = pricing or CartPricer(self.request).price()
 
-        if not cart:
+        if not pricing.lines:
             return None
 
-        new_cart = []
-        for item in cart.items():
-            # Usar nombres camuflados para pasarelas de pago
-            item_id = item[0]
-            item_data = item[1]
-            product_id = item_data.get('product_id', item_id)
-            masked_name = get_masked_product_name(product_id, item_id)
-            masked_description = get_masked_description(
-                item_data['profiles'],
-                item_data['quantity'],
-                product_id
-            )
-
-            cart_items = {
-                "id": str(item_id),  # ID del item para homologación
-                "title": masked_name,
-                "description": masked_description,
-                "category_id": "services",  # Categoría del item para homologación
-                "quantity": item_data['profiles'],
-                "currency_id": "MXN",
-                "unit_price": item_data['unitPrice']*item_data['quantity'],
-                "picture_url": f'https://cuentasmexico.com/{item_data["image"]}',
-            }
-            new_cart.append(cart_items)
+        # Nombres camuflados y precio de lista por perfil (unitPrice * meses)
+        new_cart = pricing.mercadopago_items()
 
         # Inicializa Mercado Pago con variable de entorno
         sdk = mercadopago.SDK(self.mp_access_token)
@@ -7,6 +7,7 @@ from django.utils import timezone
 
 # Local
 from index.models import IndexCart, IndexCartdetail
+from index.cart_pricing import CartPricer
 from index.payment_methods.utils import get_masked_product_name, get_masked_description
 
 logger = logging.getLogger(__name__)
@@ -79,58 +80,13 @@ class PayPal:
         return order_data
 
     @staticmethod
-    def get_cart_items_for_paypal(request):
+    def get_cart_items_for_paypal(request, pricing=None):
         """
         Prepara los items del carrito para crear una orden de PayPal.
-        Aplica el descuento efectivo (mayor entre promocion y afiliado).
+        Aplica el descuento efectivo (mayor entre promocion y afiliado)
+        del CartPricing del carrito.
 
         Returns:
-            list: Lista de items en formato PayPal
+            tuple: (lista de items en formato PayPal, subtotal)
         """
-        cart = request.session.get('cart_number')
-
-        if not cart:
-            return None, 0
-
-        # Obtener porcentaje de descuento de la sesion
-        descuento_porcentaje = 0
-        if request.session.get('descuento_aplicado', 0) > 0:
-            # Calcular porcentaje desde los valores guardados
-            subtotal_original = request.session.get('cart_total', 0)
-            if subtotal_original > 0:
-                descuento_porcentaje = (request.session.get('descuento_aplicado', 0) / subtotal_original) * 100
-
-        items = []
-        subtotal = 0
-
-        for item_id, item_data in cart.items():
-            # Calcular precio por perfil (unitPrice * cantidad de meses)
-            item_cost = float(item_data['unitPrice']) * float(item_data['quantity'])
-            # Total de este item (precio por perfil * cantidad de perfiles)
-            item_total = item_cost * float(item_data['profiles'])
-
-            # Aplicar descuento si existe
-            if descuento_porcentaje > 0:
-                item_cost = item_cost * (1 - descuento_porcentaje / 100)
-                item_total = item_total * (1 - descuento_porcentaje / 100)
-
-            subtotal += item_total
-
-            # Usar nombres camuflados para pasarelas de pago
-            product_id = item_data.get('product_id', item_id)
-            masked_name = get_masked_product_name(product_id, item_id)
-            masked_description = get_masked_description(
-                item_data['profiles'],
-                item_data['quantity'],
-                product_id
-            )
-
-            items.append({
-                "name": masked_name[:127],  # PayPal limita a 127 caracteres
-                "description": masked_description,
-                "quantity": item_data['profiles'],
-                "itemCost": round(item_cost, 2),
-                "itemTotal": round(item_total, 2)
-            })
-
-        return items, round(subtotal, 2)
+        return (pricing or CartPricer(request).price()).paypal_items()
@@ -8,7 +8,7 @@ from django.utils import timezone
 
 # Local
 from index.models import IndexCart, IndexCartdetail
-from index.payment_methods.utils import get_masked_product_name, get_masked_description
+from index.cart_pricing import CartPricer
 
 logger = logging.getLogger(__name__)
 
@@ -29,63 +29,22 @@ class StripePayment:
         # Configurar Stripe con la secret key
         stripe.api_key = self.stripe_secret_key
 
-    def create_checkout_session(self, cart_id):
+    def create_checkout_session(self, cart_id, pricing=None):
         """
         Crea una sesion de Stripe Checkout basada en el carrito de la sesion.
+        `pricing` es el CartPricing ya calculado (si no, se calcula).
 
         Returns:
             dict: Contiene 'session_id' y 'url' si es exitoso, None si falla.
         """
-        cart = self.request.session.get('cart_number')
+        pricing = pricing or CartPricer(self.request).price()
 
-        if not cart:
+        if not pricing.lines:
             logger.warning("No hay carrito en la sesion")
             return None
 
-        # Obtener porcentaje de descuento de la sesion (si hay descuento activo)
-        descuento_porcentaje = 0
-        if self.request.session.get('descuento_aplicado', 0) > 0:
-            subtotal_original = self.request.session.get('cart_total', 0)
-            if subtotal_original > 0:
-                descuento_porcentaje = (self.request.session.get('descuento_aplicado', 0) / subtotal_original) * 100
-
-        # Convertir items del carrito al formato de Stripe
-        line_items = []
-
-        for item_id, item_data in cart.items():
-            # Calcular precio por perfil (unitPrice * cantidad de meses)
-            item_cost = float(item_data['unitPrice']) * float(item_data['quantity'])
-            
-            # Aplicar descuento si existe
-            if descuento_porcentaje > 0:
-                item_cost = item_cost * (1 - descuento_porcentaje / 100)
-            
-            # Total de este item (precio por perfil * cantidad de perfiles)
-            item_total = item_cost * float(item_data['profiles'])
-
-            # Stripe espera precios en centavos (MXN centavos)
-            unit_amount_cents = int(round(item_cost * 100))
-
-            # Usar nombres camuflados para pasarelas de pago
-            product_id = item_data.get('product_id', item_id)
-            masked_name = get_masked_product_name(product_id, item_id)
-            masked_description = get_masked_description(
-                item_data['profiles'],
-                item_data['quantity'],
-                product_id
-            )
-
-            line_items.append({
-                'price_data': {
-                    'currency': 'mxn',
-                    'product_data': {
-                        'name': masked_name[:127],
-                        'description': masked_description,
-                    },
-                    'unit_amount': unit_amount_cents,
-                },
-                'quantity': int(item_data['profiles']),
-            })
+        # Items en formato de Stripe con el descuento efectivo ya aplicado
+        line_items = pricing.stripe_line_items()
 
         try:
             # Crear sesion de checkout en Stripe
@@ -114,58 +73,15 @@ class StripePayment:
             return None
 
     @staticmethod
-    def get_cart_items_for_stripe(request):
+    def get_cart_items_for_stripe(request, pricing=None):
         """
         Prepara los items del carrito para crear una sesion de Stripe.
+        Usa el CartPricing del carrito (el mismo que PayPal y MercadoPago).
 
         Returns:
             tuple: (lista de items en formato Stripe, subtotal)
         """
-        cart = request.session.get('cart_number')
-
-        if not cart:
-            return None, 0
-
-        # Obtener porcentaje de descuento de la sesion (si hay descuento activo)
-        descuento_porcentaje = 0
-        if request.session.get('descuento_aplicado', 0) > 0:
-            subtotal_original = request.session.get('cart_total', 0)
-            if subtotal_original > 0:
-                descuento_porcentaje = (request.session.get('descuento_aplicado', 0) / subtotal_original) * 100
-
-        items = []
-        subtotal = 0
-
-        for item_id, item_data in cart.items():
-            # Calcular precio por perfil (unitPrice * cantidad de meses)
-            item_cost = float(item_data['unitPrice']) * float(item_data['quantity'])
-            
-            # Aplicar descuento si existe
-            if descuento_porcentaje > 0:
-                item_cost = item_cost * (1 - descuento_porcentaje / 100)
-            
-            # Total de este item (precio por perfil * cantidad de perfiles)
-            item_total = item_cost * float(item_data['profiles'])
-            subtotal += item_total
-
-            # Usar nombres camuflados para pasarelas de pago
-            product_id = item_data.get('product_id', item_id)
-            masked_name = get_masked_product_name(product_id, item_id)
-            masked_description = get_masked_description(
-                item_data['profiles'],
-                item_data['quantity'],
-                product_id
-            )
-
-            items.append({
-                "name": masked_name[:127],
-                "description": masked_description,
-                "quantity": item_data['profiles'],
-                "itemCost": round(item_cost, 2),
-                "itemTotal": round(item_total, 2)
-            })
-
-        return items, round(subtotal, 2)
+        return (pricing or CartPricer(request).price()).stripe_items()
 
     @staticmethod
     def verify_webhook_signature(payload, sig_header, webhook_secret):
@@ -148,6 +148,7 @@
     if (!root) return;
 
     var endpoint = root.getAttribute("data-endpoint");
+    var streamEndpoint = window.ReadableStream && window.TextDecoder ? root.getAttribute("data-stream-endpoint") : null;
     var metaEndpoint = root.getAttribute("data-meta-endpoint");
     var maxImages = parseInt(root.getAttribute("data-max-images") || "3", 10);
     var toggleBtn = document.getElementById("cm-ai-chat-toggle");
@@ -191,6 +192,84 @@
       return div;
     }
 
+    function parseSseBlock(block) {
+      var eventName = "message";
+      var dataLines = [];
+      block.split("\n").forEach(function (line) {
+        if (line.indexOf("event:") === 0) {
+          eventName = line.slice(6).trim();
+        } else if (line.indexOf("data:") === 0) {
+          dataLines.push(line.slice(5).replace(/^ /, ""));
+        }
+      });
+      if (!dataLines.length) return null;
+      try {
+        return { event: eventName, data: JSON.parse(dataLines.join("\n")) };
+      } catch (parseError) {
+        return null;
+      }
+    }
+
+    // Lee el stream SSE del chat y va pintando la respuesta conforme llega.
+    // El timeout se reinicia con cada fragmento: solo corta si el stream se queda callado.
+    async function readAnswerStream(response, controller, onFirstToken) {
+      var reader = response.body.getReader();
+      var decoder = new TextDecoder();
+      var buffer = "";
+      var result = { answer: "", meta: {}, failure: null, bubble: null };
+      var idleTimer = null;
+      function armIdleTimeout() {
+        clearTimeout(idleTimer);
+        idleTimer = setTimeout(function () {
+          controller.abort();
+        }, requestTimeoutMs);
+      }
+      armIdleTimeout();
+      try {
+        while (true) {
+          var step = await reader.read();
+          if (step.done) break;
+          armIdleTimeout();
+          buffer += decoder.decode(step.value, { stream: true }).replace(/\r\n/g, "\n");
+          var boundary = buffer.indexOf("\n\n");
+          while (boundary >= 0) {
+            var message = parseSseBlock(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            boundary = buffer.indexOf("\n\n");
+            if (!message) continue;
+            var data = message.data || {};
+            if (message.event === "meta") {
+              result.meta = data;
+            } else if (message.event === "delta") {
+              result.answer += data.text || "";
+              if (!result.bubble) {
+                onFirstToken();
+                result.bubble = appendMessage("assistant", result.answer);
+              } else {
+                result.bubble.innerHTML = renderMarkdown(result.answer);
+                messagesEl.scrollTop = messagesEl.scrollHeight;
+              }
+            } else if (message.event === "done") {
+              result.answer = data.answer || result.answer;
+            } else if (message.event === "error") {
+              result.failure = data;
+            }
+          }
+        }
+      } finally {
+        clearTimeout(idleTimer);
+      }
+      return result;
+    }
+
+    function showMcpNotice(data) {
+      if (data && data.mcp_used) {
+        appendMessage("assistant", "Acción: usé MCP de base de datos (solo lectura) para responder.", "cm-ai-chat-msg--status");
+      } else if (data && data.mcp_mode === "force") {
+        appendMessage("assistant", "Aviso: forzaste MCP pero no se logró usar contexto DB.", "cm-ai-chat-msg--status");
+      }
+    }
+
     function setLoading(state) {
       loading = !!state;
       sendBtn.disabled = loading;
@@ -318,7 +397,7 @@
           controller.abort();
         }, requestTimeoutMs);
 
-        var response = await fetch(endpoint, {
+        var response = await fetch(streamEndpoint || endpoint, {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
@@ -334,6 +413,33 @@
           })
         });
         clearTimeout(timeoutId);
+
+        var contentType = response.headers.get("Content-Type") || "";
+        if (response.ok && response.body && contentType.indexOf("text/event-stream") >= 0) {
+          var streamed = await readAnswerStream(response, controller, function () {
+            clearInterval(stageTimer);
+            statusMsg.remove();
+          });
+          clearInterval(stageTimer);
+          statusMsg.remove();
+          if (streamed.failure) {
+            var streamExtra = streamed.failure.details ? "\n\n" + streamed.failure.details : "";
+            appendMessage(
+              "assistant",
+              (streamed.failure.error || "No se pudo procesar tu consulta en este momento.") + streamExtra
+            );
+            return;
+          }
+          if (streamed.bubble) {
+            streamed.bubble.innerHTML = renderMarkdown(streamed.answer || "Sin respuesta.");
+          } else {
+            appendMessage("assistant", streamed.answer || "Sin respuesta.");
+          }
+          showMcpNotice(streamed.meta);
+          history.push({ role: "assistant", content: streamed.answer || "" });
+          return;
+        }
+
         var rawBody = await response.text();
         var data = null;
         try {
@@ -369,11 +475,7 @@
           return;
         }
         appendMessage("assistant", data.answer || "Sin respuesta.");
-        if (data && data.mcp_used) {
-          appendMessage("assistant", "Acción: usé MCP de base de datos (solo lectura) para responder.", "cm-ai-chat-msg--status");
-        } else if (data && data.mcp_mode === "force") {
-          appendMessage("assistant", "Aviso: forzaste MCP pero no se logró usar contexto DB.", "cm-ai-chat-msg--status");
-        }
+        showMcpNotice(data);
         history.push({ role: "assistant", content: data.answer || "" });
       } catch (error) {
         clearInterval(stageTimer);
@@ -1,5 +1,23 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.urls import reverse
+from CuentasMexico.ai import AIClient, InputPart
+from CuentasMexico.ai.gemini_provider import GeminiProvider
+from CuentasMexico.ai.openai_provider import OpenAIProvider
+from adm.functions import promotion_engine
+from adm.models import Affiliate, Business, IndexPromoImage, Promocion, Service
+from index.cart_pricing import CartPricer
+from index.models import IndexCartdetail
 from index.phone_utils import PhoneNumberHandler
 
 
@@ -86,3 +104,374 @@ class RedeemShortcutRoutesTestCase(TestCase):
         response = self.client.get('/redeem/7FREE')
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, '/redeem?name=7FREE')
+
+
+@override_settings(OTP_RATE_LIMIT_PER_PHONE=2, OTP_RATE_LIMIT_PER_IP=10, OTP_RATE_WINDOW_SEC=900)
+class VerificationRateLimitTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _send(self, phone, remote_addr='198.51.100.7'):
+        return self.client.post(
+            reverse('send_whatsapp_verification'),
+            data=json.dumps({'phone_number': phone, 'country': 'México'}),
+            content_type='application/json',
+            REMOTE_ADDR=remote_addr,
+        )
+
+    @patch('index.views.WhatsAppVerification.send_verification_code')
+    def test_phone_limit_returns_429_with_retry_after(self, send_code):
+        send_code.return_value = {'success': True, 'message': 'ok'}
+
+        self.assertEqual(self._send('8331234567').status_code, 200)
+        self.assertEqual(self._send('833 123 4567').status_code, 200)
+        response = self._send('8331234567')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(send_code.call_count, 2)
+        # Otro número desde la misma IP sigue permitido
+        self.assertEqual(self._send('8339999999').status_code, 200)
+
+    @patch('index.views.WhatsAppVerification.send_verification_code')
+    def test_ip_limit_across_numbers(self, send_code):
+        send_code.return_value = {'success': True, 'message': 'ok'}
+        statuses = [self._send(f'83300000{i:02d}').status_code for i in range(11)]
+        self.assertEqual(statuses.count(200), 10)
+        self.assertEqual(statuses[-1], 429)
+
+    @patch('index.views.WhatsAppVerification.send_verification_code')
+    def test_spoofed_forwarded_for_does_not_change_ip_bucket(self, send_code):
+        send_code.return_value = {'success': True, 'message': 'ok'}
+        statuses = [
+            self.client.post(
+                reverse('send_whatsapp_verification'),
+                data=json.dumps({'phone_number': f'83300000{i:02d}', 'country': 'México'}),
+                content_type='application/json',
+                # nginx agrega la IP real después de lo que mande el cliente
+                HTTP_X_FORWARDED_FOR=f'10.0.0.{i}, 198.51.100.7',
+                REMOTE_ADDR='172.18.0.5',
+            ).status_code
+            for i in range(11)
+        ]
+        self.assertEqual(statuses.count(200), 10)
+        self.assertEqual(statuses[-1], 429)
+
+    @patch('index.views.WhatsAppVerification.send_verification_code')
+    def test_phone_rejections_do_not_consume_ip_budget(self, send_code):
+        send_code.return_value = {'success': True, 'message': 'ok'}
+        statuses = [self._send('8331234567').status_code for _ in range(6)]
+        self.assertEqual(statuses, [200, 200, 429, 429, 429, 429])
+
+        # Solo los 2 envíos aceptados cuentan contra el límite de 10 por IP
+        statuses = [self._send(f'83300000{i:02d}').status_code for i in range(9)]
+        self.assertEqual(statuses.count(200), 8)
+        self.assertEqual(statuses[-1], 429)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StorefrontCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        promotion_engine.reset()
+        Business.objects.create(pk=1, name='Cuentas Test', email='biz@test.com', url='https://test.biz', phone_number='+5218331234567')
+        self.service = Service.objects.create(description='Netflix', perfil_quantity=1, price=111, regular_price=111)
+        Service.objects.create(description='Spotify', perfil_quantity=1, price=55, regular_price=55)
+
+    def tearDown(self):
+        promotion_engine.reset()
+
+    def test_anonymous_home_is_served_from_fragment_cache(self):
+        first = self.client.get('/')
+        self.assertEqual(first.status_code, 200)
+        self.assertContains(first, 'Netflix')
+        # Solo queda el INSERT de PageVisitMiddleware; la página no consulta nada
+        with self.assertNumQueries(1):
+            second = self.client.get('/')
+        self.assertEqual(second.content, first.content)
+
+        self.service.description = 'Netflix Premium'
+        self.service.save()
+        IndexPromoImage.objects.create(image='index/promos/izquierda.png', title='Promo izquierda', position='left')
+        third = self.client.get('/')
+        self.assertContains(third, 'Netflix Premium')
+        self.assertContains(third, 'Promo izquierda')
+
+    def test_cart_badge_is_rendered_outside_the_fragment(self):
+        self.client.get('/')
+        session = self.client.session
+        session['cart_quantity'] = 3
+        session.save()
+        response = self.client.get('/')
+        self.assertRegex(response.content.decode(), r'rounded-pill bg-danger">\s*3\s*</span>')
+        self.assertContains(response, 'Netflix')
+
+    def test_shop_list_is_cached_per_city(self):
+        self.client.get('/shop')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/shop').status_code, 200)
+        self.client.get('/shop?city=Monterrey')
+        with self.assertNumQueries(1):
+            self.client.get('/shop?city=Monterrey')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CartPricingTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # index_cartdetail no es administrada por Django; se crea para la prueba
+        with connection.schema_editor() as editor:
+            editor.create_model(IndexCartdetail)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(IndexCartdetail)
+
+    def setUp(self):
+        cache.clear()
+        promotion_engine.reset()
+        Business.objects.create(pk=1, name='Cuentas Test', email='biz@test.com', url='https://test.biz', phone_number='+5218331234567')
+        self.services = [
+            Service.objects.create(description=f'Servicio {index}', perfil_quantity=1, price=100 + index * 10)
+            for index in range(6)
+        ]
+        promocion = Promocion.objects.create(
+            nombre='Verano', tipo_descuento='porcentaje', porcentaje_descuento=20, aplicacion='especificos', status='activa',
+        )
+        promocion.servicios.set([self.services[1]])
+        self.user = User.objects.create_user(username='cliente', password='secret123')
+        partner = User.objects.create_user(username='socio', password='secret123')
+        Affiliate.objects.create(user=partner, codigo_afiliado='SOCIO1', codigo_descuento='SOCIO10', porcentaje_descuento=10)
+
+    def tearDown(self):
+        promotion_engine.reset()
+
+    def _cart(self, services):
+        cart = {}
+        for service in services:
+            cart[str(service.id)] = {
+                'product_id': service.id, 'name': service.description, 'quantity': 2, 'profiles': 1,
+                'price': service.price * 2, 'image': '', 'description': service.description, 'unitPrice': service.price,
+            }
+        return cart
+
+    def _session(self, services, affiliate_code=None):
+        session = self.client.session
+        session['cart_number'] = self._cart(services)
+        session['cart_total'] = sum(item['price'] for item in session['cart_number'].values())
+        session['cart_quantity'] = len(services)
+        if affiliate_code:
+            session['affiliate_code'] = affiliate_code
+        session.save()
+
+    def test_one_pricing_feeds_summary_and_payment_payloads(self):
+        request = SimpleNamespace(session={'cart_number': self._cart(self.services[:3]), 'affiliate_code': 'SOCIO1'})
+        pricing = CartPricer(request).price()
+        # La promoción (20%) gana al código de afiliado (10%)
+        self.assertEqual((pricing.tipo_descuento, pricing.nombre_descuento), ('promocion', 'Verano'))
+        self.assertEqual((pricing.subtotal, pricing.descuento_total, pricing.total_final), (660, 132, 528))
+        self.assertEqual(pricing.discount_info()['items'][0]['precio_final'], 160)
+
+        stripe_items, stripe_subtotal = pricing.stripe_items()
+        paypal_items, paypal_subtotal = pricing.paypal_items()
+        self.assertEqual(stripe_subtotal, paypal_subtotal)
+        self.assertAlmostEqual(stripe_subtotal, 528, places=1)
+        self.assertEqual([item['name'] for item in paypal_items], [f'Suscripción Digital #{s.id}' for s in self.services[:3]])
+        self.assertEqual(
+            sum(line['price_data']['unit_amount'] * line['quantity'] for line in pricing.stripe_line_items()),
+            sum(round(item['itemCost'] * 100) for item in stripe_items),
+        )
+        self.assertEqual(pricing.mercadopago_items()[0]['unit_price'], 200)
+
+        with self.assertRaises(Exception):
+            pricing.subtotal = 0
+
+    @patch('index.views.STRIPE_ENABLED', True)
+    def test_cart_page_query_count_does_not_grow_with_lines(self):
+        self.client.login(username='cliente', password='secret123')
+        counts = []
+        for size in (2, 6):
+            self._session(self.services[:size], affiliate_code='SOCIO1')
+            self.client.get('/cart')  # calienta caché de negocio y promociones
+            self._session(self.services[:size], affiliate_code='SOCIO1')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/cart')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['paypal_data']['items']), size)
+            self.assertEqual(len(response.context['stripe_data']['items']), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(IndexCartdetail.objects.filter(cart__customer=self.user).count(), 2 + 2 + 6 + 6)
+
+
+
+class _FakeProviderHandler(BaseHTTPRequestHandler):
+    """Imita /v1/responses de OpenAI y streamGenerateContent de Gemini."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        server.requests.append((self.path, body))
+        if server.fail_status:
+            return self._send_json(server.fail_status, {'error': {'message': 'invalid api key'}})
+        if server.reject_temperature and 'temperature' in body:
+            return self._send_json(400, {'error': {'message': "Unsupported parameter: 'temperature'"}})
+        if self.path.startswith('/v1/responses') and not body.get('stream'):
+            return self._send_json(200, {'output_text': ''.join(server.words)})
+
+        gemini = ':streamGenerateContent' in self.path
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for word in server.words:
+                if gemini:
+                    event = 'data: ' + json.dumps({'candidates': [{'content': {'parts': [{'text': word}]}}]})
+                else:
+                    event = 'event: response.output_text.delta\ndata: ' + json.dumps(
+                        {'type': 'response.output_text.delta', 'delta': word}
+                    )
+                self.wfile.write((event + '\n\n').encode())
+                self.wfile.flush()
+                server.sent += 1
+                time.sleep(server.delay)
+            if not gemini:
+                self.wfile.write(b'event: response.completed\ndata: {"type": "response.completed"}\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            server.disconnected.set()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    AI_CHAT_USE_DB_CONTEXT=False,
+)
+class AIChatStreamTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeProviderHandler)
+        cls.server.daemon_threads = True
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.server.words = ['Hola', ', ', 'soy ', 'el asistente.']
+        self.server.delay = 0
+        self.server.sent = 0
+        self.server.reject_temperature = False
+        self.server.fail_status = None
+        self.server.requests = []
+        self.server.disconnected = threading.Event()
+        self.user = User.objects.create_user('staff', 'staff@test.com', 'x')
+        self.client.force_login(self.user)
+        for target, value in [
+            ('get_active_provider', 'openai'),
+            ('get_model_for_task', 'gpt-5-mini'),
+            ('get_provider_api_key', 'sk-test'),
+        ]:
+            patcher = patch(f'index.views_ai_chat.{target}', return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch('index.views_ai_chat._chat_client', side_effect=lambda: AIClient(
+            OpenAIProvider(api_key='sk-test', base_url=self.base_url, timeout=5), provider_name='openai'
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post(self, name='site_ai_chat_stream', message='hola'):
+        return self.client.post(
+            reverse(name),
+            data=json.dumps({'message': message, 'mcp_mode': 'off'}),
+            content_type='application/json',
+            HTTP_REFERER='https://cuentasmexico.com/adm/',
+        )
+
+    @staticmethod
+    def _events(chunks):
+        events = []
+        for block in b''.join(chunks).decode().split('\n\n'):
+            if block.strip():
+                event, data = block.split('\n')
+                events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_openai_stream_yields_deltas_and_retries_without_temperature(self):
+        self.server.reject_temperature = True
+        provider = OpenAIProvider(api_key='sk-test', base_url=self.base_url, timeout=5)
+        chunks = list(provider.generate_stream(model='gpt-5-mini', parts=[InputPart.from_text('hola')], temperature=0.2))
+
+        self.assertEqual(chunks, self.server.words)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(self.server.requests[-1][1]['stream'])
+        self.assertNotIn('temperature', self.server.requests[-1][1])
+
+    def test_gemini_stream_uses_sse_endpoint(self):
+        provider = GeminiProvider(api_key='g-test', base_url=self.base_url, timeout=5)
+        chunks = list(provider.generate_stream(model='gemini-2.5-flash', parts=[InputPart.from_text('hola')]))
+
+        self.assertEqual(chunks, self.server.words)
+        self.assertEqual(self.server.requests[0][0], '/models/gemini-2.5-flash:streamGenerateContent?alt=sse')
+
+    def test_stream_endpoint_sends_meta_deltas_and_done(self):
+        response = self._post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        events = self._events(response.streaming_content)
+        self.assertEqual(events[0][0], 'meta')
+        self.assertEqual(events[0][1]['model'], 'gpt-5-mini')
+        self.assertEqual([data['text'] for event, data in events if event == 'delta'], self.server.words)
+        self.assertEqual(events[-1], ('done', {'success': True, 'answer': 'Hola, soy el asistente.'}))
+
+    def test_json_endpoint_keeps_working(self):
+        response = self._post(name='site_ai_chat')
+        self.assertEqual(response.json()['answer'], 'Hola, soy el asistente.')
+
+    def test_validation_errors_stay_json(self):
+        response = self._post(message='')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+    def test_provider_error_becomes_error_event(self):
+        self.server.fail_status = 401
+        events = self._events(self._post().streaming_content)
+        self.assertEqual(events[-1][0], 'error')
+        self.assertIn('Error del proveedor IA', events[-1][1]['error'])
+
+    def test_client_disconnect_cancels_upstream_request(self):
+        self.server.words = [f'token{i} ' for i in range(500)]
+        self.server.delay = 0.01
+        response = self._post()
+        stream = iter(response.streaming_content)
+        next(stream)  # meta
+        self.assertIn(b'delta', next(stream))
+        # Lo que hace el servidor WSGI cuando el navegador se va
+        response.close()
+
+        self.assertTrue(self.server.disconnected.wait(5))
+        self.assertLess(self.server.sent, len(self.server.words))
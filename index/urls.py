@@ -79,6 +79,7 @@ urlpatterns = [
     path('api/disney-change-availability/', views.disney_change_availability, name='disney_change_availability'),
     path('api/disney-change-account/', views.disney_change_account, name='disney_change_account'),
     path('api/ai-chat/', views_ai_chat.ai_chat, name='site_ai_chat'),
+    path('api/ai-chat/stream/', views_ai_chat.ai_chat_stream, name='site_ai_chat_stream'),
     path('api/ai-chat/meta/', views_ai_chat.ai_chat_meta, name='site_ai_chat_meta'),
 
     # PayPal payment routes
@@ -561,74 +561,7 @@ def calcular_descuento_carrito(request):
             - nombre_descuento: Nombre del descuento aplicado
             - items: Lista de items con descuento individual
     """
-    from adm.models import Service
+    from index.cart_pricing import CartPricer
 
-    cart = request.session.get('cart_number', {})
-    subtotal = 0
-    descuento_total = 0
-    items_con_descuento = []
-
-    # Obtener el mejor descuento global (para simplicidad, usamos porcentaje)
-    mejor_descuento_porcentaje = 0
-    tipo_descuento = None
-    nombre_descuento = None
-
-    # 1. Verificar si hay codigo de afiliado en sesion
-    affiliate_code = request.session.get('affiliate_code')
-    if affiliate_code:
-        try:
-            affiliate = Affiliate.objects.get(codigo_afiliado=affiliate_code, status='activo')
-            mejor_descuento_porcentaje = float(affiliate.porcentaje_descuento)
-            tipo_descuento = 'afiliado'
-            nombre_descuento = f'Codigo {affiliate.codigo_descuento}'
-        except Affiliate.DoesNotExist:
-            pass
-
-    # 2. Verificar promociones activas (obtener el mayor descuento de promocion)
-    from adm.functions.promociones import PromocionManager
-
-    for item_id, item_data in cart.items():
-        try:
-            servicio = Service.objects.get(pk=item_data.get('product_id'))
-            promo_info = PromocionManager.calcular_precio_con_descuento(servicio)
-
-            if promo_info['porcentaje_descuento'] > mejor_descuento_porcentaje:
-                mejor_descuento_porcentaje = promo_info['porcentaje_descuento']
-                tipo_descuento = 'promocion'
-                nombre_descuento = promo_info.get('promocion_nombre', 'Promocion')
-        except Service.DoesNotExist:
-            pass
-
-    # 3. Calcular totales con el mejor descuento
-    for item_id, item_data in cart.items():
-        precio_item = int(item_data.get('price', 0))
-        subtotal += precio_item
-
-        if mejor_descuento_porcentaje > 0:
-            descuento_item = int(precio_item * (mejor_descuento_porcentaje / 100))
-            descuento_total += descuento_item
-            precio_final_item = precio_item - descuento_item
-        else:
-            descuento_item = 0
-            precio_final_item = precio_item
-
-        items_con_descuento.append({
-            'id': item_id,
-            'nombre': item_data.get('name', ''),
-            'precio_original': precio_item,
-            'descuento': descuento_item,
-            'precio_final': precio_final_item,
-        })
-
-    total_final = subtotal - descuento_total
-
-    return {
-        'subtotal': subtotal,
-        'descuento_total': descuento_total,
-        'total_final': total_final,
-        'porcentaje_descuento': mejor_descuento_porcentaje,
-        'tipo_descuento': tipo_descuento,
-        'nombre_descuento': nombre_descuento,
-        'tiene_descuento': descuento_total > 0,
-        'items': items_con_descuento,
-    }
+    # Servicios, afiliado y promociones se cargan una sola vez (ver CartPricer)
+    return CartPricer(request).price().discount_info()
@@ -11,6 +11,7 @@ from django.views.generic import DetailView, CreateView, TemplateView, ListView,
 from django.views.generic.edit import FormView
 from django.http import HttpResponseRedirect
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -21,8 +22,9 @@ from index.models import IndexCart, IndexCartdetail
 from index.payment_methods.MercagoPago import MercadoPago
 from index.payment_methods.PayPal import PayPal
 from index.payment_methods.Stripe import StripePayment
-from index.payment_methods.utils import get_masked_product_name, get_masked_description
+from index.cart_pricing import CartPricer
 from django.core.cache import cache
+from CuentasMexico.ratelimit import rate_limit
 import stripe
 
 # Configuracion de metodos de pago habilitados
@@ -141,28 +143,29 @@ def _get_pending_redeem_redirect(request, pop=False):
 
 def index(request):
     from adm.models import IndexCarouselImage, IndexPromoImage
+    from adm.functions import storefront_cache
     from adm.functions.promociones import PromocionManager
     template_name = "index/index.html"
 
-    # Obtener imágenes activas
+    # Todo lo de abajo es perezoso: solo se consulta si el fragmento
+    # {% cache %} de index.html no está en caché para esta versión del catálogo
     carousel_images = IndexCarouselImage.objects.filter(active=True).order_by('order')
     promo_images = IndexPromoImage.objects.filter(active=True).order_by('position')
 
     # Separar promociones por posición
-    promo_left = promo_images.filter(position='left').first()
-    promo_right = promo_images.filter(position='right').first()
+    promo_left = SimpleLazyObject(lambda: promo_images.filter(position='left').first())
+    promo_right = SimpleLazyObject(lambda: promo_images.filter(position='right').first())
 
-    # Obtener servicios y aplicar promociones
-    servicios = Service.objects.filter(status=True)
-    servicios_con_promocion = PromocionManager.aplicar_promociones_a_servicios(servicios)
+    # Servicios con promociones aplicadas
+    servicios_con_promocion = SimpleLazyObject(
+        lambda: PromocionManager.aplicar_promociones_a_servicios(Service.objects.filter(status=True))
+    )
 
     # Obtener banners de promociones
     promociones_banner = PromocionManager.obtener_promociones_banner()
 
     return render(request, template_name, {
-        'business': BusinessInfo.data(),
-        'credits': BusinessInfo.credits(request),
-        'services': Service.objects.filter(status=True),
+        **storefront_cache.page_context(request),
         'servicios_con_promocion': servicios_con_promocion,
         'carousel_images': carousel_images,
         'promo_left': promo_left,
@@ -174,7 +177,7 @@ def index(request):
 class CartView(TemplateView):
     template_name = "index/cart.html"
 
-    def set_cart_mercadopago(self, cart_db):
+    def set_cart_mercadopago(self, cart_db, pricing=None):
         """Configura el pago con MercadoPago (deshabilitado por defecto)"""
         if not MERCADOPAGO_ENABLED:
             return None
@@ -184,18 +187,18 @@ class CartView(TemplateView):
             return cached
 
         mp = MercadoPago(self.request)
-        result = mp.Mp_ExpressCheckout(cart_db.id)
+        result = mp.Mp_ExpressCheckout(cart_db.id, pricing=pricing)
         if result:
             cache.set('cart_mp', result, timeout=60*60*24)
         return result
 
-    def set_cart_paypal(self, cart_db):
+    def set_cart_paypal(self, cart_db, pricing=None):
         """Prepara los datos para PayPal"""
         if not PAYPAL_ENABLED:
             return None
 
         # Preparar items del carrito para PayPal
-        items, subtotal = PayPal.get_cart_items_for_paypal(self.request)
+        items, subtotal = PayPal.get_cart_items_for_paypal(self.request, pricing=pricing)
         if not items:
             return None
 
@@ -206,13 +209,13 @@ class CartView(TemplateView):
             'ready': True
         }
 
-    def set_cart_stripe(self, cart_db):
+    def set_cart_stripe(self, cart_db, pricing=None):
         """Prepara los datos para Stripe"""
         if not STRIPE_ENABLED:
             return None
 
         # Preparar items del carrito para Stripe
-        items, subtotal = StripePayment.get_cart_items_for_stripe(self.request)
+        items, subtotal = StripePayment.get_cart_items_for_stripe(self.request, pricing=pricing)
         if not items:
             return None
 
@@ -225,7 +228,6 @@ class CartView(TemplateView):
 
     def get_context_data(self, **kwargs):
         import os
-        from index.utils_affiliates import calcular_descuento_carrito
 
         context = super().get_context_data(**kwargs)
         context["business"] = BusinessInfo.data()
@@ -253,8 +255,10 @@ class CartView(TemplateView):
         context["paypal_data"] = None  # PayPal
         context["stripe_data"] = None  # Stripe
 
-        # Calcular descuento efectivo (mayor entre promocion y afiliado)
-        descuento_info = calcular_descuento_carrito(self.request)
+        # Calcular descuento efectivo (mayor entre promocion y afiliado); el
+        # mismo resultado alimenta el resumen y las tres pasarelas
+        pricing = CartPricer(self.request).price()
+        descuento_info = pricing.discount_info()
         context['descuento_info'] = descuento_info
 
         # Guardar total con descuento en sesion para usarlo en pagos
@@ -276,19 +280,19 @@ class CartView(TemplateView):
             return context
 
         # Crear carrito en BD
-        cart_db = CartDb.create_full_cart(self)
+        cart_db = CartDb.create_full_cart(self, pricing=pricing)
         if cart_db is None:
             return context
 
         # Configurar metodos de pago disponibles
         if MERCADOPAGO_ENABLED:
-            context["init_point"] = self.set_cart_mercadopago(cart_db)
+            context["init_point"] = self.set_cart_mercadopago(cart_db, pricing)
 
         if PAYPAL_ENABLED:
-            context["paypal_data"] = self.set_cart_paypal(cart_db)
+            context["paypal_data"] = self.set_cart_paypal(cart_db, pricing)
 
         if STRIPE_ENABLED:
-            context["stripe_data"] = self.set_cart_stripe(cart_db)
+            context["stripe_data"] = self.set_cart_stripe(cart_db, pricing)
 
         return context
 
@@ -345,10 +349,12 @@ class ShopListView(ListView):
     template_name = "index/shop.html"
 
     def get_context_data(self, **kwargs):
+        from adm.functions import storefront_cache
+
         context = super().get_context_data(**kwargs)
-        context["business"] = BusinessInfo.data()
-        context["credits"] = BusinessInfo.credits(self.request)
-        context['services'] = Service.objects.filter(status=True)
+        # object_list es perezoso; shop.html lo pinta dentro de {% cache %}
+        context.update(storefront_cache.page_context(self.request))
+        context['city'] = self.request.GET.get('city')
         return context
 
     def get_queryset(self):
@@ -673,13 +679,11 @@ class RedeemDoneView(TemplateView):
             self._cached_code = cupon
             service = Service.objects.get(pk=service_id)
             validate_coupon_for_customer(cupon, self.request.user, service=service)
-            end_date = cupon.get_expiration_date(timezone.now())
             customer = self.request.user.id
 
-            account = Sales.search_better_acc(service_id, end_date, code)
+            account = Sales.redeem_best_account(self.request, service_id, code, customer, validated_coupon=cupon)
 
             if account[0] == True:
-                Sales.redeem(self.request, account[1], code, customer, validated_coupon=cupon)
                 latest_sale = (
                     Sale.objects.filter(
                         customer_id=customer,
@@ -1101,23 +1105,17 @@ def DistributorSale(request):
 
     for key, values in cart.items():
         for i in range(values['profiles']):
-            expiration_date = timezone.now() + timedelta(days=30 *
-                                                         values['quantity'])
-            new_acc = Sales.search_better_acc(
-                values['product_id'], expiration_date, None)
             quantity = values['quantity']
             service_name = values['name']
             price = (int(values['unitPrice'])*int(values['quantity']))*-1
 
-            print(new_acc)
-            if new_acc == None:
-                return HttpResponse('Tenemos problemas para completar tu orden, porfavor contactate con atencion al cliente.')
-
-            elif new_acc[0] == False:
-                return HttpResponse(new_acc[1])
+            # Aparta y asigna la cuenta dentro de la transacción de la venta
+            new_sale = Sales.web_sale_best_account(
+                request, values['product_id'], values['unitPrice'], values['quantity'])
+            if new_sale[0] == False:
+                return HttpResponse(new_sale[1])
             else:
-                sale = Sales.web_sale(
-                    request, new_acc[1], values['unitPrice'], values['quantity'])
+                sale = new_sale[1]
                 sale_id = sale['id']
                 Sales.credits_modify(
                     customer, price, f'Orden {sale_id}: {quantity} meses de {service_name}.')
@@ -1297,24 +1295,20 @@ def mp_webhook(request):
 
                     # Buscar la mejor cuenta disponible usando la lógica optimizada
                     try:
-                        best_account = Sales.find_best_account(
+                        best_account, sale_result = Sales.sell_best_account(
                             service_id=service_id,
-                            months_requested=months
+                            months_requested=months,
+                            customer=customer,
+                            webhook_provider="MercadoPago",
+                            payment_type=payment_data.get('payment_type_id', 'unknown'),
+                            payment_id=str(payment_id),
+                            expiration_date=expiration,
+                            unit_price=unit_price,
+                            request=request
                         )
 
                         if best_account:
                             logger.info(f"    Mejor cuenta encontrada: {best_account.email} (Perfil: {best_account.profile})")
-                            # Crear la venta
-                            sale_result = Sales.sale_ok(
-                                customer=customer,
-                                webhook_provider="MercadoPago",
-                                payment_type=payment_data.get('payment_type_id', 'unknown'),
-                                payment_id=str(payment_id),
-                                service_obj=best_account,
-                                expiration_date=expiration,
-                                unit_price=unit_price,
-                                request=request
-                            )
                             if sale_result and sale_result[0]:
                                 sales_created.append(sale_result[1])
                                 logger.info(f"    Venta creada exitosamente: ID {sale_result[1].id}")
@@ -1914,6 +1908,9 @@ from .email_verification import EmailVerification
 
 @require_http_methods(["POST"])
 @csrf_exempt
+@rate_limit('otp_ip', limit='OTP_RATE_LIMIT_PER_IP', window='OTP_RATE_WINDOW_SEC', key='ip')
+@rate_limit('otp_phone', limit='OTP_RATE_LIMIT_PER_PHONE', window='OTP_RATE_WINDOW_SEC', key='phone',
+            message='Ya enviamos varios códigos a este número. Espera unos minutos antes de pedir otro.')
 def send_whatsapp_verification(request):
     """
     Send verification code via WhatsApp
@@ -2015,6 +2012,9 @@ def verify_whatsapp_code(request):
 
 @require_http_methods(["POST"])
 @csrf_exempt
+@rate_limit('otp_ip', limit='OTP_RATE_LIMIT_PER_IP', window='OTP_RATE_WINDOW_SEC', key='ip')
+@rate_limit('otp_phone', limit='OTP_RATE_LIMIT_PER_PHONE', window='OTP_RATE_WINDOW_SEC', key='phone',
+            message='Ya enviamos varios códigos a este número. Espera unos minutos antes de pedir otro.')
 def send_whatsapp_login_code(request):
     """
     Send verification code for login via WhatsApp
@@ -2212,6 +2212,8 @@ def whatsapp_login_verify_and_auth(request):
 @require_http_methods(["POST"])
 @csrf_exempt
 @login_required
+@rate_limit('email_verification', limit='EMAIL_VERIFICATION_RATE_LIMIT',
+            window='EMAIL_VERIFICATION_RATE_WINDOW_SEC', key='user')
 def send_email_verification(request):
     """
     Send verification code via email for authenticated user.
@@ -2556,22 +2558,19 @@ def process_paypal_payment(request, cart_id, order_id, payment_data):
         profiles_without_stock = 0
         for i in range(profiles):
             try:
-                best_account = Sales.find_best_account(
+                best_account, sale_result = Sales.sell_best_account(
                     service_id=service_id,
-                    months_requested=months
+                    months_requested=months,
+                    customer=customer,
+                    webhook_provider="PayPal",
+                    payment_type="paypal",
+                    payment_id=order_id,
+                    expiration_date=expiration,
+                    unit_price=unit_price,
+                    request=request
                 )
 
                 if best_account:
-                    sale_result = Sales.sale_ok(
-                        customer=customer,
-                        webhook_provider="PayPal",
-                        payment_type="paypal",
-                        payment_id=order_id,
-                        service_obj=best_account,
-                        expiration_date=expiration,
-                        unit_price=unit_price,
-                        request=request
-                    )
                     if sale_result and sale_result[0]:
                         sales_created.append(sale_result[1])
                         logger.info(f"PayPal: Venta creada: ID {sale_result[1].id}")
@@ -2696,22 +2695,19 @@ def paypal_capture_order(request):
             profiles_without_stock = 0
             for i in range(profiles):
                 try:
-                    best_account = Sales.find_best_account(
+                    best_account, sale_result = Sales.sell_best_account(
                         service_id=service_id,
-                        months_requested=months
+                        months_requested=months,
+                        customer=customer,
+                        webhook_provider="PayPal",
+                        payment_type="paypal",
+                        payment_id=order_id,
+                        expiration_date=expiration,
+                        unit_price=unit_price,
+                        request=request
                     )
 
                     if best_account:
-                        sale_result = Sales.sale_ok(
-                            customer=customer,
-                            webhook_provider="PayPal",
-                            payment_type="paypal",
-                            payment_id=order_id,
-                            service_obj=best_account,
-                            expiration_date=expiration,
-                            unit_price=unit_price,
-                            request=request
-                        )
                         if sale_result and sale_result[0]:
                             sales_created.append(sale_result[1])
                             logger.info(f"PayPal: Venta creada: ID {sale_result[1].id}")
@@ -2853,45 +2849,8 @@ def stripe_create_checkout_session(request):
                 'message': 'No hay items en el carrito'
             }, status=400)
 
-        # Obtener porcentaje de descuento de la sesión (si hay descuento activo)
-        descuento_porcentaje = 0
-        if request.session.get('descuento_aplicado', 0) > 0:
-            subtotal_original = request.session.get('cart_total', 0)
-            if subtotal_original > 0:
-                descuento_porcentaje = (request.session.get('descuento_aplicado', 0) / subtotal_original) * 100
-
-        line_items = []
-        for item_id, item_data in cart_session.items():
-            # Calcular precio por perfil (unitPrice * cantidad de meses)
-            item_cost = float(item_data['unitPrice']) * float(item_data['quantity'])
-
-            # Aplicar descuento si existe
-            if descuento_porcentaje > 0:
-                item_cost = item_cost * (1 - descuento_porcentaje / 100)
-
-            # Stripe espera precios en centavos
-            unit_amount_cents = int(round(item_cost * 100))
-
-            # Usar nombres camuflados para pasarelas de pago
-            product_id = item_data.get('product_id', item_id)
-            masked_name = get_masked_product_name(product_id, item_id)
-            masked_description = get_masked_description(
-                item_data['profiles'],
-                item_data['quantity'],
-                product_id
-            )
-
-            line_items.append({
-                'price_data': {
-                    'currency': 'mxn',
-                    'product_data': {
-                        'name': masked_name[:127],
-                        'description': masked_description,
-                    },
-                    'unit_amount': unit_amount_cents,
-                },
-                'quantity': int(item_data['profiles']),
-            })
+        # Items con el descuento efectivo del carrito (CartPricer)
+        line_items = CartPricer(request).price().stripe_line_items()
 
         # Crear sesion de checkout con métodos de pago adicionales
         # Incluye: card, oxxo y customer_balance (SPEI/transferencia bancaria)
@@ -3343,22 +3302,19 @@ def process_stripe_payment(request, cart_id, session_id, session_data):
         profiles_without_stock = 0
         for i in range(profiles):
             try:
-                best_account = Sales.find_best_account(
+                best_account, sale_result = Sales.sell_best_account(
                     service_id=service_id,
-                    months_requested=months
+                    months_requested=months,
+                    customer=customer,
+                    webhook_provider="Stripe",
+                    payment_type="stripe",
+                    payment_id=session_id,
+                    expiration_date=expiration,
+                    unit_price=unit_price,
+                    request=request
                 )
 
                 if best_account:
-                    sale_result = Sales.sale_ok(
-                        customer=customer,
-                        webhook_provider="Stripe",
-                        payment_type="stripe",
-                        payment_id=session_id,
-                        service_obj=best_account,
-                        expiration_date=expiration,
-                        unit_price=unit_price,
-                        request=request
-                    )
                     if sale_result and sale_result[0]:
                         sales_created.append(sale_result[1])
                         logger.info(f"Stripe: Venta creada: ID {sale_result[1].id}")
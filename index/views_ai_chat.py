@@ -1,12 +1,11 @@
 import base64
 import json
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
@@ -21,6 +20,7 @@ from CuentasMexico.ai.exceptions import AIProviderError
 from CuentasMexico.ai.mcp_readonly_db import ReadOnlyDatabaseMCP
 from CuentasMexico.ai.model_catalog import chat_model_choices
 from CuentasMexico.ai.types import InputPart
+from CuentasMexico.ratelimit import rate_limit
 
 
 def _as_bool(value: Any, default: bool = False) -> bool:
@@ -31,19 +31,6 @@ def _as_bool(value: Any, default: bool = False) -> bool:
     return str(value).strip().lower() in {"1", "true", "yes", "on"}
 
 
-def _throttle(request, limit: int = 20, window_sec: int = 60) -> bool:
-    ip = request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")[0].strip() or request.META.get(
-        "REMOTE_ADDR", "unknown"
-    )
-    session_key = request.session.session_key or "anon"
-    cache_key = f"ai_chat_rl:{ip}:{session_key}"
-    current = cache.get(cache_key, 0)
-    if current >= limit:
-        return False
-    cache.set(cache_key, current + 1, timeout=window_sec)
-    return True
-
-
 def _safe_text(value: Any) -> str:
     return (str(value or "")).strip()
 
@@ -692,35 +679,26 @@ def _build_mcp_business_context(question: str, *, user_id: int, is_superuser: bo
     return mcp.build_context_text(question=question, queries=queries, limit=10)
 
 
-@csrf_exempt
-@login_required
-@require_http_methods(["POST"])
-def ai_chat(request):
+def _prepare_chat(request):
+    """
+    Valida el request del chat y arma lo necesario para generar la respuesta.
+    Devuelve (chat, None) o (None, JsonResponse con el error).
+    """
     referer = str(request.META.get("HTTP_REFERER", "") or "")
     if "/adm/" not in referer:
-        return JsonResponse(
+        return None, JsonResponse(
             {"success": False, "error": "El chat IA solo está disponible dentro de /adm."},
             status=403,
         )
 
     chat_enabled = _as_bool(getattr(settings, "AI_CHAT_ENABLED", True), True)
     if not chat_enabled:
-        return JsonResponse({"success": False, "error": "El chat IA está deshabilitado."}, status=403)
-
-    if not _throttle(
-        request,
-        limit=int(getattr(settings, "AI_CHAT_RATE_LIMIT", 20)),
-        window_sec=int(getattr(settings, "AI_CHAT_RATE_WINDOW_SEC", 60)),
-    ):
-        return JsonResponse(
-            {"success": False, "error": "Demasiadas solicitudes. Intenta de nuevo en un minuto."},
-            status=429,
-        )
+        return None, JsonResponse({"success": False, "error": "El chat IA está deshabilitado."}, status=403)
 
     try:
         payload = json.loads(request.body.decode("utf-8") or "{}")
     except Exception:
-        return JsonResponse({"success": False, "error": "JSON inválido."}, status=400)
+        return None, JsonResponse({"success": False, "error": "JSON inválido."}, status=400)
 
     message = _safe_text(payload.get("message"))
     history = payload.get("history") if isinstance(payload.get("history"), list) else []
@@ -742,16 +720,16 @@ def ai_chat(request):
     )
 
     if not message and not images:
-        return JsonResponse({"success": False, "error": "Debes escribir un mensaje o adjuntar una imagen."}, status=400)
+        return None, JsonResponse({"success": False, "error": "Debes escribir un mensaje o adjuntar una imagen."}, status=400)
 
     if len(message) > max_message_chars:
-        return JsonResponse(
+        return None, JsonResponse(
             {"success": False, "error": f"Tu mensaje excede el máximo de {max_message_chars} caracteres."},
             status=400,
         )
 
     if len(images) > max_images:
-        return JsonResponse(
+        return None, JsonResponse(
             {"success": False, "error": f"Solo puedes enviar hasta {max_images} imágenes por mensaje."},
             status=400,
         )
@@ -769,16 +747,16 @@ def ai_chat(request):
         if not data_base64:
             continue
         if mime_type not in accepted_mimes:
-            return JsonResponse(
+            return None, JsonResponse(
                 {"success": False, "error": f"Formato no permitido: {mime_type}"},
                 status=400,
             )
         try:
             raw = base64.b64decode(data_base64, validate=True)
         except Exception:
-            return JsonResponse({"success": False, "error": "Imagen inválida (base64)."}, status=400)
+            return None, JsonResponse({"success": False, "error": "Imagen inválida (base64)."}, status=400)
         if len(raw) > max_image_bytes:
-            return JsonResponse(
+            return None, JsonResponse(
                 {"success": False, "error": f"Cada imagen debe pesar máximo {max_image_mb}MB."},
                 status=400,
             )
@@ -802,17 +780,17 @@ def ai_chat(request):
     allowed_models = {value for value, _ in chat_model_choices(provider)}
     if model_override:
         if model_override not in allowed_models:
-            return JsonResponse(
+            return None, JsonResponse(
                 {"success": False, "error": f"Modelo no permitido para chat: {model_override}"},
                 status=400,
             )
         model = model_override
 
     if not model:
-        return JsonResponse({"success": False, "error": "No hay modelo configurado para IA."}, status=500)
+        return None, JsonResponse({"success": False, "error": "No hay modelo configurado para IA."}, status=500)
     provider_key = get_provider_api_key(provider)
     if not provider_key:
-        return JsonResponse(
+        return None, JsonResponse(
             {
                 "success": False,
                 "error": f"Falta API key para {provider}. Configúrala en /adm/settings/ai/update",
@@ -820,151 +798,261 @@ def ai_chat(request):
             status=500,
         )
 
-    try:
-        using_mcp = False
-        mcp_context = ""
-        mcp_error = ""
-        use_db_context = _as_bool(getattr(settings, "AI_CHAT_USE_DB_CONTEXT", True), True)
-        should_try_mcp = (
-            use_db_context
-            and not parts
-            and (
-                mcp_mode == "force"
-                or (mcp_mode == "auto" and _should_auto_use_mcp(message, history))
-            )
+    return {
+        "message": message,
+        "history": history,
+        "parts": parts,
+        "context_history": context_history,
+        "prompt": prompt_with_context,
+        "system_prompt": system_prompt,
+        "provider": provider,
+        "model": model,
+        "default_model": default_model,
+        "mcp_mode": mcp_mode,
+        "mcp_used": False,
+        "mcp_error": "",
+    }, None
+
+
+def _apply_mcp_context(request, chat: Dict[str, Any]):
+    """
+    Agrega al prompt el contexto MCP de solo lectura cuando aplica. Devuelve
+    un JsonResponse solo si el MCP estaba forzado y falló.
+    """
+    message = chat["message"]
+    mcp_mode = chat["mcp_mode"]
+    mcp_context = ""
+    use_db_context = _as_bool(getattr(settings, "AI_CHAT_USE_DB_CONTEXT", True), True)
+    should_try_mcp = (
+        use_db_context
+        and not chat["parts"]
+        and (
+            mcp_mode == "force"
+            or (mcp_mode == "auto" and _should_auto_use_mcp(message, chat["history"]))
         )
-        if should_try_mcp:
-            using_mcp = True
-            try:
-                mcp_cfg = get_db_mcp_config()
-                allowed_tables = set(mcp_cfg["allowed_tables"] or [])
-                if allowed_tables:
-                    # Tablas base mínimas para cruzar ventas -> usuario -> user detail
-                    allowed_tables.update({"adm_sale", "auth_user", "adm_userdetail"})
-                mcp = ReadOnlyDatabaseMCP(
-                    allowed_tables=allowed_tables or None,
-                    max_rows=min(int(mcp_cfg["max_rows"]), 50),
-                    include_schema=False,
-                )
-                fast_path = _is_fast_heuristic_candidate(message)
-                # En modo force también usamos primero el motor universal iterativo.
-                if mcp_mode == "force":
-                    if fast_path:
-                        mcp_context = _build_mcp_business_context(
+    )
+    if should_try_mcp:
+        chat["mcp_used"] = True
+        try:
+            mcp_cfg = get_db_mcp_config()
+            allowed_tables = set(mcp_cfg["allowed_tables"] or [])
+            if allowed_tables:
+                # Tablas base mínimas para cruzar ventas -> usuario -> user detail
+                allowed_tables.update({"adm_sale", "auth_user", "adm_userdetail"})
+            mcp = ReadOnlyDatabaseMCP(
+                allowed_tables=allowed_tables or None,
+                max_rows=min(int(mcp_cfg["max_rows"]), 50),
+                include_schema=False,
+            )
+            fast_path = _is_fast_heuristic_candidate(message)
+            # En modo force también usamos primero el motor universal iterativo.
+            if mcp_mode == "force":
+                if fast_path:
+                    mcp_context = _build_mcp_business_context(
+                        question=message,
+                        user_id=request.user.id,
+                        is_superuser=bool(request.user.is_superuser),
+                    )
+                else:
+                    planning_model = get_model_for_task("text", provider=chat["provider"]) or chat["model"]
+                    try:
+                        mcp_context = _run_universal_mcp_context(
                             question=message,
+                            history_text=chat["context_history"],
+                            provider=chat["provider"],
+                            model=planning_model,
+                            timeout_sec=int(getattr(settings, "AI_CHAT_TIMEOUT_SEC", 25)),
+                            mcp=mcp,
+                        )
+                    except Exception:
+                        mcp_context = _build_mcp_business_context(
+                            message,
                             user_id=request.user.id,
                             is_superuser=bool(request.user.is_superuser),
                         )
-                    else:
-                        planning_model = get_model_for_task("text", provider=provider) or model
-                        try:
-                            mcp_context = _run_universal_mcp_context(
-                                question=message,
-                                history_text=context_history,
-                                provider=provider,
-                                model=planning_model,
-                                timeout_sec=int(getattr(settings, "AI_CHAT_TIMEOUT_SEC", 25)),
-                                mcp=mcp,
-                            )
-                        except Exception:
-                            mcp_context = _build_mcp_business_context(
-                                message,
-                                user_id=request.user.id,
-                                is_superuser=bool(request.user.is_superuser),
-                            )
+            else:
+                if fast_path:
+                    mcp_context = _build_mcp_business_context(
+                        message,
+                        user_id=request.user.id,
+                        is_superuser=bool(request.user.is_superuser),
+                    )
                 else:
-                    if fast_path:
+                    planning_model = get_model_for_task("text", provider=chat["provider"]) or chat["model"]
+                    try:
+                        mcp_context = _run_universal_mcp_context(
+                            question=message,
+                            history_text=chat["context_history"],
+                            provider=chat["provider"],
+                            model=planning_model,
+                            timeout_sec=int(getattr(settings, "AI_CHAT_TIMEOUT_SEC", 25)),
+                            mcp=mcp,
+                        )
+                    except Exception:
                         mcp_context = _build_mcp_business_context(
                             message,
                             user_id=request.user.id,
                             is_superuser=bool(request.user.is_superuser),
                         )
-                    else:
-                        planning_model = get_model_for_task("text", provider=provider) or model
-                        try:
-                            mcp_context = _run_universal_mcp_context(
-                                question=message,
-                                history_text=context_history,
-                                provider=provider,
-                                model=planning_model,
-                                timeout_sec=int(getattr(settings, "AI_CHAT_TIMEOUT_SEC", 25)),
-                                mcp=mcp,
-                            )
-                        except Exception:
-                            mcp_context = _build_mcp_business_context(
-                                message,
-                                user_id=request.user.id,
-                                is_superuser=bool(request.user.is_superuser),
-                            )
-            except Exception as exc:
-                # El chat debe seguir funcionando aunque falle el contexto DB.
-                using_mcp = False
-                mcp_context = ""
-                mcp_error = f"No se pudo obtener contexto MCP de la base de datos. Detalle: {str(exc)}"
-                if mcp_mode == "force":
-                    return JsonResponse(
-                        {
-                            "success": False,
-                            "error": "MCP forzado y falló la lectura de BD.",
-                            "details": mcp_error,
-                        },
-                        status=500,
-                    )
-
-        if mcp_context:
-            prompt_with_context = (
-                (prompt_with_context or message or "")
-                + "\n\n"
-                + "Contexto MCP (base de datos, solo lectura):\n"
-                + mcp_context
-                + "\n\n"
-                + "Si la pregunta pide datos de clientes/ventas, usa este contexto y menciónalo. "
-                + "Cuando existan datos temporales (mes/año), responde con fechas concretas y números."
-            )
+        except Exception as exc:
+            # El chat debe seguir funcionando aunque falle el contexto DB.
+            chat["mcp_used"] = False
+            mcp_context = ""
+            chat["mcp_error"] = f"No se pudo obtener contexto MCP de la base de datos. Detalle: {str(exc)}"
+            if mcp_mode == "force":
+                return JsonResponse(
+                    {
+                        "success": False,
+                        "error": "MCP forzado y falló la lectura de BD.",
+                        "details": chat["mcp_error"],
+                    },
+                    status=500,
+                )
 
-        client = AIClient.from_settings(timeout=int(getattr(settings, "AI_CHAT_TIMEOUT_SEC", 25)))
-        result = client.generate(
-            model=model,
-            prompt=prompt_with_context if prompt_with_context else None,
-            parts=parts if parts else None,
-            system_prompt=system_prompt,
-            temperature=float(getattr(settings, "AI_CHAT_TEMPERATURE", 0.2)),
-            max_output_tokens=int(getattr(settings, "AI_CHAT_MAX_OUTPUT_TOKENS", 220)),
-        )
-        answer = _safe_text(result.text) or "No pude generar una respuesta en este momento."
-        return JsonResponse(
-            {
-                "success": True,
-                "answer": answer,
-                "provider": provider,
-                "model": model,
-                "default_model": default_model,
-                "mcp_used": using_mcp,
-                "mcp_mode": mcp_mode,
-                "mcp_error": mcp_error,
-            }
+    if mcp_context:
+        chat["prompt"] = (
+            (chat["prompt"] or message or "")
+            + "\n\n"
+            + "Contexto MCP (base de datos, solo lectura):\n"
+            + mcp_context
+            + "\n\n"
+            + "Si la pregunta pide datos de clientes/ventas, usa este contexto y menciónalo. "
+            + "Cuando existan datos temporales (mes/año), responde con fechas concretas y números."
         )
-    except AIProviderError as exc:
+    return None
+
+
+def _chat_client() -> AIClient:
+    return AIClient.from_settings(timeout=int(getattr(settings, "AI_CHAT_TIMEOUT_SEC", 25)))
+
+
+def _generate_kwargs(chat: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "model": chat["model"],
+        "prompt": chat["prompt"] if chat["prompt"] else None,
+        "parts": chat["parts"] if chat["parts"] else None,
+        "system_prompt": chat["system_prompt"],
+        "temperature": float(getattr(settings, "AI_CHAT_TEMPERATURE", 0.2)),
+        "max_output_tokens": int(getattr(settings, "AI_CHAT_MAX_OUTPUT_TOKENS", 220)),
+    }
+
+
+def _chat_meta(chat: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "provider": chat["provider"],
+        "model": chat["model"],
+        "default_model": chat["default_model"],
+        "mcp_used": chat["mcp_used"],
+        "mcp_mode": chat["mcp_mode"],
+        "mcp_error": chat["mcp_error"],
+    }
+
+
+def _chat_error(exc: Exception) -> Dict[str, Any]:
+    if isinstance(exc, AIProviderError):
         details = ""
         if getattr(exc, "details", None):
             details = str(exc.details)
-        return JsonResponse(
-            {
-                "success": False,
-                "error": f"Error del proveedor IA: {str(exc)}",
-                "details": details[:600],
-            },
-            status=500,
-        )
+        return {
+            "success": False,
+            "error": f"Error del proveedor IA: {str(exc)}",
+            "details": details[:600],
+        }
+    return {
+        "success": False,
+        "error": f"No fue posible obtener respuesta del asistente: {str(exc)}",
+        "details": str(exc)[:600],
+    }
+
+
+@csrf_exempt
+@login_required
+@require_http_methods(["POST"])
+@rate_limit(
+    "ai_chat",
+    limit="AI_CHAT_RATE_LIMIT",
+    window="AI_CHAT_RATE_WINDOW_SEC",
+    key=("ip", "session"),
+    message="Demasiadas solicitudes. Intenta de nuevo en un minuto.",
+    error_key="error",
+)
+def ai_chat(request):
+    chat, error = _prepare_chat(request)
+    if error:
+        return error
+
+    try:
+        error = _apply_mcp_context(request, chat)
+        if error:
+            return error
+        result = _chat_client().generate(**_generate_kwargs(chat))
+        answer = _safe_text(result.text) or "No pude generar una respuesta en este momento."
+        return JsonResponse({"success": True, "answer": answer, **_chat_meta(chat)})
     except Exception as exc:
-        return JsonResponse(
-            {
-                "success": False,
-                "error": f"No fue posible obtener respuesta del asistente: {str(exc)}",
-                "details": str(exc)[:600],
-            },
-            status=500,
-        )
+        return JsonResponse(_chat_error(exc), status=500)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_chat_events(chat: Dict[str, Any], chunks: Iterator[str]) -> Iterator[str]:
+    """
+    Eventos SSE del chat: `meta`, un `delta` por fragmento del proveedor y al
+    final `done` con la respuesta completa (o `error`).
+
+    Si el navegador se desconecta, el servidor WSGI cierra la respuesta, que
+    cierra este generador (GeneratorExit en el `yield`); el `finally` cierra a
+    su vez el stream del proveedor y con eso la conexión HTTP hacia él.
+    """
+    pieces: List[str] = []
+    try:
+        yield _sse("meta", _chat_meta(chat))
+        for chunk in chunks:
+            pieces.append(chunk)
+            yield _sse("delta", {"text": chunk})
+        answer = _safe_text("".join(pieces)) or "No pude generar una respuesta en este momento."
+        yield _sse("done", {"success": True, "answer": answer})
+    except Exception as exc:
+        yield _sse("error", _chat_error(exc))
+    finally:
+        chunks.close()
+
+
+@csrf_exempt
+@login_required
+@require_http_methods(["POST"])
+@rate_limit(
+    "ai_chat",
+    limit="AI_CHAT_RATE_LIMIT",
+    window="AI_CHAT_RATE_WINDOW_SEC",
+    key=("ip", "session"),
+    message="Demasiadas solicitudes. Intenta de nuevo en un minuto.",
+    error_key="error",
+)
+def ai_chat_stream(request):
+    """
+    Mismo chat que `ai_chat`, pero la respuesta sale como Server-Sent Events
+    conforme el proveedor genera el texto. Validaciones y MCP responden JSON
+    igual que `ai_chat`; solo la generación va en el stream.
+    """
+    chat, error = _prepare_chat(request)
+    if error:
+        return error
+
+    try:
+        error = _apply_mcp_context(request, chat)
+        if error:
+            return error
+        chunks = _chat_client().generate_stream(**_generate_kwargs(chat))
+    except Exception as exc:
+        return JsonResponse(_chat_error(exc), status=500)
+
+    response = StreamingHttpResponse(_sse_chat_events(chat, chunks), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Nginx no debe acumular el stream antes de mandarlo al navegador
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 @csrf_exempt
@@ -4,9 +4,10 @@ WhatsApp verification module for user registration
 import requests
 import random
 import string
-from django.conf import settings
 from django.core.cache import cache
 from adm.functions.country import Country
+from adm.functions.send_whatsapp_notification import Notification
+from adm.functions.whatsapp_pacing import PRIORITY_TRANSACTIONAL, report_send
 
 
 class WhatsAppVerification:
@@ -53,13 +54,11 @@ class WhatsAppVerification:
             # Prepare message
             message = f"Tu código de verificación para Cuentas México es: {code}\n\nEste código expira en 10 minutos."
 
-            # Get Evolution API configuration
-            evo_api_url = settings.EVO_WHATSAPP_API_URL
-            evo_instance = settings.EVO_INSTANCE
-            evo_api_key = settings.EVO_API_KEY
-
-            if not evo_api_url or not evo_instance or not evo_api_key:
+            # Get Evolution API configuration (instancia con turno transaccional del pool)
+            if not Notification._evo_config():
                 return {'success': False, 'message': 'WhatsApp API no configurada'}
+            instance = Notification._reserve_instance(PRIORITY_TRANSACTIONAL, full_phone)
+            evo_api_url, evo_instance, evo_api_key = Notification._evo_config(instance)
 
             # Evolution API endpoint for sending text messages
             endpoint = f"{evo_api_url}/message/sendText/{evo_instance}"
@@ -77,6 +76,7 @@ class WhatsAppVerification:
             }
 
             response = requests.post(endpoint, json=payload, headers=headers, timeout=10)
+            report_send(evo_instance, response.status_code)
 
             if response.status_code == 200 or response.status_code == 201:
                 # Store code in cache with 10 minute expiration